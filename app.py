@@ -1,36 +1,123 @@
+import io
 import os
+from contextlib import asynccontextmanager
 
 import psycopg2
-import db
-from db_setup import get_connection
-from fastapi import FastAPI, HTTPException, Body
-
-app = FastAPI()
+import async_db
+import async_routes
+import cache
+import conditional
+import memory_db
+import events
+import exports
+import fanout
+import listing_import
+import metrics
+import queries
+import repository
+import schemas
+import singleflight
+import tracing
+from fast_json import FastJSONResponse
+from db_pool import PoolTimeoutError, close_pool, get_pool
+from pg_listener import get_listener, stop_listener
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+# "psycopg2" (synkrona routes) eller "asyncpg" (async_routes.py där de finns)
+DB_DRIVER = os.getenv("DB_DRIVER", "psycopg2")
+
+# db.py eller memory_db.py beroende på REPOSITORY_BACKEND, se repository.py
+repo = repository.get_repository()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Öppnar connection poolerna vid start och stänger dem vid avslut"""
+    if not repository.uses_database():
+        # memory_db levererar händelser direkt och behöver ingen pool
+        yield
+        fanout.stop_buffer()
+        return
+    get_pool()
+    if DB_DRIVER == "asyncpg":
+        await async_db.create_pool()
+    listener = get_listener()
+    if cache.CACHE_LISTEN:
+        # Invalideringar från andra workers, se cache.py
+        cache.listen_for_invalidations(listener)
+    events.listen_for_events(listener)
+    listener.start()
+    yield
+    stop_listener()
+    # Skriver ut notiser som ligger kvar i bufferten innan poolen stängs
+    fanout.stop_buffer()
+    if DB_DRIVER == "asyncpg":
+        await async_db.close_pool()
+    close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+# Tid per fas och request i Server-Timing, se tracing.py
+app.router.route_class = tracing.TracedRoute
+app.add_middleware(tracing.TracingMiddleware)
 
 """
 Innehåller endpoints för alla tabeller
 """
 
+
+def get_db():
+    """Lånar en koppling från poolen för en request och lämnar tillbaka den efteråt"""
+    if not repository.uses_database():
+        yield memory_db.get_store()
+        return
+    pool = get_pool()
+    try:
+        with tracing.span("db_connect"):
+            connection = pool.getconn()
+    except PoolTimeoutError:
+        raise HTTPException(status_code=503, detail="Databasen är överbelastad")
+    try:
+        yield connection
+    finally:
+        pool.putconn(connection)
+
+
+def require_database():
+    """För routes som bara finns mot PostgreSQL"""
+    if not repository.uses_database():
+        raise HTTPException(
+            status_code=501, detail="Finns inte med REPOSITORY_BACKEND=memory"
+        )
+
+
+# De asynkrona routes måste registreras före de synkrona för att ta över samma paths
+if DB_DRIVER == "asyncpg" and repository.uses_database():
+    app.include_router(async_routes.router)
+
+
 # Bid endpoint
 
 
-@app.get("/bids")
-def get_all_bids():
+@app.get("/bids", responses={200: {"model": schemas.BidPage}})
+def get_all_bids(cursor: str = None, limit: int = None, connection=Depends(get_db)):
     """Hämtar alla bud"""
     try:
-        connection = get_connection()
-        bids = db.get_all_bids(connection)
-        return {"bids": bids}
+        bids, next_cursor = repo.get_all_bids(connection, cursor, limit)
+        return FastJSONResponse({"bids": bids, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/bids/{bid_id}")
-def get_bid(bid_id: int):
+@app.get("/bids/{bid_id}", response_model=schemas.Bid)
+def get_bid(bid_id: int, connection=Depends(get_db)):
     """Hämtar ett specifikt bud"""
     try:
-        connection = get_connection()
-        bid = db.get_bid_by_id(connection, bid_id)
+        bid = repo.get_bid_by_id(connection, bid_id)
         return bid
     except ValueError:
         raise HTTPException(status_code=404, detail="Bud hittades inte")
@@ -38,36 +125,40 @@ def get_bid(bid_id: int):
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/listings/{listing_id}/bids")
-def get_bids_for_listing(listing_id: int):
+@app.get("/listings/{listing_id}/bids", response_model=schemas.BidList)
+def get_bids_for_listing(listing_id: int, connection=Depends(get_db)):
     """Hämtar alla bud för en annons"""
     try:
-        connection = get_connection()
-        bids = db.get_bids_for_listing(connection, listing_id)
+        bids = repo.get_bids_for_listing(connection, listing_id)
         return {"bids": bids}
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/bids", status_code=201)
-def create_bid(
-    user_id: int = Body(...), listing_id: int = Body(...), bid_amount: float = Body(...)
-):
+@app.post("/bids", status_code=201, response_model=schemas.Bid)
+def create_bid(bid: schemas.BidCreate, connection=Depends(get_db)):
     """Skapar ett nytt bud"""
     try:
-        connection = get_connection()
-        new_bid = db.create_bid(connection, user_id, listing_id, bid_amount)
+        new_bid = repo.create_bid(
+            connection, bid.user_id, bid.listing_id, bid.bid_amount
+        )
+        fanout.get_buffer().add(
+            bid.listing_id, "new_bid", f"Nytt bud på {bid.bid_amount:.2f} kr"
+        )
         return new_bid
+    except repo.BidRejectedError as error:
+        raise HTTPException(status_code=409, detail=str(error))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Annons hittades inte")
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa bud")
 
 
-@app.delete("/bids/{bid_id}")
-def delete_bid(bid_id: int):
+@app.delete("/bids/{bid_id}", response_model=schemas.Deleted)
+def delete_bid(bid_id: int, connection=Depends(get_db)):
     """Raderar ett bud"""
     try:
-        connection = get_connection()
-        result = db.delete_bid(connection, bid_id)
+        result = repo.delete_bid(connection, bid_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Bud hittades inte")
@@ -78,23 +169,21 @@ def delete_bid(bid_id: int):
 # User_ratings endpoints
 
 
-@app.get("/user-ratings")
-def get_all_user_ratings():
+@app.get("/user-ratings", response_model=schemas.UserRatingList)
+def get_all_user_ratings(connection=Depends(get_db)):
     """Hämtar alla användaromdömmen"""
     try:
-        connection = get_connection()
-        ratings = db.get_all_user_ratings(connection)
+        ratings = repo.get_all_user_ratings(connection)
         return {"ratings": ratings}
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/users/{user_id}/rating")
-def get_user_rating(user_id: int):
+@app.get("/users/{user_id}/rating", response_model=schemas.UserRating)
+def get_user_rating(user_id: int, connection=Depends(get_db)):
     """Hämtar omdöme för en användare"""
     try:
-        connection = get_connection()
-        rating = db.get_user_rating_by_user_id(connection, user_id)
+        rating = repo.get_user_rating_by_user_id(connection, user_id)
         return rating
     except ValueError:
         raise HTTPException(status_code=404, detail="Omdöme hittades inte")
@@ -102,32 +191,28 @@ def get_user_rating(user_id: int):
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/user-ratings", status_code=201)
-def create_user_rating(
-    user_id: int = Body(...),
-    total_ratings: int = Body(0),
-    average_rating: float = Body(0.00),
-):
+@app.post("/user-ratings", status_code=201, response_model=schemas.UserRating)
+def create_user_rating(rating: schemas.UserRatingCreate, connection=Depends(get_db)):
     """Skapar ett nytt omdöme"""
     try:
-        connection = get_connection()
-        new_rating = db.create_user_rating(
-            connection, user_id, total_ratings, average_rating
+        new_rating = repo.create_user_rating(
+            connection, rating.user_id, rating.total_ratings, rating.average_rating
         )
         return new_rating
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa omdöme")
 
 
-@app.put("/users/{user_id}/rating")
+@app.put("/users/{user_id}/rating", response_model=schemas.UserRating)
 def update_user_rating(
-    user_id: int, total_ratings: int = None, average_rating: float = None
+    user_id: int,
+    rating: schemas.UserRatingUpdate = Depends(),
+    connection=Depends(get_db),
 ):
     """Uppdaterar ett omdöme"""
     try:
-        connection = get_connection()
-        updated_rating = db.update_user_rating(
-            connection, user_id, total_ratings, average_rating
+        updated_rating = repo.update_user_rating(
+            connection, user_id, rating.total_ratings, rating.average_rating
         )
         return updated_rating
     except ValueError:
@@ -136,12 +221,11 @@ def update_user_rating(
         raise HTTPException(status_code=400, detail="Kunde inte uppdatera omdöme")
 
 
-@app.delete("/users/{user_id}/rating")
-def delete_user_rating(user_id: int):
+@app.delete("/users/{user_id}/rating", response_model=schemas.Deleted)
+def delete_user_rating(user_id: int, connection=Depends(get_db)):
     """Raderar ett omdöme"""
     try:
-        connection = get_connection()
-        result = db.delete_user_rating(connection, user_id)
+        result = repo.delete_user_rating(connection, user_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Omdöme hittades inte")
@@ -152,23 +236,23 @@ def delete_user_rating(user_id: int):
 # Review endpoints
 
 
-@app.get("/reviews")
-def get_all_reviews():
+@app.get("/reviews", responses={200: {"model": schemas.ReviewPage}})
+def get_all_reviews(cursor: str = None, limit: int = None, connection=Depends(get_db)):
     """Hämtar alla recensioner"""
     try:
-        connection = get_connection()
-        reviews = db.get_all_reviews(connection)
-        return {"reviews": reviews}
+        reviews, next_cursor = repo.get_all_reviews(connection, cursor, limit)
+        return FastJSONResponse({"reviews": reviews, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/reviews/{review_id}")
-def get_review(review_id: int):
+@app.get("/reviews/{review_id}", response_model=schemas.Review)
+def get_review(review_id: int, connection=Depends(get_db)):
     """Hämtar en recension"""
     try:
-        connection = get_connection()
-        review = db.get_review_by_id(connection, review_id)
+        review = repo.get_review_by_id(connection, review_id)
         return review
     except ValueError:
         raise HTTPException(status_code=404, detail="Recension hittades inte")
@@ -176,42 +260,45 @@ def get_review(review_id: int):
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/users/{user_id}/reviews")
-def get_reviews_for_user(user_id: int):
-    """Hämtar recensioner för en användare"""
-    try:
-        connection = get_connection()
-        reviews = db.get_reviews_for_user(connection, user_id)
+@app.get("/users/{user_id}/reviews", response_model=schemas.ReviewList)
+def get_reviews_for_user(
+    user_id: int, request: Request, response: Response, connection=Depends(get_db)
+):
+    """Hämtar recensioner för en användare, 304 om inget ändrats"""
+    try:
+        version = repo.get_reviews_version(connection, user_id)
+        headers = conditional.headers("reviews", user_id, *version)
+        if conditional.is_fresh(request, headers):
+            return conditional.not_modified(headers)
+        reviews = repo.get_reviews_for_user(connection, user_id)
+        response.headers.update(headers)
         return {"reviews": reviews}
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/reviews", status_code=201)
-def create_review(
-    reviewer_id: int = Body(...),
-    reviewed_user_id: int = Body(...),
-    listing_id: int = Body(...),
-    rating: int = Body(...),
-    review_text: str = Body(None),
-):
+@app.post("/reviews", status_code=201, response_model=schemas.Review)
+def create_review(review: schemas.ReviewCreate, connection=Depends(get_db)):
     """Skapar en ny recension"""
     try:
-        connection = get_connection()
-        new_review = db.create_review(
-            connection, reviewer_id, reviewed_user_id, listing_id, rating, review_text
+        new_review = repo.create_review(
+            connection,
+            review.reviewer_id,
+            review.reviewed_user_id,
+            review.listing_id,
+            review.rating,
+            review.review_text,
         )
         return new_review
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa recension")
 
 
-@app.delete("/reviews/{review_id}")
-def delete_review(review_id: int):
+@app.delete("/reviews/{review_id}", response_model=schemas.Deleted)
+def delete_review(review_id: int, connection=Depends(get_db)):
     """Raderar en recension"""
     try:
-        connection = get_connection()
-        result = db.delete_review(connection, review_id)
+        result = repo.delete_review(connection, review_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Recension hittades inte")
@@ -220,23 +307,23 @@ def delete_review(review_id: int):
 
 
 # Image endpoints
-@app.get("/images")
-def get_all_images():
+@app.get("/images", responses={200: {"model": schemas.ImagePage}})
+def get_all_images(cursor: str = None, limit: int = None, connection=Depends(get_db)):
     """Hämtar alla bilder"""
     try:
-        connection = get_connection()
-        images = db.get_all_images(connection)
-        return {"images": images}
+        images, next_cursor = repo.get_all_images(connection, cursor, limit)
+        return FastJSONResponse({"images": images, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/images/{image_id}")
-def get_image(image_id: int):
+@app.get("/images/{image_id}", response_model=schemas.Image)
+def get_image(image_id: int, connection=Depends(get_db)):
     """Hämtar en bild"""
     try:
-        connection = get_connection()
-        image = db.get_image_by_id(connection, image_id)
+        image = repo.get_image_by_id(connection, image_id)
         return image
     except ValueError:
         raise HTTPException(status_code=404, detail="Bild hittades inte")
@@ -244,36 +331,40 @@ def get_image(image_id: int):
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/listings/{listing_id}/images")
-def get_images_for_listing(listing_id: int):
-    """Hämtar bilder för en annons"""
-    try:
-        connection = get_connection()
-        images = db.get_images_for_listing(connection, listing_id)
+@app.get("/listings/{listing_id}/images", response_model=schemas.ImageList)
+def get_images_for_listing(
+    listing_id: int, request: Request, response: Response, connection=Depends(get_db)
+):
+    """Hämtar bilder för en annons, 304 om inget ändrats"""
+    try:
+        version = repo.get_images_version(connection, listing_id)
+        headers = conditional.headers("images", listing_id, *version)
+        if conditional.is_fresh(request, headers):
+            return conditional.not_modified(headers)
+        images = repo.get_images_for_listing(connection, listing_id)
+        response.headers.update(headers)
         return {"images": images}
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/images", status_code=201)
-def create_image(
-    user_id: int = Body(...), listing_id: int = Body(...), image_url: str = Body(...)
-):
+@app.post("/images", status_code=201, response_model=schemas.Image)
+def create_image(image: schemas.ImageCreate, connection=Depends(get_db)):
     """Skapar en ny bild"""
     try:
-        connection = get_connection()
-        new_image = db.create_image(connection, user_id, listing_id, image_url)
+        new_image = repo.create_image(
+            connection, image.user_id, image.listing_id, image.image_url
+        )
         return new_image
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa bild")
 
 
-@app.delete("/images/{image_id}")
-def delete_image(image_id: int):
+@app.delete("/images/{image_id}", response_model=schemas.Deleted)
+def delete_image(image_id: int, connection=Depends(get_db)):
     """Raderar en bild"""
     try:
-        connection = get_connection()
-        result = db.delete_image(connection, image_id)
+        result = repo.delete_image(connection, image_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Bild hittades inte")
@@ -282,23 +373,23 @@ def delete_image(image_id: int):
 
 
 # Report endpoints
-@app.get("/reports")
-def get_all_reports():
+@app.get("/reports", responses={200: {"model": schemas.ReportPage}})
+def get_all_reports(cursor: str = None, limit: int = None, connection=Depends(get_db)):
     """Hämtar alla rapporteringar"""
     try:
-        connection = get_connection()
-        reports = db.get_all_reports(connection)
-        return {"reports": reports}
+        reports, next_cursor = repo.get_all_reports(connection, cursor, limit)
+        return FastJSONResponse({"reports": reports, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/reports/{report_id}")
-def get_report(report_id: int):
+@app.get("/reports/{report_id}", response_model=schemas.Report)
+def get_report(report_id: int, connection=Depends(get_db)):
     """Hämtar en rapport"""
     try:
-        connection = get_connection()
-        report = db.get_report_by_id(connection, report_id)
+        report = repo.get_report_by_id(connection, report_id)
         return report
     except ValueError:
         raise HTTPException(status_code=404, detail="Rapport hittades inte")
@@ -306,38 +397,33 @@ def get_report(report_id: int):
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/listings/{listing_id}/reports")
-def get_reports_for_listing(listing_id: int):
+@app.get("/listings/{listing_id}/reports", response_model=schemas.ReportList)
+def get_reports_for_listing(listing_id: int, connection=Depends(get_db)):
     """Hämtar rapporteringar för en annons"""
     try:
-        connection = get_connection()
-        reports = db.get_reports_for_listing(connection, listing_id)
+        reports = repo.get_reports_for_listing(connection, listing_id)
         return {"reports": reports}
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/reports", status_code=201)
-def create_report(
-    user_id: int = Body(...),
-    listing_id: int = Body(...),
-    report_reason: str = Body(...),
-):
+@app.post("/reports", status_code=201, response_model=schemas.Report)
+def create_report(report: schemas.ReportCreate, connection=Depends(get_db)):
     """Skapar en ny rapportering"""
     try:
-        connection = get_connection()
-        new_report = db.create_report(connection, user_id, listing_id, report_reason)
+        new_report = repo.create_report(
+            connection, report.user_id, report.listing_id, report.report_reason
+        )
         return new_report
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa rapportering")
 
 
-@app.delete("/reports/{report_id}")
-def delete_report(report_id: int):
+@app.delete("/reports/{report_id}", response_model=schemas.Deleted)
+def delete_report(report_id: int, connection=Depends(get_db)):
     """Raderar en rapportering"""
     try:
-        connection = get_connection()
-        result = db.delete_report(connection, report_id)
+        result = repo.delete_report(connection, report_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Rapportering hittades inte")
@@ -348,23 +434,23 @@ def delete_report(report_id: int):
 # User endpoints
 
 
-@app.get("/users")
-def get_all_users():
+@app.get("/users", responses={200: {"model": schemas.UserPage}})
+def get_all_users(cursor: str = None, limit: int = None, connection=Depends(get_db)):
     """Hämtar alla användare"""
     try:
-        connection = get_connection()
-        users = db.get_all_users(connection)
-        return {"users": users}
+        users, next_cursor = repo.get_all_users(connection, cursor, limit)
+        return FastJSONResponse({"users": users, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/users/{user_id}")
-def get_user(user_id: int):
+@app.get("/users/{user_id}", response_model=schemas.User)
+def get_user(user_id: int, connection=Depends(get_db)):
     """Hämtar en användare"""
     try:
-        connection = get_connection()
-        user = db.get_user_by_id(connection, user_id)
+        user = repo.get_user_by_id(connection, user_id)
         return user
     except ValueError:
         raise HTTPException(status_code=404, detail="Användare hittades inte")
@@ -372,38 +458,33 @@ def get_user(user_id: int):
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/users", status_code=201)
-def create_user(
-    username: str = Body(...),
-    email: str = Body(...),
-    password: str = Body(...),
-    user_since: str = Body(...),
-    date_of_birth: str = Body(...),
-    phone_number: str = Body(None),
-):
+@app.post("/users", status_code=201, response_model=schemas.User)
+def create_user(user: schemas.UserCreate, connection=Depends(get_db)):
     """Skapar en ny användare"""
     try:
-        connection = get_connection()
-        new_user = db.create_user(
+        new_user = repo.create_user(
             connection,
-            username,
-            email,
-            password,
-            user_since,
-            date_of_birth,
-            phone_number,
+            user.username,
+            user.email,
+            user.password,
+            user.user_since,
+            user.date_of_birth,
+            user.phone_number,
         )
         return new_user
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa användare")
 
 
-@app.put("/users/{user_id}")
-def update_user(user_id: int, email: str = None, phone_number: str = None):
+@app.put("/users/{user_id}", response_model=schemas.User)
+def update_user(
+    user_id: int, user: schemas.UserUpdate = Depends(), connection=Depends(get_db)
+):
     """Uppdaterar en användare"""
     try:
-        connection = get_connection()
-        updated_user = db.update_user(connection, user_id, email, phone_number)
+        updated_user = repo.update_user(
+            connection, user_id, user.email, user.phone_number
+        )
         return updated_user
     except ValueError:
         raise HTTPException(status_code=404, detail="Användare hittades inte")
@@ -411,12 +492,11 @@ def update_user(user_id: int, email: str = None, phone_number: str = None):
         raise HTTPException(status_code=400, detail="Kunde inte uppdatera användare")
 
 
-@app.delete("/users/{user_id}")
-def delete_user(user_id: int):
+@app.delete("/users/{user_id}", response_model=schemas.UserDeleted)
+def delete_user(user_id: int, connection=Depends(get_db)):
     """Raderar en användare"""
     try:
-        connection = get_connection()
-        result = db.delete_user(connection, user_id)
+        result = repo.delete_user(connection, user_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Användare hittades inte")
@@ -427,34 +507,41 @@ def delete_user(user_id: int):
 # Category Endpoints
 
 
-@app.get("/categories")
-def get_all_categories():
-    """Hämtar alla kategorier"""
+@app.get("/categories", response_model=schemas.CategoryList)
+def get_all_categories(
+    request: Request, response: Response, connection=Depends(get_db)
+):
+    """Hämtar alla kategorier, 304 om inget ändrats"""
     try:
-        connection = get_connection()
-        categories = db.get_all_categories(connection)
+        categories = repo.get_all_categories(connection)
+        headers = conditional.headers(
+            "categories",
+            len(categories),
+            max((category["id"] for category in categories), default=0),
+        )
+        if conditional.is_fresh(request, headers):
+            return conditional.not_modified(headers)
+        response.headers.update(headers)
         return {"categories": categories}
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/categories", status_code=201)
-def create_category(name: str = Body(..., embed=True)):
+@app.post("/categories", status_code=201, response_model=schemas.Category)
+def create_category(category: schemas.CategoryCreate, connection=Depends(get_db)):
     """Skapar en ny kategori"""
     try:
-        connection = get_connection()
-        new_category = db.create_category(connection, name)
+        new_category = repo.create_category(connection, category.name)
         return new_category
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa kategori")
 
 
-@app.delete("/categories/{category_id}")
-def delete_category(category_id: int):
+@app.delete("/categories/{category_id}", response_model=schemas.Deleted)
+def delete_category(category_id: int, connection=Depends(get_db)):
     """Raderar en kategori"""
     try:
-        connection = get_connection()
-        result = db.delete_category(connection, category_id)
+        result = repo.delete_category(connection, category_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Kategori hittades inte")
@@ -465,23 +552,72 @@ def delete_category(category_id: int):
 # Listing endpoints
 
 
-@app.get("/listings")
-def get_all_listings():
+@app.get("/listings", responses={200: {"model": schemas.ListingPage}})
+def get_all_listings(cursor: str = None, limit: int = None, connection=Depends(get_db)):
     """Hämtar alla annonser"""
     try:
-        connection = get_connection()
-        listings = db.get_all_listings(connection)
-        return {"listings": listings}
+        listings, next_cursor = repo.get_all_listings(connection, cursor, limit)
+        return FastJSONResponse({"listings": listings, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/listings/{listing_id}")
-def get_listing(listing_id: int):
-    """Hämtar en annons"""
+# Måste ligga före /listings/{listing_id} så att "search" inte tolkas som ett id
+@app.get("/listings/search", responses={200: {"model": schemas.SearchResult}})
+def search_listings(
+    q: str = None,
+    category_id: int = None,
+    region: str = None,
+    listing_type: str = None,
+    status: str = None,
+    min_price: float = None,
+    max_price: float = None,
+    facets: bool = True,
+    cursor: str = None,
+    limit: int = None,
+    connection=Depends(get_db),
+):
+    """Söker annonser med filter, fritext och antal träffar per kategori/region"""
+    filters = {
+        "category_id": category_id,
+        "region": region,
+        "listing_type": listing_type,
+        "status": status,
+        "min_price": min_price,
+        "max_price": max_price,
+    }
+    try:
+        listings, next_cursor = repo.search_listings(
+            connection, q, cursor, limit, **filters
+        )
+        result = {"listings": listings, "next_cursor": next_cursor}
+        if facets and not cursor:
+            result["facets"] = repo.get_listing_facets(connection, q, **filters)
+        return FastJSONResponse(result)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@app.get("/listings/{listing_id}", response_model=schemas.Listing)
+def get_listing(
+    listing_id: int, request: Request, response: Response, connection=Depends(get_db)
+):
+    """Hämtar en annons, 304 om den inte ändrats"""
     try:
-        connection = get_connection()
-        listing = db.get_listing_by_id(connection, listing_id)
+        listing = repo.get_listing_by_id(connection, listing_id)
+        headers = conditional.headers(
+            "listing",
+            listing_id,
+            listing["updated_at"],
+            last_modified=listing["updated_at"],
+        )
+        if conditional.is_fresh(request, headers):
+            return conditional.not_modified(headers)
+        response.headers.update(headers)
         return listing
     except ValueError:
         raise HTTPException(status_code=404, detail="Annons hittades inte")
@@ -489,64 +625,98 @@ def get_listing(listing_id: int):
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/listings", status_code=201)
-def create_listing(
-    user_id: int = Body(...),
-    category_id: int = Body(...),
-    title: str = Body(...),
-    listing_type: str = Body(...),
-    price: float = Body(...),
-    region: str = Body(...),
-    status: str = Body(...),
-    description: str = Body(...),
-    image_url: str = Body(None),
+@app.get("/listings/{listing_id}/full", response_model=schemas.ListingFull)
+def get_listing_full(
+    listing_id: int, bids_limit: int = None, connection=Depends(get_db)
 ):
+    """Hämtar en annons med bud, bilder, kommentarer, frakt och säljarens rating"""
+    try:
+        listing = repo.get_listing_full(connection, listing_id, bids_limit)
+        return listing
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Annons hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@app.post("/listings", status_code=201, response_model=schemas.Listing)
+def create_listing(listing: schemas.ListingCreate, connection=Depends(get_db)):
     """Skapar en ny annons"""
     try:
-        connection = get_connection()
-        new_listing = db.create_listing(
+        new_listing = repo.create_listing(
             connection,
-            user_id,
-            category_id,
-            title,
-            listing_type,
-            price,
-            region,
-            status,
-            description,
-            image_url,
+            listing.user_id,
+            listing.category_id,
+            listing.title,
+            listing.listing_type,
+            listing.price,
+            listing.region,
+            listing.status,
+            listing.description,
+            listing.image_url,
         )
         return new_listing
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa annons")
 
 
-@app.put("/listings/{listing_id}")
+@app.post(
+    "/listings/import",
+    response_model=schemas.ListingImport,
+    dependencies=[Depends(require_database)],
+)
+def import_listings(
+    file: UploadFile,
+    file_format: str = None,
+    user_id: int = None,
+    connection=Depends(get_db),
+):
+    """
+    Importerar annonser från en CSV- eller NDJSON-fil. Giltiga rader importeras,
+    ogiltiga returneras med radnummer och fel. user_id används för rader utan säljare.
+    """
+    if file_format is None:
+        is_ndjson = (file.filename or "").endswith((".ndjson", ".jsonl"))
+        file_format = "ndjson" if is_ndjson else "csv"
+    if file_format not in ("csv", "ndjson"):
+        raise HTTPException(
+            status_code=400, detail="Formatet måste vara csv eller ndjson"
+        )
+    try:
+        stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+        return listing_import.import_listings(connection, stream, file_format, user_id)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Filen måste vara UTF-8")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Kunde inte läsa filen")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@app.put("/listings/{listing_id}", response_model=schemas.Listing)
 def update_listing(
     listing_id: int,
-    category_id: int = None,
-    title: str = None,
-    listing_type: str = None,
-    price: float = None,
-    region: str = None,
-    status: str = None,
-    description: str = None,
-    image_url: str = None,
+    listing: schemas.ListingUpdate = Depends(),
+    connection=Depends(get_db),
 ):
     """Uppdaterar en annons"""
     try:
-        connection = get_connection()
-        updated_listing = db.update_listing(
+        updated_listing = repo.update_listing(
             connection,
             listing_id,
-            category_id,
-            title,
-            listing_type,
-            price,
-            region,
-            status,
-            description,
-            image_url,
+            listing.category_id,
+            listing.title,
+            listing.listing_type,
+            listing.price,
+            listing.region,
+            listing.status,
+            listing.description,
+            listing.image_url,
+        )
+        fanout.get_buffer().add(
+            listing_id,
+            "listing_updated",
+            f"Annonsen {updated_listing['title']} har uppdaterats",
         )
         return updated_listing
     except ValueError:
@@ -555,12 +725,11 @@ def update_listing(
         raise HTTPException(status_code=400, detail="Kunde inte uppdatera annons")
 
 
-@app.delete("/listings/{listing_id}")
-def delete_listing(listing_id: int):
+@app.delete("/listings/{listing_id}", response_model=schemas.Deleted)
+def delete_listing(listing_id: int, connection=Depends(get_db)):
     """Raderar en annons"""
     try:
-        connection = get_connection()
-        result = db.delete_listing(connection, listing_id)
+        result = repo.delete_listing(connection, listing_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Annons hittades inte")
@@ -571,23 +740,21 @@ def delete_listing(listing_id: int):
 # Watch list endpoints
 
 
-@app.get("/users/{user_id}/watchlist")
-def get_watchlist(user_id: int):
+@app.get("/users/{user_id}/watchlist", response_model=schemas.Watchlist)
+def get_watchlist(user_id: int, connection=Depends(get_db)):
     """Hämtar bevakningslista"""
     try:
-        connection = get_connection()
-        watchlist = db.get_all_watched_listings(connection, user_id)
+        watchlist = repo.get_all_watched_listings(connection, user_id)
         return {"watchlist": watchlist}
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/watchlist", status_code=201)
-def add_to_watchlist(user_id: int = Body(...), listing_id: int = Body(...)):
+@app.post("/watchlist", status_code=201, response_model=schemas.WatchedListing)
+def add_to_watchlist(watch: schemas.WatchCreate, connection=Depends(get_db)):
     """Lägger till i bevakningslista"""
     try:
-        connection = get_connection()
-        result = db.add_to_watch_list(connection, user_id, listing_id)
+        result = repo.add_to_watch_list(connection, watch.user_id, watch.listing_id)
         return result
     except Exception as error:
         raise HTTPException(
@@ -595,12 +762,11 @@ def add_to_watchlist(user_id: int = Body(...), listing_id: int = Body(...)):
         )
 
 
-@app.delete("/watchlist")
-def remove_from_watchlist(user_id: int, listing_id: int):
+@app.delete("/watchlist", response_model=schemas.Message)
+def remove_from_watchlist(user_id: int, listing_id: int, connection=Depends(get_db)):
     """Tar bort från bevakningslista"""
     try:
-        connection = get_connection()
-        result = db.remove_from_watch_list(connection, user_id, listing_id)
+        result = repo.remove_from_watch_list(connection, user_id, listing_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Finns inte i bevakningslista")
@@ -611,52 +777,120 @@ def remove_from_watchlist(user_id: int, listing_id: int):
 # Message Endpoints
 
 
-@app.get("/users/{user_id}/messages")
-def get_messages(user_id: int):
+@app.get("/users/{user_id}/messages", responses={200: {"model": schemas.MessagePage}})
+def get_messages(
+    user_id: int, cursor: str = None, limit: int = None, connection=Depends(get_db)
+):
     """Hämtar meddelanden för en användare"""
     try:
-        connection = get_connection()
-        messages = db.get_all_messages_for_user(connection, user_id)
-        return {"messages": messages}
+        messages, next_cursor = repo.get_all_messages_for_user(
+            connection, user_id, cursor, limit
+        )
+        return FastJSONResponse({"messages": messages, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+def _watched_listing_ids(user_id):
+    with repository.connection() as connection:
+        watched = repo.get_all_watched_listings(connection, user_id)
+    return [watch["listing_id"] for watch in watched]
+
+
+@app.get("/users/{user_id}/events")
+async def stream_events(user_id: int):
+    """
+    Server-Sent Events med nya notiser, meddelanden och överbjudna bud för
+    användaren. Lånar bara en databaskoppling för att hämta bevakade annonser
+    och håller sedan ingen, se events.py.
+    """
+    watched_listing_ids = await run_in_threadpool(_watched_listing_ids, user_id)
+    return StreamingResponse(
+        events.stream(user_id, watched_listing_ids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/users/{user_id}/inbox", responses={200: {"model": schemas.Inbox}})
+def get_inbox(
+    user_id: int, cursor: str = None, limit: int = None, connection=Depends(get_db)
+):
+    """Hämtar en rad per konversation med senaste meddelandet och antal olästa"""
+    try:
+        conversations, next_cursor = repo.get_inbox(connection, user_id, cursor, limit)
+        unread_total = repo.get_unread_message_count(connection, user_id)
+        return FastJSONResponse(
+            {
+                "conversations": conversations,
+                "unread_total": unread_total,
+                "next_cursor": next_cursor,
+            }
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/messages", status_code=201)
-def create_message(
-    sender_id: int = Body(...),
-    recipient_id: int = Body(...),
-    listing_id: int = Body(...),
-    message_text: str = Body(...),
+@app.get(
+    "/conversations/{user1_id}/{user2_id}",
+    responses={200: {"model": schemas.MessagePage}},
+)
+def get_conversation(
+    user1_id: int,
+    user2_id: int,
+    cursor: str = None,
+    limit: int = None,
+    connection=Depends(get_db),
 ):
+    """Hämtar meddelanden mellan två användare, nyast först"""
+    try:
+        messages, next_cursor = repo.get_conversation(
+            connection, user1_id, user2_id, cursor, limit
+        )
+        return FastJSONResponse({"messages": messages, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@app.post("/messages", status_code=201, response_model=schemas.ChatMessage)
+def create_message(message: schemas.MessageCreate, connection=Depends(get_db)):
     """Skapar ett nytt meddelande"""
     try:
-        connection = get_connection()
-        new_message = db.create_message(
-            connection, sender_id, recipient_id, listing_id, message_text
+        new_message = repo.create_message(
+            connection,
+            message.sender_id,
+            message.recipient_id,
+            message.listing_id,
+            message.message_text,
         )
         return new_message
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa meddelande")
 
 
-@app.put("/messages/{message_id}")
-def mark_message_read(message_id: int):
+@app.put("/messages/{message_id}", response_model=schemas.ChatMessage)
+def mark_message_read(message_id: int, connection=Depends(get_db)):
     """Markerar meddelande som läst"""
     try:
-        connection = get_connection()
-        result = db.mark_message_as_read(connection, message_id)
+        result = repo.mark_message_as_read(connection, message_id)
         return result
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Meddelande hittades inte")
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte uppdatera meddelande")
 
 
-@app.delete("/messages/{message_id}")
-def delete_message(message_id: int):
+@app.delete("/messages/{message_id}", response_model=schemas.Deleted)
+def delete_message(message_id: int, connection=Depends(get_db)):
     """Raderar ett meddelande"""
     try:
-        connection = get_connection()
-        result = db.delete_message(connection, message_id)
+        result = repo.delete_message(connection, message_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Meddelande hittades inte")
@@ -667,23 +901,27 @@ def delete_message(message_id: int):
 # Transaction Endpoints
 
 
-@app.get("/transactions")
-def get_all_transactions():
+@app.get("/transactions", responses={200: {"model": schemas.TransactionPage}})
+def get_all_transactions(
+    cursor: str = None, limit: int = None, connection=Depends(get_db)
+):
     """Hämtar alla transaktioner"""
     try:
-        connection = get_connection()
-        transactions = db.get_all_transactions(connection)
-        return {"transactions": transactions}
+        transactions, next_cursor = repo.get_all_transactions(connection, cursor, limit)
+        return FastJSONResponse(
+            {"transactions": transactions, "next_cursor": next_cursor}
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/transactions/{transaction_id}")
-def get_transaction(transaction_id: int):
+@app.get("/transactions/{transaction_id}", response_model=schemas.Transaction)
+def get_transaction(transaction_id: int, connection=Depends(get_db)):
     """Hämtar en transaktion"""
     try:
-        connection = get_connection()
-        transaction = db.get_transaction_by_id(connection, transaction_id)
+        transaction = repo.get_transaction_by_id(connection, transaction_id)
         return transaction
     except ValueError:
         raise HTTPException(status_code=404, detail="Transaktion hittades inte")
@@ -691,43 +929,45 @@ def get_transaction(transaction_id: int):
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/users/{user_id}/transactions")
-def get_user_transactions(user_id: int):
+@app.get("/users/{user_id}/transactions", response_model=schemas.TransactionList)
+def get_user_transactions(user_id: int, connection=Depends(get_db)):
     """Hämtar transaktioner för en användare"""
     try:
-        connection = get_connection()
-        transactions = db.get_transactions_by_user_id(connection, user_id)
+        transactions = repo.get_transactions_by_user_id(connection, user_id)
         return {"transactions": transactions}
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/transactions", status_code=201)
+@app.post("/transactions", status_code=201, response_model=schemas.Transaction)
 def create_transaction(
-    user_id: int = Body(...),
-    listing_id: int = Body(...),
-    amount: float = Body(...),
-    status: str = Body(...),
-    bid_id: int = Body(None),
+    transaction: schemas.TransactionCreate, connection=Depends(get_db)
 ):
     """Skapar en ny transaktion"""
     try:
-        connection = get_connection()
-        new_transaction = db.create_transaction(
-            connection, user_id, listing_id, amount, status, bid_id
+        new_transaction = repo.create_transaction(
+            connection,
+            transaction.user_id,
+            transaction.listing_id,
+            transaction.amount,
+            transaction.status,
+            transaction.bid_id,
         )
         return new_transaction
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa transaktion")
 
 
-@app.put("/transactions/{transaction_id}")
-def update_transaction(transaction_id: int, new_status: str):
+@app.put("/transactions/{transaction_id}", response_model=schemas.Transaction)
+def update_transaction(
+    transaction_id: int,
+    update: schemas.TransactionUpdate = Depends(),
+    connection=Depends(get_db),
+):
     """Uppdaterar en transaktion"""
     try:
-        connection = get_connection()
-        updated_transaction = db.update_transaction(
-            connection, transaction_id, new_status
+        updated_transaction = repo.update_transaction(
+            connection, transaction_id, update.new_status
         )
         return updated_transaction
     except ValueError:
@@ -739,23 +979,23 @@ def update_transaction(transaction_id: int, new_status: str):
 # Payment method
 
 
-@app.get("/payments")
-def get_all_payments():
+@app.get("/payments", responses={200: {"model": schemas.PaymentPage}})
+def get_all_payments(cursor: str = None, limit: int = None, connection=Depends(get_db)):
     """Hämtar alla betalningar"""
     try:
-        connection = get_connection()
-        payments = db.get_all_payments(connection)
-        return {"payments": payments}
+        payments, next_cursor = repo.get_all_payments(connection, cursor, limit)
+        return FastJSONResponse({"payments": payments, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/transactions/{transaction_id}/payment")
-def get_payment(transaction_id: int):
+@app.get("/transactions/{transaction_id}/payment", response_model=schemas.Payment)
+def get_payment(transaction_id: int, connection=Depends(get_db)):
     """Hämtar betalning för en transaktion"""
     try:
-        connection = get_connection()
-        payment = db.get_payment_by_transaction_id(connection, transaction_id)
+        payment = repo.get_payment_by_transaction_id(connection, transaction_id)
         return payment
     except ValueError:
         raise HTTPException(status_code=404, detail="Betalning hittades inte")
@@ -763,36 +1003,34 @@ def get_payment(transaction_id: int):
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/payments", status_code=201)
-def create_payment(
-    transaction_id: int = Body(...),
-    listing_id: int = Body(...),
-    payment_method: str = Body(...),
-    payment_status: str = Body(...),
-    amount: float = Body(...),
-):
+@app.post("/payments", status_code=201, response_model=schemas.Payment)
+def create_payment(payment: schemas.PaymentCreate, connection=Depends(get_db)):
     """Skapar en ny betalning"""
     try:
-        connection = get_connection()
-        new_payment = db.create_payment(
+        new_payment = repo.create_payment(
             connection,
-            transaction_id,
-            listing_id,
-            payment_method,
-            payment_status,
-            amount,
+            payment.transaction_id,
+            payment.listing_id,
+            payment.payment_method,
+            payment.payment_status,
+            payment.amount,
         )
         return new_payment
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa betalning")
 
 
-@app.put("/payments/{payment_id}")
-def update_payment(payment_id: int, new_status: str):
+@app.put("/payments/{payment_id}", response_model=schemas.Payment)
+def update_payment(
+    payment_id: int,
+    update: schemas.PaymentUpdate = Depends(),
+    connection=Depends(get_db),
+):
     """Uppdaterar betalningsstatus"""
     try:
-        connection = get_connection()
-        updated_payment = db.update_payment_status(connection, payment_id, new_status)
+        updated_payment = repo.update_payment_status(
+            connection, payment_id, update.new_status
+        )
         return updated_payment
     except ValueError:
         raise HTTPException(status_code=404, detail="Betalning hittades inte")
@@ -801,63 +1039,64 @@ def update_payment(payment_id: int, new_status: str):
 
 
 # Notification Endpoints
-@app.get("/users/{user_id}/notifications")
-def get_notifications(user_id: int):
+@app.get("/users/{user_id}/notifications", response_model=schemas.NotificationList)
+def get_notifications(user_id: int, connection=Depends(get_db)):
     """Hämtar notiser för en användare"""
     try:
-        connection = get_connection()
-        notifications = db.get_notifications_by_user_id(connection, user_id)
+        notifications = repo.get_notifications_by_user_id(connection, user_id)
         return {"notiser": notifications}
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.get("/users/{user_id}/notifications/unread")
-def get_unread_notifications(user_id: int):
+@app.get(
+    "/users/{user_id}/notifications/unread", response_model=schemas.NotificationList
+)
+def get_unread_notifications(user_id: int, connection=Depends(get_db)):
     """Hämtar olästa notiser"""
     try:
-        connection = get_connection()
-        notifications = db.get_unread_notifications(connection, user_id)
+        notifications = repo.get_unread_notifications(connection, user_id)
         return {"notiser": notifications}
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/notifications", status_code=201)
+@app.post("/notifications", status_code=201, response_model=schemas.Notification)
 def create_notification(
-    user_id: int = Body(...),
-    listing_id: int = Body(...),
-    notification_type: str = Body(...),
-    notification_message: str = Body(...),
+    notification: schemas.NotificationCreate, connection=Depends(get_db)
 ):
     """Skapar en ny notis"""
     try:
-        connection = get_connection()
-        new_notification = db.create_notification(
-            connection, user_id, listing_id, notification_type, notification_message
+        new_notification = repo.create_notification(
+            connection,
+            notification.user_id,
+            notification.listing_id,
+            notification.notification_type,
+            notification.notification_message,
         )
         return new_notification
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa notis")
 
 
-@app.put("/users/{user_id}/notifications/mark-read")
-def mark_notifications_read(user_id: int):
+@app.put(
+    "/users/{user_id}/notifications/mark-read",
+    response_model=schemas.NotificationsMarked,
+)
+def mark_notifications_read(user_id: int, connection=Depends(get_db)):
     """Markerar alla notiser som lästa"""
     try:
-        connection = get_connection()
-        result = db.mark_all_notifications_as_read(connection, user_id)
+        result = repo.mark_all_notifications_as_read(connection, user_id)
         return {"marked": len(result)}
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte uppdatera notiser")
 
 
-@app.delete("/notifications/{notification_id}")
-def delete_notification(notification_id: int):
+@app.delete("/notifications/{notification_id}", response_model=schemas.Deleted)
+def delete_notification(notification_id: int, connection=Depends(get_db)):
     """Raderar en notis"""
     try:
-        connection = get_connection()
-        result = db.delete_notification(connection, notification_id)
+        result = repo.delete_notification(connection, notification_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Notis hittades inte")
@@ -868,38 +1107,39 @@ def delete_notification(notification_id: int):
 # Listing comment endpoints
 
 
-@app.get("/listings/{listing_id}/comments")
-def get_listing_comments(listing_id: int):
+@app.get("/listings/{listing_id}/comments", response_model=schemas.CommentList)
+def get_listing_comments(listing_id: int, connection=Depends(get_db)):
     """Hämtar kommentarer för en annons"""
     try:
-        connection = get_connection()
-        comments = db.get_comments_by_listing_id(connection, listing_id)
+        comments = repo.get_comments_by_listing_id(connection, listing_id)
         return {"comments": comments}
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/comments", status_code=201)
-def create_comment(
-    user_id: int = Body(...), listing_id: int = Body(...), comment_text: str = Body(...)
-):
+@app.post("/comments", status_code=201, response_model=schemas.Comment)
+def create_comment(comment: schemas.CommentCreate, connection=Depends(get_db)):
     """Skapar en ny kommentar"""
     try:
-        connection = get_connection()
-        new_comment = db.create_listing_comment(
-            connection, user_id, listing_id, comment_text
+        new_comment = repo.create_listing_comment(
+            connection, comment.user_id, comment.listing_id, comment.comment_text
         )
         return new_comment
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa kommentar")
 
 
-@app.put("/comments/{comment_id}/answer")
-def answer_listing_comment(comment_id: int, answer_text: str):
+@app.put("/comments/{comment_id}/answer", response_model=schemas.Comment)
+def answer_listing_comment(
+    comment_id: int,
+    answer: schemas.CommentAnswer = Depends(),
+    connection=Depends(get_db),
+):
     """Svarar på en kommentar"""
     try:
-        connection = get_connection()
-        answered_comment = db.answer_comment(connection, comment_id, answer_text)
+        answered_comment = repo.answer_comment(
+            connection, comment_id, answer.answer_text
+        )
         return answered_comment
     except ValueError:
         raise HTTPException(status_code=404, detail="Kommentar hittades inte")
@@ -907,12 +1147,11 @@ def answer_listing_comment(comment_id: int, answer_text: str):
         raise HTTPException(status_code=400, detail="Kunde inte svara på kommentar")
 
 
-@app.delete("/comments/{comment_id}")
-def delete_comment(comment_id: int):
+@app.delete("/comments/{comment_id}", response_model=schemas.Deleted)
+def delete_comment(comment_id: int, connection=Depends(get_db)):
     """Raderar en kommentar"""
     try:
-        connection = get_connection()
-        result = db.delete_listing_comment(connection, comment_id)
+        result = repo.delete_listing_comment(connection, comment_id)
         return result
     except ValueError:
         raise HTTPException(status_code=404, detail="Kommentar hittades inte")
@@ -923,56 +1162,52 @@ def delete_comment(comment_id: int):
 # Shipping Endpoints
 
 
-@app.get("/listings/{listing_id}/shipping")
-def get_shipping(listing_id: int):
+@app.get(
+    "/listings/{listing_id}/shipping", response_model=schemas.ShippingDetails | None
+)
+def get_shipping(listing_id: int, connection=Depends(get_db)):
     """Hämtar fraktdetaljer för en annons"""
     try:
-        connection = get_connection()
-        shipping = db.get_shipping_by_listing_id(connection, listing_id)
+        shipping = repo.get_shipping_by_listing_id(connection, listing_id)
         return shipping
     except Exception as error:
         raise HTTPException(status_code=500, detail="Något gick fel")
 
 
-@app.post("/shipping", status_code=201)
-def create_shipping(
-    user_id: int = Body(...),
-    listing_id: int = Body(...),
-    shipping_method: str = Body(...),
-    shipping_cost: float = Body(...),
-    estimated_delivery_days: int = Body(None),
-    tracking_number: str = Body(None),
-    status: str = Body(None),
-    shipped_at: str = Body(None),
-):
+@app.post("/shipping", status_code=201, response_model=schemas.Shipping)
+def create_shipping(shipping: schemas.ShippingCreate, connection=Depends(get_db)):
     """Skapar fraktdetaljer"""
     try:
-        connection = get_connection()
-        new_shipping = db.create_shipping_details(
+        new_shipping = repo.create_shipping_details(
             connection,
-            user_id,
-            listing_id,
-            shipping_method,
-            shipping_cost,
-            estimated_delivery_days,
-            tracking_number,
-            status,
-            shipped_at,
+            shipping.user_id,
+            shipping.listing_id,
+            shipping.shipping_method,
+            shipping.shipping_cost,
+            shipping.estimated_delivery_days,
+            shipping.tracking_number,
+            shipping.status,
+            shipping.shipped_at,
         )
         return new_shipping
     except Exception as error:
         raise HTTPException(status_code=400, detail="Kunde inte skapa fraktdetaljer")
 
 
-@app.put("/shipping/{shipping_id}")
+@app.put("/shipping/{shipping_id}", response_model=schemas.Shipping)
 def update_shipping(
-    shipping_id: int, tracking_number: str, status: str, shipped_at: str = None
+    shipping_id: int,
+    shipping: schemas.ShippingUpdate = Depends(),
+    connection=Depends(get_db),
 ):
     """Uppdaterar fraktdetaljer"""
     try:
-        connection = get_connection()
-        updated_shipping = db.update_shipping_tracking(
-            connection, shipping_id, tracking_number, status, shipped_at
+        updated_shipping = repo.update_shipping_tracking(
+            connection,
+            shipping_id,
+            shipping.tracking_number,
+            shipping.status,
+            shipping.shipped_at,
         )
         return updated_shipping
     except ValueError:
@@ -983,10 +1218,118 @@ def update_shipping(
         )
 
 
+# Pool endpoint
+
+
+@app.get("/pool/stats", dependencies=[Depends(require_database)])
+def get_pool_stats():
+    """Hämtar mätvärden för connection poolen"""
+    return get_pool().stats()
+
+
+@app.get("/queries/stats")
+def get_query_stats():
+    """Hämtar anrop och medeltid per förberedd sats i db.py"""
+    return queries.get_registry().stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Anrop, fel, rader och svarstider per db-funktion i Prometheus textformat"""
+    return PlainTextResponse(
+        metrics.get_metrics().render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+# Cache endpoints
+
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """Hämtar träffar, missar och storlek för läscachen"""
+    stats = cache.get_cache().stats()
+    stats["listener"] = get_listener().stats()
+    return stats
+
+
+@app.get("/singleflight/stats")
+def get_singleflight_stats():
+    """Hämtar sammanslagna läsningar per db-funktion, shared är sparade frågor"""
+    return singleflight.get_singleflight().stats()
+
+
+@app.post(
+    "/listings/{listing_id}/watchers/notify",
+    status_code=202,
+    response_model=schemas.WatcherNotificationQueued,
+)
+def notify_watchers(listing_id: int, notification: schemas.WatcherNotification):
+    """Köar en notis till alla som bevakar annonsen, skrivs i batch av fanout.py"""
+    fanout.get_buffer().add(
+        listing_id, notification.notification_type, notification.notification_message
+    )
+    return {"message": "Notis köad", "listing_id": listing_id}
+
+
+@app.get("/fanout/stats")
+def get_fanout_stats():
+    """Hämtar mätvärden för utskicket till bevakare"""
+    return fanout.get_buffer().stats()
+
+
+@app.get("/events/stats")
+def get_event_stats():
+    """Hämtar antal öppna händelseströmmar och levererade händelser"""
+    return events.get_broker().stats()
+
+
+@app.put("/cache/{entity}")
+def toggle_cache(entity: str, enabled: bool):
+    """Slår på eller av cachen för en entitet"""
+    try:
+        cache.get_cache().set_enabled(entity, enabled)
+        return cache.get_cache().stats()["entities"][entity]
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Entiteten finns inte")
+
+
+# Export endpoints
+
+
+@app.get("/exports/{entity}", dependencies=[Depends(require_database)])
+def export_table(entity: str, file_format: str = "ndjson", gzip: bool = False):
+    """
+    Strömmar hela tabellen (transactions, payments, users, reports) som NDJSON
+    eller CSV, med gzip=true komprimeras svaret medan det skickas
+    """
+    if entity not in exports.EXPORTS:
+        raise HTTPException(status_code=404, detail="Exporten finns inte")
+    if file_format not in exports.FORMATS:
+        raise HTTPException(
+            status_code=400, detail="Formatet måste vara ndjson eller csv"
+        )
+    pool = get_pool()
+    try:
+        # Lånas utanför get_db eftersom kopplingen används tills strömmen är slut
+        with tracing.span("db_connect"):
+            connection = pool.getconn()
+    except PoolTimeoutError:
+        raise HTTPException(status_code=503, detail="Databasen är överbelastad")
+
+    headers = {"Content-Disposition": f'attachment; filename="{entity}.{file_format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        exports.stream(connection, entity, file_format, gzip, release=pool.putconn),
+        media_type=exports.FORMATS[file_format],
+        headers=headers,
+    )
+
+
 # Root Endpoint
 
 
-@app.get("/")
+@app.get("/", response_model=schemas.Message)
 def root():
     """Välkomstmeddelande"""
     return {"message": "Välkommen"}
@@ -0,0 +1,1019 @@
+import json
+
+import asyncpg
+
+import cache
+import events
+import metrics
+import pagination
+import singleflight
+from db import (
+    ADD_MESSAGE_TO_THREADS,
+    ADD_REVIEW_TO_RATING,
+    DELETE_THREAD,
+    LISTING_COLUMNS,
+    LISTING_FULL_BIDS,
+    LISTING_FULL_QUERY,
+    MIN_BID_INCREMENT,
+    READ_MESSAGE_IN_THREAD,
+    REBUILD_THREAD,
+    REMOVE_REVIEW_FROM_RATING,
+    BidRejectedError,
+    inbox_query,
+    listing_search_filters,
+)
+from db_pool import POOL_MAX_IDLE, POOL_MAX_SIZE, POOL_MIN_SIZE
+from db_setup import DATABASE_NAME, PASSWORD
+
+"""
+Asynkron motsvarighet till db.py, byggd på asyncpg.
+
+Funktionerna har samma namn, parametrar och returvärden som i db.py
+(listor av dicts, ValueError när en rad saknas) men tar en asyncpg-koppling
+och måste awaitas. asyncpg använder $1, $2 ... istället för %s.
+Används av async_routes.py när DB_DRIVER=asyncpg.
+"""
+
+_pool = None
+
+
+async def _init_connection(connection):
+    """Avkodar json-kolumner till Python-objekt, som psycopg2 gör"""
+    await connection.set_type_codec(
+        "json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
+    )
+    metrics.watch_asyncpg(connection)
+
+
+async def create_pool():
+    """Skapar den asynkrona poolen"""
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            database=DATABASE_NAME,
+            user="postgres",  # change if needed
+            password=PASSWORD,
+            host="localhost",  # change if needed
+            port=5432,  # change if needed
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=POOL_MAX_IDLE,
+            init=_init_connection,
+        )
+    return _pool
+
+
+async def close_pool():
+    """Stänger den asynkrona poolen"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool():
+    """Returnerar poolen, create_pool() måste ha körts först"""
+    if _pool is None:
+        raise RuntimeError("Den asynkrona poolen är inte skapad")
+    return _pool
+
+
+def _rows(records):
+    return [dict(record) for record in records]
+
+
+def _row(record):
+    return dict(record) if record is not None else None
+
+
+def _numbered(sql):
+    """Byter psycopg2:s %s mot asyncpg:s $1, $2 ..."""
+    parts = sql.split("%s")
+    numbered = [f"{part}${number}" for number, part in enumerate(parts[:-1], 1)]
+    return "".join(numbered) + parts[-1]
+
+
+# Bid functions
+
+
+async def get_all_bids(connection, after=None, limit=None):
+    """Hämtar alla bud från databasen, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("created_at", after, ("$1", "$2"))
+    rows = await connection.fetch(
+        f"""
+        SELECT * FROM bids
+        {seek}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ${len(params) + 1}
+    """,
+        *params,
+        limit + 1,
+    )
+    return pagination.next_page(_rows(rows), limit, "created_at")
+
+
+async def get_bid_by_id(connection, bid_id):
+    """Hämtar ett specifikt bud"""
+    bid = await connection.fetchrow("SELECT * FROM bids WHERE id = $1", bid_id)
+
+    if not bid:
+        raise ValueError(f"Bud med id {bid_id} finns inte")
+
+    return dict(bid)
+
+
+@singleflight.coalesced("listing_bids")
+async def get_bids_for_listing(connection, listing_id):
+    """Hämtar alla bud för en specifik annons"""
+    bids = await connection.fetch(
+        """
+        SELECT * FROM bids
+        WHERE listing_id = $1
+        ORDER BY bid_amount DESC
+    """,
+        listing_id,
+    )
+    return _rows(bids)
+
+
+async def create_bid(connection, user_id, listing_id, bid_amount):
+    """Lägger ett bud enligt budreglerna, se db.create_bid"""
+    async with connection.transaction():
+        accepted = await connection.fetchrow(
+            """
+            UPDATE listings
+            SET current_high_bid = $1, bid_count = bid_count + 1,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = $2
+              AND status = 'active'
+              AND $1 >= COALESCE(current_high_bid + $3, price)
+            RETURNING id
+        """,
+            bid_amount,
+            listing_id,
+            MIN_BID_INCREMENT,
+        )
+
+        if not accepted:
+            listing = await connection.fetchrow(
+                "SELECT status, price, current_high_bid FROM listings WHERE id = $1",
+                listing_id,
+            )
+            if not listing:
+                raise ValueError(f"Annons med id {listing_id} finns inte")
+            if listing["status"] != "active":
+                raise BidRejectedError("Annonsen är inte aktiv")
+            if listing["current_high_bid"] is None:
+                minimum = listing["price"]
+            else:
+                minimum = listing["current_high_bid"] + MIN_BID_INCREMENT
+            raise BidRejectedError(f"Budet måste vara minst {minimum:.2f}")
+
+        # Annonsraden är låst, så ledaren kan inte ändras förrän vi committat
+        leader_id = await connection.fetchval(
+            """
+            SELECT user_id FROM bids
+            WHERE listing_id = $1
+            ORDER BY bid_amount DESC, id
+            LIMIT 1
+        """,
+            listing_id,
+        )
+
+        new_bid = await connection.fetchrow(
+            """
+            INSERT INTO bids (user_id, listing_id, bid_amount)
+            VALUES ($1, $2, $3)
+            RETURNING *
+        """,
+            user_id,
+            listing_id,
+            bid_amount,
+        )
+        if leader_id is not None and leader_id != user_id:
+            await events.publish_async(connection, leader_id, "outbid", dict(new_bid))
+        await cache.notify_async(connection, "listing", listing_id)
+    cache.invalidate("listing", listing_id)
+    singleflight.forget("listing", listing_id)
+    singleflight.forget("listing_bids", listing_id)
+    return _row(new_bid)
+
+
+async def delete_bid(connection, bid_id):
+    """Raderar ett bud och räknar om annonsens högsta bud"""
+    async with connection.transaction():
+        listing_id = await connection.fetchval(
+            "SELECT listing_id FROM bids WHERE id = $1", bid_id
+        )
+        if listing_id is None:
+            raise ValueError(f"Bud med id {bid_id} finns inte")
+
+        # Samma låsordning som create_bid: först annonsen, sedan buden
+        await connection.execute(
+            "SELECT id FROM listings WHERE id = $1 FOR UPDATE", listing_id
+        )
+        deleted_bid = await connection.fetchrow(
+            "DELETE FROM bids WHERE id = $1 RETURNING id", bid_id
+        )
+
+        if deleted_bid:
+            await connection.execute(
+                """
+                UPDATE listings SET
+                    bid_count = GREATEST(bid_count - 1, 0),
+                    current_high_bid = (
+                        SELECT MAX(bid_amount) FROM bids WHERE listing_id = $1
+                    ),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = $1
+            """,
+                listing_id,
+            )
+            await cache.notify_async(connection, "listing", listing_id)
+
+    cache.invalidate("listing", listing_id)
+    singleflight.forget("listing", listing_id)
+    singleflight.forget("listing_bids", listing_id)
+
+    if not deleted_bid:
+        raise ValueError(f"Bud med id {bid_id} finns inte")
+
+    return {"message": "Bud raderat", "id": deleted_bid["id"]}
+
+
+# User_Ratings functions
+
+
+async def get_all_user_ratings(connection):
+    """Hämtar alla användarratings"""
+    return _rows(await connection.fetch("SELECT * FROM user_ratings"))
+
+
+@cache.cached("user_rating")
+async def get_user_rating_by_user_id(connection, user_id):
+    """Hämtar rating för en specifik användare"""
+    rating = await connection.fetchrow(
+        "SELECT * FROM user_ratings WHERE user_id = $1", user_id
+    )
+
+    if not rating:
+        raise ValueError(f"Rating för användare {user_id} finns inte")
+
+    return dict(rating)
+
+
+# Review Functions
+
+
+async def get_all_reviews(connection, after=None, limit=None):
+    """Hämtar alla recenssioner, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("created_at", after, ("$1", "$2"))
+    rows = await connection.fetch(
+        f"""
+        SELECT * FROM reviews
+        {seek}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ${len(params) + 1}
+    """,
+        *params,
+        limit + 1,
+    )
+    return pagination.next_page(_rows(rows), limit, "created_at")
+
+
+async def get_review_by_id(connection, review_id):
+    """Hämtar en specifik recension"""
+    review = await connection.fetchrow("SELECT * FROM reviews WHERE id = $1", review_id)
+
+    if not review:
+        raise ValueError(f"Recension med id {review_id} finns inte")
+
+    return dict(review)
+
+
+async def get_reviews_for_user(connection, user_id):
+    """Hämtar alla recensioner för en användare"""
+    reviews = await connection.fetch(
+        """
+        SELECT * FROM reviews
+        WHERE reviewed_user_id = $1
+        ORDER BY created_at DESC
+    """,
+        user_id,
+    )
+    return _rows(reviews)
+
+
+async def get_reviews_version(connection, user_id):
+    """Antal recensioner och högsta id för en användare, se db.get_reviews_version"""
+    row = await connection.fetchrow(
+        """
+        SELECT COUNT(*), COALESCE(MAX(id), 0) FROM reviews
+        WHERE reviewed_user_id = $1
+    """,
+        user_id,
+    )
+    return tuple(row)
+
+
+async def create_review(
+    connection, reviewer_id, reviewed_user_id, listing_id, rating, review_text=None
+):
+    """Skapar en ny recension"""
+    async with connection.transaction():
+        new_review = await connection.fetchrow(
+            """
+            INSERT INTO reviews (reviewer_id, reviewed_user_id, listing_id, rating, review_text)
+            VALUES ($1, $2, $3, $4, $5)
+            RETURNING *
+        """,
+            reviewer_id,
+            reviewed_user_id,
+            listing_id,
+            rating,
+            review_text,
+        )
+        await connection.execute(
+            _numbered(ADD_REVIEW_TO_RATING), reviewed_user_id, rating, rating
+        )
+        await cache.notify_async(connection, "user_rating", reviewed_user_id)
+    cache.invalidate("user_rating", reviewed_user_id)
+    return _row(new_review)
+
+
+async def delete_review(connection, review_id):
+    """Raderar en recension"""
+    async with connection.transaction():
+        deleted_review = await connection.fetchrow(
+            "DELETE FROM reviews WHERE id = $1 RETURNING id, reviewed_user_id, rating",
+            review_id,
+        )
+        if deleted_review:
+            await connection.execute(
+                _numbered(REMOVE_REVIEW_FROM_RATING),
+                deleted_review["rating"],
+                deleted_review["rating"],
+                deleted_review["reviewed_user_id"],
+            )
+            await cache.notify_async(
+                connection, "user_rating", deleted_review["reviewed_user_id"]
+            )
+
+    if not deleted_review:
+        raise ValueError(f"Recension med id {review_id} finns inte")
+
+    cache.invalidate("user_rating", deleted_review["reviewed_user_id"])
+
+    return {"message": "Recension raderad", "id": deleted_review["id"]}
+
+
+# Image Function
+
+
+async def get_all_images(connection, after=None, limit=None):
+    """Hämtar alla bilder, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("created_at", after, ("$1", "$2"))
+    rows = await connection.fetch(
+        f"""
+        SELECT * FROM images
+        {seek}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ${len(params) + 1}
+    """,
+        *params,
+        limit + 1,
+    )
+    return pagination.next_page(_rows(rows), limit, "created_at")
+
+
+async def get_image_by_id(connection, image_id):
+    """Hämtar en specifik bild"""
+    image = await connection.fetchrow("SELECT * FROM images WHERE id = $1", image_id)
+
+    if not image:
+        raise ValueError(f"Bild med id {image_id} finns inte")
+
+    return dict(image)
+
+
+async def get_images_for_listing(connection, listing_id):
+    """Hämtar alla bilder för en annons"""
+    images = await connection.fetch(
+        """
+        SELECT * FROM images
+        WHERE listing_id = $1
+        ORDER BY created_at ASC
+    """,
+        listing_id,
+    )
+    return _rows(images)
+
+
+async def get_images_version(connection, listing_id):
+    """Antal bilder och högsta id för en annons, se db.get_reviews_version"""
+    row = await connection.fetchrow(
+        """
+        SELECT COUNT(*), COALESCE(MAX(id), 0) FROM images
+        WHERE listing_id = $1
+    """,
+        listing_id,
+    )
+    return tuple(row)
+
+
+async def create_image(connection, user_id, listing_id, image_url):
+    """Lägger till en ny bild"""
+    new_image = await connection.fetchrow(
+        """
+        INSERT INTO images (user_id, listing_id, image_url)
+        VALUES ($1, $2, $3)
+        RETURNING *
+    """,
+        user_id,
+        listing_id,
+        image_url,
+    )
+    return _row(new_image)
+
+
+async def delete_image(connection, image_id):
+    """Raderar en bild"""
+    deleted_image = await connection.fetchrow(
+        "DELETE FROM images WHERE id = $1 RETURNING id", image_id
+    )
+
+    if not deleted_image:
+        raise ValueError(f"Bild med id {image_id} finns inte")
+
+    return {"message": "Bild raderad", "id": deleted_image["id"]}
+
+
+# User function
+
+
+async def get_all_users(connection, after=None, limit=None):
+    """Hämtar alla användare, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("user_since", after, ("$1", "$2"))
+    rows = await connection.fetch(
+        f"""
+        SELECT id, username, email, user_since, date_of_birth, phone_number
+        FROM users
+        {seek}
+        ORDER BY user_since DESC, id DESC
+        LIMIT ${len(params) + 1}
+    """,
+        *params,
+        limit + 1,
+    )
+    return pagination.next_page(_rows(rows), limit, "user_since")
+
+
+@cache.cached("user")
+async def get_user_by_id(connection, user_id):
+    """Hämtar en specifik användare med ID"""
+    user = await connection.fetchrow(
+        """
+        SELECT id, username, email, user_since, date_of_birth, phone_number
+        FROM users
+        WHERE id = $1
+    """,
+        user_id,
+    )
+
+    if not user:
+        raise ValueError(f"Användare med id {user_id} finns inte")
+
+    return dict(user)
+
+
+async def update_user(connection, user_id, email=None, phone_number=None):
+    """Uppdaterar en specifik användares email eller telefonnummer"""
+    async with connection.transaction():
+        updated_user = await connection.fetchrow(
+            """
+            UPDATE users
+            SET email = COALESCE($1, email),
+                phone_number = COALESCE($2, phone_number)
+            WHERE id = $3
+            RETURNING *
+        """,
+            email,
+            phone_number,
+            user_id,
+        )
+        await cache.notify_async(connection, "user", user_id)
+
+    cache.invalidate("user", user_id)
+    if not updated_user:
+        raise ValueError(f"Användare med id {user_id} finns inte")
+
+    return dict(updated_user)
+
+
+async def delete_user(connection, user_id):
+    """Raderar en användare"""
+    async with connection.transaction():
+        deleted_user = await connection.fetchrow(
+            "DELETE FROM users WHERE id = $1 RETURNING *", user_id
+        )
+        await cache.notify_async(connection, "user", user_id)
+
+    cache.invalidate("user", user_id)
+    if not deleted_user:
+        raise ValueError(f"Användare med id {user_id} finns inte")
+
+    return {"message": "Användare raderad", "user": dict(deleted_user)}
+
+
+# Category Funcition
+
+
+@cache.cached("categories")
+async def get_all_categories(connection):
+    """Hämtar alla kategorier"""
+    return _rows(await connection.fetch("SELECT * FROM categories"))
+
+
+# Listing function
+
+
+async def get_all_listings(connection, after=None, limit=None):
+    """Hämtar alla annonser, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("created_at", after, ("$1", "$2"))
+    rows = await connection.fetch(
+        f"""
+        SELECT {LISTING_COLUMNS} FROM listings
+        {seek}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ${len(params) + 1}
+    """,
+        *params,
+        limit + 1,
+    )
+    return pagination.next_page(_rows(rows), limit, "created_at")
+
+
+@cache.cached("listing")
+@singleflight.coalesced("listing")
+async def get_listing_by_id(connection, listing_id):
+    """Hämtar en specifik annons, med updated_at för ETag och Last-Modified"""
+    listing = await connection.fetchrow(
+        f"SELECT {LISTING_COLUMNS}, updated_at FROM listings WHERE id = $1",
+        listing_id,
+    )
+
+    if not listing:
+        raise ValueError(f"Annons med id {listing_id} finns inte")
+
+    return dict(listing)
+
+
+async def get_listing_full(connection, listing_id, bids_limit=None):
+    """Hämtar annonsen och allt som hör till den i en fråga, se db.get_listing_full"""
+    if bids_limit is None:
+        bids_limit = LISTING_FULL_BIDS
+    listing = await connection.fetchrow(
+        _numbered(LISTING_FULL_QUERY), bids_limit, listing_id
+    )
+
+    if not listing:
+        raise ValueError(f"Annons med id {listing_id} finns inte")
+
+    return dict(listing)
+
+
+async def create_listing(
+    connection,
+    user_id,
+    category_id,
+    title,
+    listing_type,
+    price,
+    region,
+    status,
+    description,
+    image_url=None,
+):
+    """Skapar en ny annons"""
+    new_listing = await connection.fetchrow(
+        f"""
+        INSERT INTO listings
+        (user_id, category_id, title, listing_type, price, region, status, description, image_url)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+        RETURNING {LISTING_COLUMNS}
+    """,
+        user_id,
+        category_id,
+        title,
+        listing_type,
+        price,
+        region,
+        status,
+        description,
+        image_url,
+    )
+    return _row(new_listing)
+
+
+async def update_listing(
+    connection,
+    listing_id,
+    category_id=None,
+    title=None,
+    listing_type=None,
+    price=None,
+    region=None,
+    status=None,
+    description=None,
+    image_url=None,
+):
+    """Uppdaterar en annons"""
+    async with connection.transaction():
+        updated_listing = await connection.fetchrow(
+            f"""
+            UPDATE listings SET
+            category_id = COALESCE($1, category_id),
+            title = COALESCE($2, title),
+            listing_type = COALESCE($3, listing_type),
+            price = COALESCE($4, price),
+            region = COALESCE($5, region),
+            status = COALESCE($6, status),
+            description = COALESCE($7, description),
+            image_url = COALESCE($8, image_url),
+            updated_at = CURRENT_TIMESTAMP
+            WHERE id = $9
+            RETURNING {LISTING_COLUMNS}
+        """,
+            category_id,
+            title,
+            listing_type,
+            price,
+            region,
+            status,
+            description,
+            image_url,
+            listing_id,
+        )
+        await cache.notify_async(connection, "listing", listing_id)
+
+    cache.invalidate("listing", listing_id)
+    singleflight.forget("listing", listing_id)
+    if not updated_listing:
+        raise ValueError(f"Annons med id {listing_id} finns inte")
+
+    return dict(updated_listing)
+
+
+async def delete_listing(connection, listing_id):
+    """Raderar en annons"""
+    async with connection.transaction():
+        deleted_listing = await connection.fetchrow(
+            "DELETE FROM listings WHERE id = $1 RETURNING id", listing_id
+        )
+        await cache.notify_async(connection, "listing", listing_id)
+
+    cache.invalidate("listing", listing_id)
+    singleflight.forget("listing", listing_id)
+    if not deleted_listing:
+        raise ValueError(f"Annons med id {listing_id} finns inte")
+
+    return {"message": "Annons raderad", "id": deleted_listing["id"]}
+
+
+async def search_listings(connection, query=None, after=None, limit=None, **filters):
+    """
+    Söker annonser med filter och fritext i titel och beskrivning.
+    Med fritext sorteras träffarna på relevans, annars nyast först.
+    """
+    limit = pagination.page_size(limit)
+    conditions, values = listing_search_filters(query, **filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    if query:
+        # rank som float8 så att värdet i cursorn jämförs exakt med nästa sida
+        order_column = "rank"
+        seek, seek_values = pagination.seek_clause("rank", after)
+        sql = f"""
+            SELECT * FROM (
+                SELECT {LISTING_COLUMNS},
+                    ts_rank_cd(search_vector, websearch_to_tsquery('swedish', %s))::float8 AS rank
+                FROM listings
+                {where}
+            ) AS ranked
+            {seek}
+            ORDER BY rank DESC, id DESC
+            LIMIT %s
+        """
+        values = [query, *values, *seek_values, limit + 1]
+    else:
+        order_column = "created_at"
+        seek, seek_values = pagination.seek_condition("created_at", after)
+        if seek:
+            conditions.append(seek)
+            where = f"WHERE {' AND '.join(conditions)}"
+        sql = f"""
+            SELECT {LISTING_COLUMNS} FROM listings
+            {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """
+        values = [*values, *seek_values, limit + 1]
+
+    listings = _rows(await connection.fetch(_numbered(sql), *values))
+    return pagination.next_page(listings, limit, order_column)
+
+
+async def get_listing_facets(connection, query=None, **filters):
+    """Räknar träffar per kategori och region för samma filter som search_listings"""
+    conditions, values = listing_search_filters(query, **filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    rows = await connection.fetch(
+        _numbered(
+            f"""
+            SELECT category_id, region, COUNT(*) AS count
+            FROM listings
+            {where}
+            GROUP BY GROUPING SETS ((category_id), (region))
+            ORDER BY count DESC
+        """
+        ),
+        *values,
+    )
+
+    return {
+        "categories": [
+            {"category_id": row["category_id"], "count": row["count"]}
+            for row in rows
+            if row["category_id"] is not None
+        ],
+        "regions": [
+            {"region": row["region"], "count": row["count"]}
+            for row in rows
+            if row["region"] is not None
+        ],
+    }
+
+
+# Listings Watch list function
+
+
+async def get_all_watched_listings(connection, user_id):
+    """Hämtar alla bevakade annonser för en användare"""
+    watched_listings = await connection.fetch(
+        """
+        SELECT * FROM listings_watch_list
+        WHERE user_id = $1
+    """,
+        user_id,
+    )
+    return _rows(watched_listings)
+
+
+async def add_to_watch_list(connection, user_id, listing_id):
+    """Lägger till annons i bevakningslista"""
+    async with connection.transaction():
+        new_watch = await connection.fetchrow(
+            """
+            INSERT INTO listings_watch_list (user_id, listing_id)
+            VALUES ($1, $2)
+            RETURNING *
+        """,
+            user_id,
+            listing_id,
+        )
+        await events.publish_async(
+            connection, user_id, "watch", {"listing_id": listing_id}
+        )
+    return _row(new_watch)
+
+
+async def remove_from_watch_list(connection, user_id, listing_id):
+    """Tar bort annons från bevakningslista"""
+    async with connection.transaction():
+        deleted_watch = await connection.fetchrow(
+            """
+            DELETE FROM listings_watch_list
+            WHERE user_id = $1 AND listing_id = $2
+            RETURNING *
+        """,
+            user_id,
+            listing_id,
+        )
+        if deleted_watch:
+            await events.publish_async(
+                connection, user_id, "unwatch", {"listing_id": listing_id}
+            )
+
+    if not deleted_watch:
+        raise ValueError("Annons fanns inte i bevakningslistan")
+
+    return {"message": "Annons borttagen från bevakningslista"}
+
+
+# Message function
+
+
+async def get_all_messages_for_user(connection, user_id, after=None, limit=None):
+    """Hämtar meddelanden för en användare, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    conditions = ["(sender_id = %s OR recipient_id = %s)"]
+    seek, params = pagination.seek_condition("created_at", after)
+    if seek:
+        conditions.append(seek)
+    messages = await connection.fetch(
+        _numbered(
+            f"""
+            SELECT * FROM messages
+            WHERE {' AND '.join(conditions)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """
+        ),
+        user_id,
+        user_id,
+        *params,
+        limit + 1,
+    )
+    return pagination.next_page(_rows(messages), limit, "created_at")
+
+
+async def get_inbox(connection, user_id, after=None, limit=None):
+    """Hämtar användarens konversationer, en sida i taget (senast aktiv först)"""
+    limit = pagination.page_size(limit)
+    sql, params = inbox_query(user_id, after, limit)
+    threads = await connection.fetch(_numbered(sql), *params)
+    return pagination.next_page(
+        _rows(threads), limit, "last_message_at", id_column="last_message_id"
+    )
+
+
+async def get_unread_message_count(connection, user_id):
+    """Hämtar antal olästa meddelanden för en användare"""
+    return await connection.fetchval(
+        "SELECT COUNT(*) FROM messages WHERE recipient_id = $1 AND is_read = FALSE",
+        user_id,
+    )
+
+
+async def get_conversation(connection, user1_id, user2_id, after=None, limit=None):
+    """Hämtar konversation mellan två användare, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    conditions = [
+        "((sender_id = %s AND recipient_id = %s) OR (sender_id = %s AND recipient_id = %s))"
+    ]
+    seek, params = pagination.seek_condition("created_at", after)
+    if seek:
+        conditions.append(seek)
+    conversation = await connection.fetch(
+        _numbered(
+            f"""
+            SELECT * FROM messages
+            WHERE {' AND '.join(conditions)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """
+        ),
+        user1_id,
+        user2_id,
+        user2_id,
+        user1_id,
+        *params,
+        limit + 1,
+    )
+    return pagination.next_page(_rows(conversation), limit, "created_at")
+
+
+async def create_message(connection, sender_id, recipient_id, listing_id, message_text):
+    """Skapar ett nytt meddelande"""
+    async with connection.transaction():
+        new_message = await connection.fetchrow(
+            """
+            INSERT INTO messages (sender_id, recipient_id, listing_id, message_text)
+            VALUES ($1, $2, $3, $4)
+            RETURNING *
+        """,
+            sender_id,
+            recipient_id,
+            listing_id,
+            message_text,
+        )
+        await connection.execute(_numbered(ADD_MESSAGE_TO_THREADS), new_message["id"])
+        await events.publish_async(
+            connection, recipient_id, "message", dict(new_message)
+        )
+    return _row(new_message)
+
+
+async def mark_message_as_read(connection, message_id):
+    """Markerar ett meddelande som läst"""
+    async with connection.transaction():
+        updated_message = _row(
+            await connection.fetchrow(
+                """
+                UPDATE messages
+                SET is_read = TRUE
+                FROM (SELECT id, is_read FROM messages WHERE id = $1 FOR UPDATE) AS previous
+                WHERE messages.id = previous.id
+                RETURNING messages.*, previous.is_read AS was_read
+            """,
+                message_id,
+            )
+        )
+        if not updated_message:
+            raise ValueError(f"Meddelande med id {message_id} finns inte")
+        if updated_message.pop("was_read") is False:
+            await connection.execute(
+                _numbered(READ_MESSAGE_IN_THREAD),
+                updated_message["recipient_id"],
+                updated_message["sender_id"],
+                updated_message["listing_id"],
+            )
+    return updated_message
+
+
+async def delete_message(connection, message_id):
+    """Raderar ett meddelande"""
+    async with connection.transaction():
+        deleted_message = await connection.fetchrow(
+            "DELETE FROM messages WHERE id = $1 RETURNING *", message_id
+        )
+        if deleted_message:
+            users = (deleted_message["sender_id"], deleted_message["recipient_id"])
+            thread = (deleted_message["listing_id"], *users, *users)
+            await connection.execute(_numbered(DELETE_THREAD), *thread)
+            await connection.execute(_numbered(REBUILD_THREAD), *thread)
+
+    if not deleted_message:
+        raise ValueError(f"Meddelande med id {message_id} finns inte")
+
+    return {"message": "Meddelande raderat", "id": deleted_message["id"]}
+
+
+# Notification function
+
+
+async def get_notifications_by_user_id(connection, user_id):
+    """Hämtar alla notifieringar för en användare"""
+    return _rows(
+        await connection.fetch(
+            "SELECT * FROM notifications WHERE user_id = $1", user_id
+        )
+    )
+
+
+async def get_unread_notifications(connection, user_id):
+    """Hämtar olästa notifieringar för en användare"""
+    unread_notifications = await connection.fetch(
+        """
+        SELECT * FROM notifications
+        WHERE user_id = $1 AND is_read = FALSE
+    """,
+        user_id,
+    )
+    return _rows(unread_notifications)
+
+
+async def create_notification(
+    connection, user_id, listing_id, notification_type, notification_message
+):
+    """Skapar en ny notifiering"""
+    async with connection.transaction():
+        new_notification = await connection.fetchrow(
+            """
+            INSERT INTO notifications (user_id, listing_id, notification_type, notification_message)
+            VALUES ($1, $2, $3, $4)
+            RETURNING *
+        """,
+            user_id,
+            listing_id,
+            notification_type,
+            notification_message,
+        )
+        await events.publish_async(
+            connection, user_id, "notification", dict(new_notification)
+        )
+    return _row(new_notification)
+
+
+async def mark_all_notifications_as_read(connection, user_id):
+    """Markerar alla notifieringar som lästa"""
+    marked_notifications = await connection.fetch(
+        """
+        UPDATE notifications
+        SET is_read = TRUE
+        WHERE user_id = $1
+        RETURNING *
+    """,
+        user_id,
+    )
+    return _rows(marked_notifications)
+
+
+# Mäter alla funktioner ovan som tar en koppling, se metrics.py
+metrics.instrument(globals())
@@ -0,0 +1,739 @@
+import asyncio
+
+import async_db
+import conditional
+import fanout
+import schemas
+import tracing
+from db_pool import POOL_TIMEOUT
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fast_json import FastJSONResponse
+
+"""
+Asynkrona versioner av de mest använda endpoints i app.py.
+
+Routerna registreras före de synkrona i app.py när DB_DRIVER=asyncpg och tar då
+över samma paths. Endpoints som saknas här hanteras som vanligt av app.py.
+De visas inte i /docs eftersom de har samma signatur som de synkrona.
+"""
+
+router = APIRouter(include_in_schema=False, route_class=tracing.TracedRoute)
+
+
+async def get_async_db():
+    """Lånar en asyncpg-koppling för en request och lämnar tillbaka den efteråt"""
+    pool = async_db.get_pool()
+    try:
+        with tracing.span("db_connect"):
+            connection = await pool.acquire(timeout=POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Databasen är överbelastad")
+    try:
+        yield connection
+    finally:
+        await pool.release(connection)
+
+
+# Bid endpoint
+
+
+@router.get("/bids", responses={200: {"model": schemas.BidPage}})
+async def get_all_bids(
+    cursor: str = None, limit: int = None, connection=Depends(get_async_db)
+):
+    """Hämtar alla bud"""
+    try:
+        bids, next_cursor = await async_db.get_all_bids(connection, cursor, limit)
+        return FastJSONResponse({"bids": bids, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get("/bids/{bid_id}", response_model=schemas.Bid)
+async def get_bid(bid_id: int, connection=Depends(get_async_db)):
+    """Hämtar ett specifikt bud"""
+    try:
+        bid = await async_db.get_bid_by_id(connection, bid_id)
+        return bid
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Bud hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get("/listings/{listing_id}/bids", response_model=schemas.BidList)
+async def get_bids_for_listing(listing_id: int, connection=Depends(get_async_db)):
+    """Hämtar alla bud för en annons"""
+    try:
+        bids = await async_db.get_bids_for_listing(connection, listing_id)
+        return {"bids": bids}
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.post("/bids", status_code=201, response_model=schemas.Bid)
+async def create_bid(bid: schemas.BidCreate, connection=Depends(get_async_db)):
+    """Skapar ett nytt bud"""
+    try:
+        new_bid = await async_db.create_bid(
+            connection, bid.user_id, bid.listing_id, bid.bid_amount
+        )
+        fanout.get_buffer().add(
+            bid.listing_id, "new_bid", f"Nytt bud på {bid.bid_amount:.2f} kr"
+        )
+        return new_bid
+    except async_db.BidRejectedError as error:
+        raise HTTPException(status_code=409, detail=str(error))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Annons hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=400, detail="Kunde inte skapa bud")
+
+
+@router.delete("/bids/{bid_id}", response_model=schemas.Deleted)
+async def delete_bid(bid_id: int, connection=Depends(get_async_db)):
+    """Raderar ett bud"""
+    try:
+        result = await async_db.delete_bid(connection, bid_id)
+        return result
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Bud hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+# User_ratings endpoints
+
+
+@router.get("/user-ratings", response_model=schemas.UserRatingList)
+async def get_all_user_ratings(connection=Depends(get_async_db)):
+    """Hämtar alla användaromdömmen"""
+    try:
+        ratings = await async_db.get_all_user_ratings(connection)
+        return {"ratings": ratings}
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get("/users/{user_id}/rating", response_model=schemas.UserRating)
+async def get_user_rating(user_id: int, connection=Depends(get_async_db)):
+    """Hämtar omdöme för en användare"""
+    try:
+        rating = await async_db.get_user_rating_by_user_id(connection, user_id)
+        return rating
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Omdöme hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+# Review endpoints
+
+
+@router.get("/reviews", responses={200: {"model": schemas.ReviewPage}})
+async def get_all_reviews(
+    cursor: str = None, limit: int = None, connection=Depends(get_async_db)
+):
+    """Hämtar alla recensioner"""
+    try:
+        reviews, next_cursor = await async_db.get_all_reviews(connection, cursor, limit)
+        return FastJSONResponse({"reviews": reviews, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get("/reviews/{review_id}", response_model=schemas.Review)
+async def get_review(review_id: int, connection=Depends(get_async_db)):
+    """Hämtar en recension"""
+    try:
+        review = await async_db.get_review_by_id(connection, review_id)
+        return review
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Recension hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get("/users/{user_id}/reviews", response_model=schemas.ReviewList)
+async def get_reviews_for_user(
+    user_id: int, request: Request, response: Response, connection=Depends(get_async_db)
+):
+    """Hämtar recensioner för en användare, 304 om inget ändrats"""
+    try:
+        version = await async_db.get_reviews_version(connection, user_id)
+        headers = conditional.headers("reviews", user_id, *version)
+        if conditional.is_fresh(request, headers):
+            return conditional.not_modified(headers)
+        reviews = await async_db.get_reviews_for_user(connection, user_id)
+        response.headers.update(headers)
+        return {"reviews": reviews}
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.post("/reviews", status_code=201, response_model=schemas.Review)
+async def create_review(review: schemas.ReviewCreate, connection=Depends(get_async_db)):
+    """Skapar en ny recension"""
+    try:
+        new_review = await async_db.create_review(
+            connection,
+            review.reviewer_id,
+            review.reviewed_user_id,
+            review.listing_id,
+            review.rating,
+            review.review_text,
+        )
+        return new_review
+    except Exception as error:
+        raise HTTPException(status_code=400, detail="Kunde inte skapa recension")
+
+
+@router.delete("/reviews/{review_id}", response_model=schemas.Deleted)
+async def delete_review(review_id: int, connection=Depends(get_async_db)):
+    """Raderar en recension"""
+    try:
+        result = await async_db.delete_review(connection, review_id)
+        return result
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Recension hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+# Image endpoints
+
+
+@router.get("/images", responses={200: {"model": schemas.ImagePage}})
+async def get_all_images(
+    cursor: str = None, limit: int = None, connection=Depends(get_async_db)
+):
+    """Hämtar alla bilder"""
+    try:
+        images, next_cursor = await async_db.get_all_images(connection, cursor, limit)
+        return FastJSONResponse({"images": images, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get("/images/{image_id}", response_model=schemas.Image)
+async def get_image(image_id: int, connection=Depends(get_async_db)):
+    """Hämtar en bild"""
+    try:
+        image = await async_db.get_image_by_id(connection, image_id)
+        return image
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Bild hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get("/listings/{listing_id}/images", response_model=schemas.ImageList)
+async def get_images_for_listing(
+    listing_id: int,
+    request: Request,
+    response: Response,
+    connection=Depends(get_async_db),
+):
+    """Hämtar bilder för en annons, 304 om inget ändrats"""
+    try:
+        version = await async_db.get_images_version(connection, listing_id)
+        headers = conditional.headers("images", listing_id, *version)
+        if conditional.is_fresh(request, headers):
+            return conditional.not_modified(headers)
+        images = await async_db.get_images_for_listing(connection, listing_id)
+        response.headers.update(headers)
+        return {"images": images}
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.post("/images", status_code=201, response_model=schemas.Image)
+async def create_image(image: schemas.ImageCreate, connection=Depends(get_async_db)):
+    """Skapar en ny bild"""
+    try:
+        new_image = await async_db.create_image(
+            connection, image.user_id, image.listing_id, image.image_url
+        )
+        return new_image
+    except Exception as error:
+        raise HTTPException(status_code=400, detail="Kunde inte skapa bild")
+
+
+@router.delete("/images/{image_id}", response_model=schemas.Deleted)
+async def delete_image(image_id: int, connection=Depends(get_async_db)):
+    """Raderar en bild"""
+    try:
+        result = await async_db.delete_image(connection, image_id)
+        return result
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Bild hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+# User endpoints
+
+
+@router.get("/users", responses={200: {"model": schemas.UserPage}})
+async def get_all_users(
+    cursor: str = None, limit: int = None, connection=Depends(get_async_db)
+):
+    """Hämtar alla användare"""
+    try:
+        users, next_cursor = await async_db.get_all_users(connection, cursor, limit)
+        return FastJSONResponse({"users": users, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get("/users/{user_id}", response_model=schemas.User)
+async def get_user(user_id: int, connection=Depends(get_async_db)):
+    """Hämtar en användare"""
+    try:
+        user = await async_db.get_user_by_id(connection, user_id)
+        return user
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Användare hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.put("/users/{user_id}", response_model=schemas.User)
+async def update_user(
+    user_id: int,
+    user: schemas.UserUpdate = Depends(),
+    connection=Depends(get_async_db),
+):
+    """Uppdaterar en användare"""
+    try:
+        updated_user = await async_db.update_user(
+            connection, user_id, user.email, user.phone_number
+        )
+        return updated_user
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Användare hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=400, detail="Kunde inte uppdatera användare")
+
+
+@router.delete("/users/{user_id}", response_model=schemas.UserDeleted)
+async def delete_user(user_id: int, connection=Depends(get_async_db)):
+    """Raderar en användare"""
+    try:
+        result = await async_db.delete_user(connection, user_id)
+        return result
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Användare hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+# Category Endpoints
+
+
+@router.get("/categories", response_model=schemas.CategoryList)
+async def get_all_categories(
+    request: Request, response: Response, connection=Depends(get_async_db)
+):
+    """Hämtar alla kategorier, 304 om inget ändrats"""
+    try:
+        categories = await async_db.get_all_categories(connection)
+        headers = conditional.headers(
+            "categories",
+            len(categories),
+            max((category["id"] for category in categories), default=0),
+        )
+        if conditional.is_fresh(request, headers):
+            return conditional.not_modified(headers)
+        response.headers.update(headers)
+        return {"categories": categories}
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+# Listing endpoints
+
+
+@router.get("/listings", responses={200: {"model": schemas.ListingPage}})
+async def get_all_listings(
+    cursor: str = None, limit: int = None, connection=Depends(get_async_db)
+):
+    """Hämtar alla annonser"""
+    try:
+        listings, next_cursor = await async_db.get_all_listings(
+            connection, cursor, limit
+        )
+        return FastJSONResponse({"listings": listings, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+# Måste ligga före /listings/{listing_id} så att "search" inte tolkas som ett id
+@router.get("/listings/search", responses={200: {"model": schemas.SearchResult}})
+async def search_listings(
+    q: str = None,
+    category_id: int = None,
+    region: str = None,
+    listing_type: str = None,
+    status: str = None,
+    min_price: float = None,
+    max_price: float = None,
+    facets: bool = True,
+    cursor: str = None,
+    limit: int = None,
+    connection=Depends(get_async_db),
+):
+    """Söker annonser med filter, fritext och antal träffar per kategori/region"""
+    filters = {
+        "category_id": category_id,
+        "region": region,
+        "listing_type": listing_type,
+        "status": status,
+        "min_price": min_price,
+        "max_price": max_price,
+    }
+    try:
+        listings, next_cursor = await async_db.search_listings(
+            connection, q, cursor, limit, **filters
+        )
+        result = {"listings": listings, "next_cursor": next_cursor}
+        if facets and not cursor:
+            result["facets"] = await async_db.get_listing_facets(
+                connection, q, **filters
+            )
+        return FastJSONResponse(result)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get("/listings/{listing_id}", response_model=schemas.Listing)
+async def get_listing(
+    listing_id: int,
+    request: Request,
+    response: Response,
+    connection=Depends(get_async_db),
+):
+    """Hämtar en annons, 304 om den inte ändrats"""
+    try:
+        listing = await async_db.get_listing_by_id(connection, listing_id)
+        headers = conditional.headers(
+            "listing",
+            listing_id,
+            listing["updated_at"],
+            last_modified=listing["updated_at"],
+        )
+        if conditional.is_fresh(request, headers):
+            return conditional.not_modified(headers)
+        response.headers.update(headers)
+        return listing
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Annons hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get("/listings/{listing_id}/full", response_model=schemas.ListingFull)
+async def get_listing_full(
+    listing_id: int, bids_limit: int = None, connection=Depends(get_async_db)
+):
+    """Hämtar en annons med bud, bilder, kommentarer, frakt och säljarens rating"""
+    try:
+        listing = await async_db.get_listing_full(connection, listing_id, bids_limit)
+        return listing
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Annons hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.post("/listings", status_code=201, response_model=schemas.Listing)
+async def create_listing(
+    listing: schemas.ListingCreate, connection=Depends(get_async_db)
+):
+    """Skapar en ny annons"""
+    try:
+        new_listing = await async_db.create_listing(
+            connection,
+            listing.user_id,
+            listing.category_id,
+            listing.title,
+            listing.listing_type,
+            listing.price,
+            listing.region,
+            listing.status,
+            listing.description,
+            listing.image_url,
+        )
+        return new_listing
+    except Exception as error:
+        raise HTTPException(status_code=400, detail="Kunde inte skapa annons")
+
+
+@router.put("/listings/{listing_id}", response_model=schemas.Listing)
+async def update_listing(
+    listing_id: int,
+    listing: schemas.ListingUpdate = Depends(),
+    connection=Depends(get_async_db),
+):
+    """Uppdaterar en annons"""
+    try:
+        updated_listing = await async_db.update_listing(
+            connection,
+            listing_id,
+            listing.category_id,
+            listing.title,
+            listing.listing_type,
+            listing.price,
+            listing.region,
+            listing.status,
+            listing.description,
+            listing.image_url,
+        )
+        fanout.get_buffer().add(
+            listing_id,
+            "listing_updated",
+            f"Annonsen {updated_listing['title']} har uppdaterats",
+        )
+        return updated_listing
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Annons hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=400, detail="Kunde inte uppdatera annons")
+
+
+@router.delete("/listings/{listing_id}", response_model=schemas.Deleted)
+async def delete_listing(listing_id: int, connection=Depends(get_async_db)):
+    """Raderar en annons"""
+    try:
+        result = await async_db.delete_listing(connection, listing_id)
+        return result
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Annons hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+# Watch list endpoints
+
+
+@router.get("/users/{user_id}/watchlist", response_model=schemas.Watchlist)
+async def get_watchlist(user_id: int, connection=Depends(get_async_db)):
+    """Hämtar bevakningslista"""
+    try:
+        watchlist = await async_db.get_all_watched_listings(connection, user_id)
+        return {"watchlist": watchlist}
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.post("/watchlist", status_code=201, response_model=schemas.WatchedListing)
+async def add_to_watchlist(
+    watch: schemas.WatchCreate, connection=Depends(get_async_db)
+):
+    """Lägger till i bevakningslista"""
+    try:
+        result = await async_db.add_to_watch_list(
+            connection, watch.user_id, watch.listing_id
+        )
+        return result
+    except Exception as error:
+        raise HTTPException(
+            status_code=400, detail="Kunde inte lägga till i bevakningslista"
+        )
+
+
+@router.delete("/watchlist", response_model=schemas.Message)
+async def remove_from_watchlist(
+    user_id: int, listing_id: int, connection=Depends(get_async_db)
+):
+    """Tar bort från bevakningslista"""
+    try:
+        result = await async_db.remove_from_watch_list(connection, user_id, listing_id)
+        return result
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Finns inte i bevakningslista")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+# Message Endpoints
+
+
+@router.get(
+    "/users/{user_id}/messages", responses={200: {"model": schemas.MessagePage}}
+)
+async def get_messages(
+    user_id: int,
+    cursor: str = None,
+    limit: int = None,
+    connection=Depends(get_async_db),
+):
+    """Hämtar meddelanden för en användare"""
+    try:
+        messages, next_cursor = await async_db.get_all_messages_for_user(
+            connection, user_id, cursor, limit
+        )
+        return FastJSONResponse({"messages": messages, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get("/users/{user_id}/inbox", responses={200: {"model": schemas.Inbox}})
+async def get_inbox(
+    user_id: int,
+    cursor: str = None,
+    limit: int = None,
+    connection=Depends(get_async_db),
+):
+    """Hämtar en rad per konversation med senaste meddelandet och antal olästa"""
+    try:
+        conversations, next_cursor = await async_db.get_inbox(
+            connection, user_id, cursor, limit
+        )
+        unread_total = await async_db.get_unread_message_count(connection, user_id)
+        return FastJSONResponse(
+            {
+                "conversations": conversations,
+                "unread_total": unread_total,
+                "next_cursor": next_cursor,
+            }
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get(
+    "/conversations/{user1_id}/{user2_id}",
+    responses={200: {"model": schemas.MessagePage}},
+)
+async def get_conversation(
+    user1_id: int,
+    user2_id: int,
+    cursor: str = None,
+    limit: int = None,
+    connection=Depends(get_async_db),
+):
+    """Hämtar meddelanden mellan två användare, nyast först"""
+    try:
+        messages, next_cursor = await async_db.get_conversation(
+            connection, user1_id, user2_id, cursor, limit
+        )
+        return FastJSONResponse({"messages": messages, "next_cursor": next_cursor})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ogiltig cursor")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.post("/messages", status_code=201, response_model=schemas.ChatMessage)
+async def create_message(
+    message: schemas.MessageCreate, connection=Depends(get_async_db)
+):
+    """Skapar ett nytt meddelande"""
+    try:
+        new_message = await async_db.create_message(
+            connection,
+            message.sender_id,
+            message.recipient_id,
+            message.listing_id,
+            message.message_text,
+        )
+        return new_message
+    except Exception as error:
+        raise HTTPException(status_code=400, detail="Kunde inte skapa meddelande")
+
+
+@router.put("/messages/{message_id}", response_model=schemas.ChatMessage)
+async def mark_message_read(message_id: int, connection=Depends(get_async_db)):
+    """Markerar meddelande som läst"""
+    try:
+        result = await async_db.mark_message_as_read(connection, message_id)
+        return result
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Meddelande hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=400, detail="Kunde inte uppdatera meddelande")
+
+
+@router.delete("/messages/{message_id}", response_model=schemas.Deleted)
+async def delete_message(message_id: int, connection=Depends(get_async_db)):
+    """Raderar ett meddelande"""
+    try:
+        result = await async_db.delete_message(connection, message_id)
+        return result
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Meddelande hittades inte")
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+# Notification Endpoints
+
+
+@router.get("/users/{user_id}/notifications", response_model=schemas.NotificationList)
+async def get_notifications(user_id: int, connection=Depends(get_async_db)):
+    """Hämtar notiser för en användare"""
+    try:
+        notifications = await async_db.get_notifications_by_user_id(connection, user_id)
+        return {"notiser": notifications}
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.get(
+    "/users/{user_id}/notifications/unread", response_model=schemas.NotificationList
+)
+async def get_unread_notifications(user_id: int, connection=Depends(get_async_db)):
+    """Hämtar olästa notiser"""
+    try:
+        notifications = await async_db.get_unread_notifications(connection, user_id)
+        return {"notiser": notifications}
+    except Exception as error:
+        raise HTTPException(status_code=500, detail="Något gick fel")
+
+
+@router.post("/notifications", status_code=201, response_model=schemas.Notification)
+async def create_notification(
+    notification: schemas.NotificationCreate, connection=Depends(get_async_db)
+):
+    """Skapar en ny notis"""
+    try:
+        new_notification = await async_db.create_notification(
+            connection,
+            notification.user_id,
+            notification.listing_id,
+            notification.notification_type,
+            notification.notification_message,
+        )
+        return new_notification
+    except Exception as error:
+        raise HTTPException(status_code=400, detail="Kunde inte skapa notis")
+
+
+@router.put(
+    "/users/{user_id}/notifications/mark-read",
+    response_model=schemas.NotificationsMarked,
+)
+async def mark_notifications_read(user_id: int, connection=Depends(get_async_db)):
+    """Markerar alla notiser som lästa"""
+    try:
+        result = await async_db.mark_all_notifications_as_read(connection, user_id)
+        return {"marked": len(result)}
+    except Exception as error:
+        raise HTTPException(status_code=400, detail="Kunde inte uppdatera notiser")
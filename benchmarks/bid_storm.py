@@ -0,0 +1,164 @@
+import argparse
+import random
+import threading
+import time
+from decimal import Decimal
+
+import db
+from db_setup import get_connection
+
+"""
+Stresstest för budmotorn: många samtidiga budgivare på samma annons.
+
+Varje tråd har en egen anslutning och lägger bud i en tight loop, lite över det
+högsta bud den senast sett, precis som i slutsekunderna av en auktion. Efteråt
+kontrolleras att inga uppdateringar tappats:
+
+- listings.bid_count == antal rader i bids för annonsen
+- listings.current_high_bid == MAX(bid_amount)
+- antal accepterade bud == antal rader i bids
+- accepterade bud är strikt stigande i id-ordning och följer MIN_BID_INCREMENT
+
+Kör mot en testdatabas: python -m benchmarks.bid_storm --bidders 200 --seconds 5
+"""
+
+
+def create_listing(connection, seller_id, category_id, price):
+    """Skapar en aktiv annons att buda på"""
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO listings
+                    (user_id, category_id, title, listing_type, price, region,
+                     status, description)
+                VALUES (%s, %s, 'Budstorm', 'selling', %s, 'Stockholm', 'active',
+                        'Stresstest av budmotorn')
+                RETURNING id
+            """,
+                (seller_id, category_id, price),
+            )
+            return cursor.fetchone()[0]
+
+
+def first_id(connection, table):
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {table} ORDER BY id LIMIT 1")
+            row = cursor.fetchone()
+    if not row:
+        raise SystemExit(f"Tabellen {table} är tom, seeda databasen först")
+    return row[0]
+
+
+def bidder(listing_id, user_id, start_price, seconds, barrier, results):
+    connection = get_connection()
+    accepted = rejected = 0
+    seen_high = start_price
+    try:
+        # Alla anslutningar är uppe innan klockan börjar gå
+        barrier.wait()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            amount = seen_high + db.MIN_BID_INCREMENT * random.randint(1, 3)
+            try:
+                db.create_bid(connection, user_id, listing_id, amount)
+                accepted += 1
+                seen_high = amount
+            except db.BidRejectedError:
+                rejected += 1
+                listing = db.get_listing_by_id(connection, listing_id)
+                seen_high = listing["current_high_bid"] or start_price
+    finally:
+        connection.close()
+    results.append((accepted, rejected))
+
+
+def verify(connection, listing_id, accepted):
+    """Returnerar en lista med fel, tom om allt stämmer"""
+    errors = []
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT current_high_bid, bid_count FROM listings WHERE id = %s",
+                (listing_id,),
+            )
+            high_bid, bid_count = cursor.fetchone()
+            cursor.execute(
+                "SELECT bid_amount FROM bids WHERE listing_id = %s ORDER BY id",
+                (listing_id,),
+            )
+            amounts = [row[0] for row in cursor.fetchall()]
+
+    if bid_count != len(amounts):
+        errors.append(f"bid_count {bid_count} men {len(amounts)} bud i bids")
+    if accepted != len(amounts):
+        errors.append(f"{accepted} accepterade bud men {len(amounts)} i bids")
+    if amounts and high_bid != max(amounts):
+        errors.append(f"current_high_bid {high_bid} men MAX(bid_amount) {max(amounts)}")
+    for previous, current in zip(amounts, amounts[1:]):
+        if current < previous + db.MIN_BID_INCREMENT:
+            errors.append(
+                f"bud {current} efter {previous} bryter mot MIN_BID_INCREMENT"
+            )
+            break
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stresstest för budmotorn")
+    parser.add_argument("--bidders", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--start-price", type=Decimal, default=Decimal("100.00"))
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        user_id = first_id(connection, "users")
+        listing_id = create_listing(
+            connection,
+            user_id,
+            first_id(connection, "categories"),
+            args.start_price,
+        )
+
+        results = []
+        barrier = threading.Barrier(args.bidders)
+        threads = [
+            threading.Thread(
+                target=bidder,
+                args=(
+                    listing_id,
+                    user_id,
+                    args.start_price,
+                    args.seconds,
+                    barrier,
+                    results,
+                ),
+            )
+            for _ in range(args.bidders)
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        accepted = sum(result[0] for result in results)
+        rejected = sum(result[1] for result in results)
+        print(f"Annons {listing_id}: {args.bidders} budgivare i {elapsed:.1f} s")
+        print(f"Accepterade {accepted}, avvisade {rejected}")
+
+        errors = verify(connection, listing_id, accepted)
+        for error in errors:
+            print(f"FEL: {error}")
+        if errors:
+            raise SystemExit(1)
+        print("OK, inga tappade uppdateringar")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,804 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import cached_property, lru_cache
+
+import numpy as np
+
+import db
+import db_setup
+from benchmarks.seed import (
+    ADJECTIVES,
+    CATEGORY_NAMES,
+    DESCRIPTION_WORDS,
+    NOTIFICATION_TYPES,
+    NOUNS,
+    NOW,
+    PAYMENT_METHODS,
+    REGION_WEIGHTS,
+    REGIONS,
+    REPORT_REASONS,
+    SHIPPING_METHODS,
+    check_empty,
+    finish,
+    reset,
+    rows_for_scale,
+)
+from db_setup import get_connection
+
+"""
+Snabb generator av syntetiska data för alla 15 tabeller, för test med miljontals rader.
+
+Samma tabeller och antal per --scale som benchmarks.seed (--scale 100 ger ca 13
+miljoner rader), men varje kolumn räknas fram med NumPy för ett helt block av
+id:n i taget och blocken skrivs med COPY från flera processer parallellt.
+
+Varje värde är en funktion av (seed, tabell, kolumn, id) via en hash, inte av en
+slumpgenerator med tillstånd. Därför spelar det ingen roll vilken process som
+skriver vilket block, och en rad som refererar till en annan (budets annons,
+affärens vinnande bud, bildens säljare) kan räkna fram den raden igen utan att
+processerna delar något. Samma --seed ger samma data oavsett --workers.
+
+Fördelningar:
+
+- popularitet: annonser och användare väljs Zipf-fördelat (LISTING_POPULARITY,
+  USER_ACTIVITY), låga id:n är populärast som i benchmarks.seed
+- bud: varje säljannons får bud i proportion till sin popularitet, budens id:n
+  ligger i följd per annons och beloppen stiger; tiderna klumpar sig mot slutet
+  av auktionen (AUCTION_DAYS)
+- meddelanden: trådar mellan en köpare och säljaren med Pareto-fördelad längd,
+  de flesta trådar är korta men några är mycket långa
+- affärer görs på sålda annonser till det högsta budet, betalningar, recensioner
+  och frakt hör till affärerna
+
+Antalet bud och meddelanden blir nära men inte exakt målet, eftersom de läggs ut
+per annons och per tråd. Bevakningslistan har en primärnyckel, dubbletter hoppas
+över. Efteråt körs samma avslutning som i benchmarks.seed (sekvenser, högsta bud,
+user_ratings, message_threads och ANALYZE).
+
+Kräver numpy (benchmarks/requirements.txt).
+
+Kör mot en testdatabas (DATABASE_NAME): python -m benchmarks.datagen --scale 100 --workers 8 --reset
+"""
+
+# Zipf-exponenter, högre betyder att de populäraste tar en större andel
+LISTING_POPULARITY = 0.8
+USER_ACTIVITY = 0.7
+CATEGORY_POPULARITY = 1.0
+
+AUCTION_DAYS = 7
+# Pareto-exponent för trådarnas längd, 1.5 ger i snitt ca 3 meddelanden
+THREAD_LENGTH_ALPHA = 1.5
+MAX_THREAD_LENGTH = 200
+
+# Rader per block som en process genererar och skriver med en COPY
+CHUNK_ROWS = 100_000
+
+COLUMNS = {
+    "users": (
+        "id",
+        "username",
+        "email",
+        "password",
+        "user_since",
+        "date_of_birth",
+        "phone_number",
+    ),
+    "categories": ("id", "name"),
+    "listings": (
+        "id",
+        "user_id",
+        "category_id",
+        "title",
+        "image_url",
+        "listing_type",
+        "price",
+        "created_at",
+        "region",
+        "status",
+        "description",
+    ),
+    "listings_watch_list": ("user_id", "listing_id", "created_at"),
+    "messages": (
+        "id",
+        "sender_id",
+        "recipient_id",
+        "listing_id",
+        "message_text",
+        "created_at",
+        "is_read",
+    ),
+    "bids": ("id", "user_id", "listing_id", "created_at", "bid_amount"),
+    "transactions": (
+        "id",
+        "user_id",
+        "bid_id",
+        "listing_id",
+        "created_at",
+        "status",
+        "amount",
+    ),
+    "payments": (
+        "id",
+        "transaction_id",
+        "listing_id",
+        "payment_method",
+        "payment_status",
+        "amount",
+        "paid_at",
+    ),
+    "reviews": (
+        "id",
+        "reviewer_id",
+        "reviewed_user_id",
+        "listing_id",
+        "rating",
+        "review_text",
+        "created_at",
+    ),
+    "images": ("id", "user_id", "listing_id", "image_url", "created_at"),
+    "notifications": (
+        "id",
+        "user_id",
+        "listing_id",
+        "notification_type",
+        "notification_message",
+        "is_read",
+        "created_at",
+    ),
+    "listing_comments": (
+        "id",
+        "user_id",
+        "listing_id",
+        "comment_text",
+        "created_at",
+        "answer_text",
+        "answered_at",
+    ),
+    "shipping_details": (
+        "id",
+        "user_id",
+        "listing_id",
+        "shipping_method",
+        "shipping_cost",
+        "estimated_delivery_days",
+        "tracking_number",
+        "status",
+        "shipped_at",
+    ),
+    "reports": ("id", "user_id", "listing_id", "report_reason", "created_at"),
+}
+
+NULL = "\\N"
+DAY = 86_400
+NOW_SECONDS = int(np.datetime64(NOW, "s").astype(np.int64))
+
+
+def _salt(name):
+    return zlib.crc32(name.encode())
+
+
+def _choose(u, values, weights):
+    """Väljer bland values med vikter, u är likformigt i [0, 1)"""
+    cdf = np.cumsum(weights, dtype=np.float64)
+    index = np.searchsorted(cdf / cdf[-1], u, side="right")
+    return np.asarray(values)[np.minimum(index, len(values) - 1)]
+
+
+@lru_cache(maxsize=None)
+def _zipf_weights(count, exponent):
+    weights = np.arange(1, count + 1, dtype=np.float64) ** -exponent
+    return weights / weights.sum()
+
+
+@lru_cache(maxsize=None)
+def _zipf_cdf(count, exponent):
+    return np.cumsum(_zipf_weights(count, exponent))
+
+
+def zipf(u, count, exponent):
+    """Id mellan 1 och count där id 1 är vanligast"""
+    index = np.searchsorted(_zipf_cdf(count, exponent), u, side="right")
+    return np.minimum(index, count - 1) + 1
+
+
+# Formatering för COPY i textformat
+
+
+def _ints(values):
+    return values.astype(np.int64).astype(str).tolist()
+
+
+def _money(values):
+    return [f"{value:.2f}" for value in values.tolist()]
+
+
+def _timestamps(seconds):
+    return seconds.astype("datetime64[s]").astype(str).tolist()
+
+
+def _bools(values):
+    return np.where(values, "t", "f").tolist()
+
+
+def _nullable(values, present):
+    return np.where(present, values, NULL).tolist()
+
+
+def _strings(values):
+    return np.asarray(values).astype(str).tolist()
+
+
+def to_copy_text(columns):
+    """Tabbseparerade rader, texterna innehåller inga tabbar eller radbrytningar"""
+    return "\n".join("\t".join(row) for row in zip(*columns)) + "\n"
+
+
+class Generator:
+    """Räknar fram raderna för ett block av id:n i valfri tabell"""
+
+    def __init__(self, rows, seed):
+        # Målen per tabell, alla processer måste få samma för samma utläggning
+        self.rows = dict(rows)
+        self.seed = seed
+        self.users = self.rows["users"]
+        self.listing_count = self.rows["listings"]
+
+    def uniform(self, ids, name):
+        """Likformigt i [0, 1) som bara beror på seed, name och id (splitmix64)"""
+        with np.errstate(over="ignore"):
+            x = ids.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+            x += np.uint64((self.seed << 32) ^ _salt(name))
+            x ^= x >> np.uint64(30)
+            x *= np.uint64(0xBF58476D1CE4E5B9)
+            x ^= x >> np.uint64(27)
+            x *= np.uint64(0x94D049BB133111EB)
+            x ^= x >> np.uint64(31)
+        return (x >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+    def user(self, ids, name):
+        return zipf(self.uniform(ids, name), self.users, USER_ACTIVITY)
+
+    def listing(self, ids, name):
+        return zipf(self.uniform(ids, name), self.listing_count, LISTING_POPULARITY)
+
+    def _phrases(self, name, words, low, high, count=1024):
+        """En fast uppsättning texter att välja bland, dyrt att bygga per rad"""
+        rng = np.random.default_rng([self.seed, _salt(name)])
+        return np.array(
+            [
+                " ".join(rng.choice(words, rng.integers(low, high + 1)))
+                for _ in range(count)
+            ]
+        )
+
+    def _pick_phrase(self, ids, name, pool):
+        return pool[(self.uniform(ids, name) * len(pool)).astype(np.intp)]
+
+    @cached_property
+    def titles(self):
+        return np.array(
+            [f"{adjective} {noun}" for adjective in ADJECTIVES for noun in NOUNS]
+        )
+
+    @cached_property
+    def descriptions(self):
+        return self._phrases("descriptions", DESCRIPTION_WORDS, 5, 30)
+
+    @cached_property
+    def short_texts(self):
+        return self._phrases("short_texts", DESCRIPTION_WORDS, 3, 15)
+
+    # Annonsernas egenskaper, används av alla tabeller som pekar på en annons
+
+    def seller(self, listing_ids):
+        return self.user(listing_ids, "listings.user_id")
+
+    def created(self, listing_ids):
+        age = (self.uniform(listing_ids, "listings.created_at") * 365 * DAY).astype(
+            np.int64
+        )
+        return NOW_SECONDS - age
+
+    def listing_type(self, listing_ids):
+        return _choose(
+            self.uniform(listing_ids, "listings.listing_type"),
+            ["selling", "buying", "free"],
+            [85, 10, 5],
+        )
+
+    def listing_status(self, listing_ids):
+        return _choose(
+            self.uniform(listing_ids, "listings.status"),
+            ["active", "sold", "closed"],
+            [70, 20, 10],
+        )
+
+    def price(self, listing_ids):
+        # Lognormal via Box-Muller
+        u1 = self.uniform(listing_ids, "listings.price.1")
+        u2 = self.uniform(listing_ids, "listings.price.2")
+        normal = np.sqrt(-2 * np.log1p(-u1)) * np.cos(2 * np.pi * u2)
+        price = np.clip(np.round(np.exp(5.5 + 1.2 * normal), 2), 1, 99_999)
+        return np.where(self.listing_type(listing_ids) == "free", 0.0, price)
+
+    def title(self, listing_ids):
+        return self._pick_phrase(listing_ids, "listings.title", self.titles)
+
+    # Utläggning av bud, trådar och affärer, samma i alla processer
+
+    @cached_property
+    def bid_layout(self):
+        """(antal bud per annons, id före annonsens första bud), bara säljannonser"""
+        ids = np.arange(1, self.listing_count + 1)
+        weights = _zipf_weights(self.listing_count, LISTING_POPULARITY).copy()
+        weights[self.listing_type(ids) != "selling"] = 0
+        expected = weights / max(weights.sum(), 1e-300) * self.rows["bids"]
+        counts = np.floor(expected).astype(np.int64)
+        counts += self.uniform(ids, "bids.count") < expected - counts
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return counts, offsets
+
+    @cached_property
+    def thread_layout(self):
+        """Id före varje tråds första meddelande, trådlängden är Pareto-fördelad"""
+        mean_length = THREAD_LENGTH_ALPHA / (THREAD_LENGTH_ALPHA - 1)
+        threads = np.arange(1, max(int(self.rows["messages"] / mean_length), 1) + 1)
+        u = self.uniform(threads, "messages.thread_length")
+        lengths = np.minimum(
+            np.floor((1 - u) ** (-1 / THREAD_LENGTH_ALPHA)), MAX_THREAD_LENGTH
+        ).astype(np.int64)
+        return np.concatenate(([0], np.cumsum(lengths)))
+
+    @cached_property
+    def sold_listings(self):
+        """Sålda annonser med bud, en affär per annons"""
+        counts, _ = self.bid_layout
+        ids = np.arange(1, self.listing_count + 1)
+        sold = ids[(self.listing_status(ids) == "sold") & (counts > 0)]
+        return sold[: self.rows["transactions"]]
+
+    def planned_rows(self):
+        """Antal rader som faktiskt skrivs per tabell"""
+        rows = dict(self.rows)
+        rows["bids"] = int(self.bid_layout[1][-1])
+        rows["messages"] = int(self.thread_layout[-1])
+        rows["transactions"] = len(self.sold_listings)
+        rows["payments"] = min(rows["payments"], rows["transactions"])
+        return rows
+
+    def _bids(self, bid_ids):
+        """(annons, budgivare, tid, belopp) för bud-id:n"""
+        counts, offsets = self.bid_layout
+        listing_ids = np.searchsorted(offsets, bid_ids - 1, side="right")
+        position = bid_ids - 1 - offsets[listing_ids - 1]
+        progress = (position + 1) / (counts[listing_ids - 1] + 1)
+        # Upphöjt till 0.25 hamnar de flesta buden nära auktionens slut
+        at = self.created(listing_ids) + (AUCTION_DAYS * DAY * progress**0.25).astype(
+            np.int64
+        )
+        price = self.price(listing_ids)
+        amount = np.round(
+            price
+            + float(db.MIN_BID_INCREMENT) * (position + 1)
+            + price * 0.5 * progress,
+            2,
+        )
+        bidders = self.user(bid_ids, "bids.user_id")
+        return listing_ids, bidders, np.minimum(at, NOW_SECONDS), amount
+
+    def _transactions(self, transaction_ids):
+        """(annons, vinnande bud, köpare, tid, belopp) för affärs-id:n"""
+        listing_ids = self.sold_listings[transaction_ids - 1]
+        _, offsets = self.bid_layout
+        bid_ids = offsets[listing_ids]
+        _, buyers, at, amount = self._bids(bid_ids)
+        return listing_ids, bid_ids, buyers, at, amount
+
+    # En metod per tabell, returnerar kolumnerna i samma ordning som COLUMNS
+
+    def generate_users(self, ids):
+        u = self.uniform(ids, "users.user_since")
+        user_since = NOW_SECONDS - 365 * DAY - (u * 1_000 * DAY).astype(np.int64)
+        born = np.datetime64("1950-01-01") + (
+            self.uniform(ids, "users.date_of_birth") * 55 * 365
+        ).astype("timedelta64[D]")
+        phone = (self.uniform(ids, "users.phone_number.digits") * 1e8).astype(np.int64)
+        names = np.char.add("user", ids.astype(str))
+        return [
+            _ints(ids),
+            names.tolist(),
+            np.char.add(names, "@example.se").tolist(),
+            ["benchmark"] * len(ids),
+            _timestamps(user_since),
+            born.astype(str).tolist(),
+            _nullable(
+                np.char.add("07", np.char.zfill(phone.astype(str), 8)),
+                self.uniform(ids, "users.phone_number") < 0.7,
+            ),
+        ]
+
+    def generate_categories(self, ids):
+        return [_ints(ids), [CATEGORY_NAMES[i - 1] for i in ids.tolist()]]
+
+    def generate_listings(self, ids):
+        categories = zipf(
+            self.uniform(ids, "listings.category_id"),
+            self.rows["categories"],
+            CATEGORY_POPULARITY,
+        )
+        return [
+            _ints(ids),
+            _ints(self.seller(ids)),
+            _ints(categories),
+            _strings(self.title(ids)),
+            [f"https://img.example.se/{i}.jpg" for i in ids.tolist()],
+            _strings(self.listing_type(ids)),
+            _money(self.price(ids)),
+            _timestamps(self.created(ids)),
+            _strings(
+                _choose(self.uniform(ids, "listings.region"), REGIONS, REGION_WEIGHTS)
+            ),
+            _strings(self.listing_status(ids)),
+            _strings(self._pick_phrase(ids, "listings.description", self.descriptions)),
+        ]
+
+    def generate_listings_watch_list(self, ids):
+        listing_ids = self.listing(ids, "watch.listing_id")
+        at = self.created(listing_ids) + (
+            self.uniform(ids, "watch.created_at") * 30 * DAY
+        ).astype(np.int64)
+        return [
+            _ints(self.user(ids, "watch.user_id")),
+            _ints(listing_ids),
+            _timestamps(np.minimum(at, NOW_SECONDS)),
+        ]
+
+    def generate_messages(self, ids):
+        offsets = self.thread_layout
+        threads = np.searchsorted(offsets, ids - 1, side="right")
+        turn = ids - 1 - offsets[threads - 1]
+        last = ids == offsets[threads]
+        listing_ids = self.listing(threads, "messages.listing_id")
+        buyers = self.user(threads, "messages.buyer")
+        owners = self.seller(listing_ids)
+        from_buyer = turn % 2 == 0
+        started = self.created(listing_ids) + (
+            self.uniform(threads, "messages.started") * 60 * DAY
+        ).astype(np.int64)
+        gap = 60 + (self.uniform(threads, "messages.gap") * 600 * 60).astype(np.int64)
+        at = started + turn * gap
+        # Bara det senaste meddelandet i en tråd kan vara oläst
+        unread = last & (self.uniform(ids, "messages.is_read") < 0.5)
+        return [
+            _ints(ids),
+            _ints(np.where(from_buyer, buyers, owners)),
+            _ints(np.where(from_buyer, owners, buyers)),
+            _ints(listing_ids),
+            _strings(self._pick_phrase(ids, "messages.text", self.short_texts)),
+            _timestamps(np.minimum(at, NOW_SECONDS)),
+            _bools(~unread),
+        ]
+
+    def generate_bids(self, ids):
+        listing_ids, bidders, at, amount = self._bids(ids)
+        return [
+            _ints(ids),
+            _ints(bidders),
+            _ints(listing_ids),
+            _timestamps(at),
+            _money(amount),
+        ]
+
+    def generate_transactions(self, ids):
+        listing_ids, bid_ids, buyers, at, amount = self._transactions(ids)
+        status = _choose(
+            self.uniform(ids, "transactions.status"),
+            ["completed", "pending", "cancelled"],
+            [80, 15, 5],
+        )
+        return [
+            _ints(ids),
+            _ints(buyers),
+            _ints(bid_ids),
+            _ints(listing_ids),
+            _timestamps(at),
+            _strings(status),
+            _money(amount),
+        ]
+
+    def generate_payments(self, ids):
+        # En betalning per affär, med samma id och status som följer affärens
+        listing_ids, _, _, at, amount = self._transactions(ids)
+        status = _choose(
+            self.uniform(ids, "transactions.status"),
+            ["completed", "pending", "refunded"],
+            [80, 15, 5],
+        )
+        paid_at = at + (self.uniform(ids, "payments.paid_at") * 2 * DAY).astype(
+            np.int64
+        )
+        return [
+            _ints(ids),
+            _ints(ids),
+            _ints(listing_ids),
+            _strings(
+                _choose(
+                    self.uniform(ids, "payments.method"),
+                    PAYMENT_METHODS,
+                    [40, 40, 10, 10],
+                )
+            ),
+            _strings(status),
+            _money(amount),
+            _timestamps(np.minimum(paid_at, NOW_SECONDS)),
+        ]
+
+    def generate_reviews(self, ids):
+        transactions = len(self.sold_listings)
+        if transactions:
+            transaction_ids = (
+                self.uniform(ids, "reviews.transaction") * transactions
+            ).astype(np.int64) + 1
+            listing_ids, _, reviewers, at, _ = self._transactions(transaction_ids)
+        else:
+            listing_ids = self.listing(ids, "reviews.listing_id")
+            reviewers = self.user(ids, "reviews.reviewer_id")
+            at = self.created(listing_ids)
+        at = at + (self.uniform(ids, "reviews.created_at") * 14 * DAY).astype(np.int64)
+        rating = _choose(
+            self.uniform(ids, "reviews.rating"), [5, 4, 3, 2, 1], [60, 25, 8, 4, 3]
+        )
+        return [
+            _ints(ids),
+            _ints(reviewers),
+            _ints(self.seller(listing_ids)),
+            _ints(listing_ids),
+            _ints(rating),
+            _strings(self._pick_phrase(ids, "reviews.text", self.short_texts)),
+            _timestamps(np.minimum(at, NOW_SECONDS)),
+        ]
+
+    def generate_images(self, ids):
+        listing_ids = self.listing(ids, "images.listing_id")
+        at = self.created(listing_ids) + (
+            self.uniform(ids, "images.created_at") * 3_600
+        ).astype(np.int64)
+        return [
+            _ints(ids),
+            _ints(self.seller(listing_ids)),
+            _ints(listing_ids),
+            [
+                f"https://img.example.se/{listing_id}/{image_id}.jpg"
+                for listing_id, image_id in zip(listing_ids.tolist(), ids.tolist())
+            ],
+            _timestamps(np.minimum(at, NOW_SECONDS)),
+        ]
+
+    def generate_notifications(self, ids):
+        listing_ids = self.listing(ids, "notifications.listing_id")
+        types = _choose(
+            self.uniform(ids, "notifications.type"),
+            NOTIFICATION_TYPES,
+            [1] * len(NOTIFICATION_TYPES),
+        )
+        at = self.created(listing_ids) + (
+            self.uniform(ids, "notifications.created_at") * 60 * DAY
+        ).astype(np.int64)
+        return [
+            _ints(ids),
+            _ints(self.user(ids, "notifications.user_id")),
+            _ints(listing_ids),
+            _strings(types),
+            np.char.add(np.char.add(types, " på "), self.title(listing_ids)).tolist(),
+            _bools(self.uniform(ids, "notifications.is_read") < 0.7),
+            _timestamps(np.minimum(at, NOW_SECONDS)),
+        ]
+
+    def generate_listing_comments(self, ids):
+        listing_ids = self.listing(ids, "comments.listing_id")
+        at = self.created(listing_ids) + (
+            self.uniform(ids, "comments.created_at") * 30 * DAY
+        ).astype(np.int64)
+        answered = self.uniform(ids, "comments.answered") < 0.6
+        answered_at = at + (
+            3_600 + self.uniform(ids, "comments.answered_at") * 47 * 3_600
+        ).astype(np.int64)
+        return [
+            _ints(ids),
+            _ints(self.user(ids, "comments.user_id")),
+            _ints(listing_ids),
+            np.char.add(
+                self._pick_phrase(ids, "comments.text", self.short_texts), "?"
+            ).tolist(),
+            _timestamps(np.minimum(at, NOW_SECONDS)),
+            _nullable(
+                self._pick_phrase(ids, "comments.answer", self.short_texts), answered
+            ),
+            _nullable(np.array(_timestamps(answered_at)), answered),
+        ]
+
+    def generate_shipping_details(self, ids):
+        # Frakt för affärerna först, sedan för populära annonser
+        transactions = len(self.sold_listings)
+        listing_ids = self.listing(ids, "shipping.listing_id")
+        for_transaction = ids <= transactions
+        if for_transaction.any():
+            listing_ids[for_transaction] = self.sold_listings[ids[for_transaction] - 1]
+        shipped = self.uniform(ids, "shipping.shipped") < 0.5
+        shipped_at = self.created(listing_ids) + (
+            (1 + self.uniform(ids, "shipping.shipped_at") * 19) * DAY
+        ).astype(np.int64)
+        tracking = (self.uniform(ids, "shipping.tracking") * 1e9).astype(np.int64)
+        return [
+            _ints(ids),
+            _ints(self.seller(listing_ids)),
+            _ints(listing_ids),
+            _strings(
+                _choose(
+                    self.uniform(ids, "shipping.method"),
+                    SHIPPING_METHODS,
+                    [40, 15, 10, 20, 15],
+                )
+            ),
+            _money(np.round(self.uniform(ids, "shipping.cost") * 150, 2)),
+            _ints(1 + (self.uniform(ids, "shipping.days") * 7).astype(np.int64)),
+            _nullable(
+                np.char.add("SE", np.char.zfill(tracking.astype(str), 9)), shipped
+            ),
+            np.where(shipped, "shipped", "pending").tolist(),
+            _nullable(
+                np.array(_timestamps(np.minimum(shipped_at, NOW_SECONDS))), shipped
+            ),
+        ]
+
+    def generate_reports(self, ids):
+        listing_ids = self.listing(ids, "reports.listing_id")
+        at = self.created(listing_ids) + (
+            self.uniform(ids, "reports.created_at") * 30 * DAY
+        ).astype(np.int64)
+        return [
+            _ints(ids),
+            _ints(self.user(ids, "reports.user_id")),
+            _ints(listing_ids),
+            _strings(
+                _choose(
+                    self.uniform(ids, "reports.reason"),
+                    REPORT_REASONS,
+                    [1] * len(REPORT_REASONS),
+                )
+            ),
+            _timestamps(np.minimum(at, NOW_SECONDS)),
+        ]
+
+
+@lru_cache(maxsize=4)
+def _generator(rows, seed):
+    """En Generator per process, utläggningarna byggs bara en gång"""
+    return Generator(rows, seed)
+
+
+def load_chunk(table, start, stop, rows, seed):
+    """Genererar id:n start till stop - 1 och skriver dem med COPY, körs i en worker"""
+    generator = _generator(rows, seed)
+    columns = getattr(generator, f"generate_{table}")(
+        np.arange(start, stop, dtype=np.int64)
+    )
+    buffer = io.StringIO(to_copy_text(columns))
+    names = ", ".join(COLUMNS[table])
+
+    connection = get_connection()
+    try:
+        with connection:
+            with connection.cursor() as cursor:
+                # Datat går att generera igen, ingen anledning att vänta på WAL-flush
+                cursor.execute("SET LOCAL synchronous_commit TO off")
+                if table == "listings_watch_list":
+                    # Primärnyckeln (user_id, listing_id), dubbletter hoppas över
+                    cursor.execute(
+                        "CREATE TEMP TABLE watch_staging "
+                        "(LIKE listings_watch_list) ON COMMIT DROP"
+                    )
+                    cursor.copy_expert(
+                        f"COPY watch_staging ({names}) FROM STDIN", buffer
+                    )
+                    cursor.execute(
+                        f"INSERT INTO listings_watch_list ({names}) "
+                        f"SELECT {names} FROM watch_staging ON CONFLICT DO NOTHING"
+                    )
+                else:
+                    cursor.copy_expert(f"COPY {table} ({names}) FROM STDIN", buffer)
+    finally:
+        connection.close()
+    return table, stop - start
+
+
+def chunks(planned, chunk_rows=CHUNK_ROWS):
+    """(tabell, start, stop) för alla block, de största tabellerna först"""
+    tasks = []
+    for table in sorted(planned, key=planned.get, reverse=True):
+        for start in range(1, planned[table] + 1, chunk_rows):
+            tasks.append((table, start, min(start + chunk_rows, planned[table] + 1)))
+    return tasks
+
+
+def generate(scale=1.0, seed=42, workers=None, chunk_rows=CHUNK_ROWS, progress=None):
+    """
+    Fyller de tomma tabellerna parallellt. progress(tabell, skrivna, planerade)
+    anropas efter varje block. Returnerar antal planerade rader per tabell.
+    """
+    rows = tuple(sorted(rows_for_scale(scale).items()))
+    planned = Generator(rows, seed).planned_rows()
+    written = dict.fromkeys(planned, 0)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(load_chunk, table, start, stop, rows, seed)
+            for table, start, stop in chunks(planned, chunk_rows)
+        ]
+        for future in as_completed(futures):
+            table, count = future.result()
+            written[table] += count
+            if progress:
+                progress(table, written[table], planned[table])
+    return planned
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genererar stora mängder testdata")
+    parser.add_argument("--scale", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument(
+        "--reset", action="store_true", help="töm alla tabeller först (TRUNCATE)"
+    )
+    args = parser.parse_args()
+
+    db_setup.create_tables()
+    db_setup.run_migrations()
+    # Stängs innan workers startas, de ska inte ärva kopplingen
+    connection = get_connection()
+    try:
+        if args.reset:
+            reset(connection)
+        check_empty(connection)
+    except ValueError as error:
+        parser.error(f"{error}, använd --reset")
+    finally:
+        connection.close()
+
+    def progress(table, written, planned):
+        if written == planned:
+            print(f"{table}: {planned} rader", file=sys.stderr)
+
+    started = time.perf_counter()
+    generate(args.scale, args.seed, args.workers, args.chunk_rows, progress)
+    loaded = time.perf_counter() - started
+    connection = get_connection()
+    try:
+        counts = finish(connection)
+    finally:
+        connection.close()
+
+    total = sum(counts.values())
+    elapsed = time.perf_counter() - started
+    summary = {
+        "scale": args.scale,
+        "seed": args.seed,
+        "workers": args.workers,
+        "load_seconds": round(loaded, 2),
+        "seconds": round(elapsed, 2),
+        "rows_per_second": round(total / elapsed),
+        "total_rows": total,
+        "rows": counts,
+    }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import statistics
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from psycopg2.extras import RealDictCursor
+
+import db
+import fast_json
+import pagination
+from db_pool import get_pool
+
+"""
+Jämför tre sätt att svara på /listings med en hel sida:
+
+- dict: RealDictCursor, jsonable_encoder och JSONResponse (som tidigare)
+- tupel: vanlig cursor och db.fetch_rows, FastJSONResponse utan jsonable_encoder
+- json_agg: PostgreSQL bygger JSON:en och Python skickar texten vidare
+
+Tiden omfattar frågan och serialiseringen till bytes.
+
+Kör: python -m benchmarks.json_path --limit 200 --iterations 500
+"""
+
+
+LISTINGS_PAGE = f"""
+    SELECT {db.LISTING_COLUMNS} FROM listings
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+"""
+
+# Hela sidan som en JSON-array, byggd i PostgreSQL
+LISTINGS_PAGE_JSON = f"""
+    SELECT COALESCE(json_agg(page ORDER BY created_at DESC, id DESC), '[]')::text
+    FROM ({LISTINGS_PAGE}) AS page
+"""
+
+
+def dict_path(connection, limit):
+    """Som /listings gjorde förut"""
+    with connection:
+        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(LISTINGS_PAGE, (limit + 1,))
+            listings = cursor.fetchall()
+    listings, next_cursor = pagination.next_page(listings, limit, "created_at")
+    content = jsonable_encoder({"listings": listings, "next_cursor": next_cursor})
+    return JSONResponse(content).body
+
+
+def tuple_path(connection, limit):
+    """Som /listings gör nu"""
+    listings, next_cursor = db.get_all_listings(connection, None, limit)
+    return fast_json.FastJSONResponse(
+        {"listings": listings, "next_cursor": next_cursor}
+    ).body
+
+
+def json_agg_path(connection, limit):
+    """Utan nästa cursor, visar bara vad det kostar att låta PostgreSQL bygga JSON"""
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(LISTINGS_PAGE_JSON, (limit,))
+            listings = cursor.fetchone()[0]
+    return fast_json.FastJSONResponse(
+        b'{"listings":%s,"next_cursor":null}' % listings.encode()
+    ).body
+
+
+def measure(path, connection, limit, iterations):
+    """Returnerar svarstider i millisekunder"""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        path(connection, limit)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Jämför serialiseringsvägar")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+    pagination.MAX_PAGE_SIZE = max(pagination.MAX_PAGE_SIZE, args.limit)
+
+    paths = {"dict": dict_path, "tupel": tuple_path, "json_agg": json_agg_path}
+    pool = get_pool()
+    try:
+        with pool.connection() as connection:
+            results = {}
+            for name, path in paths.items():
+                measure(path, connection, args.limit, 20)
+                results[name] = measure(path, connection, args.limit, args.iterations)
+    finally:
+        pool.close()
+
+    baseline = statistics.median(results["dict"])
+    print(f"{args.limit} annonser per sida, orjson: {bool(fast_json.orjson)}")
+    for name, timings in results.items():
+        ordered = sorted(timings)
+        p50 = statistics.median(timings)
+        p95 = ordered[int(len(ordered) * 0.95) - 1]
+        print(
+            f"{name:<9} p50 {p50:.2f} ms  p95 {p95:.2f} ms  "
+            f"{baseline / p50:.1f}x mot dict"
+        )
+
+
+if __name__ == "__main__":
+    main()
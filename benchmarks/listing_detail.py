@@ -0,0 +1,93 @@
+import argparse
+import statistics
+import time
+
+import db
+from db_pool import get_pool
+
+"""
+Jämför två sätt att ladda en annonssida:
+
+- separat: ett anrop per del (annons, bud, bilder, kommentarer, frakt, rating),
+  var och en med egen koppling från poolen, som när klienten anropar
+  /listings/{id}, /listings/{id}/bids, /listings/{id}/images osv.
+- full: db.get_listing_full, en fråga över en koppling (/listings/{id}/full)
+
+Kör: python -m benchmarks.listing_detail --listing-id 1 --iterations 500
+"""
+
+
+def load_separately(pool, listing_id):
+    """Sex anrop, sex rundor till databasen"""
+    with pool.connection() as connection:
+        listing = db.get_listing_by_id(connection, listing_id)
+    with pool.connection() as connection:
+        listing["bids"] = db.get_bids_for_listing(connection, listing_id)[
+            : db.LISTING_FULL_BIDS
+        ]
+    with pool.connection() as connection:
+        listing["images"] = db.get_images_for_listing(connection, listing_id)
+    with pool.connection() as connection:
+        listing["comments"] = db.get_comments_by_listing_id(connection, listing_id)
+    with pool.connection() as connection:
+        listing["shipping"] = db.get_shipping_by_listing_id(connection, listing_id)
+    with pool.connection() as connection:
+        try:
+            listing["seller_rating"] = db.get_user_rating_by_user_id(
+                connection, listing["user_id"]
+            )
+        except ValueError:
+            listing["seller_rating"] = None
+    return listing
+
+
+def load_full(pool, listing_id):
+    """En fråga, en runda till databasen"""
+    with pool.connection() as connection:
+        return db.get_listing_full(connection, listing_id)
+
+
+def measure(loader, pool, listing_id, iterations):
+    """Returnerar svarstider i millisekunder"""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        loader(pool, listing_id)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def summary(name, round_trips, timings):
+    ordered = sorted(timings)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    return (
+        f"{name:<9} rundor {round_trips}  "
+        f"medel {statistics.mean(timings):.2f} ms  "
+        f"p50 {statistics.median(timings):.2f} ms  p95 {p95:.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Jämför annonssidans två laddvägar")
+    parser.add_argument("--listing-id", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    pool = get_pool()
+    try:
+        # Värm upp poolen och planerna
+        measure(load_separately, pool, args.listing_id, 10)
+        measure(load_full, pool, args.listing_id, 10)
+
+        separate = measure(load_separately, pool, args.listing_id, args.iterations)
+        full = measure(load_full, pool, args.listing_id, args.iterations)
+    finally:
+        pool.close()
+
+    print(summary("separat", 6, separate))
+    print(summary("full", 1, full))
+    print(f"full är {statistics.mean(separate) / statistics.mean(full):.1f}x snabbare")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,579 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import httpx
+
+import db
+import memory_db
+import repository
+from benchmarks import seed as seed_data
+from db_setup import get_connection
+
+"""
+Lasttest av HTTP-API:t med blandade läs- och skrivflöden, för att jämföra commits.
+
+Flödena motsvarar hur sajten används:
+
+- browse: listan med annonser (ibland nästa sida), annonssidan, sök, kategorier
+- bid_storm: bud på några få heta annonser, 409 (för lågt bud) räknas som svar
+- messaging: skicka meddelande, läsa inkorgen och konversationen
+- notifications: skapa notiser, hämta olästa och markera dem som lästa
+
+--workload mixed kör alla flöden viktat enligt MIXED_WEIGHTS, annars bara det
+angivna. Varje tråd väljer flöde och id:n med en egen Random(--seed + trådnummer).
+
+Utan --url körs appen i samma process via TestClient, med --url går anropen över
+nätverket till en server som redan kör (t.ex. uvicorn app:app). Under körningen
+räknas kopplingarna mot databasen i pg_stat_activity två gånger per sekund.
+
+Resultatet skrivs som JSON: p50/p95/p99, genomströmning och statuskoder per
+operation och flöde, kopplingar mot databasen och /pool/stats efter körningen.
+Med --compare skrivs skillnaden mot ett tidigare resultat till stderr.
+
+Fyll databasen först med benchmarks.seed, eller benchmarks.datagen för större data.
+Med REPOSITORY_BACKEND=memory körs appen i processen mot memory_db, som fylls med
+samma data som benchmarks.seed --scale ger. Då mäts bara FastAPI-lagret, och
+skillnaden mot en körning mot PostgreSQL är vad databasen kostar.
+
+Kör: python -m benchmarks.load_test --workload mixed --concurrency 16 --duration 30 --output resultat.json
+"""
+
+WORKLOADS = ("browse", "bid_storm", "messaging", "notifications")
+MIXED_WEIGHTS = {"browse": 70, "bid_storm": 10, "messaging": 12, "notifications": 8}
+
+# Så många annonser delar på buden i bid_storm
+HOT_LISTINGS = 5
+SEARCH_WORDS = ["stol", "bord", "lampa", "cykel", "gammal", "retro", "fint skick"]
+
+# Hur ofta kopplingarna mot databasen räknas
+SAMPLE_INTERVAL = 0.5
+
+
+class Dataset:
+    """Id:n som flödena väljer bland, läses från databasen innan körningen"""
+
+    def __init__(self, max_user_id, listing_ids, hot_listings):
+        if not max_user_id or not listing_ids or not hot_listings:
+            raise ValueError("Databasen saknar användare eller aktiva annonser")
+        self.max_user_id = max_user_id
+        self.listing_ids = listing_ids
+        self.hot_listings = hot_listings
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_database(cls, connection):
+        with connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+                max_user_id = cursor.fetchone()[0]
+                cursor.execute(
+                    "SELECT id FROM listings WHERE status = 'active' ORDER BY id LIMIT 1000"
+                )
+                listing_ids = [row[0] for row in cursor.fetchall()]
+                cursor.execute(
+                    """
+                    SELECT id, COALESCE(current_high_bid, price) FROM listings
+                    WHERE status = 'active' AND listing_type = 'selling'
+                    ORDER BY bid_count DESC, id
+                    LIMIT %s
+                """,
+                    (HOT_LISTINGS,),
+                )
+                hot_listings = {row[0]: float(row[1]) for row in cursor.fetchall()}
+        return cls(max_user_id, listing_ids, hot_listings)
+
+    @classmethod
+    def from_store(cls, store):
+        """Samma urval ur en memory_db.MemoryStore"""
+        with store:
+            active = [
+                listing
+                for _, listing in sorted(store.tables["listings"].items())
+                if listing["status"] == "active"
+            ]
+            hot = sorted(
+                (listing for listing in active if listing["listing_type"] == "selling"),
+                key=lambda listing: (-listing["bid_count"], listing["id"]),
+            )[:HOT_LISTINGS]
+            return cls(
+                max(store.tables["users"], default=0),
+                [listing["id"] for listing in active[:1000]],
+                {
+                    listing["id"]: float(
+                        listing["current_high_bid"] or listing["price"]
+                    )
+                    for listing in hot
+                },
+            )
+
+    def user_id(self, rng):
+        """Aktiva användare (låga id:n) är vanligast, som i benchmarks.seed"""
+        return int(self.max_user_id * rng.random() ** 3) + 1
+
+    def listing_id(self, rng):
+        return self.listing_ids[int(len(self.listing_ids) * rng.random() ** 3)]
+
+    def high_bid(self, listing_id):
+        with self._lock:
+            return self.hot_listings[listing_id]
+
+    def saw_bid(self, listing_id, amount):
+        with self._lock:
+            self.hot_listings[listing_id] = max(self.hot_listings[listing_id], amount)
+
+
+class Recorder:
+    """Svarstider och statuskoder per (flöde, operation) för en tråd"""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = Counter()
+        self.recording = False
+
+    def call(self, client, workload, operation, method, path, ok=(200,), **kwargs):
+        """Gör ett anrop och mäter det, returnerar svaret eller None vid fel"""
+        key = (workload, operation)
+        started = time.perf_counter()
+        try:
+            response = client.request(method, path, **kwargs)
+        except httpx.HTTPError as error:
+            if self.recording:
+                self.statuses[key][type(error).__name__] += 1
+                self.errors[key] += 1
+            return None
+        elapsed = time.perf_counter() - started
+        if self.recording:
+            self.timings[key].append(elapsed)
+            self.statuses[key][str(response.status_code)] += 1
+            if response.status_code not in ok:
+                self.errors[key] += 1
+        return response if response.status_code in ok else None
+
+
+# Flöden, ett anrop till run_* motsvarar en användare som gör en sak
+
+
+def run_browse(client, recorder, dataset, rng):
+    choice = rng.random()
+    if choice < 0.4:
+        response = recorder.call(client, "browse", "list", "GET", "/listings?limit=50")
+        if response is not None and rng.random() < 0.3:
+            next_cursor = response.json()["next_cursor"]
+            if next_cursor:
+                recorder.call(
+                    client,
+                    "browse",
+                    "list_next_page",
+                    "GET",
+                    "/listings",
+                    params={"limit": 50, "cursor": next_cursor},
+                )
+    elif choice < 0.7:
+        listing_id = dataset.listing_id(rng)
+        recorder.call(
+            client, "browse", "listing_full", "GET", f"/listings/{listing_id}/full"
+        )
+    elif choice < 0.85:
+        recorder.call(
+            client,
+            "browse",
+            "search",
+            "GET",
+            "/listings/search",
+            params={"q": rng.choice(SEARCH_WORDS), "limit": 20},
+        )
+    elif choice < 0.95:
+        recorder.call(client, "browse", "categories", "GET", "/categories")
+    else:
+        listing_id = dataset.listing_id(rng)
+        recorder.call(
+            client, "browse", "listing_bids", "GET", f"/listings/{listing_id}/bids"
+        )
+
+
+def run_bid_storm(client, recorder, dataset, rng):
+    listing_id = rng.choice(list(dataset.hot_listings))
+    amount = round(
+        dataset.high_bid(listing_id) + float(db.MIN_BID_INCREMENT) * (1 + rng.random()),
+        2,
+    )
+    response = recorder.call(
+        client,
+        "bid_storm",
+        "place_bid",
+        "POST",
+        "/bids",
+        ok=(201, 409),
+        json={
+            "user_id": dataset.user_id(rng),
+            "listing_id": listing_id,
+            "bid_amount": amount,
+        },
+    )
+    if response is None:
+        return
+    if response.status_code == 201:
+        dataset.saw_bid(listing_id, amount)
+    else:
+        # Någon annan hann före, läs det nya högsta budet
+        listing = recorder.call(
+            client, "bid_storm", "refresh_listing", "GET", f"/listings/{listing_id}"
+        )
+        if listing is not None:
+            high_bid = listing.json()["current_high_bid"]
+            if high_bid is not None:
+                dataset.saw_bid(listing_id, float(high_bid))
+
+
+def run_messaging(client, recorder, dataset, rng):
+    sender_id = dataset.user_id(rng)
+    recipient_id = dataset.user_id(rng)
+    recorder.call(
+        client,
+        "messaging",
+        "send_message",
+        "POST",
+        "/messages",
+        ok=(201,),
+        json={
+            "sender_id": sender_id,
+            "recipient_id": recipient_id,
+            "listing_id": dataset.listing_id(rng),
+            "message_text": "Finns den kvar?",
+        },
+    )
+    recorder.call(client, "messaging", "inbox", "GET", f"/users/{recipient_id}/inbox")
+    if rng.random() < 0.5:
+        recorder.call(
+            client,
+            "messaging",
+            "conversation",
+            "GET",
+            f"/conversations/{sender_id}/{recipient_id}",
+        )
+
+
+def run_notifications(client, recorder, dataset, rng):
+    user_id = dataset.user_id(rng)
+    recorder.call(
+        client,
+        "notifications",
+        "create_notification",
+        "POST",
+        "/notifications",
+        ok=(201,),
+        json={
+            "user_id": user_id,
+            "listing_id": dataset.listing_id(rng),
+            "notification_type": "new_bid",
+            "notification_message": "Nytt bud på en bevakad annons",
+        },
+    )
+    recorder.call(
+        client,
+        "notifications",
+        "unread",
+        "GET",
+        f"/users/{user_id}/notifications/unread",
+    )
+    if rng.random() < 0.2:
+        recorder.call(
+            client,
+            "notifications",
+            "mark_read",
+            "PUT",
+            f"/users/{user_id}/notifications/mark-read",
+        )
+
+
+FLOWS = {
+    "browse": run_browse,
+    "bid_storm": run_bid_storm,
+    "messaging": run_messaging,
+    "notifications": run_notifications,
+}
+
+
+def _worker(client, dataset, workload, seed, recorder, stop):
+    rng = random.Random(seed)
+    names = list(MIXED_WEIGHTS)
+    weights = list(MIXED_WEIGHTS.values())
+    while not stop.is_set():
+        name = rng.choices(names, weights)[0] if workload == "mixed" else workload
+        FLOWS[name](client, recorder, dataset, rng)
+
+
+class ConnectionSampler(threading.Thread):
+    """Räknar kopplingarna mot databasen i pg_stat_activity under körningen"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+
+    def run(self):
+        connection = get_connection()
+        connection.autocommit = True
+        try:
+            with connection.cursor() as cursor:
+                while not self._done.is_set():
+                    cursor.execute(
+                        """
+                        SELECT COUNT(*), COUNT(*) FILTER (WHERE state = 'active')
+                        FROM pg_stat_activity
+                        WHERE datname = current_database() AND pid <> pg_backend_pid()
+                    """
+                    )
+                    self.samples.append(cursor.fetchone())
+                    self._done.wait(self.interval)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def summary(self):
+        totals = [total for total, _ in self.samples] or [0]
+        return {
+            "samples": len(self.samples),
+            "max": max(totals),
+            "avg": round(sum(totals) / len(totals), 1),
+            "max_active": max((active for _, active in self.samples), default=0),
+        }
+
+
+def percentile(ordered, fraction):
+    """Närmaste rang i en sorterad lista"""
+    if not ordered:
+        return None
+    index = min(max(int(round(fraction * len(ordered) + 0.5)) - 1, 0), len(ordered) - 1)
+    return ordered[index]
+
+
+def latency_summary(timings):
+    """Millisekunder för en lista med sekunder"""
+    ordered = sorted(timings)
+    if not ordered:
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    return {
+        "p50": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99": round(percentile(ordered, 0.99) * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+
+def _summarize(timings, statuses, errors, duration):
+    requests = sum(statuses.values())
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / duration, 1),
+        "latency_ms": latency_summary(timings),
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+def aggregate(recorders, duration):
+    """Slår ihop trådarnas mätningar per operation, flöde och totalt"""
+    groups = defaultdict(lambda: ([], Counter(), [0]))
+    for recorder in recorders:
+        for key in set(recorder.timings) | set(recorder.statuses):
+            workload, operation = key
+            for name in (f"{workload}.{operation}", workload, "total"):
+                timings, statuses, errors = groups[name]
+                timings.extend(recorder.timings[key])
+                statuses.update(recorder.statuses[key])
+                errors[0] += recorder.errors[key]
+    summaries = {
+        name: _summarize(timings, statuses, errors[0], duration)
+        for name, (timings, statuses, errors) in groups.items()
+    }
+    total = summaries.pop("total", _summarize([], Counter(), 0, duration))
+    workloads = {name: summaries.pop(name) for name in WORKLOADS if name in summaries}
+    return total, workloads, dict(sorted(summaries.items()))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(client, dataset, workload, concurrency, duration, warmup, seed):
+    """Kör flödet i concurrency trådar, mäter bara efter warmup sekunder"""
+    stop = threading.Event()
+    recorders = [Recorder() for _ in range(concurrency)]
+    threads = [
+        threading.Thread(
+            target=_worker,
+            args=(client, dataset, workload, seed + index, recorder, stop),
+            daemon=True,
+        )
+        for index, recorder in enumerate(recorders)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+
+    sampler = ConnectionSampler()
+    if repository.uses_database():
+        sampler.start()
+    for recorder in recorders:
+        recorder.recording = True
+    started = time.perf_counter()
+    time.sleep(duration)
+    for recorder in recorders:
+        recorder.recording = False
+    elapsed = time.perf_counter() - started
+    if sampler.is_alive():
+        sampler.stop()
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return recorders, elapsed, sampler.summary()
+
+
+def compare(result, baseline, out=sys.stderr):
+    """Skriver p95 och genomströmning mot ett tidigare resultat"""
+    print(
+        f"jämfört med {baseline.get('commit')} ({baseline.get('workload')}):", file=out
+    )
+    rows = [("total", result["total"], baseline.get("total"))]
+    for section in ("workloads", "operations"):
+        for name, summary in result[section].items():
+            rows.append((name, summary, baseline.get(section, {}).get(name)))
+    for name, summary, before in rows:
+        if not before or not before["throughput_rps"]:
+            continue
+        p95, p95_before = summary["latency_ms"]["p95"], before["latency_ms"]["p95"]
+        rps, rps_before = summary["throughput_rps"], before["throughput_rps"]
+        line = f"  {name:<36} r/s {rps_before:>8.1f} -> {rps:>8.1f} ({rps / rps_before - 1:+.0%})"
+        if p95 is not None and p95_before:
+            line += f"  p95 {p95_before:>8.2f} -> {p95:>8.2f} ms ({p95 / p95_before - 1:+.0%})"
+        print(line, file=out)
+
+
+def load_memory_store(scale, seed):
+    """Fyller memory_db med benchmarks.seed-data och returnerar dess Dataset"""
+    store = memory_db.get_store()
+    store.clear()
+    for table, columns, rows in seed_data.generate(scale, seed):
+        store.load(table, columns, rows)
+    memory_db.recompute_user_ratings(store)
+    return Dataset.from_store(store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lasttest av API:t")
+    parser.add_argument("--workload", choices=("mixed",) + WORKLOADS, default="mixed")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="sekunder")
+    parser.add_argument("--warmup", type=float, default=3, help="sekunder")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--url", help="t.ex. http://localhost:8000, annars körs appen i processen"
+    )
+    parser.add_argument("--output", help="fil för JSON-resultatet, annars stdout")
+    parser.add_argument("--compare", help="tidigare JSON-resultat att jämföra med")
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1,
+        help="datamängd för REPOSITORY_BACKEND=memory, som i benchmarks.seed",
+    )
+    args = parser.parse_args()
+
+    if repository.uses_database():
+        connection = get_connection()
+        try:
+            dataset = Dataset.from_database(connection)
+        except ValueError as error:
+            parser.error(f"{error}, kör benchmarks.seed först")
+        finally:
+            connection.close()
+    else:
+        if args.url:
+            parser.error(
+                "REPOSITORY_BACKEND=memory fungerar bara i processen, utan --url"
+            )
+        dataset = load_memory_store(args.scale, args.seed)
+
+    if args.url:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        client = httpx.Client(base_url=args.url, limits=limits, timeout=30)
+        target = args.url
+    else:
+        # Importeras här så att appen inte startas när --url används
+        from fastapi.testclient import TestClient
+
+        from app import app
+
+        client = TestClient(app)
+        target = "in-process"
+
+    started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    with client:
+        recorders, elapsed, connections = run(
+            client,
+            dataset,
+            args.workload,
+            args.concurrency,
+            args.duration,
+            args.warmup,
+            args.seed,
+        )
+        pool = None
+        if repository.uses_database():
+            pool = client.get("/pool/stats").json()
+
+    total, workloads, operations = aggregate(recorders, elapsed)
+    result = {
+        "commit": _git_commit(),
+        "started_at": started_at,
+        "target": target,
+        "db_driver": os.getenv("DB_DRIVER", "psycopg2"),
+        "repository": repository.REPOSITORY_BACKEND,
+        "workload": args.workload,
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 2),
+        "seed": args.seed,
+        "total": total,
+        "workloads": workloads,
+        "operations": operations,
+        "db_connections": connections,
+        "pool": pool,
+    }
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            compare(result, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
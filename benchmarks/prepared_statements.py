@@ -0,0 +1,101 @@
+import argparse
+import statistics
+import time
+
+import cache
+import db
+import queries
+from db_pool import get_pool
+
+"""
+Mäter de tio vanligaste läsningarna och en skrivning med flera satser (nytt
+meddelande som raderas igen) med och utan förberedda satser (queries.py).
+
+Läscachen stängs av så att varje anrop går till databasen. Båda varianterna
+körs på samma koppling, först som vanlig text och sedan med PREPARE/EXECUTE.
+Varje anrop får en egen transaktion, som en request med en lånad koppling.
+
+Kör: python -m benchmarks.prepared_statements --listing-id 1 --user-id 1
+"""
+
+
+def hot_queries(listing_id, user_id):
+    return {
+        "get_listing_by_id": lambda c: db.get_listing_by_id(c, listing_id),
+        "get_listing_full": lambda c: db.get_listing_full(c, listing_id),
+        "get_bids_for_listing": lambda c: db.get_bids_for_listing(c, listing_id),
+        "get_images_for_listing": lambda c: db.get_images_for_listing(c, listing_id),
+        "get_comments_by_listing_id": lambda c: db.get_comments_by_listing_id(
+            c, listing_id
+        ),
+        "get_user_by_id": lambda c: db.get_user_by_id(c, user_id),
+        "get_user_rating_by_user_id": lambda c: _ignore_missing(
+            db.get_user_rating_by_user_id, c, user_id
+        ),
+        "get_all_categories": lambda c: db.get_all_categories(c),
+        "get_unread_message_count": lambda c: db.get_unread_message_count(c, user_id),
+        "get_unread_notifications": lambda c: db.get_unread_notifications(c, user_id),
+        "create_and_delete_message": lambda c: _create_and_delete_message(
+            c, user_id, listing_id
+        ),
+    }
+
+
+def _create_and_delete_message(connection, user_id, listing_id):
+    message = db.create_message(connection, user_id, user_id, listing_id, "test")
+    db.delete_message(connection, message["id"])
+
+
+def _ignore_missing(function, *args):
+    try:
+        return function(*args)
+    except ValueError:
+        return None
+
+
+def measure(function, connection, iterations):
+    """Returnerar svarstider i millisekunder"""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function(connection)
+        timings.append((time.perf_counter() - started) * 1000)
+        # Läsningarna lämnar transaktionen öppen, poolen rullar tillbaka vid retur
+        connection.rollback()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Jämför vanlig text mot PREPARE")
+    parser.add_argument("--listing-id", type=int, default=1)
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    for entity in cache.ENTITIES:
+        cache.get_cache().set_enabled(entity, False)
+    registry = queries.get_registry()
+
+    pool = get_pool()
+    results = {}
+    try:
+        with pool.connection() as connection:
+            for name, function in hot_queries(args.listing_id, args.user_id).items():
+                registry.set_enabled(False)
+                measure(function, connection, 20)
+                before = measure(function, connection, args.iterations)
+                registry.set_enabled(True)
+                measure(function, connection, 20)
+                after = measure(function, connection, args.iterations)
+                results[name] = (statistics.median(before), statistics.median(after))
+    finally:
+        pool.close()
+
+    print(f"{'fråga':<28} {'text p50':>10} {'prepare p50':>12} {'skillnad':>9}")
+    for name, (before, after) in results.items():
+        change = (after - before) / before * 100
+        print(f"{name:<28} {before:>8.3f}ms {after:>10.3f}ms {change:>8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import time
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+import db
+import pagination
+import schemas
+from app import get_db
+from db_pool import close_pool
+from fast_json import FastJSONResponse
+
+"""
+Mäter hur många anrop per sekund /listings och /bids klarar med stora sidor,
+med tre sätt att skicka svaret:
+
+- generisk: routen returnerar ett dict utan response_model, FastAPI kör
+  jsonable_encoder och json.dumps
+- response_model: samma dict med schemas.ListingPage/BidPage, pydantic-core
+  validerar och serialiserar direkt till JSON
+- FastJSONResponse: routen returnerar svaret själv med orjson, utan validering
+  mot modellen, som app.py gör för sidor med cursor. Modellen finns bara i
+  responses= för dokumentationen
+
+Alla varianter går genom FastAPI med TestClient, så tiden omfattar frågan,
+serialiseringen och ramverket men inget nätverk.
+
+Kör: python -m benchmarks.response_models --limits 50 200 1000 --seconds 3
+"""
+
+
+ROUTES = {
+    "listings": (db.get_all_listings, schemas.ListingPage),
+    "bids": (db.get_all_bids, schemas.BidPage),
+}
+
+
+def build_app():
+    """En app med /{variant}/{entitet} för varje kombination"""
+    app = FastAPI()
+    for entity, (fetch, model) in ROUTES.items():
+        _add_routes(app, entity, fetch, model)
+    return app
+
+
+def _add_routes(app, entity, fetch, model):
+    @app.get(f"/generisk/{entity}")
+    def generic(limit: int = None, connection=Depends(get_db)):
+        rows, next_cursor = fetch(connection, None, limit)
+        return {entity: rows, "next_cursor": next_cursor}
+
+    @app.get(f"/response_model/{entity}", response_model=model)
+    def typed(limit: int = None, connection=Depends(get_db)):
+        rows, next_cursor = fetch(connection, None, limit)
+        return {entity: rows, "next_cursor": next_cursor}
+
+    @app.get(f"/FastJSONResponse/{entity}", responses={200: {"model": model}})
+    def fast(limit: int = None, connection=Depends(get_db)):
+        rows, next_cursor = fetch(connection, None, limit)
+        return FastJSONResponse({entity: rows, "next_cursor": next_cursor})
+
+
+def throughput(client, path, seconds):
+    """Anrop per sekund under seconds sekunder"""
+    for _ in range(10):
+        client.get(path)
+    calls = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        response = client.get(path)
+        calls += 1
+    response.raise_for_status()
+    return calls / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Jämför svarsvägar för stora sidor")
+    parser.add_argument("--limits", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+    pagination.MAX_PAGE_SIZE = max(pagination.MAX_PAGE_SIZE, *args.limits)
+
+    variants = ["generisk", "response_model", "FastJSONResponse"]
+    print(f"{'route':<10} {'rader':>6} " + " ".join(f"{v:>17}" for v in variants))
+    try:
+        with TestClient(build_app()) as client:
+            for entity in ROUTES:
+                for limit in args.limits:
+                    rates = [
+                        throughput(client, f"/{v}/{entity}?limit={limit}", args.seconds)
+                        for v in variants
+                    ]
+                    print(
+                        f"/{entity:<9} {limit:>6} "
+                        + " ".join(f"{rate:>13.0f} r/s" for rate in rates)
+                    )
+    finally:
+        close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,645 @@
+import argparse
+import csv
+import io
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+import db
+import db_setup
+from db_setup import get_connection
+
+"""
+Fyller en lokal databas med ett Tradera-likt dataset för benchmarks och lasttester.
+
+Alla 15 tabeller fylls med antal rader som skalar med --scale (1 ger ca 130 000
+rader, se ROWS_PER_SCALE). Samma --seed ger samma data, så att mätningar från
+olika commits går att jämföra. Populära annonser och aktiva användare har låga
+id:n, så att några få annonser får många bud, bilder och bevakare.
+
+Raderna skrivs med COPY och explicita id:n, därefter sätts sekvenserna, högsta
+bud och antal bud på annonserna, user_ratings byggs om från recensionerna och
+message_threads från meddelandena. Tabellerna måste vara tomma, --reset tömmer dem först (TRUNCATE).
+
+För miljontals rader, använd benchmarks.datagen som skriver samma tabeller
+parallellt med NumPy.
+
+Kör mot en testdatabas (DATABASE_NAME): python -m benchmarks.seed --scale 1 --reset
+"""
+
+TABLES = (
+    "users",
+    "categories",
+    "listings",
+    "listings_watch_list",
+    "messages",
+    "bids",
+    "transactions",
+    "payments",
+    "user_ratings",
+    "reviews",
+    "images",
+    "notifications",
+    "listing_comments",
+    "shipping_details",
+    "reports",
+)
+
+# Rader per tabell vid --scale 1, user_ratings byggs från reviews
+ROWS_PER_SCALE = {
+    "users": 2_000,
+    "categories": 30,
+    "listings": 10_000,
+    "listings_watch_list": 8_000,
+    "messages": 20_000,
+    "bids": 40_000,
+    "transactions": 2_000,
+    "payments": 1_800,
+    "reviews": 4_000,
+    "images": 15_000,
+    "notifications": 20_000,
+    "listing_comments": 5_000,
+    "shipping_details": 3_000,
+    "reports": 300,
+}
+
+# Skrivs med COPY i batchar om så många rader
+COPY_BATCH_SIZE = 20_000
+
+CATEGORY_NAMES = [
+    "Möbler",
+    "Kläder",
+    "Elektronik",
+    "Böcker",
+    "Sport",
+    "Leksaker",
+    "Konst",
+    "Smycken",
+    "Klockor",
+    "Verktyg",
+    "Trädgård",
+    "Fordon",
+    "Musik",
+    "Film",
+    "Frimärken",
+    "Mynt",
+    "Porslin",
+    "Glas",
+    "Datorer",
+    "Telefoner",
+    "Foto",
+    "Hobby",
+    "Antikt",
+    "Barnartiklar",
+    "Skor",
+    "Väskor",
+    "Belysning",
+    "Textil",
+    "Samlarsaker",
+    "Övrigt",
+]
+REGIONS = [
+    "Stockholm",
+    "Västra Götaland",
+    "Skåne",
+    "Uppsala",
+    "Östergötland",
+    "Jönköping",
+    "Halland",
+    "Örebro",
+    "Dalarna",
+    "Norrbotten",
+]
+# Storstadsregionerna har flest annonser
+REGION_WEIGHTS = [30, 20, 18, 6, 6, 5, 5, 4, 3, 3]
+ADJECTIVES = ["Gammal", "Ny", "Fin", "Sliten", "Röd", "Blå", "Stor", "Liten", "Retro"]
+NOUNS = [
+    "stol",
+    "bord",
+    "soffa",
+    "jacka",
+    "lampa",
+    "cykel",
+    "telefon",
+    "dator",
+    "vas",
+    "klocka",
+    "matta",
+    "spegel",
+    "byrå",
+    "kamera",
+    "gitarr",
+]
+DESCRIPTION_WORDS = [
+    "fint",
+    "skick",
+    "använd",
+    "oanvänd",
+    "hämtas",
+    "skickas",
+    "original",
+    "kartong",
+    "repor",
+    "fungerar",
+    "perfekt",
+    "vintage",
+    "säljes",
+    "pga",
+    "flytt",
+]
+NOTIFICATION_TYPES = ["new_bid", "outbid", "message", "listing_sold", "price_drop"]
+PAYMENT_METHODS = ["card", "swish", "invoice", "paypal"]
+SHIPPING_METHODS = ["PostNord", "DHL", "Schenker", "Budbee", "Hämtas"]
+REPORT_REASONS = ["Förfalskning", "Fel kategori", "Stötande innehåll", "Bedrägeri"]
+
+NOW = datetime(2025, 1, 1)
+
+
+def rows_for_scale(scale):
+    """Antal rader per tabell, minst en av varje"""
+    rows = {
+        table: max(int(count * scale), 1) for table, count in ROWS_PER_SCALE.items()
+    }
+    rows["categories"] = min(max(rows["categories"], 5), len(CATEGORY_NAMES))
+    return rows
+
+
+def popular(rng, count):
+    """Ett id mellan 1 och count där låga id:n är mycket vanligare"""
+    return int(count * rng.random() ** 3) + 1
+
+
+def _timestamp(rng, after, days=90):
+    return after + timedelta(seconds=rng.randint(0, days * 86_400))
+
+
+def _text(rng, words, count):
+    return " ".join(rng.choice(words) for _ in range(count))
+
+
+def generate(scale, seed):
+    """Ger (tabell, kolumner, rader) för alla tabeller utom user_ratings"""
+    rng = random.Random(seed)
+    rows = rows_for_scale(scale)
+    n_users = rows["users"]
+    start = NOW - timedelta(days=365)
+
+    users = []
+    for user_id in range(1, n_users + 1):
+        users.append(
+            (
+                user_id,
+                f"user{user_id}",
+                f"user{user_id}@example.se",
+                "benchmark",
+                _timestamp(rng, start - timedelta(days=1_000), 1_000),
+                f"{rng.randint(1950, 2005)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}",
+                f"07{rng.randint(0, 99_999_999):08}" if rng.random() < 0.7 else None,
+            )
+        )
+    yield "users", (
+        "id",
+        "username",
+        "email",
+        "password",
+        "user_since",
+        "date_of_birth",
+        "phone_number",
+    ), users
+
+    categories = [
+        (category_id, CATEGORY_NAMES[category_id - 1])
+        for category_id in range(1, rows["categories"] + 1)
+    ]
+    yield "categories", ("id", "name"), categories
+
+    listings = []
+    for listing_id in range(1, rows["listings"] + 1):
+        listing_type = rng.choices(["selling", "buying", "free"], [85, 10, 5])[0]
+        price = 0 if listing_type == "free" else round(rng.lognormvariate(5.5, 1.2), 2)
+        listings.append(
+            (
+                listing_id,
+                popular(rng, n_users),
+                popular(rng, len(categories)),
+                f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}",
+                f"https://img.example.se/{listing_id}.jpg",
+                listing_type,
+                min(price, 99_999_999),
+                _timestamp(rng, start, 365),
+                rng.choices(REGIONS, REGION_WEIGHTS)[0],
+                rng.choices(["active", "sold", "closed"], [70, 20, 10])[0],
+                _text(rng, DESCRIPTION_WORDS, rng.randint(5, 30)),
+            )
+        )
+    yield "listings", (
+        "id",
+        "user_id",
+        "category_id",
+        "title",
+        "image_url",
+        "listing_type",
+        "price",
+        "created_at",
+        "region",
+        "status",
+        "description",
+    ), listings
+
+    def listing(listing_id):
+        return listings[listing_id - 1]
+
+    def seller(listing_id):
+        return listing(listing_id)[1]
+
+    def created(listing_id):
+        return listing(listing_id)[7]
+
+    # Bud stiger per annons, ökningen är minst MIN_BID_INCREMENT
+    bids = []
+    high_bids = {}
+    bid_times = {}
+    for bid_id in range(1, rows["bids"] + 1):
+        listing_id = popular(rng, len(listings))
+        amount = high_bids.get(listing_id, float(listing(listing_id)[6]))
+        amount = round(amount + float(db.MIN_BID_INCREMENT) + rng.random() * 50, 2)
+        at = bid_times.get(listing_id, created(listing_id))
+        at += timedelta(seconds=rng.randint(1, 7_200))
+        high_bids[listing_id] = amount
+        bid_times[listing_id] = at
+        bids.append((bid_id, popular(rng, n_users), listing_id, at, amount))
+    yield "bids", ("id", "user_id", "listing_id", "created_at", "bid_amount"), bids
+
+    watched = set()
+    for _ in range(rows["listings_watch_list"]):
+        watched.add((popular(rng, n_users), popular(rng, len(listings))))
+    watch_list = [
+        (user_id, listing_id, _timestamp(rng, created(listing_id), 30))
+        for user_id, listing_id in sorted(watched)
+    ]
+    yield "listings_watch_list", ("user_id", "listing_id", "created_at"), watch_list
+
+    # Trådar mellan en köpare och säljaren, svaren kommer efter frågan
+    messages = []
+    message_id = 0
+    while message_id < rows["messages"]:
+        listing_id = popular(rng, len(listings))
+        buyer, owner = popular(rng, n_users), seller(listing_id)
+        at = _timestamp(rng, created(listing_id), 60)
+        for turn in range(min(rng.randint(1, 8), rows["messages"] - message_id)):
+            message_id += 1
+            sender, recipient = (buyer, owner) if turn % 2 == 0 else (owner, buyer)
+            at += timedelta(minutes=rng.randint(1, 600))
+            messages.append(
+                (
+                    message_id,
+                    sender,
+                    recipient,
+                    listing_id,
+                    _text(rng, DESCRIPTION_WORDS, rng.randint(3, 20)),
+                    at,
+                    rng.random() < 0.8,
+                )
+            )
+    yield "messages", (
+        "id",
+        "sender_id",
+        "recipient_id",
+        "listing_id",
+        "message_text",
+        "created_at",
+        "is_read",
+    ), messages
+
+    # Affärer på annonser med bud, till det högsta budet
+    last_bid = {bid[2]: bid for bid in bids}
+    sold = list(last_bid.values())
+    rng.shuffle(sold)
+    transactions = []
+    for transaction_id, bid in enumerate(sold[: rows["transactions"]], start=1):
+        bid_id, buyer, listing_id, at, amount = bid
+        status = rng.choices(["completed", "pending", "cancelled"], [80, 15, 5])[0]
+        transactions.append(
+            (transaction_id, buyer, bid_id, listing_id, at, status, amount)
+        )
+    yield "transactions", (
+        "id",
+        "user_id",
+        "bid_id",
+        "listing_id",
+        "created_at",
+        "status",
+        "amount",
+    ), transactions
+
+    payments = []
+    for payment_id, transaction in enumerate(transactions[: rows["payments"]], start=1):
+        transaction_id, _, _, listing_id, at, status, amount = transaction
+        payment_status = {"completed": "completed", "cancelled": "refunded"}.get(
+            status, "pending"
+        )
+        payments.append(
+            (
+                payment_id,
+                transaction_id,
+                listing_id,
+                rng.choice(PAYMENT_METHODS),
+                payment_status,
+                amount,
+                at + timedelta(minutes=rng.randint(1, 2_880)),
+            )
+        )
+    yield "payments", (
+        "id",
+        "transaction_id",
+        "listing_id",
+        "payment_method",
+        "payment_status",
+        "amount",
+        "paid_at",
+    ), payments
+
+    reviews = []
+    for review_id in range(1, rows["reviews"] + 1):
+        if transactions:
+            _, buyer, _, listing_id, at, _, _ = rng.choice(transactions)
+        else:
+            listing_id = popular(rng, len(listings))
+            buyer, at = popular(rng, n_users), created(listing_id)
+        reviews.append(
+            (
+                review_id,
+                buyer,
+                seller(listing_id),
+                listing_id,
+                rng.choices([5, 4, 3, 2, 1], [60, 25, 8, 4, 3])[0],
+                _text(rng, DESCRIPTION_WORDS, rng.randint(2, 15)),
+                at + timedelta(days=rng.randint(1, 14)),
+            )
+        )
+    yield "reviews", (
+        "id",
+        "reviewer_id",
+        "reviewed_user_id",
+        "listing_id",
+        "rating",
+        "review_text",
+        "created_at",
+    ), reviews
+
+    images = []
+    for image_id in range(1, rows["images"] + 1):
+        listing_id = popular(rng, len(listings))
+        images.append(
+            (
+                image_id,
+                seller(listing_id),
+                listing_id,
+                f"https://img.example.se/{listing_id}/{image_id}.jpg",
+                created(listing_id) + timedelta(minutes=rng.randint(0, 60)),
+            )
+        )
+    yield "images", (
+        "id",
+        "user_id",
+        "listing_id",
+        "image_url",
+        "created_at",
+    ), images
+
+    notifications = []
+    for notification_id in range(1, rows["notifications"] + 1):
+        listing_id = popular(rng, len(listings))
+        notification_type = rng.choice(NOTIFICATION_TYPES)
+        notifications.append(
+            (
+                notification_id,
+                popular(rng, n_users),
+                listing_id,
+                notification_type,
+                f"{notification_type} på {listing(listing_id)[3]}",
+                rng.random() < 0.7,
+                _timestamp(rng, created(listing_id), 60),
+            )
+        )
+    yield "notifications", (
+        "id",
+        "user_id",
+        "listing_id",
+        "notification_type",
+        "notification_message",
+        "is_read",
+        "created_at",
+    ), notifications
+
+    comments = []
+    for comment_id in range(1, rows["listing_comments"] + 1):
+        listing_id = popular(rng, len(listings))
+        at = _timestamp(rng, created(listing_id), 30)
+        answered = rng.random() < 0.6
+        comments.append(
+            (
+                comment_id,
+                popular(rng, n_users),
+                listing_id,
+                _text(rng, DESCRIPTION_WORDS, rng.randint(3, 15)) + "?",
+                at,
+                _text(rng, DESCRIPTION_WORDS, rng.randint(3, 15)) if answered else None,
+                at + timedelta(hours=rng.randint(1, 48)) if answered else None,
+            )
+        )
+    yield "listing_comments", (
+        "id",
+        "user_id",
+        "listing_id",
+        "comment_text",
+        "created_at",
+        "answer_text",
+        "answered_at",
+    ), comments
+
+    shipping = []
+    for shipping_id in range(1, rows["shipping_details"] + 1):
+        listing_id = (
+            transactions[shipping_id - 1][3]
+            if shipping_id <= len(transactions)
+            else popular(rng, len(listings))
+        )
+        shipped = rng.random() < 0.5
+        shipping.append(
+            (
+                shipping_id,
+                seller(listing_id),
+                listing_id,
+                rng.choice(SHIPPING_METHODS),
+                round(rng.uniform(0, 150), 2),
+                rng.randint(1, 7),
+                f"SE{rng.randint(0, 999_999_999):09}" if shipped else None,
+                "shipped" if shipped else "pending",
+                (
+                    created(listing_id) + timedelta(days=rng.randint(1, 20))
+                    if shipped
+                    else None
+                ),
+            )
+        )
+    yield "shipping_details", (
+        "id",
+        "user_id",
+        "listing_id",
+        "shipping_method",
+        "shipping_cost",
+        "estimated_delivery_days",
+        "tracking_number",
+        "status",
+        "shipped_at",
+    ), shipping
+
+    reports = []
+    for report_id in range(1, rows["reports"] + 1):
+        listing_id = popular(rng, len(listings))
+        reports.append(
+            (
+                report_id,
+                popular(rng, n_users),
+                listing_id,
+                rng.choice(REPORT_REASONS),
+                _timestamp(rng, created(listing_id), 30),
+            )
+        )
+    yield "reports", (
+        "id",
+        "user_id",
+        "listing_id",
+        "report_reason",
+        "created_at",
+    ), reports
+
+
+def copy_rows(cursor, table, columns, rows, batch_size=COPY_BATCH_SIZE):
+    """Skriver raderna med COPY i batchar"""
+    for offset in range(0, len(rows), batch_size):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows[offset : offset + batch_size])
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+
+
+def row_counts(connection):
+    """Antal rader per tabell"""
+    with connection:
+        with connection.cursor() as cursor:
+            counts = {}
+            for table in TABLES:
+                cursor.execute(f"SELECT COUNT(*) FROM {table}")
+                counts[table] = cursor.fetchone()[0]
+    return counts
+
+
+def reset(connection):
+    """Tömmer alla tabeller och startar om sekvenserna"""
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY")
+
+
+def check_empty(connection):
+    """Kastar ValueError om någon tabell redan har rader"""
+    non_empty = [table for table, count in row_counts(connection).items() if count]
+    if non_empty:
+        raise ValueError(f"Tabellerna är inte tomma: {', '.join(non_empty)}")
+
+
+def finish(connection):
+    """
+    Körs när alla rader är skrivna: sätter sekvenserna efter de explicita id:na,
+    högsta bud och antal bud på annonserna och bygger om user_ratings och
+    message_threads.
+    Returnerar antal rader per tabell.
+    """
+    with connection:
+        with connection.cursor() as cursor:
+            for table in TABLES:
+                if table == "listings_watch_list":
+                    continue
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"(SELECT COALESCE(MAX(id), 0) + 1 FROM {table}), false)"
+                )
+            # Samma som migration 3
+            cursor.execute(
+                """
+                UPDATE listings SET
+                    current_high_bid = totals.high_bid,
+                    bid_count = totals.bid_count
+                FROM (
+                    SELECT listing_id, MAX(bid_amount) AS high_bid, COUNT(*) AS bid_count
+                    FROM bids
+                    GROUP BY listing_id
+                ) AS totals
+                WHERE listings.id = totals.listing_id
+            """
+            )
+    db.recompute_user_ratings(connection)
+    db.recompute_message_threads(connection)
+
+    # ANALYZE kan inte köras i en transaktion med andra satser
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+    finally:
+        connection.autocommit = False
+    return row_counts(connection)
+
+
+def seed(connection, scale=1.0, seed=42):
+    """
+    Fyller de tomma tabellerna. Returnerar antal rader per tabell.
+    Kastar ValueError om någon tabell redan har rader.
+    """
+    check_empty(connection)
+    with connection:
+        with connection.cursor() as cursor:
+            for table, columns, rows in generate(scale, seed):
+                copy_rows(cursor, table, columns, rows)
+    return finish(connection)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fyller databasen med testdata")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--reset", action="store_true", help="töm alla tabeller först (TRUNCATE)"
+    )
+    args = parser.parse_args()
+
+    db_setup.create_tables()
+    db_setup.run_migrations()
+    connection = get_connection()
+    try:
+        if args.reset:
+            reset(connection)
+        started = time.perf_counter()
+        counts = seed(connection, args.scale, args.seed)
+    except ValueError as error:
+        parser.error(f"{error}, använd --reset")
+    finally:
+        connection.close()
+
+    summary = {
+        "scale": args.scale,
+        "seed": args.seed,
+        "seconds": round(time.perf_counter() - started, 2),
+        "rows": counts,
+    }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+"""
+Läscache i processen för heta uppslag på en rad (annons, användare, rating)
+och kategorilistan.
+
+Värden sparas i en gemensam LRU som begränsas i bytes (CACHE_MAX_BYTES).
+Varje entitet har en egen TTL i sekunder, CACHE_TTL_<ENTITET>, där 0 stänger av
+cachen för just den entiteten. Skrivningar i db.py och async_db.py anropar
+invalidate() efter commit så att ändringar via API:t aldrig läses gamla.
+
+Med flera workers skickar skrivningarna dessutom NOTIFY på INVALIDATION_CHANNEL
+i samma transaktion (notify() / notify_async()). Varje worker lyssnar via
+pg_listener och tar bort samma nycklar ur sin egen cache när transaktionen
+har committats.
+
+Funktioner kopplas på med dekoratorn, argumenten efter connection blir nyckeln:
+
+    @cache.cached("listing")
+    def get_listing_by_id(connection, listing_id): ...
+"""
+
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Sätt till 0 för att inte lyssna på invalideringar från andra workers
+CACHE_LISTEN = os.getenv("CACHE_LISTEN", "1") == "1"
+
+INVALIDATION_CHANNEL = "cache_invalidation"
+
+# Identifierar processen så att den kan hoppa över sina egna notiser
+_ORIGIN = uuid.uuid4().hex
+
+ENTITIES = {
+    "listing": float(os.getenv("CACHE_TTL_LISTING", "30")),
+    "user": float(os.getenv("CACHE_TTL_USER", "60")),
+    "categories": float(os.getenv("CACHE_TTL_CATEGORIES", "300")),
+    "user_rating": float(os.getenv("CACHE_TTL_USER_RATING", "60")),
+}
+
+
+def _sizeof(value):
+    """Ungefärlig storlek i bytes för rader från databasen"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_sizeof(key) + _sizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_sizeof(item) for item in value)
+    return size
+
+
+def _copy(value):
+    """Kopia av raden så att anroparen inte kan ändra det cachade värdet"""
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+class Cache:
+    """Trådsäker LRU med TTL per entitet och gräns i bytes"""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttls=None):
+        self.max_bytes = max_bytes
+        self.ttls = dict(ENTITIES if ttls is None else ttls)
+        self.enabled = {entity: ttl > 0 for entity, ttl in self.ttls.items()}
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Ökas vid varje invalidering, se set()
+        self._generation = 0
+        self._counters = {
+            entity: {
+                "hits": 0,
+                "misses": 0,
+                "evictions": 0,
+                "expirations": 0,
+                "invalidations": 0,
+            }
+            for entity in self.ttls
+        }
+
+    def is_enabled(self, entity):
+        return self.enabled.get(entity, False)
+
+    def set_enabled(self, entity, enabled):
+        """Slår på eller av cachen för en entitet, avstängd töms den"""
+        if entity not in self.ttls:
+            raise ValueError(f"Okänd entitet {entity}")
+        self.enabled[entity] = enabled
+        if not enabled:
+            self.invalidate(entity)
+
+    def generation(self):
+        return self._generation
+
+    def get(self, entity, key):
+        """Returnerar (True, värde) vid träff, annars (False, None)"""
+        with self._lock:
+            counters = self._counters[entity]
+            entry = self._entries.get((entity, key))
+            if entry is None:
+                counters["misses"] += 1
+                return False, None
+            value, expires_at, size = entry
+            if expires_at <= time.monotonic():
+                self._remove((entity, key))
+                counters["expirations"] += 1
+                counters["misses"] += 1
+                return False, None
+            self._entries.move_to_end((entity, key))
+            counters["hits"] += 1
+        return True, _copy(value)
+
+    def set(self, entity, key, value, generation):
+        """
+        Sparar ett värde som lästes när generation() var `generation`.
+        Har något invaliderats sedan dess kan värdet vara inaktuellt och sparas inte.
+        """
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self._generation or not self.is_enabled(entity):
+                return
+            self._remove((entity, key))
+            expires_at = time.monotonic() + self.ttls[entity]
+            self._entries[(entity, key)] = (_copy(value), expires_at, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._counters[oldest[0]]["evictions"] += 1
+
+    def invalidate(self, entity, *key):
+        """Tar bort en nyckel, eller alla nycklar för entiteten om ingen nyckel anges"""
+        with self._lock:
+            self._generation += 1
+            if key:
+                removed = self._remove((entity, key))
+            else:
+                keys = [entry for entry in self._entries if entry[0] == entity]
+                for entry in keys:
+                    self._remove(entry)
+                removed = bool(keys)
+            if removed:
+                self._counters[entity]["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, cache_key):
+        entry = self._entries.pop(cache_key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[2]
+        return True
+
+    def stats(self):
+        """Mätvärden för stats-endpointen"""
+        with self._lock:
+            entities = {}
+            for entity, counters in self._counters.items():
+                lookups = counters["hits"] + counters["misses"]
+                entities[entity] = {
+                    "enabled": self.is_enabled(entity),
+                    "ttl": self.ttls[entity],
+                    "entries": sum(1 for key in self._entries if key[0] == entity),
+                    **counters,
+                    "hit_ratio": (
+                        round(counters["hits"] / lookups, 3) if lookups else None
+                    ),
+                }
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "entities": entities,
+            }
+
+
+_cache = Cache()
+
+
+def get_cache():
+    return _cache
+
+
+def invalidate(entity, *key):
+    _cache.invalidate(entity, *key)
+
+
+def _payload(entity, key):
+    return json.dumps({"origin": _ORIGIN, "entity": entity, "key": list(key)})
+
+
+def notify(cursor, entity, *key):
+    """Ber övriga workers invalidera nyckeln, levereras först vid commit"""
+    cursor.execute(
+        "SELECT pg_notify(%s, %s)", (INVALIDATION_CHANNEL, _payload(entity, key))
+    )
+
+
+async def notify_async(connection, entity, *key):
+    """Som notify() men för en asyncpg-koppling"""
+    await connection.execute(
+        "SELECT pg_notify($1, $2)", INVALIDATION_CHANNEL, _payload(entity, key)
+    )
+
+
+def handle_notification(payload):
+    """Tar emot en notis från en annan worker och invaliderar nyckeln lokalt"""
+    message = json.loads(payload)
+    if message["origin"] == _ORIGIN:
+        # Den egna processen invaliderade redan efter commit
+        return
+    if message["entity"] in _cache.ttls:
+        _cache.invalidate(message["entity"], *message["key"])
+
+
+def listen_for_invalidations(listener):
+    """
+    Kopplar cachen till en pg_listener.PgListener. Notiser som skickas medan
+    kopplingen är nere går förlorade, så cachen töms vid återanslutning.
+    """
+    listener.subscribe(INVALIDATION_CHANNEL, handle_notification)
+    listener.on_reconnect(_cache.clear)
+
+
+def cached(entity):
+    """Dekorator för db-funktioner som tar connection först, fungerar även för async"""
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(connection, *args):
+                if not _cache.is_enabled(entity):
+                    return await function(connection, *args)
+                hit, value = _cache.get(entity, args)
+                if hit:
+                    return value
+                generation = _cache.generation()
+                value = await function(connection, *args)
+                _cache.set(entity, args, value, generation)
+                return value
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(connection, *args):
+            if not _cache.is_enabled(entity):
+                return function(connection, *args)
+            hit, value = _cache.get(entity, args)
+            if hit:
+                return value
+            generation = _cache.generation()
+            value = function(connection, *args)
+            _cache.set(entity, args, value, generation)
+            return value
+
+        return wrapper
+
+    return decorator
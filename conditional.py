@@ -0,0 +1,86 @@
+import hashlib
+import os
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from dotenv import load_dotenv
+from fastapi import Response
+
+load_dotenv()
+
+"""
+Villkorliga GET med ETag och Last-Modified, och Cache-Control per route.
+
+ETag räknas från en billig versionsstämpel istället för från svaret, så att
+304 Not Modified kan skickas innan den fulla frågan körs och innan svaret
+serialiseras:
+
+- /listings/{id}: annonsens updated_at, som sätts av update_listing, create_bid
+  och delete_bid. Raden kommer oftast från läscachen.
+- /categories: antal kategorier och högsta id. Kategorier ändras aldrig, de
+  läggs bara till och raderas, och listan ligger i läscachen.
+- /users/{id}/reviews och /listings/{id}/images: antal rader och högsta id från
+  get_reviews_version / get_images_version, en index-only scan.
+
+Last-Modified skickas bara där det finns en riktig ändringstid (annonser).
+Skickar klienten If-None-Match används bara den, annars If-Modified-Since.
+
+- CACHE_CONTROL_<ROUTE>: Cache-Control för categories, listing, reviews och images
+"""
+
+# Ökas när svarens format ändras så att gamla ETags slutar matcha
+ETAG_VERSION = 1
+
+CACHE_CONTROL = {
+    "categories": os.getenv("CACHE_CONTROL_CATEGORIES", "public, max-age=300"),
+    # Bud ändrar annonsen hela tiden, klienten får fråga varje gång men får 304
+    "listing": os.getenv("CACHE_CONTROL_LISTING", "no-cache"),
+    "reviews": os.getenv("CACHE_CONTROL_REVIEWS", "public, max-age=60"),
+    "images": os.getenv("CACHE_CONTROL_IMAGES", "public, max-age=300"),
+}
+
+
+def etag(route, *version):
+    """Stark ETag för routen och versionsstämpeln"""
+    key = repr((ETAG_VERSION, route, version)).encode()
+    return f'"{hashlib.blake2b(key, digest_size=12).hexdigest()}"'
+
+
+def http_date(value):
+    """Datum i formatet för Last-Modified, naiva tider räknas som lokal tid"""
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def headers(route, *version, last_modified=None):
+    """ETag, Cache-Control och Last-Modified för ett svar från routen"""
+    result = {"ETag": etag(route, *version), "Cache-Control": CACHE_CONTROL[route]}
+    if last_modified is not None:
+        result["Last-Modified"] = http_date(last_modified)
+    return result
+
+
+def is_fresh(request, response_headers):
+    """True om klientens kopia fortfarande gäller och 304 kan skickas"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        current = response_headers["ETag"]
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # Svag jämförelse som för GET i RFC 9110
+        return "*" in tags or current in tags or f"W/{current}" in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    last_modified = response_headers.get("Last-Modified")
+    if not if_modified_since or not last_modified:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parsedate_to_datetime(last_modified) <= since
+
+
+def not_modified(response_headers):
+    """304 utan innehåll, med samma validerare som ett fullt svar"""
+    return Response(status_code=304, headers=response_headers)
@@ -1,6 +1,16 @@
+import os
+from decimal import Decimal
+
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+import cache
+import events
+import metrics
+import pagination
+import queries
+import singleflight
+
 """
 This file is responsible for making database queries, which your fastapi endpoints/routes can use.
 The reason we split them up is to avoid clutter in the endpoints, so that the endpoints might focus on other tasks 
@@ -18,23 +28,52 @@ start with a connection parameter.
 """
 
 
+# Minsta höjning jämfört med nuvarande högsta bud, Decimal som DECIMAL(10, 2)-kolumnerna
+MIN_BID_INCREMENT = Decimal(os.getenv("MIN_BID_INCREMENT", "1.00"))
+
+
+class BidRejectedError(Exception):
+    """Budet bröt mot budreglerna (annonsen är inte aktiv eller budet är för lågt)"""
+
+
+def fetch_rows(cursor):
+    """
+    Hämtar alla rader från en vanlig cursor som dicts. För långa listor går det
+    betydligt snabbare än RealDictCursor, som bygger upp varje rad nyckel för nyckel.
+    """
+    columns = [column.name for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
 # Bid functions
 
 
-def get_all_bids(connection):
-    """Hämtar alla bud från databasen"""
+def get_all_bids(connection, after=None, limit=None):
+    """Hämtar alla bud från databasen, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("created_at", after)
     with connection:
-        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM bids ORDER BY created_at DESC")
-            bids = cursor.fetchall()
-    return bids
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT * FROM bids
+                {seek}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """,
+                (*params, limit + 1),
+            )
+            bids = fetch_rows(cursor)
+    return pagination.next_page(bids, limit, "created_at")
 
 
 def get_bid_by_id(connection, bid_id):
     """Hämtar ett specifikt bud"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM bids WHERE id = %s", (bid_id,))
+            queries.execute(
+                cursor, "get_bid_by_id", "SELECT * FROM bids WHERE id = %s", (bid_id,)
+            )
             bid = cursor.fetchone()
 
     if not bid:
@@ -43,11 +82,14 @@ def get_bid_by_id(connection, bid_id):
     return bid
 
 
+@singleflight.coalesced("listing_bids")
 def get_bids_for_listing(connection, listing_id):
     """Hämtar alla bud för en specifik annons"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_bids_for_listing",
                 """
                 SELECT * FROM bids 
                 WHERE listing_id = %s 
@@ -60,10 +102,65 @@ def get_bids_for_listing(connection, listing_id):
 
 
 def create_bid(connection, user_id, listing_id, bid_amount):
-    """Skapar ett nytt bud"""
+    """
+    Lägger ett bud om annonsen är aktiv och budet är tillräckligt högt.
+    Första budet måste vara minst annonsens pris, följande minst
+    current_high_bid + MIN_BID_INCREMENT. Uppdateringen av annonsen låser raden,
+    så samtidiga bud på samma annons prövas ett i taget mot det senaste högsta budet.
+    """
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_bid_accept",
+                """
+                UPDATE listings
+                SET current_high_bid = %s, bid_count = bid_count + 1,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                  AND status = 'active'
+                  AND %s >= COALESCE(current_high_bid + %s, price)
+                RETURNING id
+            """,
+                (bid_amount, listing_id, bid_amount, MIN_BID_INCREMENT),
+            )
+            accepted = cursor.fetchone()
+
+            if not accepted:
+                queries.execute(
+                    cursor,
+                    "create_bid_listing_state",
+                    "SELECT status, price, current_high_bid FROM listings WHERE id = %s",
+                    (listing_id,),
+                )
+                listing = cursor.fetchone()
+                if not listing:
+                    raise ValueError(f"Annons med id {listing_id} finns inte")
+                if listing["status"] != "active":
+                    raise BidRejectedError("Annonsen är inte aktiv")
+                if listing["current_high_bid"] is None:
+                    minimum = listing["price"]
+                else:
+                    minimum = listing["current_high_bid"] + MIN_BID_INCREMENT
+                raise BidRejectedError(f"Budet måste vara minst {minimum:.2f}")
+
+            # Annonsraden är låst, så ledaren kan inte ändras förrän vi committat
+            queries.execute(
+                cursor,
+                "create_bid_leader",
+                """
+                SELECT user_id FROM bids
+                WHERE listing_id = %s
+                ORDER BY bid_amount DESC, id
+                LIMIT 1
+            """,
+                (listing_id,),
+            )
+            leader = cursor.fetchone()
+
+            queries.execute(
+                cursor,
+                "create_bid_insert",
                 """
                 INSERT INTO bids (user_id, listing_id, bid_amount)
                 VALUES (%s, %s, %s)
@@ -72,16 +169,65 @@ def create_bid(connection, user_id, listing_id, bid_amount):
                 (user_id, listing_id, bid_amount),
             )
             new_bid = cursor.fetchone()
+            if leader and leader["user_id"] != user_id:
+                events.publish(cursor, leader["user_id"], "outbid", new_bid)
+            cache.notify(cursor, "listing", listing_id)
+    cache.invalidate("listing", listing_id)
+    singleflight.forget("listing", listing_id)
+    singleflight.forget("listing_bids", listing_id)
     return new_bid
 
 
 def delete_bid(connection, bid_id):
-    """Raderar ett bud"""
+    """Raderar ett bud och räknar om annonsens högsta bud"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("DELETE FROM bids WHERE id = %s RETURNING id", (bid_id,))
+            queries.execute(
+                cursor,
+                "delete_bid_listing",
+                "SELECT listing_id FROM bids WHERE id = %s",
+                (bid_id,),
+            )
+            bid = cursor.fetchone()
+            if not bid:
+                raise ValueError(f"Bud med id {bid_id} finns inte")
+
+            # Samma låsordning som create_bid: först annonsen, sedan buden
+            queries.execute(
+                cursor,
+                "delete_bid_lock_listing",
+                "SELECT id FROM listings WHERE id = %s FOR UPDATE",
+                (bid["listing_id"],),
+            )
+            queries.execute(
+                cursor,
+                "delete_bid",
+                "DELETE FROM bids WHERE id = %s RETURNING id",
+                (bid_id,),
+            )
             deleted_bid = cursor.fetchone()
 
+            if deleted_bid:
+                queries.execute(
+                    cursor,
+                    "delete_bid_recount",
+                    """
+                    UPDATE listings SET
+                        bid_count = GREATEST(bid_count - 1, 0),
+                        current_high_bid = (
+                            SELECT MAX(bid_amount) FROM bids WHERE listing_id = %s
+                        ),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                """,
+                    (bid["listing_id"], bid["listing_id"]),
+                )
+                cache.notify(cursor, "listing", bid["listing_id"])
+
+    cache.invalidate("listing", bid["listing_id"])
+    singleflight.forget("listing", bid["listing_id"])
+    singleflight.forget("listing_bids", bid["listing_id"])
+
     if not deleted_bid:
         raise ValueError(f"Bud med id {bid_id} finns inte")
 
@@ -95,16 +241,24 @@ def get_all_user_ratings(connection):
     """Hämtar alla användarratings"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM user_ratings")
+            queries.execute(
+                cursor, "get_all_user_ratings", "SELECT * FROM user_ratings"
+            )
             ratings = cursor.fetchall()
     return ratings
 
 
+@cache.cached("user_rating")
 def get_user_rating_by_user_id(connection, user_id):
     """Hämtar rating för en specifik användare"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM user_ratings WHERE user_id = %s", (user_id,))
+            queries.execute(
+                cursor,
+                "get_user_rating_by_user_id",
+                "SELECT * FROM user_ratings WHERE user_id = %s",
+                (user_id,),
+            )
             rating = cursor.fetchone()
 
     if not rating:
@@ -117,15 +271,19 @@ def create_user_rating(connection, user_id, total_ratings=0, average_rating=0.00
     """Skapar ett nytt användarrating"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_user_rating",
                 """
-                INSERT INTO user_ratings (user_id, total_ratings, average_rating)
-                VALUES (%s, %s, %s)
+                INSERT INTO user_ratings (user_id, total_ratings, average_rating, rating_sum)
+                VALUES (%s, %s, %s, ROUND(%s::numeric * %s::numeric))
                 RETURNING *
             """,
-                (user_id, total_ratings, average_rating),
+                (user_id, total_ratings, average_rating, total_ratings, average_rating),
             )
             new_rating = cursor.fetchone()
+            cache.notify(cursor, "user_rating", user_id)
+    cache.invalidate("user_rating", user_id)
     return new_rating
 
 
@@ -144,6 +302,12 @@ def update_user_rating(connection, user_id, total_ratings=None, average_rating=N
     if not updates:
         raise ValueError("Inget att uppdatera")
 
+    # Håll summan i fas så att nästa recension räknas från de nya värdena
+    updates.append(
+        "rating_sum = ROUND(COALESCE(%s, total_ratings) * COALESCE(%s, average_rating))"
+    )
+    values.extend([total_ratings, average_rating])
+
     values.append(user_id)
     query = (
         f"UPDATE user_ratings SET {', '.join(updates)} WHERE user_id = %s RETURNING *"
@@ -153,7 +317,9 @@ def update_user_rating(connection, user_id, total_ratings=None, average_rating=N
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute(query, values)
             updated_rating = cursor.fetchone()
+            cache.notify(cursor, "user_rating", user_id)
 
+    cache.invalidate("user_rating", user_id)
     if not updated_rating:
         raise ValueError(f"Rating för användare {user_id} finns inte")
 
@@ -164,34 +330,125 @@ def delete_user_rating(connection, user_id):
     """Raderar ett användarrating"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "DELETE FROM user_ratings WHERE user_id = %s RETURNING id", (user_id,)
+            queries.execute(
+                cursor,
+                "delete_user_rating",
+                "DELETE FROM user_ratings WHERE user_id = %s RETURNING id",
+                (user_id,),
             )
             deleted_rating = cursor.fetchone()
+            cache.notify(cursor, "user_rating", user_id)
 
+    cache.invalidate("user_rating", user_id)
     if not deleted_rating:
         raise ValueError(f"Rating för användare {user_id} finns inte")
 
     return {"message": "Rating raderat", "id": deleted_rating["id"]}
 
 
+def recompute_user_ratings(connection):
+    """
+    Bygger om alla ratings från reviews i en mängdbaserad körning, för reparation.
+    Recensioner låses för skrivning under tiden så att inga inkrementella
+    uppdateringar tappas. Returnerar antal ändrade rader.
+    """
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute("LOCK TABLE reviews IN SHARE MODE")
+            cursor.execute(
+                """
+                INSERT INTO user_ratings (user_id, total_ratings, rating_sum, average_rating)
+                SELECT
+                    reviewed_user_id,
+                    COUNT(*),
+                    SUM(rating),
+                    ROUND(AVG(rating), 2)
+                FROM reviews
+                GROUP BY reviewed_user_id
+                ON CONFLICT (user_id) DO UPDATE SET
+                    total_ratings = EXCLUDED.total_ratings,
+                    rating_sum = EXCLUDED.rating_sum,
+                    average_rating = EXCLUDED.average_rating
+                WHERE (user_ratings.total_ratings, user_ratings.rating_sum)
+                    IS DISTINCT FROM (EXCLUDED.total_ratings, EXCLUDED.rating_sum)
+            """
+            )
+            changed = cursor.rowcount
+            cursor.execute(
+                """
+                UPDATE user_ratings
+                SET total_ratings = 0, rating_sum = 0, average_rating = 0
+                WHERE total_ratings <> 0
+                  AND NOT EXISTS (
+                      SELECT 1 FROM reviews WHERE reviewed_user_id = user_ratings.user_id
+                  )
+            """
+            )
+            changed += cursor.rowcount
+            cache.notify(cursor, "user_rating")
+    cache.invalidate("user_rating")
+    return changed
+
+
 # Review Functions
 
+# Uppdaterar user_ratings i samma transaktion som recensionen skrivs, med löpande
+# summa och antal så att ingen omräkning över alla recensioner behövs
+ADD_REVIEW_TO_RATING = """
+    INSERT INTO user_ratings (user_id, total_ratings, rating_sum, average_rating)
+    VALUES (%s, 1, %s, %s)
+    ON CONFLICT (user_id) DO UPDATE SET
+        total_ratings = user_ratings.total_ratings + 1,
+        rating_sum = user_ratings.rating_sum + EXCLUDED.rating_sum,
+        average_rating = ROUND(
+            (user_ratings.rating_sum + EXCLUDED.rating_sum)::numeric
+            / (user_ratings.total_ratings + 1),
+            2
+        )
+"""
 
-def get_all_reviews(conncection):
-    """Hämtar alla recenssioner"""
-    with conncection:
-        with conncection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM reviews ORDER BY created_at DESC")
-            reviews = cursor.fetchall()
-    return reviews
+REMOVE_REVIEW_FROM_RATING = """
+    UPDATE user_ratings SET
+        total_ratings = GREATEST(total_ratings - 1, 0),
+        rating_sum = rating_sum - %s,
+        average_rating = CASE
+            WHEN total_ratings > 1
+            THEN ROUND((rating_sum - %s)::numeric / (total_ratings - 1), 2)
+            ELSE 0
+        END
+    WHERE user_id = %s
+"""
+
+
+def get_all_reviews(connection, after=None, limit=None):
+    """Hämtar alla recenssioner, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("created_at", after)
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT * FROM reviews
+                {seek}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """,
+                (*params, limit + 1),
+            )
+            reviews = fetch_rows(cursor)
+    return pagination.next_page(reviews, limit, "created_at")
 
 
 def get_review_by_id(connection, review_id):
     """Hämtar en specifik recension"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM reviews WHERE id = %s", (review_id,))
+            queries.execute(
+                cursor,
+                "get_review_by_id",
+                "SELECT * FROM reviews WHERE id = %s",
+                (review_id,),
+            )
             review = cursor.fetchone()
 
     if not review:
@@ -204,7 +461,9 @@ def get_reviews_for_user(connection, user_id):
     """Hämtar alla recensioner för en användare"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_reviews_for_user",
                 """
                 SELECT * FROM reviews 
                 WHERE reviewed_user_id = %s 
@@ -216,13 +475,34 @@ def get_reviews_for_user(connection, user_id):
     return reviews
 
 
+def get_reviews_version(connection, user_id):
+    """
+    Antal recensioner och högsta id för en användare. Recensioner ändras aldrig
+    och id:n växer, så paret ändras vid varje ny eller raderad recension.
+    """
+    with connection:
+        with connection.cursor() as cursor:
+            queries.execute(
+                cursor,
+                "get_reviews_version",
+                """
+                SELECT COUNT(*), COALESCE(MAX(id), 0) FROM reviews
+                WHERE reviewed_user_id = %s
+            """,
+                (user_id,),
+            )
+            return tuple(cursor.fetchone())
+
+
 def create_review(
     connection, reviewer_id, reviewed_user_id, listing_id, rating, review_text=None
 ):
     """Skapar en ny recension"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_review",
                 """
                 INSERT INTO reviews (reviewer_id, reviewed_user_id, listing_id, rating, review_text)
                 VALUES (%s, %s, %s, %s, %s)
@@ -231,6 +511,14 @@ def create_review(
                 (reviewer_id, reviewed_user_id, listing_id, rating, review_text),
             )
             new_review = cursor.fetchone()
+            queries.execute(
+                cursor,
+                "add_review_to_rating",
+                ADD_REVIEW_TO_RATING,
+                (reviewed_user_id, rating, rating),
+            )
+            cache.notify(cursor, "user_rating", reviewed_user_id)
+    cache.invalidate("user_rating", reviewed_user_id)
     return new_review
 
 
@@ -238,34 +526,66 @@ def delete_review(connection, review_id):
     """Raderar en recension"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "DELETE FROM reviews WHERE id = %s RETURNING id", (review_id,)
+            queries.execute(
+                cursor,
+                "delete_review",
+                "DELETE FROM reviews WHERE id = %s RETURNING id, reviewed_user_id, rating",
+                (review_id,),
             )
             deleted_review = cursor.fetchone()
+            if deleted_review:
+                queries.execute(
+                    cursor,
+                    "remove_review_from_rating",
+                    REMOVE_REVIEW_FROM_RATING,
+                    (
+                        deleted_review["rating"],
+                        deleted_review["rating"],
+                        deleted_review["reviewed_user_id"],
+                    ),
+                )
+                cache.notify(cursor, "user_rating", deleted_review["reviewed_user_id"])
 
     if not deleted_review:
         raise ValueError(f"Recension med id {review_id} finns inte")
 
+    cache.invalidate("user_rating", deleted_review["reviewed_user_id"])
+
     return {"message": "Recension raderad", "id": deleted_review["id"]}
 
 
 # Image Function
 
 
-def get_all_images(connection):
-    """Hämtar alla bilder"""
+def get_all_images(connection, after=None, limit=None):
+    """Hämtar alla bilder, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("created_at", after)
     with connection:
-        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM images ORDER BY created_at DESC")
-            images = cursor.fetchall()
-    return images
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT * FROM images
+                {seek}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """,
+                (*params, limit + 1),
+            )
+            images = fetch_rows(cursor)
+    return pagination.next_page(images, limit, "created_at")
 
 
 def get_image_by_id(connection, image_id):
     """Hämtar en specifik bild"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM images WHERE id = %s", (image_id,))
+            queries.execute(
+                cursor,
+                "get_image_by_id",
+                "SELECT * FROM images WHERE id = %s",
+                (image_id,),
+            )
             image = cursor.fetchone()
 
     if not image:
@@ -278,7 +598,9 @@ def get_images_for_listing(connection, listing_id):
     """Hämtar alla bilder för en annons"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_images_for_listing",
                 """
                 SELECT * FROM images 
                 WHERE listing_id = %s 
@@ -290,11 +612,29 @@ def get_images_for_listing(connection, listing_id):
     return images
 
 
+def get_images_version(connection, listing_id):
+    """Antal bilder och högsta id för en annons, se get_reviews_version"""
+    with connection:
+        with connection.cursor() as cursor:
+            queries.execute(
+                cursor,
+                "get_images_version",
+                """
+                SELECT COUNT(*), COALESCE(MAX(id), 0) FROM images
+                WHERE listing_id = %s
+            """,
+                (listing_id,),
+            )
+            return tuple(cursor.fetchone())
+
+
 def create_image(connection, user_id, listing_id, image_url):
     """Lägger till en ny bild"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_image",
                 """
                 INSERT INTO images (user_id, listing_id, image_url)
                 VALUES (%s, %s, %s)
@@ -310,7 +650,12 @@ def delete_image(connection, image_id):
     """Raderar en bild"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("DELETE FROM images WHERE id = %s RETURNING id", (image_id,))
+            queries.execute(
+                cursor,
+                "delete_image",
+                "DELETE FROM images WHERE id = %s RETURNING id",
+                (image_id,),
+            )
             deleted_image = cursor.fetchone()
 
     if not deleted_image:
@@ -322,20 +667,35 @@ def delete_image(connection, image_id):
 # Report functions
 
 
-def get_all_reports(connection):
-    """Hämtar alla rapporteringar"""
+def get_all_reports(connection, after=None, limit=None):
+    """Hämtar alla rapporteringar, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("created_at", after)
     with connection:
-        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM reports ORDER BY created_at DESC")
-            reports = cursor.fetchall()
-    return reports
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT * FROM reports
+                {seek}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """,
+                (*params, limit + 1),
+            )
+            reports = fetch_rows(cursor)
+    return pagination.next_page(reports, limit, "created_at")
 
 
 def get_report_by_id(connection, report_id):
     """Hämtar en specifik rapport"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM reports WHERE id = %s", (report_id,))
+            queries.execute(
+                cursor,
+                "get_report_by_id",
+                "SELECT * FROM reports WHERE id = %s",
+                (report_id,),
+            )
             report = cursor.fetchone()
 
     if not report:
@@ -348,7 +708,9 @@ def get_reports_for_listing(connection, listing_id):
     """Hämtar alla rapporter för en annons"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_reports_for_listing",
                 """
                 SELECT * FROM reports 
                 WHERE listing_id = %s 
@@ -364,7 +726,9 @@ def create_report(connection, user_id, listing_id, report_reason):
     """Skapar en ny rapportering"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_report",
                 """
                 INSERT INTO reports (user_id, listing_id, report_reason)
                 VALUES (%s, %s, %s)
@@ -380,8 +744,11 @@ def delete_report(connection, report_id):
     """Raderar en rapportering"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "DELETE FROM reports WHERE id = %s RETURNING id", (report_id,)
+            queries.execute(
+                cursor,
+                "delete_report",
+                "DELETE FROM reports WHERE id = %s RETURNING id",
+                (report_id,),
             )
             deleted_report = cursor.fetchone()
 
@@ -392,20 +759,34 @@ def delete_report(connection, report_id):
 
 
 # User function
-def get_all_users(connection):
-    """Hämtar alla användare"""
+def get_all_users(connection, after=None, limit=None):
+    """Hämtar alla användare, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("user_since", after)
     with connection:
-        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM users")
-            all_users = cursor.fetchall()
-    return all_users
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT id, username, email, user_since, date_of_birth, phone_number
+                FROM users
+                {seek}
+                ORDER BY user_since DESC, id DESC
+                LIMIT %s
+            """,
+                (*params, limit + 1),
+            )
+            all_users = fetch_rows(cursor)
+    return pagination.next_page(all_users, limit, "user_since")
 
 
+@cache.cached("user")
 def get_user_by_id(connection, user_id):
     """Hämtar en specifik användare med ID"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_user_by_id",
                 """
                 SELECT id, username, email, user_since, date_of_birth, phone_number 
                 FROM users 
@@ -425,7 +806,9 @@ def get_user_by_email(connection, email):
     """Hämtar användare med email (för inloggning)"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_user_by_email",
                 """
                 SELECT id, username, email, user_since, date_of_birth, phone_number 
                 FROM users 
@@ -441,7 +824,9 @@ def get_user_by_username(connection, username):
     """Hämtar användare med username (för inloggning)"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_user_by_username",
                 """
                 SELECT id, username, email, user_since, date_of_birth, phone_number 
                 FROM users 
@@ -459,7 +844,9 @@ def create_user(
     """Skapar en ny användare"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_user",
                 """
                 INSERT INTO users (username, email, password, user_since, date_of_birth, phone_number) 
                 VALUES (%s, %s, %s, %s, %s, %s) 
@@ -475,7 +862,9 @@ def update_user(connection, user_id, email=None, phone_number=None):
     """Uppdaterar en specifik användares email eller telefonnummer"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "update_user",
                 """
                 UPDATE users 
                 SET email = COALESCE(%s, email),
@@ -486,7 +875,9 @@ def update_user(connection, user_id, email=None, phone_number=None):
                 (email, phone_number, user_id),
             )
             updated_user = cursor.fetchone()
+            cache.notify(cursor, "user", user_id)
 
+    cache.invalidate("user", user_id)
     if not updated_user:
         raise ValueError(f"Användare med id {user_id} finns inte")
 
@@ -497,9 +888,16 @@ def delete_user(connection, user_id):
     """Raderar en användare"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("DELETE FROM users WHERE id = %s RETURNING *", (user_id,))
+            queries.execute(
+                cursor,
+                "delete_user",
+                "DELETE FROM users WHERE id = %s RETURNING *",
+                (user_id,),
+            )
             deleted_user = cursor.fetchone()
+            cache.notify(cursor, "user", user_id)
 
+    cache.invalidate("user", user_id)
     if not deleted_user:
         raise ValueError(f"Användare med id {user_id} finns inte")
 
@@ -507,11 +905,12 @@ def delete_user(connection, user_id):
 
 
 # Category Funcition
+@cache.cached("categories")
 def get_all_categories(connection):
     """Hämtar alla kategorier"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM categories")
+            queries.execute(cursor, "get_all_categories", "SELECT * FROM categories")
             categories = cursor.fetchall()
     return categories
 
@@ -520,7 +919,9 @@ def create_category(connection, name):
     """Skapar en ny kategori"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_category",
                 """
                 INSERT INTO categories (name) 
                 VALUES (%s) 
@@ -529,6 +930,8 @@ def create_category(connection, name):
                 (name,),
             )
             new_category = cursor.fetchone()
+            cache.notify(cursor, "categories")
+    cache.invalidate("categories")
     return new_category
 
 
@@ -536,11 +939,16 @@ def delete_category(connection, category_id):
     """Raderar en kategori"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "DELETE FROM categories WHERE id = %s RETURNING *", (category_id,)
+            queries.execute(
+                cursor,
+                "delete_category",
+                "DELETE FROM categories WHERE id = %s RETURNING *",
+                (category_id,),
             )
             deleted_category = cursor.fetchone()
+            cache.notify(cursor, "categories")
 
+    cache.invalidate("categories")
     if not deleted_category:
         raise ValueError(f"Kategori med id {category_id} finns inte")
 
@@ -548,20 +956,117 @@ def delete_category(connection, category_id):
 
 
 # Listing function
-def get_all_listings(connection):
-    """Hämtar alla annonser"""
+
+# Kolumner som skickas till klienten, search_vector används bara för sökning
+LISTING_COLUMNS = """
+    id, user_id, category_id, title, image_url, listing_type, price,
+    created_at, region, status, description, current_high_bid, bid_count
+"""
+
+
+def get_all_listings(connection, after=None, limit=None):
+    """Hämtar alla annonser, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("created_at", after)
     with connection:
-        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM listings ORDER BY created_at DESC")
-            listings = cursor.fetchall()
-    return listings
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT {LISTING_COLUMNS} FROM listings
+                {seek}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """,
+                (*params, limit + 1),
+            )
+            listings = fetch_rows(cursor)
+    return pagination.next_page(listings, limit, "created_at")
 
 
+@cache.cached("listing")
+@singleflight.coalesced("listing")
 def get_listing_by_id(connection, listing_id):
-    """Hämtar en specifik annons"""
+    """Hämtar en specifik annons, med updated_at för ETag och Last-Modified"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM listings WHERE id = %s", (listing_id,))
+            queries.execute(
+                cursor,
+                "get_listing_by_id",
+                f"SELECT {LISTING_COLUMNS}, updated_at FROM listings WHERE id = %s",
+                (listing_id,),
+            )
+            listing = cursor.fetchone()
+
+    if not listing:
+        raise ValueError(f"Annons med id {listing_id} finns inte")
+
+    return listing
+
+
+# Antal bud som följer med i get_listing_full (högst först)
+LISTING_FULL_BIDS = int(os.getenv("LISTING_FULL_BIDS", "10"))
+
+# Allt en annonssida behöver i en fråga, relationerna aggregeras till JSON
+LISTING_FULL_QUERY = f"""
+    SELECT
+        {LISTING_COLUMNS},
+        COALESCE((
+            SELECT json_agg(top_bids)
+            FROM (
+                SELECT * FROM bids
+                WHERE bids.listing_id = listings.id
+                ORDER BY bid_amount DESC, id
+                LIMIT %s
+            ) AS top_bids
+        ), '[]') AS bids,
+        COALESCE((
+            SELECT json_agg(images ORDER BY images.created_at)
+            FROM images
+            WHERE images.listing_id = listings.id
+        ), '[]') AS images,
+        COALESCE((
+            SELECT json_agg(comments ORDER BY comments.created_at)
+            FROM (
+                SELECT id, user_id, listing_id, comment_text, answer_text, created_at
+                FROM listing_comments
+                WHERE listing_comments.listing_id = listings.id
+            ) AS comments
+        ), '[]') AS comments,
+        (
+            SELECT row_to_json(shipping)
+            FROM (
+                SELECT id, listing_id, shipping_method, shipping_cost,
+                       estimated_delivery_days, tracking_number, status, shipped_at
+                FROM shipping_details
+                WHERE shipping_details.listing_id = listings.id
+                LIMIT 1
+            ) AS shipping
+        ) AS shipping,
+        (
+            SELECT row_to_json(seller_rating)
+            FROM (
+                SELECT total_ratings, average_rating
+                FROM user_ratings
+                WHERE user_ratings.user_id = listings.user_id
+            ) AS seller_rating
+        ) AS seller_rating
+    FROM listings
+    WHERE id = %s
+"""
+
+
+def get_listing_full(connection, listing_id, bids_limit=None):
+    """
+    Hämtar annonsen med de högsta buden, bilder, kommentarer, frakt och säljarens
+    rating i en enda fråga, istället för ett anrop per del
+    """
+    if bids_limit is None:
+        bids_limit = LISTING_FULL_BIDS
+    with connection:
+        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            queries.execute(
+                cursor, "get_listing_full", LISTING_FULL_QUERY, (bids_limit, listing_id)
+            )
             listing = cursor.fetchone()
 
     if not listing:
@@ -585,12 +1090,14 @@ def create_listing(
     """Skapar en ny annons"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
+            queries.execute(
+                cursor,
+                "create_listing",
+                f"""
                 INSERT INTO listings 
                 (user_id, category_id, title, listing_type, price, region, status, description, image_url)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) 
-                RETURNING *
+                RETURNING {LISTING_COLUMNS}
             """,
                 (
                     user_id,
@@ -623,8 +1130,10 @@ def update_listing(
     """Uppdaterar en annons"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
+            queries.execute(
+                cursor,
+                "update_listing",
+                f"""
                 UPDATE listings SET
                 category_id = COALESCE(%s, category_id),
                 title = COALESCE(%s, title),
@@ -633,9 +1142,10 @@ def update_listing(
                 region = COALESCE(%s, region),
                 status = COALESCE(%s, status),
                 description = COALESCE(%s, description),
-                image_url = COALESCE(%s, image_url)
+                image_url = COALESCE(%s, image_url),
+                updated_at = CURRENT_TIMESTAMP
                 WHERE id = %s 
-                RETURNING *
+                RETURNING {LISTING_COLUMNS}
             """,
                 (
                     category_id,
@@ -650,7 +1160,10 @@ def update_listing(
                 ),
             )
             updated_listing = cursor.fetchone()
+            cache.notify(cursor, "listing", listing_id)
 
+    cache.invalidate("listing", listing_id)
+    singleflight.forget("listing", listing_id)
     if not updated_listing:
         raise ValueError(f"Annons med id {listing_id} finns inte")
 
@@ -661,23 +1174,148 @@ def delete_listing(connection, listing_id):
     """Raderar en annons"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "DELETE FROM listings WHERE id = %s RETURNING *", (listing_id,)
+            queries.execute(
+                cursor,
+                "delete_listing",
+                "DELETE FROM listings WHERE id = %s RETURNING id",
+                (listing_id,),
             )
             deleted_listing = cursor.fetchone()
+            cache.notify(cursor, "listing", listing_id)
 
+    cache.invalidate("listing", listing_id)
+    singleflight.forget("listing", listing_id)
     if not deleted_listing:
         raise ValueError(f"Annons med id {listing_id} finns inte")
 
     return {"message": "Annons raderad", "id": deleted_listing["id"]}
 
 
+def listing_search_filters(
+    query=None,
+    category_id=None,
+    region=None,
+    listing_type=None,
+    status=None,
+    min_price=None,
+    max_price=None,
+):
+    """Bygger WHERE-villkor och parametrar för sökning bland annonser"""
+    conditions = []
+    values = []
+
+    if query:
+        conditions.append("search_vector @@ websearch_to_tsquery('swedish', %s)")
+        values.append(query)
+    if category_id is not None:
+        conditions.append("category_id = %s")
+        values.append(category_id)
+    if region is not None:
+        conditions.append("region = %s")
+        values.append(region)
+    if listing_type is not None:
+        conditions.append("listing_type = %s")
+        values.append(listing_type)
+    if status is not None:
+        conditions.append("status = %s")
+        values.append(status)
+    if min_price is not None:
+        conditions.append("price >= %s")
+        values.append(min_price)
+    if max_price is not None:
+        conditions.append("price <= %s")
+        values.append(max_price)
+
+    return conditions, values
+
+
+def search_listings(connection, query=None, after=None, limit=None, **filters):
+    """
+    Söker annonser med filter och fritext i titel och beskrivning.
+    Med fritext sorteras träffarna på relevans, annars nyast först.
+    """
+    limit = pagination.page_size(limit)
+    conditions, values = listing_search_filters(query, **filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    if query:
+        # rank som float8 så att värdet i cursorn jämförs exakt med nästa sida
+        order_column = "rank"
+        seek, seek_values = pagination.seek_clause("rank", after)
+        sql = f"""
+            SELECT * FROM (
+                SELECT {LISTING_COLUMNS},
+                    ts_rank_cd(search_vector, websearch_to_tsquery('swedish', %s))::float8 AS rank
+                FROM listings
+                {where}
+            ) AS ranked
+            {seek}
+            ORDER BY rank DESC, id DESC
+            LIMIT %s
+        """
+        values = [query, *values, *seek_values, limit + 1]
+    else:
+        order_column = "created_at"
+        seek, seek_values = pagination.seek_condition("created_at", after)
+        if seek:
+            conditions.append(seek)
+            where = f"WHERE {' AND '.join(conditions)}"
+        sql = f"""
+            SELECT {LISTING_COLUMNS} FROM listings
+            {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """
+        values = [*values, *seek_values, limit + 1]
+
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, values)
+            listings = fetch_rows(cursor)
+    return pagination.next_page(listings, limit, order_column)
+
+
+def get_listing_facets(connection, query=None, **filters):
+    """Räknar träffar per kategori och region för samma filter som search_listings"""
+    conditions, values = listing_search_filters(query, **filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with connection:
+        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                f"""
+                SELECT category_id, region, COUNT(*) AS count
+                FROM listings
+                {where}
+                GROUP BY GROUPING SETS ((category_id), (region))
+                ORDER BY count DESC
+            """,
+                values,
+            )
+            rows = cursor.fetchall()
+
+    return {
+        "categories": [
+            {"category_id": row["category_id"], "count": row["count"]}
+            for row in rows
+            if row["category_id"] is not None
+        ],
+        "regions": [
+            {"region": row["region"], "count": row["count"]}
+            for row in rows
+            if row["region"] is not None
+        ],
+    }
+
+
 # Listings Watch list function
 def get_all_watched_listings(connection, user_id):
     """Hämtar alla bevakade annonser för en användare"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_all_watched_listings",
                 """
                 SELECT * FROM listings_watch_list 
                 WHERE user_id = %s
@@ -692,7 +1330,9 @@ def add_to_watch_list(connection, user_id, listing_id):
     """Lägger till annons i bevakningslista"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "add_to_watch_list",
                 """
                 INSERT INTO listings_watch_list (user_id, listing_id)
                 VALUES (%s, %s) 
@@ -701,6 +1341,7 @@ def add_to_watch_list(connection, user_id, listing_id):
                 (user_id, listing_id),
             )
             new_watch = cursor.fetchone()
+            events.publish(cursor, user_id, "watch", {"listing_id": listing_id})
     return new_watch
 
 
@@ -708,7 +1349,9 @@ def remove_from_watch_list(connection, user_id, listing_id):
     """Tar bort annons från bevakningslista"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "remove_from_watch_list",
                 """
                 DELETE FROM listings_watch_list 
                 WHERE user_id = %s AND listing_id = %s 
@@ -717,6 +1360,8 @@ def remove_from_watch_list(connection, user_id, listing_id):
                 (user_id, listing_id),
             )
             deleted_watch = cursor.fetchone()
+            if deleted_watch:
+                events.publish(cursor, user_id, "unwatch", {"listing_id": listing_id})
 
     if not deleted_watch:
         raise ValueError("Annons fanns inte i bevakningslistan")
@@ -725,44 +1370,224 @@ def remove_from_watch_list(connection, user_id, listing_id):
 
 
 # Message function
-def get_all_messages_for_user(connection, user_id):
-    """Hämtar alla meddelanden för en användare"""
-    with connection:
-        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+def get_all_messages_for_user(connection, user_id, after=None, limit=None):
+    """Hämtar meddelanden för en användare, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    conditions = ["(sender_id = %s OR recipient_id = %s)"]
+    seek, params = pagination.seek_condition("created_at", after)
+    if seek:
+        conditions.append(seek)
+    with connection:
+        with connection.cursor() as cursor:
             cursor.execute(
-                """
-                SELECT * FROM messages 
-                WHERE sender_id = %s OR recipient_id = %s 
-                ORDER BY created_at DESC
+                f"""
+                SELECT * FROM messages
+                WHERE {' AND '.join(conditions)}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
             """,
-                (user_id, user_id),
+                (user_id, user_id, *params, limit + 1),
             )
-            messages = cursor.fetchall()
-    return messages
+            messages = fetch_rows(cursor)
+    return pagination.next_page(messages, limit, "created_at")
+
+
+def message_threads_query(condition):
+    """
+    SELECT som räknar fram message_threads-rader från messages: en rad per
+    användare, motpart och annons med senaste meddelandet och antal olästa.
+    condition filtrerar på user_id, partner_id och listing_id och flyttas in i
+    båda grenarna av UNION ALL, så att indexen på messages används.
+    """
+    return f"""
+        SELECT DISTINCT ON (user_id, partner_id, listing_id)
+            user_id,
+            partner_id,
+            listing_id,
+            id AS last_message_id,
+            sender_id AS last_sender_id,
+            message_text AS last_message,
+            created_at AS last_message_at,
+            COUNT(*) FILTER (WHERE recipient_id = user_id AND is_read = FALSE)
+                OVER (PARTITION BY user_id, partner_id, listing_id) AS unread_count
+        FROM (
+            SELECT sender_id AS user_id, recipient_id AS partner_id, listing_id, id,
+                   sender_id, recipient_id, message_text, created_at, is_read
+            FROM messages
+            UNION ALL
+            SELECT recipient_id, sender_id, listing_id, id,
+                   sender_id, recipient_id, message_text, created_at, is_read
+            FROM messages
+            WHERE recipient_id <> sender_id
+        ) AS own_messages
+        WHERE {condition}
+        ORDER BY user_id, partner_id, listing_id, created_at DESC, id DESC
+    """
+
+
+# Nyare än trådens senaste meddelande, enligt inkorgens sortering
+_NEWER_MESSAGE = """
+    (EXCLUDED.last_message_at, EXCLUDED.last_message_id)
+        > (message_threads.last_message_at, message_threads.last_message_id)
+"""
 
+# Uppdaterar avsändarens och mottagarens rad i message_threads i samma
+# transaktion som meddelandet skrivs, så att inkorgen inte behöver läsa hela
+# meddelandehistoriken. Raderna skrivs i user_id-ordning så att två meddelanden
+# åt var sitt håll i samma tråd inte kan ge deadlock, och ett meddelande som
+# committas efter ett nyare ersätter inte det senaste
+ADD_MESSAGE_TO_THREADS = f"""
+    INSERT INTO message_threads (
+        user_id, partner_id, listing_id, last_message_id, last_sender_id,
+        last_message, last_message_at, unread_count
+    )
+    SELECT sides.user_id, sides.partner_id, messages.listing_id, messages.id,
+           messages.sender_id, messages.message_text, messages.created_at,
+           sides.unread_count
+    FROM messages
+    CROSS JOIN LATERAL (
+        VALUES (messages.sender_id, messages.recipient_id, 0),
+               (messages.recipient_id, messages.sender_id, 1)
+    ) AS sides (user_id, partner_id, unread_count)
+    WHERE messages.id = %s
+      AND (sides.unread_count = 1 OR messages.sender_id <> messages.recipient_id)
+    ORDER BY sides.user_id
+    ON CONFLICT (user_id, partner_id, listing_id) DO UPDATE SET
+        last_message_id = CASE WHEN {_NEWER_MESSAGE}
+            THEN EXCLUDED.last_message_id ELSE message_threads.last_message_id END,
+        last_sender_id = CASE WHEN {_NEWER_MESSAGE}
+            THEN EXCLUDED.last_sender_id ELSE message_threads.last_sender_id END,
+        last_message = CASE WHEN {_NEWER_MESSAGE}
+            THEN EXCLUDED.last_message ELSE message_threads.last_message END,
+        last_message_at = CASE WHEN {_NEWER_MESSAGE}
+            THEN EXCLUDED.last_message_at ELSE message_threads.last_message_at END,
+        unread_count = message_threads.unread_count + EXCLUDED.unread_count
+"""
+
+READ_MESSAGE_IN_THREAD = """
+    UPDATE message_threads SET unread_count = GREATEST(unread_count - 1, 0)
+    WHERE user_id = %s AND partner_id = %s AND listing_id = %s
+"""
+
+# Efter en radering räknas trådens rader om från messages, bara den trådens
+# meddelanden läses. Parametrar: listing_id och de två användarna två gånger
+DELETE_THREAD = """
+    DELETE FROM message_threads
+    WHERE listing_id = %s AND user_id IN (%s, %s) AND partner_id IN (%s, %s)
+"""
+
+REBUILD_THREAD = f"""
+    INSERT INTO message_threads (
+        user_id, partner_id, listing_id, last_message_id, last_sender_id,
+        last_message, last_message_at, unread_count
+    )
+    {message_threads_query(
+        "listing_id = %s AND user_id IN (%s, %s) AND partner_id IN (%s, %s)"
+    )}
+"""
 
-def get_conversation(connection, user1_id, user2_id):
-    """Hämtar konversation mellan två användare"""
+
+def recompute_message_threads(connection):
+    """
+    Bygger om message_threads från messages, efter bulkladdning eller för
+    reparation. Meddelanden låses för skrivning under tiden. Returnerar antal trådar.
+    """
     with connection:
-        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+        with connection.cursor() as cursor:
+            cursor.execute("LOCK TABLE messages IN SHARE MODE")
+            cursor.execute("DELETE FROM message_threads")
             cursor.execute(
-                """
-                SELECT * FROM messages 
-                WHERE (sender_id = %s AND recipient_id = %s) 
-                   OR (sender_id = %s AND recipient_id = %s)
-                ORDER BY created_at ASC
+                f"""
+                INSERT INTO message_threads (
+                    user_id, partner_id, listing_id, last_message_id, last_sender_id,
+                    last_message, last_message_at, unread_count
+                )
+                {message_threads_query("TRUE")}
+            """
+            )
+            return cursor.rowcount
+
+
+def inbox_query(user_id, after, limit):
+    """
+    Returnerar (sql, parametrar) för inkorgen: en sida av användarens rader i
+    message_threads, som läses med indexet på (user_id, last_message_at,
+    last_message_id) oavsett hur många meddelanden användaren har. Delas med async_db.
+    """
+    seek, params = pagination.seek_condition(
+        "last_message_at", after, id_column="last_message_id"
+    )
+    conditions = ["user_id = %s"]
+    if seek:
+        conditions.append(seek)
+    sql = f"""
+        SELECT partner_id, listing_id, last_message_id, last_sender_id,
+               last_message, last_message_at, unread_count
+        FROM message_threads
+        WHERE {' AND '.join(conditions)}
+        ORDER BY last_message_at DESC, last_message_id DESC
+        LIMIT %s
+    """
+    return sql, [user_id, *params, limit + 1]
+
+
+def get_inbox(connection, user_id, after=None, limit=None):
+    """Hämtar användarens konversationer, en sida i taget (senast aktiv först)"""
+    limit = pagination.page_size(limit)
+    sql, params = inbox_query(user_id, after, limit)
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            threads = fetch_rows(cursor)
+    return pagination.next_page(
+        threads, limit, "last_message_at", id_column="last_message_id"
+    )
+
+
+def get_unread_message_count(connection, user_id):
+    """Hämtar antal olästa meddelanden för en användare"""
+    with connection:
+        with connection.cursor() as cursor:
+            queries.execute(
+                cursor,
+                "get_unread_message_count",
+                "SELECT COUNT(*) FROM messages WHERE recipient_id = %s AND is_read = FALSE",
+                (user_id,),
+            )
+            return cursor.fetchone()[0]
+
+
+def get_conversation(connection, user1_id, user2_id, after=None, limit=None):
+    """Hämtar konversation mellan två användare, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    conditions = [
+        "((sender_id = %s AND recipient_id = %s) OR (sender_id = %s AND recipient_id = %s))"
+    ]
+    seek, params = pagination.seek_condition("created_at", after)
+    if seek:
+        conditions.append(seek)
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT * FROM messages
+                WHERE {' AND '.join(conditions)}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
             """,
-                (user1_id, user2_id, user2_id, user1_id),
+                (user1_id, user2_id, user2_id, user1_id, *params, limit + 1),
             )
-            conversation = cursor.fetchall()
-    return conversation
+            conversation = fetch_rows(cursor)
+    return pagination.next_page(conversation, limit, "created_at")
 
 
 def create_message(connection, sender_id, recipient_id, listing_id, message_text):
     """Skapar ett nytt meddelande"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_message",
                 """
                 INSERT INTO messages (sender_id, recipient_id, listing_id, message_text)
                 VALUES (%s, %s, %s, %s) 
@@ -771,6 +1596,13 @@ def create_message(connection, sender_id, recipient_id, listing_id, message_text
                 (sender_id, recipient_id, listing_id, message_text),
             )
             new_message = cursor.fetchone()
+            queries.execute(
+                cursor,
+                "add_message_to_threads",
+                ADD_MESSAGE_TO_THREADS,
+                (new_message["id"],),
+            )
+            events.publish(cursor, recipient_id, "message", new_message)
     return new_message
 
 
@@ -778,16 +1610,32 @@ def mark_message_as_read(connection, message_id):
     """Markerar ett meddelande som läst"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "mark_message_as_read",
                 """
-                UPDATE messages 
-                SET is_read = TRUE 
-                WHERE id = %s 
-                RETURNING *
+                UPDATE messages
+                SET is_read = TRUE
+                FROM (SELECT id, is_read FROM messages WHERE id = %s FOR UPDATE) AS previous
+                WHERE messages.id = previous.id
+                RETURNING messages.*, previous.is_read AS was_read
             """,
                 (message_id,),
             )
             updated_message = cursor.fetchone()
+            if not updated_message:
+                raise ValueError(f"Meddelande med id {message_id} finns inte")
+            if updated_message.pop("was_read") is False:
+                queries.execute(
+                    cursor,
+                    "read_message_in_thread",
+                    READ_MESSAGE_IN_THREAD,
+                    (
+                        updated_message["recipient_id"],
+                        updated_message["sender_id"],
+                        updated_message["listing_id"],
+                    ),
+                )
     return updated_message
 
 
@@ -795,10 +1643,18 @@ def delete_message(connection, message_id):
     """Raderar ett meddelande"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "DELETE FROM messages WHERE id = %s RETURNING *", (message_id,)
+            queries.execute(
+                cursor,
+                "delete_message",
+                "DELETE FROM messages WHERE id = %s RETURNING *",
+                (message_id,),
             )
             deleted_message = cursor.fetchone()
+            if deleted_message:
+                users = (deleted_message["sender_id"], deleted_message["recipient_id"])
+                thread = (deleted_message["listing_id"], *users, *users)
+                queries.execute(cursor, "delete_thread", DELETE_THREAD, thread)
+                queries.execute(cursor, "rebuild_thread", REBUILD_THREAD, thread)
 
     if not deleted_message:
         raise ValueError(f"Meddelande med id {message_id} finns inte")
@@ -807,21 +1663,34 @@ def delete_message(connection, message_id):
 
 
 # Transaction function
-def get_all_transactions(connection):
-    """Hämtar alla transaktioner"""
+def get_all_transactions(connection, after=None, limit=None):
+    """Hämtar alla transaktioner, en sida i taget (nyast först)"""
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("created_at", after)
     with connection:
-        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM transactions")
-            transactions = cursor.fetchall()
-    return transactions
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT * FROM transactions
+                {seek}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """,
+                (*params, limit + 1),
+            )
+            transactions = fetch_rows(cursor)
+    return pagination.next_page(transactions, limit, "created_at")
 
 
 def get_transaction_by_id(connection, transaction_id):
     """Hämtar en specifik transaktion"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "SELECT * FROM transactions WHERE id = %s", (transaction_id,)
+            queries.execute(
+                cursor,
+                "get_transaction_by_id",
+                "SELECT * FROM transactions WHERE id = %s",
+                (transaction_id,),
             )
             transaction = cursor.fetchone()
 
@@ -835,7 +1704,9 @@ def get_transactions_by_user_id(connection, user_id):
     """Hämtar alla transaktioner för en användare"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_transactions_by_user_id",
                 """
                 SELECT id, user_id, bid_id, listing_id, status, amount
                 FROM transactions 
@@ -851,7 +1722,9 @@ def create_transaction(connection, user_id, listing_id, amount, status, bid_id=N
     """Skapar en ny transaktion"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_transaction",
                 """
                 INSERT INTO transactions (user_id, listing_id, amount, status, bid_id) 
                 VALUES (%s, %s, %s, %s, %s) 
@@ -867,7 +1740,9 @@ def update_transaction(connection, transaction_id, new_status):
     """Uppdaterar status på en transaktion"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "update_transaction",
                 """
                 UPDATE transactions 
                 SET status = COALESCE(%s, status)
@@ -887,21 +1762,37 @@ def update_transaction(connection, transaction_id, new_status):
 # Payment function
 
 
-def get_all_payments(connection):
-    """Hämtar alla betalningar"""
+def get_all_payments(connection, after=None, limit=None):
+    """
+    Hämtar alla betalningar, en sida i taget (senast skapade först). Sorteras på
+    id eftersom paid_at kan vara NULL och inte fungerar som cursor.
+    """
+    limit = pagination.page_size(limit)
+    seek, params = pagination.seek_clause("id", after)
     with connection:
-        with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM payments ORDER BY paid_at DESC")
-            payments = cursor.fetchall()
-    return payments
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT * FROM payments
+                {seek}
+                ORDER BY id DESC
+                LIMIT %s
+            """,
+                (*params, limit + 1),
+            )
+            payments = fetch_rows(cursor)
+    return pagination.next_page(payments, limit, "id")
 
 
 def get_payment_by_transaction_id(connection, transaction_id):
     """Hämtar betalning för en transaktion"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "SELECT * FROM payments WHERE transaction_id = %s", (transaction_id,)
+            queries.execute(
+                cursor,
+                "get_payment_by_transaction_id",
+                "SELECT * FROM payments WHERE transaction_id = %s",
+                (transaction_id,),
             )
             payment = cursor.fetchone()
 
@@ -917,7 +1808,9 @@ def create_payment(
     """Skapar en ny betalning"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_payment",
                 """
                 INSERT INTO payments (transaction_id, listing_id, payment_method, payment_status, amount)
                 VALUES (%s, %s, %s, %s, %s) 
@@ -933,7 +1826,9 @@ def update_payment_status(connection, payment_id, new_status):
     """Uppdaterar betalningsstatus"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "update_payment_status",
                 """
                 UPDATE payments 
                 SET payment_status = %s 
@@ -957,7 +1852,12 @@ def get_notifications_by_user_id(connection, user_id):
     """Hämtar alla notifieringar för en användare"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("SELECT * FROM notifications WHERE user_id = %s", (user_id,))
+            queries.execute(
+                cursor,
+                "get_notifications_by_user_id",
+                "SELECT * FROM notifications WHERE user_id = %s",
+                (user_id,),
+            )
             notifications = cursor.fetchall()
     return notifications
 
@@ -966,7 +1866,9 @@ def get_unread_notifications(connection, user_id):
     """Hämtar olästa notifieringar för en användare"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_unread_notifications",
                 """
                 SELECT * FROM notifications
                 WHERE user_id = %s AND is_read = FALSE
@@ -983,7 +1885,9 @@ def create_notification(
     """Skapar en ny notifiering"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_notification",
                 """
                 INSERT INTO notifications (user_id, listing_id, notification_type, notification_message) 
                 VALUES (%s, %s, %s, %s)
@@ -992,14 +1896,84 @@ def create_notification(
                 (user_id, listing_id, notification_type, notification_message),
             )
             new_notification = cursor.fetchone()
+            events.publish(cursor, user_id, "notification", new_notification)
     return new_notification
 
 
+def notify_watchers(connection, fanout_events):
+    """
+    Skapar en notis till varje bevakare av annonsen för varje händelse
+    (listing_id, notification_type, notification_message). Alla händelser skrivs
+    med en INSERT ... SELECT mot listings_watch_list. Varje händelse med
+    bevakare skickas som en enda live-händelse för annonsen, som events.py
+    delar ut till bevakarna med öppna strömmar. Returnerar antal notiser.
+    """
+    if not fanout_events:
+        return 0
+    listing_ids, notification_types, notification_messages = zip(*fanout_events)
+    payloads = [
+        events.watcher_payload(
+            listing_id,
+            "notification",
+            {
+                "listing_id": listing_id,
+                "notification_type": notification_type,
+                "notification_message": notification_message,
+            },
+        )
+        for listing_id, notification_type, notification_message in fanout_events
+    ]
+    with connection:
+        with connection.cursor() as cursor:
+            queries.execute(
+                cursor,
+                "notify_watchers",
+                """
+                WITH fanout AS (
+                    SELECT * FROM unnest(%s::bigint[], %s::text[], %s::text[], %s::text[])
+                        AS fanout (listing_id, notification_type, notification_message,
+                                   payload)
+                ),
+                inserted AS (
+                    INSERT INTO notifications
+                        (user_id, listing_id, notification_type, notification_message)
+                    SELECT watchers.user_id, fanout.listing_id,
+                           fanout.notification_type, fanout.notification_message
+                    FROM fanout
+                    JOIN listings_watch_list AS watchers
+                        ON watchers.listing_id = fanout.listing_id
+                    RETURNING 1
+                )
+                SELECT
+                    (SELECT COUNT(*) FROM inserted),
+                    (
+                        SELECT COUNT(pg_notify(%s, fanout.payload))
+                        FROM fanout
+                        WHERE EXISTS (
+                            SELECT 1 FROM listings_watch_list AS watchers
+                            WHERE watchers.listing_id = fanout.listing_id
+                        )
+                    )
+            """,
+                (
+                    list(listing_ids),
+                    list(notification_types),
+                    list(notification_messages),
+                    payloads,
+                    events.EVENTS_CHANNEL,
+                ),
+            )
+            created = cursor.fetchone()[0]
+    return created
+
+
 def mark_all_notifications_as_read(connection, user_id):
     """Markerar alla notifieringar som lästa"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "mark_all_notifications_as_read",
                 """
                 UPDATE notifications
                 SET is_read = TRUE 
@@ -1016,7 +1990,9 @@ def delete_notification(connection, notification_id):
     """Raderar en notifiering"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "delete_notification",
                 "DELETE FROM notifications WHERE id = %s RETURNING *",
                 (notification_id,),
             )
@@ -1033,7 +2009,9 @@ def get_comments_by_listing_id(connection, listing_id):
     """Hämtar alla kommentarer för en annons"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_comments_by_listing_id",
                 """
                 SELECT id, user_id, listing_id, comment_text, answer_text
                 FROM listing_comments
@@ -1049,8 +2027,11 @@ def get_comments_by_user_id(connection, user_id):
     """Hämtar alla kommentarer från en användare"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "SELECT * FROM listing_comments WHERE user_id = %s", (user_id,)
+            queries.execute(
+                cursor,
+                "get_comments_by_user_id",
+                "SELECT * FROM listing_comments WHERE user_id = %s",
+                (user_id,),
             )
             comments = cursor.fetchall()
     return comments
@@ -1060,7 +2041,9 @@ def create_listing_comment(connection, user_id, listing_id, comment_text):
     """Skapar en ny kommentar"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_listing_comment",
                 """
                 INSERT INTO listing_comments (user_id, listing_id, comment_text) 
                 VALUES (%s, %s, %s)
@@ -1076,7 +2059,9 @@ def answer_comment(connection, comment_id, answer_text):
     """Svarar på en kommentar"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "answer_comment",
                 """
                 UPDATE listing_comments 
                 SET answer_text = %s, answered_at = CURRENT_TIMESTAMP
@@ -1097,8 +2082,11 @@ def delete_listing_comment(connection, comment_id):
     """Raderar en kommentar"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                "DELETE FROM listing_comments WHERE id = %s RETURNING *", (comment_id,)
+            queries.execute(
+                cursor,
+                "delete_listing_comment",
+                "DELETE FROM listing_comments WHERE id = %s RETURNING *",
+                (comment_id,),
             )
             deleted_comment = cursor.fetchone()
 
@@ -1115,7 +2103,9 @@ def get_shipping_by_listing_id(connection, listing_id):
     """Hämtar fraktdetaljer för en annons"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "get_shipping_by_listing_id",
                 """
                 SELECT id, listing_id, shipping_method, shipping_cost, estimated_delivery_days, tracking_number, status, shipped_at
                 FROM shipping_details 
@@ -1141,7 +2131,9 @@ def create_shipping_details(
     """Skapar fraktdetaljer"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "create_shipping_details",
                 """
                 INSERT INTO shipping_details (user_id, listing_id, shipping_method, shipping_cost, estimated_delivery_days, tracking_number, status, shipped_at) 
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
@@ -1168,7 +2160,9 @@ def update_shipping_tracking(
     """Uppdaterar spårningsinformation"""
     with connection:
         with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
+            queries.execute(
+                cursor,
+                "update_shipping_tracking",
                 """
                 UPDATE shipping_details 
                 SET tracking_number = COALESCE(%s, tracking_number),
@@ -1215,3 +2209,7 @@ def update_shipping_tracking(
 #             )
 #             item_id = cursor.fetchone()["id"]
 #     return item_id
+
+
+# Mäter alla funktioner ovan som tar en koppling, se metrics.py
+metrics.instrument(globals())
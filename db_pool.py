@@ -0,0 +1,349 @@
+import logging
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from dotenv import load_dotenv
+
+from db_setup import get_connection
+
+load_dotenv()
+
+"""
+Connection pool som ersätter en ny koppling per request.
+
+Kopplingar lånas ut med getconn() och lämnas tillbaka med putconn(),
+eller enklare med `with pool.connection() as connection:`.
+Inställningarna läses från miljövariabler (.env):
+
+- DB_POOL_MIN_SIZE: antal kopplingar som alltid hålls öppna
+- DB_POOL_MAX_SIZE: max antal kopplingar mot databasen
+- DB_POOL_TIMEOUT: sekunder att vänta på en ledig koppling
+- DB_POOL_MAX_IDLE: sekunder innan en oanvänd koppling stängs
+- DB_POOL_HEALTH_CHECK_AFTER: kör SELECT 1 på kopplingar som legat oanvända längre än så
+- DB_POOL_LEAK_TIMEOUT: sekunder innan en utlånad koppling loggas som läcka (0 = av)
+"""
+
+logger = logging.getLogger(__name__)
+
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))
+POOL_LEAK_TIMEOUT = float(os.getenv("DB_POOL_LEAK_TIMEOUT", "30"))
+POOL_REAP_INTERVAL = float(os.getenv("DB_POOL_REAP_INTERVAL", "10"))
+
+
+class PoolTimeoutError(Exception):
+    """Ingen ledig koppling inom timeout"""
+
+
+class ConnectionPool:
+    """Trådsäker pool av psycopg2-kopplingar"""
+
+    def __init__(
+        self,
+        connect=get_connection,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        timeout=POOL_TIMEOUT,
+        max_idle=POOL_MAX_IDLE,
+        health_check_after=POOL_HEALTH_CHECK_AFTER,
+        leak_timeout=POOL_LEAK_TIMEOUT,
+    ):
+        if min_size > max_size:
+            raise ValueError("min_size kan inte vara större än max_size")
+
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.leak_timeout = leak_timeout
+
+        self._condition = threading.Condition()
+        # Lediga kopplingar som (connection, tidpunkt då den lämnades tillbaka)
+        self._idle = []
+        # Utlånade kopplingar: id(connection) -> info om utlåningen
+        self._in_use = {}
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._reaper = None
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._connections_created = 0
+        self._connections_closed = 0
+        self._health_check_failures = 0
+        self._leaks_detected = 0
+
+    def open(self):
+        """Fyller poolen till min_size och startar städtråden"""
+        while True:
+            with self._condition:
+                if self._size >= self.min_size:
+                    break
+                self._size += 1
+            try:
+                connection = self._new_connection()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                raise
+            with self._condition:
+                self._idle.append((connection, time.monotonic()))
+                self._condition.notify()
+
+        if self._reaper is None and POOL_REAP_INTERVAL > 0:
+            self._reaper = threading.Thread(
+                target=self._reap_forever, name="db-pool-reaper", daemon=True
+            )
+            self._reaper.start()
+
+    def close(self):
+        """Stänger alla lediga kopplingar, utlånade stängs när de lämnas tillbaka"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+
+        for connection, _ in idle:
+            self._close_connection(connection)
+
+    def getconn(self):
+        """Lånar en koppling, väntar högst timeout sekunder"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        connection = None
+        idle_since = None
+
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("Poolen är stängd")
+                if self._idle:
+                    connection, idle_since = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Ingen ledig databaskoppling inom {self.timeout} sekunder"
+                    )
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        try:
+            if connection is None:
+                connection = self._new_connection()
+            elif not self._is_healthy(connection, idle_since):
+                self._close_connection(connection)
+                connection = self._new_connection()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+        waited = time.monotonic() - started
+        stack = traceback.extract_stack()[:-1] if self.leak_timeout > 0 else None
+
+        with self._condition:
+            self._in_use[id(connection)] = {
+                "connection": connection,
+                "checked_out_at": time.monotonic(),
+                "stack": stack,
+                "reported": False,
+            }
+            self._checkouts += 1
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+
+        return connection
+
+    def putconn(self, connection):
+        """Lämnar tillbaka en koppling till poolen"""
+        with self._condition:
+            if self._in_use.pop(id(connection), None) is None:
+                raise ValueError("Kopplingen tillhör inte poolen")
+
+        reusable = self._reset(connection)
+
+        with self._condition:
+            if reusable and not self._closed:
+                self._idle.append((connection, time.monotonic()))
+            else:
+                self._size -= 1
+            self._condition.notify()
+
+        if not reusable or self._closed:
+            self._close_connection(connection)
+
+    @contextmanager
+    def connection(self):
+        """Context manager som lånar och alltid lämnar tillbaka en koppling"""
+        connection = self.getconn()
+        try:
+            yield connection
+        finally:
+            self.putconn(connection)
+
+    def reap(self):
+        """Stänger kopplingar som legat oanvända för länge och loggar läckor"""
+        now = time.monotonic()
+        expired = []
+
+        with self._condition:
+            keep = []
+            # Äldst först, så att de mest nyligen använda kopplingarna blir kvar
+            for connection, idle_since in self._idle:
+                too_old = now - idle_since > self.max_idle
+                if too_old and self._size - len(expired) > self.min_size:
+                    expired.append(connection)
+                else:
+                    keep.append((connection, idle_since))
+            self._idle = keep
+            self._size -= len(expired)
+
+            leaks = []
+            if self.leak_timeout > 0:
+                for info in self._in_use.values():
+                    held = now - info["checked_out_at"]
+                    if held > self.leak_timeout and not info["reported"]:
+                        info["reported"] = True
+                        self._leaks_detected += 1
+                        leaks.append((held, info["stack"]))
+            self._condition.notify_all()
+
+        for connection in expired:
+            self._close_connection(connection)
+
+        for held, stack in leaks:
+            logger.warning(
+                "Databaskoppling har varit utlånad i %.1f sekunder, möjlig läcka. "
+                "Lånades av:\n%s",
+                held,
+                "".join(traceback.format_list(stack or [])),
+            )
+
+    def stats(self):
+        """Returnerar mätvärden för poolen"""
+        with self._condition:
+            in_use = len(self._in_use)
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": in_use,
+                "waiting": self._waiting,
+                "saturation": round(in_use / self.max_size, 3),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_time_avg_ms": round(
+                    1000 * self._wait_time_total / max(self._checkouts, 1), 3
+                ),
+                "wait_time_max_ms": round(1000 * self._wait_time_max, 3),
+                "connections_created": self._connections_created,
+                "connections_closed": self._connections_closed,
+                "health_check_failures": self._health_check_failures,
+                "leaks_detected": self._leaks_detected,
+            }
+
+    def _new_connection(self):
+        connection = self._connect()
+        with self._condition:
+            self._connections_created += 1
+        return connection
+
+    def _close_connection(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self._condition:
+            self._connections_closed += 1
+
+    def _is_healthy(self, connection, idle_since):
+        """Billig kontroll vid varje utlåning, SELECT 1 om kopplingen legat länge"""
+        healthy = (
+            not connection.closed
+            and connection.get_transaction_status()
+            == extensions.TRANSACTION_STATUS_IDLE
+        )
+        if healthy and time.monotonic() - idle_since > self.health_check_after:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                connection.rollback()
+            except psycopg2.Error:
+                healthy = False
+
+        if not healthy:
+            with self._condition:
+                self._health_check_failures += 1
+        return healthy
+
+    def _reset(self, connection):
+        """Avslutar eventuell öppen transaktion, False om kopplingen är trasig"""
+        if connection.closed:
+            return False
+        status = connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _reap_forever(self):
+        while not self._closed:
+            time.sleep(POOL_REAP_INTERVAL)
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("Fel vid städning av connection pool")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returnerar den gemensamma poolen, skapas vid första anropet"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool()
+                pool.open()
+                _pool = pool
+    return _pool
+
+
+def close_pool():
+    """Stänger den gemensamma poolen"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
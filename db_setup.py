@@ -1,7 +1,13 @@
 import os
+import sys
+
 import psycopg2
 from dotenv import load_dotenv
 
+import db
+import metrics
+import migrations
+
 load_dotenv()
 # Koppling till databas
 DATABASE_NAME = os.getenv("DATABASE_NAME")
@@ -21,6 +27,8 @@ def get_connection():
         password=PASSWORD,
         host="localhost",  # change if needed
         port="5432",  # change if needed
+        # Loggar långsamma frågor, se metrics.py
+        connection_factory=metrics.InstrumentedConnection,
     )
 
 
@@ -259,7 +267,48 @@ def create_tables():
         connection.close()
 
 
+def run_migrations(dry_run=False):
+    """
+    Runs the versioned migrations in migrations.py (indexes etc.)
+    that have not been applied to the database yet
+    """
+    connection = get_connection()
+    try:
+        applied = migrations.migrate(connection, dry_run=dry_run)
+    finally:
+        connection.close()
+    return applied
+
+
+def recompute_user_ratings():
+    """
+    Rebuilds user_ratings from the reviews table in one pass,
+    used to repair ratings that have drifted
+    """
+    connection = get_connection()
+    try:
+        changed = db.recompute_user_ratings(connection)
+    finally:
+        connection.close()
+    return changed
+
+
 if __name__ == "__main__":
     # Only reason to execute this file would be to create new tables, meaning it serves a migration file
-    create_tables()
-    print("Tables created successfully.")
+    # python db_setup.py              -> create tables and apply migrations
+    # python db_setup.py migrate      -> apply migrations only
+    # python db_setup.py migrate --dry-run -> print pending migrations
+    # python db_setup.py recompute-ratings -> rebuild user_ratings from reviews
+    args = sys.argv[1:]
+    if "recompute-ratings" in args:
+        print(f"{recompute_user_ratings()} rating(s) updated.")
+        sys.exit()
+    dry_run = "--dry-run" in args
+    if "migrate" not in args:
+        create_tables()
+        print("Tables created successfully.")
+    applied = run_migrations(dry_run=dry_run)
+    if dry_run:
+        print(f"Dry run, {len(applied)} migration(s) pending.")
+    else:
+        print(f"{len(applied)} migration(s) applied.")
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import os
+import threading
+from decimal import Decimal
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+"""
+Live-händelser per användare (notiser, meddelanden, överbjudna bud) som
+Server-Sent Events.
+
+Skrivningarna i db.py och async_db.py anropar publish() / publish_async() i
+samma transaktion, som skickar NOTIFY på EVENTS_CHANNEL. Varje worker tar emot
+kanalen på pg_listeners enda delade koppling och delar ut händelsen till
+användarens öppna strömmar via asyncio-köer. En prenumerant kostar alltså ingen
+egen databaskoppling.
+
+Notiser till bevakare av en annons (notify_watchers) skickas som en enda NOTIFY
+per annons och händelse, inte en per bevakare. Brokern vet vilka annonser
+användarna med öppna strömmar bevakar (hämtas när strömmen öppnas och hålls
+aktuell med watch/unwatch-händelser) och delar ut händelsen till dem. Den har
+annonsen, typen och meddelandet men inte notisens id, som finns i /notifications.
+
+- EVENTS_QUEUE_SIZE: max antal olevererade händelser per ström, äldre kastas
+- EVENTS_HEARTBEAT: sekunder mellan keep-alive-kommentarer i strömmen
+"""
+
+EVENTS_CHANNEL = "user_events"
+
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+
+# NOTIFY-payload får vara högst 8000 bytes
+MAX_PAYLOAD_BYTES = 7900
+
+
+def _json_default(value):
+    """Samma format som API-svaren: ISO-datum och decimaltal som tal"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _payload(user_id, event_type, data):
+    payload = json.dumps(
+        {"user_id": user_id, "type": event_type, "data": data}, default=_json_default
+    )
+    if len(payload.encode()) > MAX_PAYLOAD_BYTES:
+        # För stor rad, klienten får hämta resten själv
+        payload = json.dumps(
+            {"user_id": user_id, "type": event_type, "data": {"id": data["id"]}}
+        )
+    return payload
+
+
+def watcher_payload(listing_id, event_type, data):
+    """Payload för en händelse till alla med öppen ström som bevakar annonsen"""
+    payload = json.dumps(
+        {"listing_id": listing_id, "type": event_type, "data": data},
+        default=_json_default,
+    )
+    if len(payload.encode()) > MAX_PAYLOAD_BYTES:
+        data = {
+            key: value for key, value in data.items() if key != "notification_message"
+        }
+        payload = json.dumps(
+            {"listing_id": listing_id, "type": event_type, "data": data},
+            default=_json_default,
+        )
+    return payload
+
+
+def publish(cursor, user_id, event_type, data):
+    """Skickar en händelse till användaren, levereras först vid commit"""
+    cursor.execute(
+        "SELECT pg_notify(%s, %s)",
+        (EVENTS_CHANNEL, _payload(user_id, event_type, data)),
+    )
+
+
+def publish_local(user_id, event_type, data):
+    """Som publish() men levereras direkt i processen, för memory_db utan NOTIFY"""
+    _broker.handle_notification(_payload(user_id, event_type, data))
+
+
+def publish_watchers_local(listing_id, event_type, data):
+    """Som publish_local() men till annonsens bevakare, se watcher_payload()"""
+    _broker.handle_notification(watcher_payload(listing_id, event_type, data))
+
+
+async def publish_async(connection, user_id, event_type, data):
+    """Som publish() men för en asyncpg-koppling"""
+    await connection.execute(
+        "SELECT pg_notify($1, $2)",
+        EVENTS_CHANNEL,
+        _payload(user_id, event_type, data),
+    )
+
+
+class EventBroker:
+    """Håller öppna strömmar per användare och delar ut händelser till dem"""
+
+    def __init__(self, queue_size=EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        # Bara användare med öppna strömmar: annons -> bevakare och tvärtom
+        self._watchers = {}
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._delivered = 0
+        self._dropped = 0
+
+    def subscribe(self, user_id, watched_listing_ids=()):
+        """
+        Registrerar en ström, måste anropas i event loopen som läser kön.
+        watched_listing_ids är annonserna användaren bevakar just nu.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add((loop, queue))
+            for listing_id in watched_listing_ids:
+                self._watch(user_id, listing_id)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id, set())
+            subscribers.difference_update(
+                {entry for entry in subscribers if entry[1] is queue}
+            )
+            if not subscribers:
+                self._subscribers.pop(user_id, None)
+                for listing_id in list(self._watched.get(user_id, ())):
+                    self._unwatch(user_id, listing_id)
+
+    def handle_notification(self, payload):
+        """Anropas i lyssnartråden för varje NOTIFY på EVENTS_CHANNEL"""
+        event = json.loads(payload)
+        with self._lock:
+            if "listing_id" in event:
+                user_ids = list(self._watchers.get(event["listing_id"], ()))
+            else:
+                user_ids = [event["user_id"]]
+                self._track_watch_list(event)
+            subscribers = [
+                entry
+                for user_id in user_ids
+                for entry in self._subscribers.get(user_id, ())
+            ]
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._offer, queue, event)
+
+    def _track_watch_list(self, event):
+        """Håller bevakningarna aktuella för användare med öppna strömmar"""
+        user_id = event["user_id"]
+        if user_id not in self._subscribers:
+            return
+        if event["type"] == "watch":
+            self._watch(user_id, event["data"]["listing_id"])
+        elif event["type"] == "unwatch":
+            self._unwatch(user_id, event["data"]["listing_id"])
+
+    def _watch(self, user_id, listing_id):
+        self._watchers.setdefault(listing_id, set()).add(user_id)
+        self._watched.setdefault(user_id, set()).add(listing_id)
+
+    def _unwatch(self, user_id, listing_id):
+        watchers = self._watchers.get(listing_id, set())
+        watchers.discard(user_id)
+        if not watchers:
+            self._watchers.pop(listing_id, None)
+        watched = self._watched.get(user_id, set())
+        watched.discard(listing_id)
+        if not watched:
+            self._watched.pop(user_id, None)
+
+    def _offer(self, queue, event):
+        if queue.full():
+            # Långsam klient: släng den äldsta hellre än att blockera de andra
+            queue.get_nowait()
+            self._dropped += 1
+        queue.put_nowait(event)
+        self._delivered += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._subscribers),
+                "streams": sum(len(queues) for queues in self._subscribers.values()),
+                "watched_listings": len(self._watchers),
+                "delivered": self._delivered,
+                "dropped": self._dropped,
+            }
+
+
+_broker = EventBroker()
+
+
+def get_broker():
+    return _broker
+
+
+def listen_for_events(listener):
+    """Kopplar brokern till en pg_listener.PgListener"""
+    listener.subscribe(EVENTS_CHANNEL, _broker.handle_notification)
+
+
+def format_event(event):
+    """Formaterar en händelse enligt text/event-stream"""
+    data = json.dumps(event["data"])
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+
+async def stream(user_id, watched_listing_ids=()):
+    """
+    Asynkron generator för StreamingResponse. Skickar en kommentar var
+    EVENTS_HEARTBEAT sekund så att proxies inte stänger en tyst ström.
+    När klienten kopplar ner avbryter eller stänger StreamingResponse
+    generatorn, och prenumerationen tas bort i finally. Generatorn läser inte
+    själv från receive, där lyssnar StreamingResponse redan efter http.disconnect.
+    watched_listing_ids är annonserna användaren bevakar när strömmen öppnas.
+    """
+    queue = _broker.subscribe(user_id, watched_listing_ids)
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        _broker.unsubscribe(user_id, queue)
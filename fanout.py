@@ -0,0 +1,170 @@
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import repository
+
+load_dotenv()
+
+"""
+Buffrad utskick av notiser till alla som bevakar en annons.
+
+Händelser (listing_id, typ, meddelande) läggs i en buffert i processen med
+add(). Flera händelser av samma typ för samma annons inom ett fönster slås ihop
+till den senaste, så en annons som ändras tio gånger i rad ger en notis per
+bevakare istället för tio. Bufferten skrivs med repositoryts notify_watchers,
+en sats för hela batchen, när den når FANOUT_BATCH_SIZE händelser eller när den
+äldsta händelsen väntat FANOUT_FLUSH_INTERVAL sekunder.
+
+- FANOUT_BATCH_SIZE: antal olika händelser som tvingar fram en skrivning
+- FANOUT_FLUSH_INTERVAL: sekunder en händelse högst väntar i bufferten
+"""
+
+logger = logging.getLogger(__name__)
+
+FANOUT_BATCH_SIZE = int(os.getenv("FANOUT_BATCH_SIZE", "500"))
+FANOUT_FLUSH_INTERVAL = float(os.getenv("FANOUT_FLUSH_INTERVAL", "1"))
+
+
+class FanoutBuffer:
+    """Trådsäker buffert som slår ihop och batchar notiser till bevakare"""
+
+    def __init__(
+        self,
+        write=None,
+        batch_size=FANOUT_BATCH_SIZE,
+        flush_interval=FANOUT_FLUSH_INTERVAL,
+    ):
+        self._write = write or _write_to_repository
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # (listing_id, typ) -> meddelande, ordningen bevaras
+        self._pending = {}
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+        self._events_received = 0
+        self._events_coalesced = 0
+        self._flushes = 0
+        self._notifications_written = 0
+        self._flush_errors = 0
+
+    def add(self, listing_id, notification_type, notification_message):
+        """Lägger en händelse i bufferten, skrivs senare av flush()"""
+        with self._condition:
+            key = (listing_id, notification_type)
+            self._events_received += 1
+            if key in self._pending:
+                self._events_coalesced += 1
+                del self._pending[key]
+            elif not self._pending:
+                # Väcker tråden så att den börjar räkna ned FANOUT_FLUSH_INTERVAL
+                self._oldest = time.monotonic()
+                self._condition.notify()
+            self._pending[key] = notification_message
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def flush(self):
+        """Skriver allt som ligger i bufferten, returnerar antal notiser"""
+        with self._flush_lock:
+            with self._condition:
+                pending, self._pending = self._pending, {}
+                self._oldest = None
+            if not pending:
+                return 0
+            batch = [
+                (listing_id, notification_type, message)
+                for (listing_id, notification_type), message in pending.items()
+            ]
+            try:
+                written = self._write(batch)
+            except Exception:
+                self._flush_errors += 1
+                logger.exception("Kunde inte skriva %s notishändelser", len(batch))
+                return 0
+            self._flushes += 1
+            self._notifications_written += written
+            return written
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name="notification-fanout", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stoppar tråden och skriver det som finns kvar"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopping and not self._due():
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = self._oldest + self.flush_interval - time.monotonic()
+                    self._condition.wait(timeout)
+                if self._stopping:
+                    return
+            self.flush()
+
+    def _due(self):
+        if not self._pending:
+            return False
+        if len(self._pending) >= self.batch_size:
+            return True
+        return time.monotonic() - self._oldest >= self.flush_interval
+
+    def stats(self):
+        with self._condition:
+            return {
+                "pending": len(self._pending),
+                "events_received": self._events_received,
+                "events_coalesced": self._events_coalesced,
+                "flushes": self._flushes,
+                "notifications_written": self._notifications_written,
+                "flush_errors": self._flush_errors,
+            }
+
+
+def _write_to_repository(batch):
+    with repository.connection() as connection:
+        return repository.get_repository().notify_watchers(connection, batch)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Returnerar processens buffert och startar den vid första anropet"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = FanoutBuffer()
+            _buffer.start()
+        return _buffer
+
+
+def stop_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is not None:
+            _buffer.stop()
+            _buffer = None
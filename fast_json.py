@@ -0,0 +1,60 @@
+import json
+from decimal import Decimal
+
+from fastapi.responses import Response
+
+import tracing
+
+try:
+    import orjson
+except ImportError:
+    # Valfritt, utan orjson används json
+    orjson = None
+
+"""
+Snabbare JSON-svar.
+
+FastJSONResponse serialiserar med orjson om det finns installerat, som hanterar
+datetime/date direkt, och Decimal som tal. Routes som returnerar en
+FastJSONResponse själva hoppar dessutom över FastAPI:s jsonable_encoder och
+response_model, så svaret varken valideras eller filtreras. De anger därför
+schemat med responses={200: {"model": ...}} för dokumentationen, och
+frågorna måste själva välja rätt kolumner.
+"""
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Kan inte göra JSON av {type(value).__name__}")
+
+
+def dumps(content):
+    """Serialiserar till JSON-bytes, samma format som FastAPI:s vanliga svar"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def page(key, items_json, next_cursor):
+    """Ett sidsvar {key: [...], "next_cursor": ...} där listan redan är JSON-text"""
+    return b'{"%s":%s,"next_cursor":%s}' % (
+        key.encode(),
+        items_json.encode(),
+        dumps(next_cursor),
+    )
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        if isinstance(content, bytes):
+            # Färdig JSON, t.ex. från page()
+            return content
+        with tracing.span("serialize"):
+            return dumps(content)
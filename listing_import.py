@@ -0,0 +1,282 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from decimal import Decimal, InvalidOperation
+
+from dotenv import load_dotenv
+
+from db_setup import get_connection
+
+load_dotenv()
+
+"""
+Massimport av annonser från CSV eller NDJSON.
+
+Filen läses rad för rad och valideras (listing_type, status, pris, kategori,
+obligatoriska fält). Giltiga rader skrivs i batchar om IMPORT_BATCH_SIZE med
+COPY till en temporär tabell och flyttas sedan till listings med en enda
+INSERT ... SELECT, där search_vector-triggern och CHECK-villkoren körs. Bara en
+batch i taget finns i minnet, så även stora filer går att importera utan att
+workern växer. Ogiltiga rader hoppas över och rapporteras med radnummer.
+
+Schemat har inga främmande nycklar. Kategorin kontrolleras mot categories
+innan raden skrivs, user_id kontrolleras inte.
+
+Kan köras från kommandoraden:
+
+    python listing_import.py annonser.csv --user-id 1
+    python listing_import.py annonser.ndjson --format ndjson
+"""
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# Fler fel än så rapporteras bara som antal
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+# DECIMAL(10, 2)
+IMPORT_MAX_PRICE = Decimal(os.getenv("IMPORT_MAX_PRICE", "99999999.99"))
+
+# Samma värden som CHECK-villkoren i db_setup.py
+LISTING_TYPES = ("buying", "selling", "free")
+LISTING_STATUSES = ("active", "sold", "closed")
+
+COLUMNS = (
+    "user_id",
+    "category_id",
+    "title",
+    "image_url",
+    "listing_type",
+    "price",
+    "region",
+    "status",
+    "description",
+)
+
+
+def read_rows(stream, file_format):
+    """
+    Ger (radnummer, dict) för varje rad i en textström. En fil som inte går att
+    tolka som CSV ger ValueError.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        try:
+            for row in reader:
+                yield reader.line_num, row
+        except csv.Error as error:
+            raise ValueError(f"Rad {reader.line_num}: {error}") from error
+    elif file_format == "ndjson":
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            if not isinstance(row, dict):
+                yield line_number, {"_invalid": "Raden är inte ett JSON-objekt"}
+                continue
+            yield line_number, row
+    else:
+        raise ValueError(f"Okänt format {file_format}")
+
+
+def _text(row, field, errors, required=True, max_length=None):
+    value = row.get(field)
+    if value is None or str(value).strip() == "":
+        if required:
+            errors.append(f"{field} saknas")
+        return None
+    value = str(value).strip()
+    if max_length and len(value) > max_length:
+        errors.append(f"{field} får vara högst {max_length} tecken")
+    return value
+
+
+def _integer(row, field, errors, default=None):
+    value = row.get(field)
+    if value is None or str(value).strip() == "":
+        if default is None:
+            errors.append(f"{field} saknas")
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        errors.append(f"{field} måste vara ett heltal")
+        return None
+
+
+def validate_row(row, category_ids, user_id=None):
+    """Returnerar (värden i COLUMNS-ordning, fel). Värdena är None om raden är ogiltig."""
+    if "_invalid" in row:
+        return None, [row["_invalid"]]
+
+    errors = []
+    row_user_id = _integer(row, "user_id", errors, default=user_id)
+    category_id = _integer(row, "category_id", errors)
+    if category_id is not None and category_id not in category_ids:
+        errors.append(f"Kategori {category_id} finns inte")
+
+    title = _text(row, "title", errors, max_length=100)
+    image_url = _text(row, "image_url", errors, required=False, max_length=500)
+    region = _text(row, "region", errors, max_length=255)
+    description = _text(row, "description", errors)
+
+    listing_type = _text(row, "listing_type", errors)
+    if listing_type is not None and listing_type not in LISTING_TYPES:
+        errors.append(f"listing_type måste vara en av {', '.join(LISTING_TYPES)}")
+    status = _text(row, "status", errors, required=False) or "active"
+    if status not in LISTING_STATUSES:
+        errors.append(f"status måste vara en av {', '.join(LISTING_STATUSES)}")
+
+    price = None
+    raw_price = row.get("price")
+    if raw_price is None or str(raw_price).strip() == "":
+        errors.append("price saknas")
+    else:
+        try:
+            price = Decimal(str(raw_price).strip())
+            if not price.is_finite() or price < 0 or price > IMPORT_MAX_PRICE:
+                errors.append(f"price måste vara mellan 0 och {IMPORT_MAX_PRICE}")
+        except InvalidOperation:
+            errors.append("price måste vara ett tal")
+
+    if errors:
+        return None, errors
+    values = (
+        row_user_id,
+        category_id,
+        title,
+        image_url,
+        listing_type,
+        price,
+        region,
+        status,
+        description,
+    )
+    return values, []
+
+
+def _copy_batch(cursor, batch):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY listing_import_staging (line, {', '.join(COLUMNS)}) "
+        "FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+
+
+def import_listings(
+    connection,
+    stream,
+    file_format="csv",
+    user_id=None,
+    batch_size=IMPORT_BATCH_SIZE,
+    progress=None,
+):
+    """
+    Importerar annonser från en textström. progress(sammanfattning) anropas efter
+    varje batch. Alla giltiga rader skrivs i samma transaktion.
+    Returnerar en sammanfattning med antal rader, importerade och fel per rad.
+    """
+    summary = {"rows": 0, "imported": 0, "failed": 0, "errors": []}
+
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id FROM categories")
+            category_ids = {row[0] for row in cursor.fetchall()}
+
+            cursor.execute(
+                """
+                CREATE TEMP TABLE listing_import_staging (
+                    line INT NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    category_id BIGINT NOT NULL,
+                    title VARCHAR(100) NOT NULL,
+                    image_url VARCHAR(500),
+                    listing_type VARCHAR(255) NOT NULL,
+                    price DECIMAL(10, 2) NOT NULL,
+                    region VARCHAR(255) NOT NULL,
+                    status VARCHAR(255) NOT NULL,
+                    description TEXT NOT NULL
+                ) ON COMMIT DROP
+            """
+            )
+
+            batch = []
+            for line_number, row in read_rows(stream, file_format):
+                summary["rows"] += 1
+                values, errors = validate_row(row, category_ids, user_id)
+                if errors:
+                    summary["failed"] += 1
+                    if len(summary["errors"]) < IMPORT_MAX_ERRORS:
+                        summary["errors"].append({"row": line_number, "errors": errors})
+                    continue
+                batch.append((line_number, *values))
+                if len(batch) >= batch_size:
+                    _copy_batch(cursor, batch)
+                    batch = []
+                    if progress:
+                        progress(summary)
+            if batch:
+                _copy_batch(cursor, batch)
+
+            cursor.execute(
+                f"""
+                INSERT INTO listings ({', '.join(COLUMNS)})
+                SELECT {', '.join(COLUMNS)}
+                FROM listing_import_staging
+                ORDER BY line
+            """
+            )
+            summary["imported"] = cursor.rowcount
+
+    if progress:
+        progress(summary)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Massimport av annonser")
+    parser.add_argument("path", help="CSV- eller NDJSON-fil, - för stdin")
+    parser.add_argument("--format", choices=("csv", "ndjson"))
+    parser.add_argument(
+        "--user-id", type=int, help="Säljare för rader som saknar user_id"
+    )
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    file_format = args.format
+    if file_format is None:
+        file_format = "ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv"
+
+    def report(summary):
+        print(
+            f"\r{summary['rows']} rader lästa, {summary['failed']} fel",
+            end="",
+            file=sys.stderr,
+        )
+
+    stream = (
+        sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    )
+    connection = get_connection()
+    try:
+        summary = import_listings(
+            connection, stream, file_format, args.user_id, args.batch_size, report
+        )
+    finally:
+        connection.close()
+        stream.close()
+
+    print(file=sys.stderr)
+    for error in summary["errors"]:
+        print(f"Rad {error['row']}: {'; '.join(error['errors'])}", file=sys.stderr)
+    print(f"{summary['imported']} annonser importerade, {summary['failed']} fel")
+
+
+if __name__ == "__main__":
+    main()
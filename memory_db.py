@@ -0,0 +1,1731 @@
+import bisect
+import heapq
+import re
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from decimal import ROUND_HALF_UP, Decimal
+
+import events
+import metrics
+import pagination
+from db import LISTING_FULL_BIDS, MIN_BID_INCREMENT, BidRejectedError
+
+"""
+Samma funktioner som db.py men med all data i minnet, för att mäta FastAPI-lagret
+utan databasen och för snabba tester. Väljs med REPOSITORY_BACKEND=memory, se
+repository.py.
+
+Funktionerna tar en MemoryStore som connection (get_db i app.py lämnar ut
+get_store()) och följer db.py: samma kolumner och ordning i svaren, ValueError
+när raden saknas, BidRejectedError för bud som bryter mot budreglerna och
+IntegrityError där PostgreSQL skulle bryta mot en unik nyckel eller ett
+CHECK-villkor. Belopp sparas som Decimal med två decimaler som i DECIMAL(10, 2).
+
+Varje tabell är en dict id -> rad med index som dicts värde -> {id: None}
+(bud per annons, meddelanden per avsändare och mottagare, recensioner per
+användare ...). Tabellerna som listas med cursor har ett sorterat index på
+(created_at, id), och varje annons har en heap med sina bud så att högsta budet
+hittas direkt. Alla anrop tar storens lås, så en funktion motsvarar en
+transaktion.
+
+Fritextsökningen är en förenkling av PostgreSQL:s: alla ord i frågan måste
+finnas som början på ett ord i titeln eller beskrivningen, och träffar i
+titeln väger tyngre.
+"""
+
+# Kolumnerna i samma ordning som i db_setup.py
+COLUMNS = {
+    "users": (
+        "id",
+        "username",
+        "email",
+        "password",
+        "user_since",
+        "date_of_birth",
+        "phone_number",
+    ),
+    "categories": ("id", "name"),
+    "listings": (
+        "id",
+        "user_id",
+        "category_id",
+        "title",
+        "image_url",
+        "listing_type",
+        "price",
+        "created_at",
+        "region",
+        "status",
+        "description",
+        "current_high_bid",
+        "bid_count",
+        "updated_at",
+    ),
+    "listings_watch_list": ("user_id", "listing_id", "created_at"),
+    "messages": (
+        "id",
+        "sender_id",
+        "recipient_id",
+        "listing_id",
+        "message_text",
+        "created_at",
+        "is_read",
+    ),
+    "bids": ("id", "user_id", "listing_id", "created_at", "bid_amount"),
+    "transactions": (
+        "id",
+        "user_id",
+        "bid_id",
+        "listing_id",
+        "created_at",
+        "status",
+        "amount",
+    ),
+    "payments": (
+        "id",
+        "transaction_id",
+        "listing_id",
+        "payment_method",
+        "payment_status",
+        "amount",
+        "paid_at",
+    ),
+    "user_ratings": ("id", "user_id", "total_ratings", "average_rating", "rating_sum"),
+    "reviews": (
+        "id",
+        "reviewer_id",
+        "reviewed_user_id",
+        "listing_id",
+        "rating",
+        "review_text",
+        "created_at",
+    ),
+    "images": ("id", "user_id", "listing_id", "image_url", "created_at"),
+    "notifications": (
+        "id",
+        "user_id",
+        "listing_id",
+        "notification_type",
+        "notification_message",
+        "is_read",
+        "created_at",
+    ),
+    "listing_comments": (
+        "id",
+        "user_id",
+        "listing_id",
+        "comment_text",
+        "created_at",
+        "answer_text",
+        "answered_at",
+    ),
+    "shipping_details": (
+        "id",
+        "user_id",
+        "listing_id",
+        "shipping_method",
+        "shipping_cost",
+        "estimated_delivery_days",
+        "tracking_number",
+        "status",
+        "shipped_at",
+    ),
+    "reports": ("id", "user_id", "listing_id", "report_reason", "created_at"),
+}
+
+# Standardvärden från db_setup.py och migrations.py, "now" blir CURRENT_TIMESTAMP
+DEFAULTS = {
+    "users": {"user_since": "now"},
+    "listings": {
+        "created_at": "now",
+        "current_high_bid": None,
+        "bid_count": 0,
+        "updated_at": "now",
+    },
+    "listings_watch_list": {"created_at": "now"},
+    "messages": {"created_at": "now", "is_read": False},
+    "bids": {"created_at": "now"},
+    "transactions": {"created_at": "now"},
+    "payments": {"paid_at": "now"},
+    "user_ratings": {"total_ratings": 0, "average_rating": 0, "rating_sum": 0},
+    "reviews": {"created_at": "now"},
+    "images": {"created_at": "now"},
+    "notifications": {"created_at": "now", "is_read": False},
+    "listing_comments": {"created_at": "now"},
+    "reports": {"created_at": "now"},
+}
+
+# Kolumner med index, värde -> {id: None}
+INDEXES = {
+    "users": ("username", "email"),
+    "bids": ("listing_id",),
+    "user_ratings": ("user_id",),
+    "reviews": ("reviewed_user_id",),
+    "images": ("listing_id",),
+    "reports": ("listing_id",),
+    "messages": ("sender_id", "recipient_id"),
+    "transactions": ("user_id",),
+    "payments": ("transaction_id",),
+    "notifications": ("user_id",),
+    "listing_comments": ("listing_id", "user_id"),
+    "shipping_details": ("listing_id",),
+    "listings_watch_list": ("user_id", "listing_id"),
+}
+
+UNIQUE = {
+    "users": ("username", "email"),
+    "user_ratings": ("user_id",),
+}
+
+# Samma värden som CHECK-villkoren i db_setup.py
+CHECKS = {
+    ("listings", "listing_type"): ("buying", "selling", "free"),
+    ("listings", "status"): ("active", "sold", "closed"),
+    ("payments", "payment_status"): (
+        "pending",
+        "completed",
+        "failed",
+        "cancelled",
+        "refunded",
+    ),
+}
+
+# Sorteringskolumnen för tabellerna som listas med cursor (nyast först)
+ORDER_COLUMNS = {
+    "bids": "created_at",
+    "reviews": "created_at",
+    "images": "created_at",
+    "reports": "created_at",
+    "users": "user_since",
+    "listings": "created_at",
+    "transactions": "created_at",
+    # paid_at kan vara NULL, se db.get_all_payments
+    "payments": "id",
+}
+
+MONEY_COLUMNS = {"price", "current_high_bid", "bid_amount", "amount", "shipping_cost"}
+TIMESTAMP_COLUMNS = {
+    "user_since",
+    "created_at",
+    "paid_at",
+    "answered_at",
+    "shipped_at",
+}
+
+CENTS = Decimal("0.01")
+
+# Fritext: vikt per träff i titeln och i beskrivningen
+TITLE_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+
+_WORD = re.compile(r"\w+")
+
+
+class IntegrityError(Exception):
+    """Motsvarar psycopg2.IntegrityError: en unik nyckel eller ett CHECK-villkor bröts"""
+
+
+def _money(value):
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def _timestamp(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        # TIMESTAMP utan tidszon
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+def _convert(column, value):
+    """Samma typer som psycopg2 returnerar för kolumnen"""
+    if value is None:
+        return None
+    if column in MONEY_COLUMNS:
+        return _money(value)
+    if column == "average_rating":
+        return _money(value)
+    if column in TIMESTAMP_COLUMNS:
+        return _timestamp(value)
+    if column == "updated_at":
+        # TIMESTAMPTZ, se migration 8
+        return value.astimezone(timezone.utc)
+    if column == "date_of_birth" and isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+
+def _select(row, columns=None):
+    """Kopia av raden, bara columns om de anges"""
+    if row is None:
+        return None
+    if columns is None:
+        return dict(row)
+    return {column: row[column] for column in columns}
+
+
+class SortedIndex:
+    """(värde, id) i stigande ordning, läses baklänges för nyast först"""
+
+    def __init__(self):
+        self._keys = []
+
+    def add(self, value, row_id):
+        bisect.insort(self._keys, (value, row_id))
+
+    def remove(self, value, row_id):
+        index = bisect.bisect_left(self._keys, (value, row_id))
+        if index < len(self._keys) and self._keys[index] == (value, row_id):
+            del self._keys[index]
+
+    def descending(self, before=None):
+        """Id:n i fallande ordning, bara de före positionen before om den anges"""
+        end = len(self._keys)
+        if before is not None:
+            end = bisect.bisect_left(self._keys, tuple(before))
+        for index in range(end - 1, -1, -1):
+            yield self._keys[index][1]
+
+
+class MemoryStore:
+    """Alla tabeller med index, skickas som connection till funktionerna nedan"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Tömmer alla tabeller och startar om id:na"""
+        with self.lock:
+            self.tables = {table: {} for table in COLUMNS}
+            self.last_ids = dict.fromkeys(COLUMNS, 0)
+            self.indexes = {
+                (table, column): defaultdict(dict)
+                for table, columns in INDEXES.items()
+                for column in columns
+            }
+            self.ordered = {table: SortedIndex() for table in ORDER_COLUMNS}
+            # listing_id -> heap med (-belopp, id), raderade bud tas bort lat
+            self.bid_heaps = defaultdict(list)
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+    @staticmethod
+    def _key(table, row):
+        if table == "listings_watch_list":
+            return (row["user_id"], row["listing_id"])
+        return row["id"]
+
+    def _check(self, table, row, row_id=None):
+        for (checked_table, column), allowed in CHECKS.items():
+            if checked_table == table and row.get(column) not in allowed:
+                raise IntegrityError(f"{table}.{column} får inte vara {row[column]!r}")
+        for column in UNIQUE.get(table, ()):
+            existing = self.indexes[(table, column)].get(row[column], {})
+            if any(other != row_id for other in existing):
+                raise IntegrityError(f"{table}.{column} {row[column]!r} finns redan")
+
+    def _index(self, table, key, row):
+        for column in INDEXES.get(table, ()):
+            self.indexes[(table, column)][row[column]][key] = None
+        if table in ORDER_COLUMNS:
+            self.ordered[table].add(row[ORDER_COLUMNS[table]], key)
+        if table == "bids":
+            heapq.heappush(self.bid_heaps[row["listing_id"]], (-row["bid_amount"], key))
+
+    def _unindex(self, table, key, row):
+        for column in INDEXES.get(table, ()):
+            ids = self.indexes[(table, column)].get(row[column])
+            if ids is not None:
+                ids.pop(key, None)
+                if not ids:
+                    del self.indexes[(table, column)][row[column]]
+        if table in ORDER_COLUMNS:
+            self.ordered[table].remove(row[ORDER_COLUMNS[table]], key)
+
+    def insert(self, table, values):
+        """Lägger till en rad, id sätts om det inte anges. Returnerar raden"""
+        row = {}
+        defaults = DEFAULTS.get(table, {})
+        for column in COLUMNS[table]:
+            if column in values:
+                value = values[column]
+            elif column == "id":
+                value = self.last_ids[table] + 1
+            else:
+                value = defaults.get(column)
+                if value == "now":
+                    value = datetime.now()
+            row[column] = _convert(column, value)
+
+        key = self._key(table, row)
+        if key in self.tables[table]:
+            raise IntegrityError(f"{table} {key} finns redan")
+        self._check(table, row)
+        if "id" in row:
+            self.last_ids[table] = max(self.last_ids[table], row["id"])
+        self.tables[table][key] = row
+        self._index(table, key, row)
+        return row
+
+    def update(self, table, key, changes):
+        """Ändrar kolumnerna i changes, returnerar raden eller None om den saknas"""
+        row = self.tables[table].get(key)
+        if row is None:
+            return None
+        updated = dict(row)
+        updated.update(
+            {column: _convert(column, value) for column, value in changes.items()}
+        )
+        self._check(table, updated, key)
+        self._unindex(table, key, row)
+        row.update(updated)
+        self._index_without_heap(table, key, row)
+        return row
+
+    def _index_without_heap(self, table, key, row):
+        # Bud ändras aldrig, så heapen behöver inte byggas om
+        for column in INDEXES.get(table, ()):
+            self.indexes[(table, column)][row[column]][key] = None
+        if table in ORDER_COLUMNS:
+            self.ordered[table].add(row[ORDER_COLUMNS[table]], key)
+
+    def delete(self, table, key):
+        """Tar bort raden, returnerar den eller None om den saknas"""
+        row = self.tables[table].pop(key, None)
+        if row is not None:
+            self._unindex(table, key, row)
+        return row
+
+    def get(self, table, key):
+        return self.tables[table].get(key)
+
+    def where(self, table, column, value):
+        """Raderna med column = value via indexet, i den ordning de lades till"""
+        rows = self.tables[table]
+        return [rows[key] for key in self.indexes[(table, column)].get(value, ())]
+
+    def highest_bid(self, listing_id):
+        """Högsta budet för annonsen (högst belopp, lägst id), None utan bud"""
+        heap = self.bid_heaps.get(listing_id)
+        bids = self.tables["bids"]
+        while heap:
+            amount, bid_id = heap[0]
+            bid = bids.get(bid_id)
+            if bid is not None and bid["listing_id"] == listing_id:
+                return bid
+            heapq.heappop(heap)
+        return None
+
+    def load(self, table, columns, rows):
+        """
+        Lägger in färdiga rader med id, t.ex. från benchmarks.seed.generate.
+        Högsta bud och antal bud på annonserna uppdateras när bud läses in.
+        """
+        with self.lock:
+            for values in rows:
+                row = self.insert(table, dict(zip(columns, values)))
+                if table == "bids":
+                    listing = self.tables["listings"].get(row["listing_id"])
+                    if listing is not None:
+                        high = listing["current_high_bid"]
+                        if high is None or row["bid_amount"] > high:
+                            listing["current_high_bid"] = row["bid_amount"]
+                        listing["bid_count"] += 1
+
+
+_store = MemoryStore()
+
+
+def get_store():
+    """Processens store, lämnas ut av get_db när REPOSITORY_BACKEND=memory"""
+    return _store
+
+
+def _page(connection, table, after, limit, columns=None):
+    """En sida ur tabellens sorterade index, som SELECT ... ORDER BY x DESC, id DESC"""
+    limit = pagination.page_size(limit)
+    rows = []
+    for key in connection.ordered[table].descending(
+        pagination.decode_cursor(after, ORDER_COLUMNS[table])
+    ):
+        rows.append(_select(connection.tables[table][key], columns))
+        if len(rows) > limit:
+            break
+    return pagination.next_page(rows, limit, ORDER_COLUMNS[table])
+
+
+def _sorted_page(rows, column, after, limit, id_column="id"):
+    """En sida ur en lista med rader, nyast först"""
+    limit = pagination.page_size(limit)
+    position = pagination.decode_cursor(after, column)
+    rows = sorted(rows, key=lambda row: (row[column], row[id_column]), reverse=True)
+    if position is not None:
+        position = tuple(position)
+        rows = [row for row in rows if (row[column], row[id_column]) < position]
+    return pagination.next_page(rows[: limit + 1], limit, column, id_column)
+
+
+# Bid functions
+
+
+def get_all_bids(connection, after=None, limit=None):
+    """Hämtar alla bud, en sida i taget (nyast först)"""
+    with connection:
+        return _page(connection, "bids", after, limit)
+
+
+def get_bid_by_id(connection, bid_id):
+    """Hämtar ett specifikt bud"""
+    with connection:
+        bid = _select(connection.get("bids", bid_id))
+    if not bid:
+        raise ValueError(f"Bud med id {bid_id} finns inte")
+    return bid
+
+
+def _bids_by_amount(connection, listing_id):
+    """Budens (-belopp, id) ur heapen i ordning, högst först"""
+    bids = connection.tables["bids"]
+    return [
+        bids[bid_id]
+        for _, bid_id in sorted(connection.bid_heaps.get(listing_id, ()))
+        if bid_id in bids
+    ]
+
+
+def get_bids_for_listing(connection, listing_id):
+    """Hämtar alla bud för en specifik annons"""
+    with connection:
+        return [_select(bid) for bid in _bids_by_amount(connection, listing_id)]
+
+
+def create_bid(connection, user_id, listing_id, bid_amount):
+    """
+    Lägger ett bud om annonsen är aktiv och budet är tillräckligt högt,
+    med samma regler som db.create_bid
+    """
+    with connection:
+        listing = connection.get("listings", listing_id)
+        if not listing:
+            raise ValueError(f"Annons med id {listing_id} finns inte")
+        if listing["current_high_bid"] is None:
+            minimum = listing["price"]
+        else:
+            minimum = listing["current_high_bid"] + _money(MIN_BID_INCREMENT)
+        if listing["status"] != "active":
+            raise BidRejectedError("Annonsen är inte aktiv")
+        if Decimal(str(bid_amount)) < minimum:
+            raise BidRejectedError(f"Budet måste vara minst {float(minimum):.2f}")
+
+        leader = connection.highest_bid(listing_id)
+        new_bid = connection.insert(
+            "bids",
+            {"user_id": user_id, "listing_id": listing_id, "bid_amount": bid_amount},
+        )
+        connection.update(
+            "listings",
+            listing_id,
+            {
+                "current_high_bid": new_bid["bid_amount"],
+                "bid_count": listing["bid_count"] + 1,
+                "updated_at": datetime.now(),
+            },
+        )
+        new_bid = _select(new_bid)
+    if leader and leader["user_id"] != user_id:
+        events.publish_local(leader["user_id"], "outbid", new_bid)
+    return new_bid
+
+
+def delete_bid(connection, bid_id):
+    """Raderar ett bud och räknar om annonsens högsta bud"""
+    with connection:
+        bid = connection.delete("bids", bid_id)
+        if not bid:
+            raise ValueError(f"Bud med id {bid_id} finns inte")
+        listing = connection.get("listings", bid["listing_id"])
+        if listing:
+            highest = connection.highest_bid(bid["listing_id"])
+            connection.update(
+                "listings",
+                bid["listing_id"],
+                {
+                    "bid_count": max(listing["bid_count"] - 1, 0),
+                    "current_high_bid": highest["bid_amount"] if highest else None,
+                    "updated_at": datetime.now(),
+                },
+            )
+    return {"message": "Bud raderat", "id": bid["id"]}
+
+
+# User_Ratings functions
+
+
+def _rating_for(connection, user_id):
+    ratings = connection.where("user_ratings", "user_id", user_id)
+    return ratings[0] if ratings else None
+
+
+def _average(rating_sum, total):
+    return (Decimal(rating_sum) / total).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def get_all_user_ratings(connection):
+    """Hämtar alla användarratings"""
+    with connection:
+        return [
+            _select(rating) for rating in connection.tables["user_ratings"].values()
+        ]
+
+
+def get_user_rating_by_user_id(connection, user_id):
+    """Hämtar rating för en specifik användare"""
+    with connection:
+        rating = _select(_rating_for(connection, user_id))
+    if not rating:
+        raise ValueError(f"Rating för användare {user_id} finns inte")
+    return rating
+
+
+def create_user_rating(connection, user_id, total_ratings=0, average_rating=0.00):
+    """Skapar ett nytt användarrating"""
+    with connection:
+        rating_sum = (Decimal(total_ratings) * Decimal(str(average_rating))).quantize(
+            Decimal(1), rounding=ROUND_HALF_UP
+        )
+        return _select(
+            connection.insert(
+                "user_ratings",
+                {
+                    "user_id": user_id,
+                    "total_ratings": total_ratings,
+                    "average_rating": average_rating,
+                    "rating_sum": int(rating_sum),
+                },
+            )
+        )
+
+
+def update_user_rating(connection, user_id, total_ratings=None, average_rating=None):
+    """Uppdaterar ett användarrating"""
+    if total_ratings is None and average_rating is None:
+        raise ValueError("Inget att uppdatera")
+    with connection:
+        rating = _rating_for(connection, user_id)
+        if not rating:
+            raise ValueError(f"Rating för användare {user_id} finns inte")
+        changes = {}
+        if total_ratings is not None:
+            changes["total_ratings"] = total_ratings
+        if average_rating is not None:
+            changes["average_rating"] = average_rating
+        # Håll summan i fas så att nästa recension räknas från de nya värdena
+        total = changes.get("total_ratings", rating["total_ratings"])
+        average = Decimal(str(changes.get("average_rating", rating["average_rating"])))
+        changes["rating_sum"] = int(
+            (total * average).quantize(Decimal(1), rounding=ROUND_HALF_UP)
+        )
+        return _select(connection.update("user_ratings", rating["id"], changes))
+
+
+def delete_user_rating(connection, user_id):
+    """Raderar ett användarrating"""
+    with connection:
+        rating = _rating_for(connection, user_id)
+        if not rating:
+            raise ValueError(f"Rating för användare {user_id} finns inte")
+        connection.delete("user_ratings", rating["id"])
+    return {"message": "Rating raderat", "id": rating["id"]}
+
+
+def recompute_user_ratings(connection):
+    """Bygger om alla ratings från reviews. Returnerar antal ändrade rader"""
+    with connection:
+        totals = defaultdict(lambda: [0, 0])
+        for review in connection.tables["reviews"].values():
+            total = totals[review["reviewed_user_id"]]
+            total[0] += 1
+            total[1] += review["rating"]
+
+        changed = 0
+        for user_id, (count, rating_sum) in totals.items():
+            rating = _rating_for(connection, user_id)
+            values = {
+                "total_ratings": count,
+                "rating_sum": rating_sum,
+                "average_rating": _average(rating_sum, count),
+            }
+            if rating is None:
+                connection.insert("user_ratings", {"user_id": user_id, **values})
+                changed += 1
+            elif (rating["total_ratings"], rating["rating_sum"]) != (count, rating_sum):
+                connection.update("user_ratings", rating["id"], values)
+                changed += 1
+
+        for rating in list(connection.tables["user_ratings"].values()):
+            if rating["user_id"] not in totals and rating["total_ratings"] != 0:
+                connection.update(
+                    "user_ratings",
+                    rating["id"],
+                    {"total_ratings": 0, "rating_sum": 0, "average_rating": 0},
+                )
+                changed += 1
+    return changed
+
+
+# Review Functions
+
+
+def get_all_reviews(connection, after=None, limit=None):
+    """Hämtar alla recensioner, en sida i taget (nyast först)"""
+    with connection:
+        return _page(connection, "reviews", after, limit)
+
+
+def get_review_by_id(connection, review_id):
+    """Hämtar en specifik recension"""
+    with connection:
+        review = _select(connection.get("reviews", review_id))
+    if not review:
+        raise ValueError(f"Recension med id {review_id} finns inte")
+    return review
+
+
+def get_reviews_for_user(connection, user_id):
+    """Hämtar alla recensioner för en användare"""
+    with connection:
+        reviews = connection.where("reviews", "reviewed_user_id", user_id)
+        return [
+            _select(review)
+            for review in sorted(
+                reviews, key=lambda review: review["created_at"], reverse=True
+            )
+        ]
+
+
+def get_reviews_version(connection, user_id):
+    """Antal recensioner och högsta id för en användare, se db.get_reviews_version"""
+    with connection:
+        ids = connection.indexes[("reviews", "reviewed_user_id")].get(user_id, {})
+        return len(ids), max(ids, default=0)
+
+
+def create_review(
+    connection, reviewer_id, reviewed_user_id, listing_id, rating, review_text=None
+):
+    """Skapar en ny recension och uppdaterar användarens rating"""
+    with connection:
+        new_review = connection.insert(
+            "reviews",
+            {
+                "reviewer_id": reviewer_id,
+                "reviewed_user_id": reviewed_user_id,
+                "listing_id": listing_id,
+                "rating": rating,
+                "review_text": review_text,
+            },
+        )
+        user_rating = _rating_for(connection, reviewed_user_id)
+        if user_rating is None:
+            connection.insert(
+                "user_ratings",
+                {
+                    "user_id": reviewed_user_id,
+                    "total_ratings": 1,
+                    "rating_sum": rating,
+                    "average_rating": rating,
+                },
+            )
+        else:
+            total = user_rating["total_ratings"] + 1
+            rating_sum = user_rating["rating_sum"] + rating
+            connection.update(
+                "user_ratings",
+                user_rating["id"],
+                {
+                    "total_ratings": total,
+                    "rating_sum": rating_sum,
+                    "average_rating": _average(rating_sum, total),
+                },
+            )
+        return _select(new_review)
+
+
+def delete_review(connection, review_id):
+    """Raderar en recension och drar bort den från användarens rating"""
+    with connection:
+        review = connection.delete("reviews", review_id)
+        if not review:
+            raise ValueError(f"Recension med id {review_id} finns inte")
+        user_rating = _rating_for(connection, review["reviewed_user_id"])
+        if user_rating is not None:
+            total = user_rating["total_ratings"]
+            rating_sum = user_rating["rating_sum"] - review["rating"]
+            connection.update(
+                "user_ratings",
+                user_rating["id"],
+                {
+                    "total_ratings": max(total - 1, 0),
+                    "rating_sum": rating_sum,
+                    "average_rating": (
+                        _average(rating_sum, total - 1) if total > 1 else 0
+                    ),
+                },
+            )
+    return {"message": "Recension raderad", "id": review["id"]}
+
+
+# Image Function
+
+
+def get_all_images(connection, after=None, limit=None):
+    """Hämtar alla bilder, en sida i taget (nyast först)"""
+    with connection:
+        return _page(connection, "images", after, limit)
+
+
+def get_image_by_id(connection, image_id):
+    """Hämtar en specifik bild"""
+    with connection:
+        image = _select(connection.get("images", image_id))
+    if not image:
+        raise ValueError(f"Bild med id {image_id} finns inte")
+    return image
+
+
+def get_images_for_listing(connection, listing_id):
+    """Hämtar alla bilder för en annons"""
+    with connection:
+        images = connection.where("images", "listing_id", listing_id)
+        return [
+            _select(image)
+            for image in sorted(images, key=lambda image: image["created_at"])
+        ]
+
+
+def get_images_version(connection, listing_id):
+    """Antal bilder och högsta id för en annons, se get_reviews_version"""
+    with connection:
+        ids = connection.indexes[("images", "listing_id")].get(listing_id, {})
+        return len(ids), max(ids, default=0)
+
+
+def create_image(connection, user_id, listing_id, image_url):
+    """Lägger till en ny bild"""
+    with connection:
+        return _select(
+            connection.insert(
+                "images",
+                {"user_id": user_id, "listing_id": listing_id, "image_url": image_url},
+            )
+        )
+
+
+def delete_image(connection, image_id):
+    """Raderar en bild"""
+    with connection:
+        image = connection.delete("images", image_id)
+    if not image:
+        raise ValueError(f"Bild med id {image_id} finns inte")
+    return {"message": "Bild raderad", "id": image["id"]}
+
+
+# Report functions
+
+
+def get_all_reports(connection, after=None, limit=None):
+    """Hämtar alla rapporteringar, en sida i taget (nyast först)"""
+    with connection:
+        return _page(connection, "reports", after, limit)
+
+
+def get_report_by_id(connection, report_id):
+    """Hämtar en specifik rapport"""
+    with connection:
+        report = _select(connection.get("reports", report_id))
+    if not report:
+        raise ValueError(f"Rapport med id {report_id} finns inte")
+    return report
+
+
+def get_reports_for_listing(connection, listing_id):
+    """Hämtar alla rapporter för en annons"""
+    with connection:
+        reports = connection.where("reports", "listing_id", listing_id)
+        return [
+            _select(report)
+            for report in sorted(
+                reports, key=lambda report: report["created_at"], reverse=True
+            )
+        ]
+
+
+def create_report(connection, user_id, listing_id, report_reason):
+    """Skapar en ny rapportering"""
+    with connection:
+        return _select(
+            connection.insert(
+                "reports",
+                {
+                    "user_id": user_id,
+                    "listing_id": listing_id,
+                    "report_reason": report_reason,
+                },
+            )
+        )
+
+
+def delete_report(connection, report_id):
+    """Raderar en rapportering"""
+    with connection:
+        report = connection.delete("reports", report_id)
+    if not report:
+        raise ValueError(f"Rapport med id {report_id} finns inte")
+    return {"message": "Rapportering raderad", "id": report["id"]}
+
+
+# User function
+
+# Kolumnerna utan lösenordet
+USER_COLUMNS = (
+    "id",
+    "username",
+    "email",
+    "user_since",
+    "date_of_birth",
+    "phone_number",
+)
+
+
+def get_all_users(connection, after=None, limit=None):
+    """Hämtar alla användare, en sida i taget (nyast först)"""
+    with connection:
+        return _page(connection, "users", after, limit, USER_COLUMNS)
+
+
+def get_user_by_id(connection, user_id):
+    """Hämtar en specifik användare med ID"""
+    with connection:
+        user = connection.get("users", user_id)
+        user = _select(user, USER_COLUMNS) if user else None
+    if not user:
+        raise ValueError(f"Användare med id {user_id} finns inte")
+    return user
+
+
+def get_user_by_email(connection, email):
+    """Hämtar användare med email (för inloggning)"""
+    with connection:
+        users = connection.where("users", "email", email)
+        return _select(users[0], USER_COLUMNS) if users else None
+
+
+def get_user_by_username(connection, username):
+    """Hämtar användare med username (för inloggning)"""
+    with connection:
+        users = connection.where("users", "username", username)
+        return _select(users[0], USER_COLUMNS) if users else None
+
+
+def create_user(
+    connection, username, email, password, user_since, date_of_birth, phone_number
+):
+    """Skapar en ny användare"""
+    with connection:
+        return _select(
+            connection.insert(
+                "users",
+                {
+                    "username": username,
+                    "email": email,
+                    "password": password,
+                    "user_since": user_since,
+                    "date_of_birth": date_of_birth,
+                    "phone_number": phone_number,
+                },
+            )
+        )
+
+
+def update_user(connection, user_id, email=None, phone_number=None):
+    """Uppdaterar en specifik användares email eller telefonnummer"""
+    changes = {}
+    if email is not None:
+        changes["email"] = email
+    if phone_number is not None:
+        changes["phone_number"] = phone_number
+    with connection:
+        updated_user = _select(connection.update("users", user_id, changes))
+    if not updated_user:
+        raise ValueError(f"Användare med id {user_id} finns inte")
+    return updated_user
+
+
+def delete_user(connection, user_id):
+    """Raderar en användare"""
+    with connection:
+        deleted_user = connection.delete("users", user_id)
+    if not deleted_user:
+        raise ValueError(f"Användare med id {user_id} finns inte")
+    return {"message": "Användare raderad", "user": _select(deleted_user)}
+
+
+# Category Funcition
+
+
+def get_all_categories(connection):
+    """Hämtar alla kategorier"""
+    with connection:
+        return [
+            _select(category) for category in connection.tables["categories"].values()
+        ]
+
+
+def create_category(connection, name):
+    """Skapar en ny kategori"""
+    with connection:
+        return _select(connection.insert("categories", {"name": name}))
+
+
+def delete_category(connection, category_id):
+    """Raderar en kategori"""
+    with connection:
+        category = connection.delete("categories", category_id)
+    if not category:
+        raise ValueError(f"Kategori med id {category_id} finns inte")
+    return {"message": "Kategori raderad", "id": category["id"]}
+
+
+# Listing function
+
+# Kolumnerna i svaren, updated_at bara från get_listing_by_id som i db.py
+LISTING_COLUMNS = COLUMNS["listings"][:-1]
+
+
+def get_all_listings(connection, after=None, limit=None):
+    """Hämtar alla annonser, en sida i taget (nyast först)"""
+    with connection:
+        return _page(connection, "listings", after, limit, LISTING_COLUMNS)
+
+
+def get_listing_by_id(connection, listing_id):
+    """Hämtar en specifik annons, med updated_at för ETag och Last-Modified"""
+    with connection:
+        listing = _select(connection.get("listings", listing_id))
+    if not listing:
+        raise ValueError(f"Annons med id {listing_id} finns inte")
+    return listing
+
+
+# Samma delar som LISTING_FULL_QUERY i db.py
+FULL_COMMENT_COLUMNS = (
+    "id",
+    "user_id",
+    "listing_id",
+    "comment_text",
+    "answer_text",
+    "created_at",
+)
+SHIPPING_COLUMNS = (
+    "id",
+    "listing_id",
+    "shipping_method",
+    "shipping_cost",
+    "estimated_delivery_days",
+    "tracking_number",
+    "status",
+    "shipped_at",
+)
+
+
+def get_listing_full(connection, listing_id, bids_limit=None):
+    """Hämtar annonsen med de högsta buden, bilder, kommentarer, frakt och säljarens rating"""
+    if bids_limit is None:
+        bids_limit = LISTING_FULL_BIDS
+    with connection:
+        listing = connection.get("listings", listing_id)
+        if not listing:
+            raise ValueError(f"Annons med id {listing_id} finns inte")
+        listing = _select(listing, LISTING_COLUMNS)
+        listing["bids"] = [
+            _select(bid) for bid in _bids_by_amount(connection, listing_id)[:bids_limit]
+        ]
+        listing["images"] = [
+            _select(image)
+            for image in sorted(
+                connection.where("images", "listing_id", listing_id),
+                key=lambda image: image["created_at"],
+            )
+        ]
+        listing["comments"] = [
+            _select(comment, FULL_COMMENT_COLUMNS)
+            for comment in sorted(
+                connection.where("listing_comments", "listing_id", listing_id),
+                key=lambda comment: comment["created_at"],
+            )
+        ]
+        shipping = connection.where("shipping_details", "listing_id", listing_id)
+        listing["shipping"] = (
+            _select(shipping[0], SHIPPING_COLUMNS) if shipping else None
+        )
+        rating = _rating_for(connection, listing["user_id"])
+        listing["seller_rating"] = (
+            _select(rating, ("total_ratings", "average_rating")) if rating else None
+        )
+    return listing
+
+
+def create_listing(
+    connection,
+    user_id,
+    category_id,
+    title,
+    listing_type,
+    price,
+    region,
+    status,
+    description,
+    image_url=None,
+):
+    """Skapar en ny annons"""
+    with connection:
+        return _select(
+            connection.insert(
+                "listings",
+                {
+                    "user_id": user_id,
+                    "category_id": category_id,
+                    "title": title,
+                    "listing_type": listing_type,
+                    "price": price,
+                    "region": region,
+                    "status": status,
+                    "description": description,
+                    "image_url": image_url,
+                },
+            ),
+            LISTING_COLUMNS,
+        )
+
+
+def update_listing(
+    connection,
+    listing_id,
+    category_id=None,
+    title=None,
+    listing_type=None,
+    price=None,
+    region=None,
+    status=None,
+    description=None,
+    image_url=None,
+):
+    """Uppdaterar en annons"""
+    values = {
+        "category_id": category_id,
+        "title": title,
+        "listing_type": listing_type,
+        "price": price,
+        "region": region,
+        "status": status,
+        "description": description,
+        "image_url": image_url,
+    }
+    changes = {column: value for column, value in values.items() if value is not None}
+    changes["updated_at"] = datetime.now()
+    with connection:
+        updated_listing = connection.update("listings", listing_id, changes)
+        updated_listing = _select(updated_listing, LISTING_COLUMNS)
+    if not updated_listing:
+        raise ValueError(f"Annons med id {listing_id} finns inte")
+    return updated_listing
+
+
+def delete_listing(connection, listing_id):
+    """Raderar en annons"""
+    with connection:
+        listing = connection.delete("listings", listing_id)
+    if not listing:
+        raise ValueError(f"Annons med id {listing_id} finns inte")
+    return {"message": "Annons raderad", "id": listing["id"]}
+
+
+def _words(text):
+    return _WORD.findall(text.lower()) if text else []
+
+
+def _rank(listing, terms):
+    """Relevans för fritexten, None om något ord saknas"""
+    title = _words(listing["title"])
+    description = _words(listing["description"])
+    rank = 0.0
+    for term in terms:
+        in_title = sum(word.startswith(term) for word in title)
+        in_description = sum(word.startswith(term) for word in description)
+        if not in_title and not in_description:
+            return None
+        rank += TITLE_WEIGHT * in_title + DESCRIPTION_WEIGHT * in_description
+    return rank / 10
+
+
+def _matching_listings(connection, query=None, **filters):
+    """(annons, relevans) för annonserna som matchar filter och fritext"""
+    terms = _words(query)
+    min_price = filters.get("min_price")
+    max_price = filters.get("max_price")
+    for listing in connection.tables["listings"].values():
+        if any(
+            filters.get(column) is not None and listing[column] != filters[column]
+            for column in ("category_id", "region", "listing_type", "status")
+        ):
+            continue
+        if min_price is not None and listing["price"] < _money(min_price):
+            continue
+        if max_price is not None and listing["price"] > _money(max_price):
+            continue
+        rank = _rank(listing, terms) if terms else None
+        if terms and rank is None:
+            continue
+        yield listing, rank
+
+
+def search_listings(connection, query=None, after=None, limit=None, **filters):
+    """
+    Söker annonser med filter och fritext i titel och beskrivning.
+    Med fritext sorteras träffarna på relevans, annars nyast först.
+    """
+    with connection:
+        rows = []
+        for listing, rank in _matching_listings(connection, query, **filters):
+            row = _select(listing, LISTING_COLUMNS)
+            if query and _words(query):
+                row["rank"] = rank
+            rows.append(row)
+    column = "rank" if query and _words(query) else "created_at"
+    return _sorted_page(rows, column, after, limit)
+
+
+def get_listing_facets(connection, query=None, **filters):
+    """Räknar träffar per kategori och region för samma filter som search_listings"""
+    categories = defaultdict(int)
+    regions = defaultdict(int)
+    with connection:
+        for listing, _ in _matching_listings(connection, query, **filters):
+            if listing["category_id"] is not None:
+                categories[listing["category_id"]] += 1
+            if listing["region"] is not None:
+                regions[listing["region"]] += 1
+    return {
+        "categories": [
+            {"category_id": category_id, "count": count}
+            for category_id, count in sorted(
+                categories.items(), key=lambda item: item[1], reverse=True
+            )
+        ],
+        "regions": [
+            {"region": region, "count": count}
+            for region, count in sorted(
+                regions.items(), key=lambda item: item[1], reverse=True
+            )
+        ],
+    }
+
+
+# Listings Watch list function
+
+
+def get_all_watched_listings(connection, user_id):
+    """Hämtar alla bevakade annonser för en användare"""
+    with connection:
+        return [
+            _select(watch)
+            for watch in connection.where("listings_watch_list", "user_id", user_id)
+        ]
+
+
+def add_to_watch_list(connection, user_id, listing_id):
+    """Lägger till annons i bevakningslista"""
+    with connection:
+        new_watch = _select(
+            connection.insert(
+                "listings_watch_list", {"user_id": user_id, "listing_id": listing_id}
+            )
+        )
+    events.publish_local(user_id, "watch", {"listing_id": listing_id})
+    return new_watch
+
+
+def remove_from_watch_list(connection, user_id, listing_id):
+    """Tar bort annons från bevakningslista"""
+    with connection:
+        watch = connection.delete("listings_watch_list", (user_id, listing_id))
+    if not watch:
+        raise ValueError("Annons fanns inte i bevakningslistan")
+    events.publish_local(user_id, "unwatch", {"listing_id": listing_id})
+    return {"message": "Annons borttagen från bevakningslista"}
+
+
+# Message function
+
+
+def _messages_for(connection, user_id):
+    """Användarens meddelanden, skickade och mottagna"""
+    sent = connection.where("messages", "sender_id", user_id)
+    received = [
+        message
+        for message in connection.where("messages", "recipient_id", user_id)
+        if message["sender_id"] != user_id
+    ]
+    return sent + received
+
+
+def get_all_messages_for_user(connection, user_id, after=None, limit=None):
+    """Hämtar meddelanden för en användare, en sida i taget (nyast först)"""
+    with connection:
+        messages = [_select(message) for message in _messages_for(connection, user_id)]
+    return _sorted_page(messages, "created_at", after, limit)
+
+
+def get_inbox(connection, user_id, after=None, limit=None):
+    """Hämtar användarens konversationer, en sida i taget (senast aktiv först)"""
+    threads = {}
+    with connection:
+        for message in _messages_for(connection, user_id):
+            if message["sender_id"] == user_id:
+                partner_id = message["recipient_id"]
+            else:
+                partner_id = message["sender_id"]
+            key = (partner_id, message["listing_id"])
+            thread = threads.get(key)
+            if thread is None:
+                thread = threads[key] = {
+                    "partner_id": partner_id,
+                    "listing_id": message["listing_id"],
+                    "last_message_id": None,
+                    "last_sender_id": None,
+                    "last_message": None,
+                    "last_message_at": None,
+                    "unread_count": 0,
+                }
+            if thread["last_message_id"] is None or (
+                message["created_at"],
+                message["id"],
+            ) > (thread["last_message_at"], thread["last_message_id"]):
+                thread["last_message_id"] = message["id"]
+                thread["last_sender_id"] = message["sender_id"]
+                thread["last_message"] = message["message_text"]
+                thread["last_message_at"] = message["created_at"]
+            if message["recipient_id"] == user_id and message["is_read"] is False:
+                thread["unread_count"] += 1
+    return _sorted_page(
+        list(threads.values()),
+        "last_message_at",
+        after,
+        limit,
+        id_column="last_message_id",
+    )
+
+
+def get_unread_message_count(connection, user_id):
+    """Hämtar antal olästa meddelanden för en användare"""
+    with connection:
+        return sum(
+            message["is_read"] is False
+            for message in connection.where("messages", "recipient_id", user_id)
+        )
+
+
+def get_conversation(connection, user1_id, user2_id, after=None, limit=None):
+    """Hämtar konversation mellan två användare, en sida i taget (nyast först)"""
+    with connection:
+        messages = [
+            _select(message)
+            for message in connection.where("messages", "sender_id", user1_id)
+            if message["recipient_id"] == user2_id
+        ]
+        if user1_id != user2_id:
+            messages += [
+                _select(message)
+                for message in connection.where("messages", "sender_id", user2_id)
+                if message["recipient_id"] == user1_id
+            ]
+    return _sorted_page(messages, "created_at", after, limit)
+
+
+def create_message(connection, sender_id, recipient_id, listing_id, message_text):
+    """Skapar ett nytt meddelande"""
+    with connection:
+        new_message = _select(
+            connection.insert(
+                "messages",
+                {
+                    "sender_id": sender_id,
+                    "recipient_id": recipient_id,
+                    "listing_id": listing_id,
+                    "message_text": message_text,
+                },
+            )
+        )
+    events.publish_local(recipient_id, "message", new_message)
+    return new_message
+
+
+def mark_message_as_read(connection, message_id):
+    """Markerar ett meddelande som läst"""
+    with connection:
+        message = connection.update("messages", message_id, {"is_read": True})
+    if not message:
+        raise ValueError(f"Meddelande med id {message_id} finns inte")
+    return _select(message)
+
+
+def delete_message(connection, message_id):
+    """Raderar ett meddelande"""
+    with connection:
+        message = connection.delete("messages", message_id)
+    if not message:
+        raise ValueError(f"Meddelande med id {message_id} finns inte")
+    return {"message": "Meddelande raderat", "id": message["id"]}
+
+
+# Transaction function
+
+
+def get_all_transactions(connection, after=None, limit=None):
+    """Hämtar alla transaktioner, en sida i taget (nyast först)"""
+    with connection:
+        return _page(connection, "transactions", after, limit)
+
+
+def get_transaction_by_id(connection, transaction_id):
+    """Hämtar en specifik transaktion"""
+    with connection:
+        transaction = _select(connection.get("transactions", transaction_id))
+    if not transaction:
+        raise ValueError(f"Transaktion med id {transaction_id} finns inte")
+    return transaction
+
+
+def get_transactions_by_user_id(connection, user_id):
+    """Hämtar alla transaktioner för en användare"""
+    columns = ("id", "user_id", "bid_id", "listing_id", "status", "amount")
+    with connection:
+        return [
+            _select(transaction, columns)
+            for transaction in connection.where("transactions", "user_id", user_id)
+        ]
+
+
+def create_transaction(connection, user_id, listing_id, amount, status, bid_id=None):
+    """Skapar en ny transaktion"""
+    with connection:
+        return _select(
+            connection.insert(
+                "transactions",
+                {
+                    "user_id": user_id,
+                    "listing_id": listing_id,
+                    "amount": amount,
+                    "status": status,
+                    "bid_id": bid_id,
+                },
+            )
+        )
+
+
+def update_transaction(connection, transaction_id, new_status):
+    """Uppdaterar status på en transaktion"""
+    changes = {} if new_status is None else {"status": new_status}
+    with connection:
+        transaction = _select(
+            connection.update("transactions", transaction_id, changes)
+        )
+    if not transaction:
+        raise ValueError(f"Transaktion med id {transaction_id} finns inte")
+    return transaction
+
+
+# Payment function
+
+
+def get_all_payments(connection, after=None, limit=None):
+    """Hämtar alla betalningar, en sida i taget (senast skapade först)"""
+    with connection:
+        return _page(connection, "payments", after, limit)
+
+
+def get_payment_by_transaction_id(connection, transaction_id):
+    """Hämtar betalning för en transaktion"""
+    with connection:
+        payments = connection.where("payments", "transaction_id", transaction_id)
+        payment = _select(payments[0]) if payments else None
+    if not payment:
+        raise ValueError(f"Betalning för transaktion {transaction_id} finns inte")
+    return payment
+
+
+def create_payment(
+    connection, transaction_id, listing_id, payment_method, payment_status, amount
+):
+    """Skapar en ny betalning"""
+    with connection:
+        return _select(
+            connection.insert(
+                "payments",
+                {
+                    "transaction_id": transaction_id,
+                    "listing_id": listing_id,
+                    "payment_method": payment_method,
+                    "payment_status": payment_status,
+                    "amount": amount,
+                },
+            )
+        )
+
+
+def update_payment_status(connection, payment_id, new_status):
+    """Uppdaterar betalningsstatus"""
+    with connection:
+        payment = _select(
+            connection.update("payments", payment_id, {"payment_status": new_status})
+        )
+    if not payment:
+        raise ValueError(f"Betalning med id {payment_id} finns inte")
+    return payment
+
+
+# Notification function
+
+
+def get_notifications_by_user_id(connection, user_id):
+    """Hämtar alla notifieringar för en användare"""
+    with connection:
+        return [
+            _select(notification)
+            for notification in connection.where("notifications", "user_id", user_id)
+        ]
+
+
+def get_unread_notifications(connection, user_id):
+    """Hämtar olästa notifieringar för en användare"""
+    with connection:
+        return [
+            _select(notification)
+            for notification in connection.where("notifications", "user_id", user_id)
+            if notification["is_read"] is False
+        ]
+
+
+def create_notification(
+    connection, user_id, listing_id, notification_type, notification_message
+):
+    """Skapar en ny notifiering"""
+    with connection:
+        new_notification = _select(
+            connection.insert(
+                "notifications",
+                {
+                    "user_id": user_id,
+                    "listing_id": listing_id,
+                    "notification_type": notification_type,
+                    "notification_message": notification_message,
+                },
+            )
+        )
+    events.publish_local(user_id, "notification", new_notification)
+    return new_notification
+
+
+def notify_watchers(connection, fanout_events):
+    """
+    Skapar en notis till varje bevakare av annonsen för varje händelse
+    (listing_id, notification_type, notification_message). Returnerar antal notiser.
+    """
+    created = 0
+    notified = []
+    with connection:
+        for listing_id, notification_type, notification_message in fanout_events:
+            watches = connection.where("listings_watch_list", "listing_id", listing_id)
+            for watch in watches:
+                connection.insert(
+                    "notifications",
+                    {
+                        "user_id": watch["user_id"],
+                        "listing_id": listing_id,
+                        "notification_type": notification_type,
+                        "notification_message": notification_message,
+                    },
+                )
+            if watches:
+                created += len(watches)
+                notified.append((listing_id, notification_type, notification_message))
+    # En händelse per annons, som db.notify_watchers
+    for listing_id, notification_type, notification_message in notified:
+        events.publish_watchers_local(
+            listing_id,
+            "notification",
+            {
+                "listing_id": listing_id,
+                "notification_type": notification_type,
+                "notification_message": notification_message,
+            },
+        )
+    return created
+
+
+def mark_all_notifications_as_read(connection, user_id):
+    """Markerar alla notifieringar som lästa"""
+    with connection:
+        return [
+            _select(
+                connection.update(
+                    "notifications", notification["id"], {"is_read": True}
+                )
+            )
+            for notification in connection.where("notifications", "user_id", user_id)
+        ]
+
+
+def delete_notification(connection, notification_id):
+    """Raderar en notifiering"""
+    with connection:
+        notification = connection.delete("notifications", notification_id)
+    if not notification:
+        raise ValueError(f"Notifiering med id {notification_id} finns inte")
+    return {"message": "Notifiering raderad", "id": notification["id"]}
+
+
+# Listning_comments function
+
+
+def get_comments_by_listing_id(connection, listing_id):
+    """Hämtar alla kommentarer för en annons"""
+    columns = ("id", "user_id", "listing_id", "comment_text", "answer_text")
+    with connection:
+        return [
+            _select(comment, columns)
+            for comment in connection.where(
+                "listing_comments", "listing_id", listing_id
+            )
+        ]
+
+
+def get_comments_by_user_id(connection, user_id):
+    """Hämtar alla kommentarer från en användare"""
+    with connection:
+        return [
+            _select(comment)
+            for comment in connection.where("listing_comments", "user_id", user_id)
+        ]
+
+
+def create_listing_comment(connection, user_id, listing_id, comment_text):
+    """Skapar en ny kommentar"""
+    with connection:
+        return _select(
+            connection.insert(
+                "listing_comments",
+                {
+                    "user_id": user_id,
+                    "listing_id": listing_id,
+                    "comment_text": comment_text,
+                },
+            )
+        )
+
+
+def answer_comment(connection, comment_id, answer_text):
+    """Svarar på en kommentar"""
+    with connection:
+        comment = _select(
+            connection.update(
+                "listing_comments",
+                comment_id,
+                {"answer_text": answer_text, "answered_at": datetime.now()},
+            )
+        )
+    if not comment:
+        raise ValueError(f"Kommentar med id {comment_id} finns inte")
+    return comment
+
+
+def delete_listing_comment(connection, comment_id):
+    """Raderar en kommentar"""
+    with connection:
+        comment = connection.delete("listing_comments", comment_id)
+    if not comment:
+        raise ValueError(f"Kommentar med id {comment_id} finns inte")
+    return {"message": "Kommentar raderad", "id": comment["id"]}
+
+
+# Shipping_details functions
+
+
+def get_shipping_by_listing_id(connection, listing_id):
+    """Hämtar fraktdetaljer för en annons"""
+    with connection:
+        shipping = connection.where("shipping_details", "listing_id", listing_id)
+        return _select(shipping[0], SHIPPING_COLUMNS) if shipping else None
+
+
+def create_shipping_details(
+    connection,
+    user_id,
+    listing_id,
+    shipping_method,
+    shipping_cost,
+    estimated_delivery_days=None,
+    tracking_number=None,
+    status=None,
+    shipped_at=None,
+):
+    """Skapar fraktdetaljer"""
+    with connection:
+        return _select(
+            connection.insert(
+                "shipping_details",
+                {
+                    "user_id": user_id,
+                    "listing_id": listing_id,
+                    "shipping_method": shipping_method,
+                    "shipping_cost": shipping_cost,
+                    "estimated_delivery_days": estimated_delivery_days,
+                    "tracking_number": tracking_number,
+                    "status": status,
+                    "shipped_at": shipped_at,
+                },
+            )
+        )
+
+
+def update_shipping_tracking(
+    connection, shipping_id, tracking_number, status, shipped_at=None
+):
+    """Uppdaterar spårningsinformation"""
+    values = {
+        "tracking_number": tracking_number,
+        "shipped_at": shipped_at,
+        "status": status,
+    }
+    changes = {column: value for column, value in values.items() if value is not None}
+    with connection:
+        shipping = _select(connection.update("shipping_details", shipping_id, changes))
+    if not shipping:
+        raise ValueError(f"Fraktdetaljer med id {shipping_id} finns inte")
+    return shipping
+
+
+# Mäter alla funktioner ovan som tar en koppling, se metrics.py
+metrics.instrument(globals())
@@ -0,0 +1,379 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import re
+import threading
+import time
+
+from psycopg2 import extensions
+from dotenv import load_dotenv
+
+import queries
+import tracing
+
+load_dotenv()
+
+"""
+Mätvärden per db-funktion och logg över långsamma frågor.
+
+instrument(globals()) i slutet av db.py och async_db.py lägger en wrapper runt
+varje funktion som tar en koppling först. Den räknar anrop, fel per feltyp,
+returnerade rader och svarstid i ett histogram. render() skriver ut allt i
+Prometheus textformat för /metrics.
+
+Frågorna själva mäts på lägre nivå: kopplingar från db_setup.get_connection
+använder InstrumentedConnection vars cursors tar tid på varje execute, och
+asyncpg-kopplingar får en query logger (watch_asyncpg). Frågor som tar längre
+än DB_SLOW_QUERY_MS loggas med SQL, parametrar och vilken db-funktion som körde
+dem. Med DB_EXPLAIN_SLOW=1 loggas även EXPLAIN (ANALYZE, BUFFERS) för
+långsamma läsfrågor från psycopg2. ANALYZE kör frågan en gång till, därför
+aldrig för INSERT/UPDATE/DELETE.
+
+- DB_METRICS: 0 för att inte lägga någon wrapper runt db-funktionerna
+- DB_SLOW_QUERY_MS: gräns i millisekunder för långsamma frågor (0 = av)
+- DB_EXPLAIN_SLOW: 1 för att logga frågeplanen för långsamma läsfrågor
+"""
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("DB_METRICS", "1") == "1"
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+EXPLAIN_SLOW = os.getenv("DB_EXPLAIN_SLOW", "0") == "1"
+
+# Övre gränser i sekunder för histogrammet, som Prometheus standard
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# Längsta parametertext i loggen
+MAX_PARAMETER_LENGTH = 200
+
+# db-funktionen som körs just nu, så att en långsam fråga kan knytas till den
+_current_function = contextvars.ContextVar("db_function", default=None)
+
+
+class _FunctionStats:
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.errors = {}
+        self.slow_queries = 0
+
+
+class Metrics:
+    """Räknare och histogram per (modul, funktion)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._functions = {}
+
+    def _stats(self, key):
+        stats = self._functions.get(key)
+        if stats is None:
+            stats = self._functions.setdefault(key, _FunctionStats())
+        return stats
+
+    def observe(self, key, seconds, rows=0, error=None):
+        """Ett anrop till en db-funktion"""
+        with self._lock:
+            stats = self._stats(key)
+            stats.calls += 1
+            stats.rows += rows
+            stats.seconds += seconds
+            stats.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+            if error is not None:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+
+    def observe_slow_query(self, key):
+        with self._lock:
+            self._stats(key).slow_queries += 1
+
+    def stats(self):
+        """Anrop, fel och medeltid per funktion, mest total tid först"""
+        with self._lock:
+            functions = sorted(
+                self._functions.items(), key=lambda item: -item[1].seconds
+            )
+            return {
+                f"{module}.{name}": {
+                    "calls": stats.calls,
+                    "rows": stats.rows,
+                    "total_ms": round(stats.seconds * 1000, 3),
+                    "avg_ms": (
+                        round(stats.seconds * 1000 / stats.calls, 3)
+                        if stats.calls
+                        else None
+                    ),
+                    "errors": dict(stats.errors),
+                    "slow_queries": stats.slow_queries,
+                }
+                for (module, name), stats in functions
+            }
+
+    def render(self):
+        """Alla mätvärden i Prometheus textformat"""
+        with self._lock:
+            functions = sorted(self._functions.items())
+            lines = [
+                "# HELP tradera_db_calls_total Anrop per db-funktion",
+                "# TYPE tradera_db_calls_total counter",
+            ]
+            for key, stats in functions:
+                lines.append(f"tradera_db_calls_total{_labels(key)} {stats.calls}")
+
+            lines += [
+                "# HELP tradera_db_rows_total Rader som db-funktionen returnerat",
+                "# TYPE tradera_db_rows_total counter",
+            ]
+            for key, stats in functions:
+                lines.append(f"tradera_db_rows_total{_labels(key)} {stats.rows}")
+
+            lines += [
+                "# HELP tradera_db_errors_total Undantag per db-funktion och feltyp",
+                "# TYPE tradera_db_errors_total counter",
+            ]
+            for key, stats in functions:
+                for error, count in sorted(stats.errors.items()):
+                    labels = _labels(key, error=error)
+                    lines.append(f"tradera_db_errors_total{labels} {count}")
+
+            lines += [
+                "# HELP tradera_db_slow_queries_total Frågor över DB_SLOW_QUERY_MS",
+                "# TYPE tradera_db_slow_queries_total counter",
+            ]
+            for key, stats in functions:
+                if stats.slow_queries:
+                    labels = _labels(key)
+                    lines.append(
+                        f"tradera_db_slow_queries_total{labels} {stats.slow_queries}"
+                    )
+
+            lines += [
+                "# HELP tradera_db_duration_seconds Svarstid per db-funktion",
+                "# TYPE tradera_db_duration_seconds histogram",
+            ]
+            for key, stats in functions:
+                cumulative = 0
+                for bound, count in zip((*BUCKETS, "+Inf"), stats.buckets):
+                    cumulative += count
+                    labels = _labels(key, le=bound)
+                    lines.append(
+                        f"tradera_db_duration_seconds_bucket{labels} {cumulative}"
+                    )
+                labels = _labels(key)
+                lines.append(f"tradera_db_duration_seconds_sum{labels} {stats.seconds}")
+                lines.append(f"tradera_db_duration_seconds_count{labels} {stats.calls}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._functions.clear()
+
+
+def _labels(key, **extra):
+    module, function = key
+    labels = {"module": module, "function": function, **extra}
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+def _count_rows(result):
+    """Rader i ett returvärde: lista, (lista, nästa cursor), en rad eller inget"""
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    return 1
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+def timed(function, module=None):
+    """Dekorator som mäter en db-funktion, fungerar även för async"""
+    key = (module or function.__module__, function.__name__)
+
+    if inspect.iscoroutinefunction(function):
+
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            token = _current_function.set(key)
+            started = time.perf_counter()
+            try:
+                result = await function(*args, **kwargs)
+            except BaseException as error:
+                _finished(key, token, started, error=type(error).__name__)
+                raise
+            _finished(key, token, started, _count_rows(result))
+            return result
+
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        token = _current_function.set(key)
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:
+            _finished(key, token, started, error=type(error).__name__)
+            raise
+        _finished(key, token, started, _count_rows(result))
+        return result
+
+    return wrapper
+
+
+def _finished(key, token, started, rows=0, error=None):
+    seconds = time.perf_counter() - started
+    _current_function.reset(token)
+    _metrics.observe(key, seconds, rows, error)
+    if _current_function.get() is None:
+        # Yttersta db-funktionen, räknas som databastid för requesten
+        tracing.record("db", started, seconds, key[1])
+
+
+def instrument(namespace):
+    """Lägger timed runt alla funktioner i modulen som tar connection först"""
+    if not METRICS_ENABLED:
+        return
+    module = namespace["__name__"]
+    for name, value in list(namespace.items()):
+        if name.startswith("_") or not inspect.isfunction(value):
+            continue
+        if value.__module__ != module:
+            # Importerad från en annan modul, mäts där
+            continue
+        parameters = list(inspect.signature(value).parameters)
+        if parameters and parameters[0] == "connection":
+            namespace[name] = timed(value, module)
+
+
+# Långsamma frågor
+
+
+def _format_parameters(query, parameters):
+    if not parameters:
+        return ""
+    if "password" in query.lower():
+        return "[dolda]"
+    text = repr(tuple(parameters))
+    if len(text) > MAX_PARAMETER_LENGTH:
+        text = text[:MAX_PARAMETER_LENGTH] + "..."
+    return text
+
+
+def _log_slow_query(seconds, query, parameters, plan=None):
+    key = _current_function.get()
+    if key is not None:
+        _metrics.observe_slow_query(key)
+    function = ".".join(key) if key else "okänd funktion"
+    message = "Långsam fråga %.1f ms i %s: %s parametrar=%s"
+    arguments = [
+        seconds * 1000,
+        function,
+        " ".join(query.split()),
+        _format_parameters(query, parameters),
+    ]
+    if plan:
+        message += "\n%s"
+        arguments.append(plan)
+    logger.warning(message, *arguments)
+
+
+def _is_read_only(query):
+    """SELECT utan skrivningar, som är säkert att köra en gång till med ANALYZE"""
+    text = query.lstrip().upper()
+    if not text.startswith(("SELECT", "WITH")):
+        return False
+    return re.search(r"\b(INSERT|UPDATE|DELETE|FOR UPDATE|NOTIFY)\b", text) is None
+
+
+def _explain(cursor, query, parameters):
+    """EXPLAIN (ANALYZE, BUFFERS) i en savepoint, så att fel inte påverkar anroparen"""
+    connection = cursor.connection
+    savepoint = not connection.autocommit
+    try:
+        # Inte connection.cursor(), EXPLAIN ska inte själv loggas som långsam
+        with extensions.cursor(connection) as explain_cursor:
+            if savepoint:
+                explain_cursor.execute("SAVEPOINT explain_slow_query")
+            try:
+                explain_cursor.execute(
+                    f"EXPLAIN (ANALYZE, BUFFERS) {query}", parameters
+                )
+                return "\n".join(row[0] for row in explain_cursor.fetchall())
+            finally:
+                if savepoint:
+                    explain_cursor.execute("ROLLBACK TO SAVEPOINT explain_slow_query")
+    except Exception as error:
+        return f"Kunde inte köra EXPLAIN: {error}"
+
+
+def _statement_sql(query):
+    """SQL bakom EXECUTE namn(...) från queries.py, annars frågan själv"""
+    match = re.match(r"\s*EXECUTE (\w+)", query)
+    if match is None:
+        return query
+    statement = queries.get_registry().statement(match.group(1))
+    return statement.sql if statement else query
+
+
+class _TimedCursor:
+    """Mixin som tar tid på execute och loggar långsamma frågor"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        result = super().execute(query, vars)
+        elapsed = time.perf_counter() - started
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            text = query.decode() if isinstance(query, bytes) else str(query)
+            sql = _statement_sql(text)
+            plan = None
+            if EXPLAIN_SLOW and self.name is None and _is_read_only(sql):
+                plan = _explain(self, text, vars)
+            _log_slow_query(elapsed, sql, vars, plan)
+        return result
+
+
+_timed_cursors = {}
+
+
+def _timed_cursor(cursor_factory):
+    timed_cursor = _timed_cursors.get(cursor_factory)
+    if timed_cursor is None:
+        timed_cursor = type(
+            f"Timed{cursor_factory.__name__}", (_TimedCursor, cursor_factory), {}
+        )
+        _timed_cursors[cursor_factory] = timed_cursor
+    return timed_cursor
+
+
+class InstrumentedConnection(extensions.connection):
+    """psycopg2-koppling vars cursors loggar långsamma frågor"""
+
+    def cursor(self, *args, **kwargs):
+        cursor_factory = (
+            kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+        )
+        kwargs["cursor_factory"] = _timed_cursor(cursor_factory)
+        return super().cursor(*args, **kwargs)
+
+
+def watch_asyncpg(connection):
+    """Loggar långsamma frågor på en asyncpg-koppling"""
+    if SLOW_QUERY_MS:
+        connection.add_query_logger(_log_asyncpg_query)
+
+
+def _log_asyncpg_query(record):
+    if record.exception is None and record.elapsed * 1000 >= SLOW_QUERY_MS:
+        _log_slow_query(record.elapsed, record.query, record.args)
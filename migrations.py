@@ -0,0 +1,451 @@
+import re
+
+"""
+Versionerade migrationer som körs efter create_tables().
+
+Varje migration är (version, beskrivning, lista med SQL-satser) och körs i
+versionsordning. Körda versioner sparas i tabellen schema_version så att varje
+migration bara körs en gång. Satser med CREATE/DROP INDEX CONCURRENTLY körs utanför
+transaktion så att tabellen inte låses för skrivningar medan indexet byggs,
+övriga satser i en transaktion med lock_timeout så att en migration hellre
+avbryts än blockerar trafiken. Uppdateringar av befintliga rader (Backfill) körs
+efter den transaktionen i id-intervall med en commit per intervall, så att bara
+ett intervall i taget är radlåst. Alla satser ska gå att köra om (IF NOT EXISTS,
+WHERE ... IS NULL och liknande).
+
+Körs med `python db_setup.py migrate` eller `python db_setup.py migrate --dry-run`.
+"""
+
+LOCK_TIMEOUT = "5s"
+
+# Lås-id för pg_advisory_lock så att två migreringar inte körs samtidigt
+MIGRATION_LOCK_ID = 727100
+
+# Antal id per transaktion i en Backfill
+BACKFILL_BATCH_SIZE = 5000
+
+
+class Backfill:
+    """
+    En sats som skriver befintliga rader och körs i intervall över table.id.
+    Satsen får %(first_id)s och %(last_id)s och ska bara röra raderna i intervallet.
+    """
+
+    def __init__(self, table, statement):
+        self.table = table
+        self.statement = statement
+
+    def __str__(self):
+        return (
+            f"-- i omgångar om {BACKFILL_BATCH_SIZE} id i {self.table}{self.statement}"
+        )
+
+
+MIGRATIONS = [
+    (
+        1,
+        "Index för WHERE och ORDER BY i db.py",
+        [
+            # Sidvisning med (sorteringskolumn, id), se pagination.py
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bids_created_at_id ON bids (created_at, id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reviews_created_at_id ON reviews (created_at, id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_images_created_at_id ON images (created_at, id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_created_at_id ON reports (created_at, id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_user_since_id ON users (user_since, id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_created_at_id ON listings (created_at, id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transactions_created_at_id ON transactions (created_at, id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_paid_at_id ON payments (paid_at, id)",
+            # get_bids_for_listing
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bids_listing_id_bid_amount ON bids (listing_id, bid_amount DESC)",
+            # get_reviews_for_user
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reviews_reviewed_user_id_created_at ON reviews (reviewed_user_id, created_at DESC)",
+            # get_images_for_listing
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_images_listing_id_created_at ON images (listing_id, created_at)",
+            # get_reports_for_listing
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reports_listing_id_created_at ON reports (listing_id, created_at DESC)",
+            # get_user_rating_by_user_id, update_user_rating, delete_user_rating
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_ratings_user_id ON user_ratings (user_id)",
+            # get_all_messages_for_user (sender_id OR recipient_id) och get_conversation
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_sender_recipient_created_at ON messages (sender_id, recipient_id, created_at)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_recipient_sender_created_at ON messages (recipient_id, sender_id, created_at)",
+            # get_transactions_by_user_id
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transactions_user_id ON transactions (user_id)",
+            # get_payment_by_transaction_id
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_transaction_id ON payments (transaction_id)",
+            # get_notifications_by_user_id, mark_all_notifications_as_read
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notifications_user_id ON notifications (user_id)",
+            # get_unread_notifications, bara olästa rader hamnar i indexet
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notifications_user_id_unread ON notifications (user_id) WHERE is_read = FALSE",
+            # get_comments_by_listing_id, get_comments_by_user_id
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listing_comments_listing_id ON listing_comments (listing_id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listing_comments_user_id ON listing_comments (user_id)",
+            # get_shipping_by_listing_id
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_shipping_details_listing_id ON shipping_details (listing_id)",
+        ],
+    ),
+    (
+        2,
+        "Fritextsökning och filterindex för annonser",
+        [
+            # Kolumnen läggs till utan default så att tabellen inte skrivs om
+            "ALTER TABLE listings ADD COLUMN IF NOT EXISTS search_vector tsvector",
+            """
+            CREATE OR REPLACE FUNCTION listings_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector :=
+                    setweight(to_tsvector('swedish', coalesce(NEW.title, '')), 'A') ||
+                    setweight(to_tsvector('swedish', coalesce(NEW.description, '')), 'B');
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+            """,
+            "DROP TRIGGER IF EXISTS listings_search_vector_trigger ON listings",
+            """
+            CREATE TRIGGER listings_search_vector_trigger
+            BEFORE INSERT OR UPDATE OF title, description ON listings
+            FOR EACH ROW EXECUTE FUNCTION listings_search_vector_update()
+            """,
+            # Befintliga rader, triggern tar hand om nya och ändrade
+            Backfill(
+                "listings",
+                """
+                UPDATE listings SET
+                    search_vector =
+                        setweight(to_tsvector('swedish', coalesce(title, '')), 'A') ||
+                        setweight(to_tsvector('swedish', coalesce(description, '')), 'B')
+                WHERE id BETWEEN %(first_id)s AND %(last_id)s AND search_vector IS NULL
+                """,
+            ),
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_search_vector ON listings USING GIN (search_vector)",
+            # search_listings utan fritext: filter + nyast först
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_category_id_created_at ON listings (category_id, created_at, id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_region_created_at ON listings (region, created_at, id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_status_price ON listings (status, price)",
+        ],
+    ),
+    (
+        3,
+        "Högsta bud och antal bud direkt på annonsen",
+        [
+            "ALTER TABLE listings ADD COLUMN IF NOT EXISTS current_high_bid DECIMAL(10, 2)",
+            # Konstant default skriver inte om tabellen (PostgreSQL 11+)
+            "ALTER TABLE listings ADD COLUMN IF NOT EXISTS bid_count INT NOT NULL DEFAULT 0",
+            Backfill(
+                "listings",
+                """
+                UPDATE listings SET
+                    current_high_bid = totals.high_bid,
+                    bid_count = totals.bid_count
+                FROM (
+                    SELECT listing_id, MAX(bid_amount) AS high_bid, COUNT(*) AS bid_count
+                    FROM bids
+                    WHERE listing_id BETWEEN %(first_id)s AND %(last_id)s
+                    GROUP BY listing_id
+                ) AS totals
+                WHERE listings.id = totals.listing_id
+                """,
+            ),
+        ],
+    ),
+    (
+        4,
+        "Löpande summa i user_ratings och en rad per användare",
+        [
+            "ALTER TABLE user_ratings ADD COLUMN IF NOT EXISTS rating_sum BIGINT NOT NULL DEFAULT 0",
+            # Dubbletter skulle stoppa det unika indexet, behåll den äldsta raden
+            """
+            DELETE FROM user_ratings AS duplicate
+            USING user_ratings AS kept
+            WHERE duplicate.user_id = kept.user_id AND duplicate.id > kept.id
+            """,
+            # Utgå från recensionerna, de manuella värdena kan ha glidit isär
+            Backfill(
+                "user_ratings",
+                """
+                UPDATE user_ratings SET
+                    total_ratings = totals.total_ratings,
+                    rating_sum = COALESCE(totals.rating_sum, 0),
+                    average_rating = COALESCE(totals.average_rating, 0)
+                FROM user_ratings AS target
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS total_ratings, SUM(rating) AS rating_sum,
+                           ROUND(AVG(rating), 2) AS average_rating
+                    FROM reviews
+                    WHERE reviews.reviewed_user_id = target.user_id
+                ) AS totals
+                WHERE user_ratings.id = target.id
+                  AND target.id BETWEEN %(first_id)s AND %(last_id)s
+                """,
+            ),
+            # Intervallen går över users.id, som reviewed_user_id pekar på
+            Backfill(
+                "users",
+                """
+                INSERT INTO user_ratings (user_id, total_ratings, rating_sum, average_rating)
+                SELECT reviewed_user_id, COUNT(*), SUM(rating), ROUND(AVG(rating), 2)
+                FROM reviews
+                WHERE reviewed_user_id BETWEEN %(first_id)s AND %(last_id)s
+                  AND NOT EXISTS (
+                    SELECT 1 FROM user_ratings
+                    WHERE user_ratings.user_id = reviews.reviewed_user_id
+                  )
+                GROUP BY reviewed_user_id
+                """,
+            ),
+            # Krävs för ON CONFLICT (user_id) och ersätter det vanliga indexet
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_user_ratings_user_id_unique ON user_ratings (user_id)",
+            "DROP INDEX CONCURRENTLY IF EXISTS idx_user_ratings_user_id",
+        ],
+    ),
+    (
+        5,
+        "Index för olästa meddelanden per tråd",
+        [
+            # Olästa per tråd i get_inbox och totalen i get_unread_message_count
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_unread ON messages (recipient_id, sender_id, listing_id) WHERE is_read = FALSE",
+        ],
+    ),
+    (
+        6,
+        "Standardvärde för notifications.created_at",
+        [
+            # create_notification anger inte created_at och kolumnen är NOT NULL
+            "ALTER TABLE notifications ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP",
+        ],
+    ),
+    (
+        7,
+        "Index för bevakare per annons",
+        [
+            # notify_watchers, primärnyckeln börjar på user_id
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_watch_list_listing_id ON listings_watch_list (listing_id, user_id)",
+        ],
+    ),
+    (
+        8,
+        "Versionsstämplar för ETag och Last-Modified",
+        [
+            # Sätts av update_listing, create_bid och delete_bid. Med tidszon så att
+            # Last-Modified blir rätt i GMT. Befintliga rader får tiden för migrationen
+            "ALTER TABLE listings ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP",
+            # COUNT och MAX(id) i get_reviews_version och get_images_version som index-only scan
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reviews_reviewed_user_id_id ON reviews (reviewed_user_id, id)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_images_listing_id_id ON images (listing_id, id)",
+        ],
+    ),
+    (
+        9,
+        "Sammanfattning per konversation för inkorgen",
+        [
+            # En rad per användare, motpart och annons, skrivs av create_message,
+            # mark_message_as_read och delete_message i db.py
+            """
+            CREATE TABLE IF NOT EXISTS message_threads (
+                user_id BIGINT NOT NULL,
+                partner_id BIGINT NOT NULL,
+                listing_id BIGINT NOT NULL,
+                last_message_id BIGINT NOT NULL,
+                last_sender_id BIGINT NOT NULL,
+                last_message TEXT NOT NULL,
+                last_message_at TIMESTAMP NOT NULL,
+                unread_count INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, partner_id, listing_id)
+            )
+            """,
+            # Samma fråga som db.message_threads_query, per intervall av users.id
+            Backfill(
+                "users",
+                """
+                INSERT INTO message_threads (
+                    user_id, partner_id, listing_id, last_message_id, last_sender_id,
+                    last_message, last_message_at, unread_count
+                )
+                SELECT DISTINCT ON (user_id, partner_id, listing_id)
+                    user_id, partner_id, listing_id, id, sender_id, message_text,
+                    created_at,
+                    COUNT(*) FILTER (WHERE recipient_id = user_id AND is_read = FALSE)
+                        OVER (PARTITION BY user_id, partner_id, listing_id)
+                FROM (
+                    SELECT sender_id AS user_id, recipient_id AS partner_id, listing_id,
+                           id, sender_id, recipient_id, message_text, created_at, is_read
+                    FROM messages
+                    UNION ALL
+                    SELECT recipient_id, sender_id, listing_id,
+                           id, sender_id, recipient_id, message_text, created_at, is_read
+                    FROM messages
+                    WHERE recipient_id <> sender_id
+                ) AS own_messages
+                WHERE user_id BETWEEN %(first_id)s AND %(last_id)s
+                ORDER BY user_id, partner_id, listing_id, created_at DESC, id DESC
+                ON CONFLICT (user_id, partner_id, listing_id) DO UPDATE SET
+                    last_message_id = EXCLUDED.last_message_id,
+                    last_sender_id = EXCLUDED.last_sender_id,
+                    last_message = EXCLUDED.last_message,
+                    last_message_at = EXCLUDED.last_message_at,
+                    unread_count = EXCLUDED.unread_count
+                """,
+            ),
+            # get_inbox: en sida av användarens trådar, senast aktiv först
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_message_threads_user_id_last_message ON message_threads (user_id, last_message_at DESC, last_message_id DESC)",
+        ],
+    ),
+    (
+        10,
+        "Betalningar sidas på id",
+        [
+            # get_all_payments sidar på primärnyckeln eftersom paid_at kan vara NULL
+            "DROP INDEX CONCURRENTLY IF EXISTS idx_payments_paid_at_id",
+        ],
+    ),
+]
+
+
+def _is_backfill(statement):
+    return isinstance(statement, Backfill)
+
+
+def _is_concurrent(statement):
+    return not _is_backfill(statement) and "CONCURRENTLY" in statement.upper()
+
+
+def _index_name(statement):
+    match = re.search(
+        r"INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", statement, re.I
+    )
+    return match.group(1) if match else None
+
+
+def ensure_version_table(connection):
+    """Skapar schema_version om den inte finns"""
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+            """
+            )
+
+
+def get_applied_versions(connection):
+    """Hämtar vilka migrationer som redan körts"""
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT version FROM schema_version")
+            return {row[0] for row in cursor.fetchall()}
+
+
+def get_pending_migrations(connection):
+    """Hämtar migrationer som inte körts ännu, i versionsordning"""
+    applied = get_applied_versions(connection)
+    return [
+        migration
+        for migration in sorted(MIGRATIONS, key=lambda migration: migration[0])
+        if migration[0] not in applied
+    ]
+
+
+def _drop_invalid_index(connection, statement):
+    """Tar bort ett ogiltigt index som ett avbrutet CONCURRENTLY-bygge lämnat kvar"""
+    name = _index_name(statement)
+    if not name:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT 1 FROM pg_index
+            JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+            WHERE pg_class.relname = %s AND NOT pg_index.indisvalid
+        """,
+            (name,),
+        )
+        if cursor.fetchone():
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def _backfill(connection, backfill):
+    """Kör en Backfill intervall för intervall, med en commit efter varje"""
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT MIN(id), MAX(id) FROM {backfill.table}")
+            first_id, last_id = cursor.fetchone()
+    if first_id is None:
+        return
+    for start in range(first_id, last_id + 1, BACKFILL_BATCH_SIZE):
+        with connection:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+                cursor.execute(
+                    backfill.statement,
+                    {"first_id": start, "last_id": start + BACKFILL_BATCH_SIZE - 1},
+                )
+
+
+def _apply(connection, version, description, statements):
+    """Kör en migration och registrerar den i schema_version"""
+    transactional = [
+        s for s in statements if not _is_concurrent(s) and not _is_backfill(s)
+    ]
+    backfills = [s for s in statements if _is_backfill(s)]
+    concurrent = [s for s in statements if _is_concurrent(s)]
+
+    # Bara schemaändringar här, transaktionen ska vara kort
+    if transactional:
+        with connection:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+                for statement in transactional:
+                    cursor.execute(statement)
+
+    for backfill in backfills:
+        _backfill(connection, backfill)
+
+    # CREATE INDEX CONCURRENTLY får inte köras i en transaktion
+    connection.autocommit = True
+    try:
+        for statement in concurrent:
+            _drop_invalid_index(connection, statement)
+            with connection.cursor() as cursor:
+                cursor.execute(statement)
+    finally:
+        connection.autocommit = False
+
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (version, description),
+            )
+
+
+def migrate(connection, dry_run=False):
+    """
+    Kör alla migrationer som inte körts ännu.
+    Med dry_run skrivs satserna bara ut. Returnerar de versioner som körts (eller skulle köras).
+    """
+    ensure_version_table(connection)
+
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    connection.autocommit = False
+
+    try:
+        pending = get_pending_migrations(connection)
+        for version, description, statements in pending:
+            print(f"Migration {version}: {description}")
+            if dry_run:
+                for statement in statements:
+                    print(f"  {statement};")
+                continue
+            _apply(connection, version, description, statements)
+        return [migration[0] for migration in pending]
+    finally:
+        connection.rollback()
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        connection.autocommit = False
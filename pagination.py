@@ -0,0 +1,100 @@
+import base64
+import json
+import os
+from datetime import date, datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+"""
+Keyset-paginering (cursor) för listor.
+
+Istället för OFFSET fortsätter nästa sida efter sista raden på föregående sida:
+WHERE (created_at, id) < (sista created_at, sista id). Med ett index på
+(created_at, id) kostar varje sida lika mycket oavsett hur långt in man bläddrar.
+Cursorn som skickas till klienten är base64-kodad och ska ses som opak.
+Sorteringskolumnen måste vara NOT NULL, en rad med NULL hamnar utanför
+jämförelsen och hoppas över eller kommer igen. Saknar tabellen en sådan kolumn
+sorteras på id.
+"""
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+
+# Typ på sorteringsvärdet per kolumn. En cursor från en lista som sorteras på
+# något annat ger ValueError (400) istället för ett fel i SQL-frågan
+CURSOR_TYPES = {
+    "created_at": datetime,
+    "user_since": datetime,
+    "last_message_at": datetime,
+    "rank": float,
+    "id": int,
+}
+
+
+def page_size(limit=None):
+    """Returnerar sidstorleken, begränsad till MAX_PAGE_SIZE"""
+    if limit is None:
+        return PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def encode_cursor(value, row_id):
+    """Gör en opak cursor av sorteringsvärdet och id för sista raden"""
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, column):
+    """Tolkar en cursor för en lista sorterad på column, returnerar (värde, id) eller None"""
+    if not cursor:
+        return None
+    value_type = CURSOR_TYPES[column]
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        if type(row_id) is not int or isinstance(value, bool):
+            raise ValueError("Ogiltig cursor")
+        if value_type is datetime:
+            value = datetime.fromisoformat(value)
+        elif value_type is float and isinstance(value, (int, float)):
+            value = float(value)
+        elif type(value) is not value_type:
+            raise ValueError("Ogiltig cursor")
+        return value, row_id
+    except (ValueError, TypeError):
+        raise ValueError("Ogiltig cursor")
+
+
+def seek_condition(column, cursor, placeholders=("%s", "%s"), id_column="id"):
+    """
+    Returnerar (villkor, parametrar) för sidan efter cursorn, ("", []) för första sidan.
+    Sorteringen måste vara ORDER BY column DESC, id_column DESC, eller bara
+    ORDER BY id_column DESC när column är id_column.
+    asyncpg skickar in sina egna placeholders, t.ex. ("$1", "$2").
+    """
+    position = decode_cursor(cursor, column)
+    if position is None:
+        return "", []
+    first, second = placeholders
+    if column == id_column:
+        return f"{id_column} < {first}", [position[1]]
+    return f"({column}, {id_column}) < ({first}, {second})", list(position)
+
+
+def seek_clause(column, cursor, placeholders=("%s", "%s"), id_column="id"):
+    """Som seek_condition men som en hel WHERE-sats"""
+    condition, params = seek_condition(column, cursor, placeholders, id_column)
+    return (f"WHERE {condition}" if condition else ""), params
+
+
+def next_page(rows, limit, column, id_column="id"):
+    """Klipper bort den extra raden och returnerar (rader, nästa cursor)"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last[column], last[id_column])
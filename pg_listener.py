@@ -0,0 +1,180 @@
+import logging
+import os
+import select
+import threading
+
+import psycopg2
+from dotenv import load_dotenv
+
+from db_setup import get_connection
+
+load_dotenv()
+
+"""
+En tråd per process som lyssnar på PostgreSQL-kanaler med LISTEN.
+
+Moduler registrerar en callback per kanal med subscribe(). Alla kanaler delar
+samma dedikerade koppling (utanför poolen). Tappas kopplingen återansluter
+tråden med backoff och anropar on_reconnect-callbacks, eftersom notiser som
+skickades under avbrottet är borta.
+
+- PG_LISTENER_POLL_INTERVAL: sekunder mellan kontroller av om tråden ska stoppas
+- PG_LISTENER_MAX_BACKOFF: längsta väntan mellan återanslutningsförsök
+"""
+
+logger = logging.getLogger(__name__)
+
+LISTENER_POLL_INTERVAL = float(os.getenv("PG_LISTENER_POLL_INTERVAL", "1"))
+LISTENER_MAX_BACKOFF = float(os.getenv("PG_LISTENER_MAX_BACKOFF", "30"))
+
+
+class PgListener:
+    """Bakgrundstråd som delar ut NOTIFY till registrerade callbacks"""
+
+    def __init__(self, connect=get_connection):
+        self._connect = connect
+        self._callbacks = {}
+        self._reconnect_callbacks = []
+        self._lock = threading.Lock()
+        self._connection = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._listening = set()
+        self._pending_listen = False
+
+        self._notifications = 0
+        self._reconnects = 0
+        self._callback_errors = 0
+
+    def subscribe(self, channel, callback):
+        """callback(payload) anropas i lyssnartråden för varje notis på kanalen"""
+        with self._lock:
+            if channel not in self._callbacks:
+                # Lyssnarloopen kör LISTEN för nya kanaler i nästa varv
+                self._pending_listen = True
+            self._callbacks.setdefault(channel, []).append(callback)
+
+    def on_reconnect(self, callback):
+        """callback() anropas efter en återanslutning"""
+        self._reconnect_callbacks.append(callback)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="pg-listener", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=LISTENER_POLL_INTERVAL * 2)
+            self._thread = None
+
+    def stats(self):
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "connected": self._connection is not None,
+            "channels": sorted(self._callbacks),
+            "notifications": self._notifications,
+            "reconnects": self._reconnects,
+            "callback_errors": self._callback_errors,
+        }
+
+    def _listen(self):
+        connection = self._connect()
+        connection.set_session(autocommit=True)
+        with self._lock:
+            channels = list(self._callbacks)
+        with connection.cursor() as cursor:
+            for channel in channels:
+                cursor.execute(f'LISTEN "{channel}"')
+        self._listening = set(channels)
+        self._pending_listen = False
+        return connection
+
+    def _run(self):
+        backoff = 0.5
+        first = True
+        while not self._stopping.is_set():
+            try:
+                self._connection = self._listen()
+                if not first:
+                    self._reconnects += 1
+                    self._after_reconnect()
+                first = False
+                backoff = 0.5
+                self._loop(self._connection)
+            except (psycopg2.Error, OSError) as error:
+                logger.warning("LISTEN-kopplingen tappades: %s", error)
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, LISTENER_MAX_BACKOFF)
+            finally:
+                connection, self._connection = self._connection, None
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except psycopg2.Error:
+                        pass
+
+    def _loop(self, connection):
+        while not self._stopping.is_set():
+            if self._pending_listen:
+                with self._lock:
+                    channels = set(self._callbacks) - self._listening
+                    self._pending_listen = False
+                with connection.cursor() as cursor:
+                    for channel in channels:
+                        cursor.execute(f'LISTEN "{channel}"')
+                self._listening |= channels
+
+            ready, _, _ = select.select([connection], [], [], LISTENER_POLL_INTERVAL)
+            if not ready:
+                continue
+            connection.poll()
+            while connection.notifies:
+                notify = connection.notifies.pop(0)
+                self._dispatch(notify.channel, notify.payload)
+
+    def _after_reconnect(self):
+        # Ett fel i en callback får inte stoppa tråden, då slutar invalideringen
+        for callback in self._reconnect_callbacks:
+            try:
+                callback()
+            except Exception:
+                self._callback_errors += 1
+                logger.exception("Fel i callback efter återanslutning")
+
+    def _dispatch(self, channel, payload):
+        self._notifications += 1
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                self._callback_errors += 1
+                logger.exception("Fel i callback för kanalen %s", channel)
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_listener():
+    """Returnerar processens lyssnare, skapas vid första anropet"""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = PgListener()
+        return _listener
+
+
+def stop_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
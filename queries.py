@@ -0,0 +1,218 @@
+import logging
+import os
+import threading
+import time
+import weakref
+
+import psycopg2
+from psycopg2 import errors, extensions
+from dotenv import load_dotenv
+
+load_dotenv()
+
+"""
+Register över namngivna SQL-satser som förbereds (PREPARE) en gång per koppling.
+
+db.py kör sina fasta satser med execute(cursor, namn, sql, params) istället för
+cursor.execute(sql, params). Första gången en koppling ser ett namn körs
+PREPARE, sedan bara EXECUTE namn(...), så PostgreSQL slipper tolka och planera
+samma text vid varje anrop. Vilka satser en koppling har förberett sparas per
+kopplingsobjekt, så en ny koppling från poolen förbereder sina satser på nytt.
+
+Går en sats inte att förbereda körs den som vanlig text även i fortsättningen.
+EXECUTE skickas direkt, utan savepoint, så en förberedd sats kostar en rundresa.
+Har kopplingen tappat sina satser (DEALLOCATE/DISCARD) eller har en tabell
+ändrats under en SELECT * körs DEALLOCATE ALL och satserna förbereds om. Är
+satsen den första i transaktionen rullas den tillbaka och görs om direkt.
+Senare satser kan inte göras om utan att det transaktionen redan gjort går
+förlorat, så felet går vidare och kopplingen börjar om vid nästa transaktion.
+En ny koppling från poolen får ett eget, tomt register.
+
+Satser som byggs dynamiskt (sökfilter, sidnumrering med cursor) körs som
+vanligt med cursor.execute. asyncpg förbereder och cachar redan sina satser per
+koppling, så async_db.py behöver inget register.
+
+- DB_PREPARE_STATEMENTS: 0 för att köra alla satser som vanlig text
+"""
+
+logger = logging.getLogger(__name__)
+
+PREPARE_STATEMENTS = os.getenv("DB_PREPARE_STATEMENTS", "1") == "1"
+
+
+class Registry:
+    """Namn -> SQL och vilka namn varje koppling har förberett"""
+
+    def __init__(self, enabled=PREPARE_STATEMENTS):
+        self.enabled = enabled
+        self._statements = {}
+        self._unpreparable = set()
+        # Kopplingsobjekt -> förberedda namn, försvinner när kopplingen stängs
+        self._prepared = weakref.WeakKeyDictionary()
+        # Kopplingar vars satser blev inaktuella mitt i en transaktion
+        self._stale = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def register(self, name, sql):
+        """Sparar satsen under namnet, samma namn får inte användas för annan SQL"""
+        with self._lock:
+            registered = self._statements.get(name)
+            if registered is None:
+                self._statements[name] = _Statement(name, sql)
+                self._counters[name] = {
+                    "calls": 0,
+                    "prepares": 0,
+                    "reprepares": 0,
+                    "total_ms": 0.0,
+                }
+            elif registered.sql != sql:
+                raise ValueError(f"Satsen {name} är redan registrerad med annan SQL")
+            return self._statements[name]
+
+    def execute(self, cursor, name, sql, params=()):
+        statement = self._statements.get(name) or self.register(name, sql)
+        started = time.perf_counter()
+        try:
+            if self.enabled and name not in self._unpreparable:
+                self._execute_prepared(cursor, statement, params)
+            else:
+                cursor.execute(sql, params)
+        finally:
+            elapsed = 1000 * (time.perf_counter() - started)
+            with self._lock:
+                counters = self._counters[name]
+                counters["calls"] += 1
+                counters["total_ms"] += elapsed
+
+    def _execute_prepared(self, cursor, statement, params):
+        connection = cursor.connection
+        # Kollas lokalt i libpq, kostar ingen rundresa
+        first = connection.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
+        with self._lock:
+            prepared = self._prepared.setdefault(connection, set())
+            stale = first and connection in self._stale
+            self._stale.discard(connection)
+        if stale:
+            self._forget_all(cursor, prepared)
+
+        if statement.name not in prepared:
+            if not self._prepare(cursor, statement):
+                cursor.execute(statement.sql, params)
+                return
+            prepared.add(statement.name)
+            cursor.execute(statement.execute_sql, params)
+            return
+
+        try:
+            cursor.execute(statement.execute_sql, params)
+        except (errors.InvalidSqlStatementName, errors.FeatureNotSupported) as error:
+            logger.info("Förbereder om %s: %s", statement.name, error)
+            with self._lock:
+                self._counters[statement.name]["reprepares"] += 1
+            if not first:
+                # Transaktionen är redan avbruten, nästa transaktion börjar om
+                with self._lock:
+                    self._stale.add(connection)
+                raise
+            # Första satsen, transaktionen har inget annat att förlora
+            connection.rollback()
+            self._forget_all(cursor, prepared)
+            if self._prepare(cursor, statement):
+                prepared.add(statement.name)
+                cursor.execute(statement.execute_sql, params)
+            else:
+                cursor.execute(statement.sql, params)
+
+    def _forget_all(self, cursor, prepared):
+        """
+        DEALLOCATE ALL och börjar om. Efter DISCARD ALL finns inga satser kvar,
+        efter en schemaändring kan fler satser än den som föll vara inaktuella.
+        """
+        cursor.execute("DEALLOCATE ALL")
+        prepared.clear()
+
+    def _prepare(self, cursor, statement):
+        """PREPARE i en savepoint så att ett fel inte avbryter transaktionen"""
+        connection = cursor.connection
+        savepoint = not connection.autocommit
+        if savepoint:
+            cursor.execute("SAVEPOINT prepare_statement")
+        try:
+            cursor.execute(f"PREPARE {statement.name} AS {statement.prepare_sql}")
+        except errors.DuplicatePreparedStatement:
+            # Förberedd av en tidigare användning av samma session
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+        except psycopg2.Error as error:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+            logger.warning("Kan inte förbereda %s: %s", statement.name, error)
+            with self._lock:
+                self._unpreparable.add(statement.name)
+            return False
+        finally:
+            if savepoint and not connection.closed:
+                cursor.execute("RELEASE SAVEPOINT prepare_statement")
+        with self._lock:
+            self._counters[statement.name]["prepares"] += 1
+        return True
+
+    def statement(self, name):
+        """Den registrerade satsen med namnet, eller None"""
+        return self._statements.get(name)
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+
+    def stats(self):
+        """Anrop och medeltid per sats, flest anrop först"""
+        with self._lock:
+            statements = {
+                name: {
+                    **counters,
+                    "total_ms": round(counters["total_ms"], 3),
+                    "avg_ms": (
+                        round(counters["total_ms"] / counters["calls"], 3)
+                        if counters["calls"]
+                        else None
+                    ),
+                    "prepared": name not in self._unpreparable,
+                }
+                for name, counters in sorted(
+                    self._counters.items(), key=lambda item: -item[1]["calls"]
+                )
+            }
+            return {
+                "enabled": self.enabled,
+                "connections": len(self._prepared),
+                "statements": statements,
+            }
+
+
+class _Statement:
+    def __init__(self, name, sql):
+        if not name.isidentifier():
+            raise ValueError(f"Ogiltigt namn på sats: {name}")
+        self.name = name
+        self.sql = sql
+        parts = sql.split("%s")
+        # PREPARE tar $1, $2 ... och skickas utan parametrar, så %% blir %
+        numbered = [f"{part}${number}" for number, part in enumerate(parts[:-1], 1)]
+        self.prepare_sql = ("".join(numbered) + parts[-1]).replace("%%", "%")
+        placeholders = ", ".join(["%s"] * (len(parts) - 1))
+        self.execute_sql = f"EXECUTE {name}"
+        if placeholders:
+            self.execute_sql += f"({placeholders})"
+
+
+_registry = Registry()
+
+
+def get_registry():
+    return _registry
+
+
+def execute(cursor, name, sql, params=()):
+    """Kör sql som den förberedda satsen name på cursorns koppling"""
+    _registry.execute(cursor, name, sql, params)
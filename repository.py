@@ -0,0 +1,141 @@
+import os
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+import db
+import memory_db
+from db_pool import get_pool
+
+load_dotenv()
+
+"""
+Väljer var app.py läser och skriver data. Ett repository är en modul med
+funktionerna i FUNCTIONS, som alla tar en koppling först och följer db.py:s
+returvärden och fel (ValueError när raden saknas, BidRejectedError för bud).
+
+- postgres: db.py med kopplingar från db_pool
+- memory: memory_db.py, allt i processens minne utan databas. För att mäta
+  FastAPI-lagret för sig och för tester. Export, import och asyncpg-routes
+  finns bara mot PostgreSQL.
+
+- REPOSITORY_BACKEND: postgres (standard) eller memory
+"""
+
+REPOSITORY_BACKEND = os.getenv("REPOSITORY_BACKEND", "postgres")
+
+BACKENDS = {"postgres": db, "memory": memory_db}
+
+# Funktionerna som app.py och fanout.py anropar
+FUNCTIONS = (
+    "get_all_bids",
+    "get_bid_by_id",
+    "get_bids_for_listing",
+    "create_bid",
+    "delete_bid",
+    "get_all_user_ratings",
+    "get_user_rating_by_user_id",
+    "create_user_rating",
+    "update_user_rating",
+    "delete_user_rating",
+    "recompute_user_ratings",
+    "get_all_reviews",
+    "get_review_by_id",
+    "get_reviews_for_user",
+    "get_reviews_version",
+    "create_review",
+    "delete_review",
+    "get_all_images",
+    "get_image_by_id",
+    "get_images_for_listing",
+    "get_images_version",
+    "create_image",
+    "delete_image",
+    "get_all_reports",
+    "get_report_by_id",
+    "get_reports_for_listing",
+    "create_report",
+    "delete_report",
+    "get_all_users",
+    "get_user_by_id",
+    "get_user_by_email",
+    "get_user_by_username",
+    "create_user",
+    "update_user",
+    "delete_user",
+    "get_all_categories",
+    "create_category",
+    "delete_category",
+    "get_all_listings",
+    "get_listing_by_id",
+    "get_listing_full",
+    "create_listing",
+    "update_listing",
+    "delete_listing",
+    "search_listings",
+    "get_listing_facets",
+    "get_all_watched_listings",
+    "add_to_watch_list",
+    "remove_from_watch_list",
+    "get_all_messages_for_user",
+    "get_inbox",
+    "get_unread_message_count",
+    "get_conversation",
+    "create_message",
+    "mark_message_as_read",
+    "delete_message",
+    "get_all_transactions",
+    "get_transaction_by_id",
+    "get_transactions_by_user_id",
+    "create_transaction",
+    "update_transaction",
+    "get_all_payments",
+    "get_payment_by_transaction_id",
+    "create_payment",
+    "update_payment_status",
+    "get_notifications_by_user_id",
+    "get_unread_notifications",
+    "create_notification",
+    "notify_watchers",
+    "mark_all_notifications_as_read",
+    "delete_notification",
+    "get_comments_by_listing_id",
+    "get_comments_by_user_id",
+    "create_listing_comment",
+    "answer_comment",
+    "delete_listing_comment",
+    "get_shipping_by_listing_id",
+    "create_shipping_details",
+    "update_shipping_tracking",
+)
+
+BidRejectedError = db.BidRejectedError
+
+
+def get_repository(backend=None):
+    """Modulen för backend (REPOSITORY_BACKEND om den inte anges)"""
+    backend = backend or REPOSITORY_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"REPOSITORY_BACKEND måste vara {' eller '.join(BACKENDS)}, inte {backend}"
+        )
+    module = BACKENDS[backend]
+    missing = [name for name in FUNCTIONS if not callable(getattr(module, name, None))]
+    if missing:
+        raise TypeError(f"{module.__name__} saknar {', '.join(missing)}")
+    return module
+
+
+def uses_database():
+    """True när data ligger i PostgreSQL och poolen behövs"""
+    return REPOSITORY_BACKEND == "postgres"
+
+
+@contextmanager
+def connection():
+    """En koppling till backend utanför en request, t.ex. för fanout.py"""
+    if not uses_database():
+        yield memory_db.get_store()
+        return
+    with get_pool().connection() as pool_connection:
+        yield pool_connection
@@ -1,3 +1,540 @@
-# Add Pydantic schemas here that you'll use in your routes / endpoints
-# Pydantic schemas are used to validate data that you receive, or to make sure that whatever data
-# you send back to the client follows a certain structure
+from datetime import date, datetime
+from typing import Literal
+
+from pydantic import BaseModel
+
+"""
+Pydantic-modeller för alla tabeller: vad routes tar emot och vad de skickar tillbaka.
+
+Per entitet finns en läsmodell (t.ex. Listing) som används som response_model,
+en Create-modell för POST-bodyn och där det behövs en Update-modell med samma
+query-parametrar som tidigare. Med response_model validerar och serialiserar
+FastAPI svaret med pydantic-core direkt till JSON istället för jsonable_encoder.
+Sidorna med cursor (/listings, /bids ...) returnerar fortfarande FastJSONResponse
+själva, det är snabbast för stora sidor (se benchmarks/response_models.py), och
+där beskriver response_model bara svaret i /docs.
+
+Belopp är NUMERIC i databasen men skickas som tal, precis som förut. Fält som
+inte alla frågor hämtar har None som standard.
+"""
+
+ListingType = Literal["buying", "selling", "free"]
+ListingStatus = Literal["active", "sold", "closed"]
+PaymentStatus = Literal["pending", "completed", "failed", "cancelled", "refunded"]
+
+
+class Deleted(BaseModel):
+    message: str
+    id: int
+
+
+class Message(BaseModel):
+    message: str
+
+
+# Bids
+
+
+class Bid(BaseModel):
+    id: int
+    user_id: int
+    listing_id: int
+    bid_amount: float
+    created_at: datetime | None = None
+
+
+class BidCreate(BaseModel):
+    user_id: int
+    listing_id: int
+    bid_amount: float
+
+
+class BidList(BaseModel):
+    bids: list[Bid]
+
+
+class BidPage(BidList):
+    next_cursor: str | None
+
+
+# User ratings
+
+
+class UserRating(BaseModel):
+    id: int | None = None
+    user_id: int | None = None
+    total_ratings: int
+    average_rating: float
+
+
+class UserRatingCreate(BaseModel):
+    user_id: int
+    total_ratings: int = 0
+    average_rating: float = 0.00
+
+
+class UserRatingUpdate(BaseModel):
+    total_ratings: int | None = None
+    average_rating: float | None = None
+
+
+class UserRatingList(BaseModel):
+    ratings: list[UserRating]
+
+
+# Reviews
+
+
+class Review(BaseModel):
+    id: int
+    reviewer_id: int
+    reviewed_user_id: int
+    listing_id: int | None
+    rating: int
+    review_text: str | None
+    created_at: datetime | None = None
+
+
+class ReviewCreate(BaseModel):
+    reviewer_id: int
+    reviewed_user_id: int
+    listing_id: int
+    rating: int
+    review_text: str | None = None
+
+
+class ReviewList(BaseModel):
+    reviews: list[Review]
+
+
+class ReviewPage(ReviewList):
+    next_cursor: str | None
+
+
+# Images
+
+
+class Image(BaseModel):
+    id: int
+    user_id: int | None = None
+    listing_id: int
+    image_url: str
+    created_at: datetime | None = None
+
+
+class ImageCreate(BaseModel):
+    user_id: int
+    listing_id: int
+    image_url: str
+
+
+class ImageList(BaseModel):
+    images: list[Image]
+
+
+class ImagePage(ImageList):
+    next_cursor: str | None
+
+
+# Reports
+
+
+class Report(BaseModel):
+    id: int
+    user_id: int
+    listing_id: int
+    report_reason: str
+    created_at: datetime | None = None
+
+
+class ReportCreate(BaseModel):
+    user_id: int
+    listing_id: int
+    report_reason: str
+
+
+class ReportList(BaseModel):
+    reports: list[Report]
+
+
+class ReportPage(ReportList):
+    next_cursor: str | None
+
+
+# Users, lösenordet skickas aldrig tillbaka
+
+
+class User(BaseModel):
+    id: int
+    username: str
+    email: str
+    user_since: datetime
+    date_of_birth: date
+    phone_number: str | None
+
+
+class UserCreate(BaseModel):
+    username: str
+    email: str
+    password: str
+    user_since: datetime
+    date_of_birth: date
+    phone_number: str | None = None
+
+
+class UserUpdate(BaseModel):
+    email: str | None = None
+    phone_number: str | None = None
+
+
+class UserPage(BaseModel):
+    users: list[User]
+    next_cursor: str | None
+
+
+class UserDeleted(BaseModel):
+    message: str
+    user: User
+
+
+# Categories
+
+
+class Category(BaseModel):
+    id: int
+    name: str
+
+
+class CategoryCreate(BaseModel):
+    name: str
+
+
+class CategoryList(BaseModel):
+    categories: list[Category]
+
+
+# Listings
+
+
+class Listing(BaseModel):
+    id: int
+    user_id: int
+    category_id: int
+    title: str
+    image_url: str | None
+    listing_type: str
+    price: float
+    created_at: datetime
+    region: str
+    status: str
+    description: str
+    current_high_bid: float | None
+    bid_count: int
+
+
+class ListingCreate(BaseModel):
+    user_id: int
+    category_id: int
+    title: str
+    listing_type: ListingType
+    price: float
+    region: str
+    status: ListingStatus
+    description: str
+    image_url: str | None = None
+
+
+class ListingUpdate(BaseModel):
+    category_id: int | None = None
+    title: str | None = None
+    listing_type: ListingType | None = None
+    price: float | None = None
+    region: str | None = None
+    status: ListingStatus | None = None
+    description: str | None = None
+    image_url: str | None = None
+
+
+class ListingPage(BaseModel):
+    listings: list[Listing]
+    next_cursor: str | None
+
+
+class CategoryCount(BaseModel):
+    category_id: int
+    count: int
+
+
+class RegionCount(BaseModel):
+    region: str
+    count: int
+
+
+class Facets(BaseModel):
+    categories: list[CategoryCount]
+    regions: list[RegionCount]
+
+
+class SearchHit(Listing):
+    # Relevans, bara vid sökning med fritext
+    rank: float | None = None
+
+
+class SearchResult(BaseModel):
+    listings: list[SearchHit]
+    next_cursor: str | None
+    facets: Facets | None = None
+
+
+class ListingImport(BaseModel):
+    rows: int
+    imported: int
+    failed: int
+    errors: list[dict]
+
+
+# Watch list
+
+
+class WatchedListing(BaseModel):
+    user_id: int
+    listing_id: int
+    created_at: datetime
+
+
+class WatchCreate(BaseModel):
+    user_id: int
+    listing_id: int
+
+
+class Watchlist(BaseModel):
+    watchlist: list[WatchedListing]
+
+
+# Messages
+
+
+class ChatMessage(BaseModel):
+    id: int
+    sender_id: int
+    recipient_id: int
+    listing_id: int
+    message_text: str
+    created_at: datetime
+    is_read: bool | None
+
+
+class MessageCreate(BaseModel):
+    sender_id: int
+    recipient_id: int
+    listing_id: int
+    message_text: str
+
+
+class MessagePage(BaseModel):
+    messages: list[ChatMessage]
+    next_cursor: str | None
+
+
+class Conversation(BaseModel):
+    partner_id: int
+    listing_id: int
+    last_message_id: int
+    last_sender_id: int
+    last_message: str
+    last_message_at: datetime
+    unread_count: int
+
+
+class Inbox(BaseModel):
+    conversations: list[Conversation]
+    unread_total: int
+    next_cursor: str | None
+
+
+# Transactions
+
+
+class Transaction(BaseModel):
+    id: int
+    user_id: int
+    bid_id: int | None
+    listing_id: int
+    status: str
+    amount: float
+    created_at: datetime | None = None
+
+
+class TransactionCreate(BaseModel):
+    user_id: int
+    listing_id: int
+    amount: float
+    status: str
+    bid_id: int | None = None
+
+
+class TransactionUpdate(BaseModel):
+    new_status: str
+
+
+class TransactionList(BaseModel):
+    transactions: list[Transaction]
+
+
+class TransactionPage(TransactionList):
+    next_cursor: str | None
+
+
+# Payments
+
+
+class Payment(BaseModel):
+    id: int
+    transaction_id: int
+    listing_id: int
+    payment_method: str
+    payment_status: str
+    amount: float
+    paid_at: datetime | None
+
+
+class PaymentCreate(BaseModel):
+    transaction_id: int
+    listing_id: int
+    payment_method: str
+    payment_status: PaymentStatus
+    amount: float
+
+
+class PaymentUpdate(BaseModel):
+    new_status: PaymentStatus
+
+
+class PaymentPage(BaseModel):
+    payments: list[Payment]
+    next_cursor: str | None
+
+
+# Notifications
+
+
+class Notification(BaseModel):
+    id: int
+    user_id: int
+    listing_id: int
+    notification_type: str
+    notification_message: str
+    is_read: bool | None
+    created_at: datetime
+
+
+class NotificationCreate(BaseModel):
+    user_id: int
+    listing_id: int
+    notification_type: str
+    notification_message: str
+
+
+class NotificationList(BaseModel):
+    notiser: list[Notification]
+
+
+class NotificationsMarked(BaseModel):
+    marked: int
+
+
+class WatcherNotification(BaseModel):
+    notification_type: str
+    notification_message: str
+
+
+class WatcherNotificationQueued(BaseModel):
+    message: str
+    listing_id: int
+
+
+# Listing comments
+
+
+class Comment(BaseModel):
+    id: int
+    user_id: int
+    listing_id: int
+    comment_text: str
+    answer_text: str | None
+    created_at: datetime | None = None
+    answered_at: datetime | None = None
+
+
+class CommentCreate(BaseModel):
+    user_id: int
+    listing_id: int
+    comment_text: str
+
+
+class CommentAnswer(BaseModel):
+    answer_text: str
+
+
+class CommentList(BaseModel):
+    comments: list[Comment]
+
+
+# Shipping
+
+
+class Shipping(BaseModel):
+    id: int
+    user_id: int
+    listing_id: int
+    shipping_method: str
+    shipping_cost: float
+    estimated_delivery_days: int | None
+    tracking_number: str | None
+    status: str | None
+    shipped_at: datetime | None
+
+
+# Frakten som den visas på annonsen, get_shipping_by_listing_id läser inte user_id
+class ShippingDetails(BaseModel):
+    id: int
+    listing_id: int
+    shipping_method: str
+    shipping_cost: float
+    estimated_delivery_days: int | None
+    tracking_number: str | None
+    status: str | None
+    shipped_at: datetime | None
+
+
+class ShippingCreate(BaseModel):
+    user_id: int
+    listing_id: int
+    shipping_method: str
+    shipping_cost: float
+    estimated_delivery_days: int | None = None
+    tracking_number: str | None = None
+    status: str | None = None
+    shipped_at: datetime | None = None
+
+
+class ShippingUpdate(BaseModel):
+    tracking_number: str
+    status: str
+    shipped_at: datetime | None = None
+
+
+# Annonsen med allt som hör till den, se db.get_listing_full
+
+
+class SellerRating(BaseModel):
+    total_ratings: int
+    average_rating: float
+
+
+class ListingFull(Listing):
+    bids: list[Bid]
+    images: list[Image]
+    comments: list[Comment]
+    shipping: ShippingDetails | None
+    seller_rating: SellerRating | None
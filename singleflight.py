@@ -0,0 +1,229 @@
+import asyncio
+import functools
+import inspect
+import os
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+"""
+Slår ihop samtidiga identiska läsningar (single-flight). När många requests
+frågar efter samma annons samtidigt kör bara den första frågan mot databasen,
+de andra väntar på den och får en kopia av samma resultat. Fel delas också,
+så en annons som inte finns ger ValueError till alla som väntade.
+
+Funktioner kopplas på med dekoratorn, argumenten efter connection blir nyckeln:
+
+    @cache.cached("listing")
+    @singleflight.coalesced("listing")
+    def get_listing_by_id(connection, listing_id): ...
+
+Under cache.cached slås bara missarna ihop. Trådar (synkrona routes) och
+asyncio (async_db.py) har var sina väntelistor eftersom en tråd inte kan vänta
+på en asyncio-future. Avbryts den som kör frågan i asyncio gör nästa väntande
+ett nytt försök.
+
+Skrivningar anropar forget() efter commit, precis som cache.invalidate(), så
+att en läsning som börjar efter skrivningen inte hänger på en fråga som
+startade före den.
+
+- SINGLEFLIGHT: 0 för att köra varje anrop för sig
+"""
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT", "1") == "1"
+
+
+def _copy(value):
+    """Kopia så att de som delar resultatet inte ändrar varandras rader"""
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+class _Call:
+    """Ett anrop som körs i en tråd, de andra väntar på event"""
+
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Håller pågående anrop per (namn, nyckel) och räknar sparade frågor"""
+
+    def __init__(self, enabled=SINGLEFLIGHT_ENABLED):
+        self.enabled = enabled
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def _counter(self, name):
+        counters = self._counters.get(name)
+        if counters is None:
+            counters = self._counters[name] = {
+                "calls": 0,
+                "executions": 0,
+                "shared": 0,
+                "errors": 0,
+                "retries": 0,
+            }
+        return counters
+
+    def do(self, name, key, function):
+        """Kör function() eller väntar på ett pågående anrop med samma nyckel"""
+        if not self.enabled:
+            return function()
+        flight = (name, key)
+        with self._lock:
+            counters = self._counter(name)
+            counters["calls"] += 1
+            call = self._calls.get(flight)
+            leader = call is None
+            if leader:
+                call = self._calls[flight] = _Call()
+                counters["executions"] += 1
+            else:
+                counters["shared"] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return _copy(call.value)
+
+        try:
+            call.value = function()
+        except BaseException as error:
+            call.error = error
+            with self._lock:
+                counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(flight) is call:
+                    del self._calls[flight]
+            call.event.set()
+        return _copy(call.value)
+
+    async def do_async(self, name, key, function):
+        """Som do() för en coroutine-funktion, väntar i samma event loop"""
+        if not self.enabled:
+            return await function()
+        loop = asyncio.get_running_loop()
+        flight = (name, key, loop)
+        with self._lock:
+            counters = self._counter(name)
+            counters["calls"] += 1
+        while True:
+            with self._lock:
+                future = self._async_calls.get(flight)
+                leader = future is None
+                if leader:
+                    future = self._async_calls[flight] = loop.create_future()
+                    counters["executions"] += 1
+                else:
+                    counters["shared"] += 1
+            if leader:
+                break
+            try:
+                return _copy(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    # Det är den här requesten som avbröts
+                    raise
+            with self._lock:
+                counters["shared"] -= 1
+                counters["retries"] += 1
+
+        try:
+            value = await function()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # Hämtas så att asyncio inte varnar när ingen väntade
+            future.exception()
+            with self._lock:
+                counters["errors"] += 1
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            with self._lock:
+                if self._async_calls.get(flight) is future:
+                    del self._async_calls[flight]
+        return _copy(value)
+
+    def forget(self, name, *key):
+        """Nästa anrop med nyckeln startar en ny fråga, de som redan väntar får svaret"""
+        with self._lock:
+            self._calls.pop((name, key), None)
+            for flight in [
+                flight for flight in self._async_calls if flight[:2] == (name, key)
+            ]:
+                del self._async_calls[flight]
+
+    def stats(self):
+        """Mätvärden för stats-endpointen, shared är antal sparade frågor"""
+        with self._lock:
+            names = {}
+            for name, counters in self._counters.items():
+                names[name] = {
+                    **counters,
+                    "saved_ratio": (
+                        round(counters["shared"] / counters["calls"], 3)
+                        if counters["calls"]
+                        else None
+                    ),
+                }
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._calls) + len(self._async_calls),
+                "queries_saved": sum(
+                    counters["shared"] for counters in self._counters.values()
+                ),
+                "functions": names,
+            }
+
+
+_singleflight = SingleFlight()
+
+
+def get_singleflight():
+    return _singleflight
+
+
+def forget(name, *key):
+    _singleflight.forget(name, *key)
+
+
+def coalesced(name):
+    """Dekorator för db-funktioner som tar connection först, fungerar även för async"""
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(connection, *args):
+                return await _singleflight.do_async(
+                    name, args, lambda: function(connection, *args)
+                )
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(connection, *args):
+            return _singleflight.do(name, args, lambda: function(connection, *args))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,150 @@
+import threading
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+import psycopg2
+import pytest
+
+import db
+import memory_db
+from db_setup import get_connection
+
+"""
+Samtidiga bud på samma annons får inte tappa uppdateringar.
+
+Alla budgivare försöker lägga samma belopp i stigande ordning, så nästan varje
+bud krockar med ett annat. Efteråt ska bid_count, antalet rader i bids och
+antalet accepterade bud vara lika, och current_high_bid det högsta accepterade.
+Körs mot memory_db och mot PostgreSQL (db.py) om databasen går att nå.
+"""
+
+BIDDERS = 16
+PRICE = Decimal("100.00")
+AMOUNTS = [PRICE + step * db.MIN_BID_INCREMENT for step in range(60)]
+
+
+class MemoryBackend:
+    def __init__(self):
+        self.store = memory_db.get_store()
+        self.store.clear()
+
+    def connect(self):
+        return self.store
+
+    def close(self, connection):
+        pass
+
+    def bid_amounts(self, listing_id):
+        return [
+            bid["bid_amount"]
+            for bid in memory_db.get_bids_for_listing(self.store, listing_id)
+        ]
+
+    def cleanup(self, listing):
+        self.store.clear()
+
+
+class PostgresBackend:
+    def __init__(self):
+        self.connection = get_connection()
+
+    def connect(self):
+        return get_connection()
+
+    def close(self, connection):
+        connection.close()
+
+    def bid_amounts(self, listing_id):
+        with self.connection:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT bid_amount FROM bids WHERE listing_id = %s", (listing_id,)
+                )
+                return [row[0] for row in cursor.fetchall()]
+
+    def cleanup(self, listing):
+        with self.connection:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM bids WHERE listing_id = %s", (listing["id"],)
+                )
+        db.delete_listing(self.connection, listing["id"])
+        db.delete_user(self.connection, listing["user_id"])
+        db.delete_category(self.connection, listing["category_id"])
+        self.connection.close()
+
+
+@pytest.fixture(params=["memory", "postgres"])
+def backend(request):
+    if request.param == "memory":
+        return MemoryBackend(), memory_db
+    try:
+        return PostgresBackend(), db
+    except psycopg2.OperationalError as error:
+        pytest.skip(f"Ingen PostgreSQL: {error}")
+
+
+def test_concurrent_bids_lose_no_updates(backend):
+    backend, repo = backend
+    connection = backend.connect()
+    name = f"budgivare_{uuid.uuid4().hex[:12]}"
+    user = repo.create_user(
+        connection,
+        name,
+        f"{name}@example.se",
+        "hemligt123",
+        datetime.now(),
+        date(1990, 1, 1),
+        None,
+    )
+    category = repo.create_category(connection, name)
+    listing = repo.create_listing(
+        connection,
+        user["id"],
+        category["id"],
+        "Budstorm",
+        "selling",
+        PRICE,
+        "Stockholm",
+        "active",
+        "Samtidiga bud",
+    )
+
+    accepted = []
+    failures = []
+    barrier = threading.Barrier(BIDDERS)
+
+    def bidder():
+        own = backend.connect()
+        try:
+            barrier.wait()
+            for amount in AMOUNTS:
+                try:
+                    repo.create_bid(own, user["id"], listing["id"], amount)
+                    accepted.append(amount)
+                except db.BidRejectedError:
+                    pass
+        except Exception as error:
+            failures.append(error)
+        finally:
+            backend.close(own)
+
+    threads = [threading.Thread(target=bidder) for _ in range(BIDDERS)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert failures == []
+        current = repo.get_listing_by_id(connection, listing["id"])
+        amounts = backend.bid_amounts(listing["id"])
+        assert current["bid_count"] == len(accepted) == len(amounts)
+        assert sorted(amounts) == sorted(accepted)
+        # Varje belopp kan bara vinna en gång och det högsta vinner alltid
+        assert len(set(accepted)) == len(accepted)
+        assert current["current_high_bid"] == max(accepted) == AMOUNTS[-1]
+    finally:
+        backend.close(connection)
+        backend.cleanup(listing)
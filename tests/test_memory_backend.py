@@ -0,0 +1,255 @@
+import os
+
+# Måste sättas innan app importeras, repository.py läser den vid import
+os.environ["REPOSITORY_BACKEND"] = "memory"
+
+import pytest
+from fastapi.testclient import TestClient
+
+import memory_db
+import schemas
+from app import app
+
+"""
+API-tester mot REPOSITORY_BACKEND=memory, utan databas.
+
+Testerna går genom samma routes som mot PostgreSQL och kontrollerar svaren som
+memory_db.py ska ge likadant som db.py: statuskoder för bud, sidnumrering med
+cursor, ratings från recensioner, inkorgen och villkorliga GET.
+
+Kör: python -m pytest tests
+"""
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(autouse=True)
+def empty_store():
+    memory_db.get_store().clear()
+
+
+def create_user(client, name):
+    response = client.post(
+        "/users",
+        json={
+            "username": name,
+            "email": f"{name}@example.se",
+            "password": "hemligt123",
+            "user_since": "2024-05-01T10:00:00",
+            "date_of_birth": "1990-01-01",
+        },
+    )
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+def create_listing(client, user_id, price=100, status="active"):
+    category = client.post("/categories", json={"name": "Möbler"}).json()
+    response = client.post(
+        "/listings",
+        json={
+            "user_id": user_id,
+            "category_id": category["id"],
+            "title": "Stol i ek",
+            "listing_type": "selling",
+            "price": price,
+            "region": "Stockholm",
+            "status": status,
+            "description": "En gammal stol",
+        },
+    )
+    assert response.status_code == 201
+    return response.json()
+
+
+def bid(client, user_id, listing_id, amount):
+    return client.post(
+        "/bids",
+        json={"user_id": user_id, "listing_id": listing_id, "bid_amount": amount},
+    )
+
+
+def test_bids_are_validated_against_the_highest_bid(client):
+    seller = create_user(client, "saljare")
+    buyer = create_user(client, "kopare")
+    listing = create_listing(client, seller["id"], price=100)
+
+    assert bid(client, buyer["id"], listing["id"], 50).status_code == 409
+    first = bid(client, buyer["id"], listing["id"], 100)
+    assert first.status_code == 201
+    assert bid(client, seller["id"], listing["id"], 100.5).status_code == 409
+    second = bid(client, seller["id"], listing["id"], 120)
+    assert second.status_code == 201
+
+    current = client.get(f"/listings/{listing['id']}").json()
+    assert current["current_high_bid"] == 120
+    assert current["bid_count"] == 2
+
+    assert client.delete(f"/bids/{second.json()['id']}").status_code == 200
+    assert client.get(f"/listings/{listing['id']}").json()["current_high_bid"] == 100
+
+
+def test_bids_on_missing_or_closed_listings(client):
+    seller = create_user(client, "saljare")
+    closed = create_listing(client, seller["id"], status="closed")
+
+    assert bid(client, seller["id"], 999, 100).status_code == 404
+    assert bid(client, seller["id"], closed["id"], 100).status_code == 409
+    assert client.get("/bids/999").status_code == 404
+    assert client.delete("/bids/999").status_code == 404
+
+
+def test_cursor_pagination_visits_every_row_once(client):
+    users = [create_user(client, f"user{number}") for number in range(5)]
+
+    seen = []
+    cursors = []
+    cursor = None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        page = client.get("/users", params=params).json()
+        seen += [user["id"] for user in page["users"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+        cursors.append(cursor)
+
+    assert seen == [user["id"] for user in reversed(users)]
+    assert client.get("/users", params={"cursor": "inte-en-cursor"}).status_code == 400
+    # En cursor från en lista som sorteras på något annat
+    assert client.get("/payments", params={"cursor": cursors[0]}).status_code == 400
+
+
+def test_ratings_follow_reviews(client):
+    seller = create_user(client, "saljare")
+    buyer = create_user(client, "kopare")
+    listing = create_listing(client, seller["id"])
+    review = {
+        "reviewer_id": buyer["id"],
+        "reviewed_user_id": seller["id"],
+        "listing_id": listing["id"],
+    }
+
+    client.post("/reviews", json={**review, "rating": 4})
+    five = client.post("/reviews", json={**review, "rating": 5}).json()
+    rating = client.get(f"/users/{seller['id']}/rating").json()
+    assert rating["total_ratings"] == 2
+    assert rating["average_rating"] == 4.5
+    assert "rating_sum" not in rating
+
+    client.delete(f"/reviews/{five['id']}")
+    rating = client.get(f"/users/{seller['id']}/rating").json()
+    assert rating["total_ratings"] == 1
+    assert rating["average_rating"] == 4
+    assert client.get(f"/users/{buyer['id']}/rating").status_code == 404
+
+
+def test_inbox_has_one_row_per_conversation(client):
+    seller = create_user(client, "saljare")
+    buyer = create_user(client, "kopare")
+    chair = create_listing(client, seller["id"])
+    table = create_listing(client, seller["id"])
+
+    def send(sender, recipient, listing, text):
+        response = client.post(
+            "/messages",
+            json={
+                "sender_id": sender["id"],
+                "recipient_id": recipient["id"],
+                "listing_id": listing["id"],
+                "message_text": text,
+            },
+        )
+        assert response.status_code == 201
+        return response.json()
+
+    first = send(buyer, seller, chair, "Finns stolen kvar?")
+    send(buyer, seller, chair, "Hallå?")
+    send(seller, buyer, chair, "Ja")
+    send(buyer, seller, table, "Och bordet?")
+
+    inbox = client.get(f"/users/{seller['id']}/inbox").json()
+    assert inbox["unread_total"] == 3
+    assert [
+        (row["listing_id"], row["last_message"], row["unread_count"])
+        for row in inbox["conversations"]
+    ] == [(table["id"], "Och bordet?", 1), (chair["id"], "Ja", 2)]
+
+    assert client.put(f"/messages/{first['id']}").json()["is_read"] is True
+    assert client.put("/messages/999").status_code == 404
+    inbox = client.get(f"/users/{seller['id']}/inbox").json()
+    assert inbox["unread_total"] == 2
+    assert inbox["conversations"][1]["unread_count"] == 1
+
+    page = client.get(f"/users/{seller['id']}/inbox", params={"limit": 1}).json()
+    assert [row["listing_id"] for row in page["conversations"]] == [table["id"]]
+    rest = client.get(
+        f"/users/{seller['id']}/inbox",
+        params={"limit": 1, "cursor": page["next_cursor"]},
+    ).json()
+    assert [row["listing_id"] for row in rest["conversations"]] == [chair["id"]]
+    assert rest["next_cursor"] is None
+
+
+def test_conditional_get_returns_304_until_the_listing_changes(client):
+    seller = create_user(client, "saljare")
+    buyer = create_user(client, "kopare")
+    listing = create_listing(client, seller["id"])
+    path = f"/listings/{listing['id']}"
+
+    first = client.get(path)
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"]
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+    since = {"If-Modified-Since": first.headers["last-modified"]}
+    assert client.get(path, headers=since).status_code == 304
+
+    bid(client, buyer["id"], listing["id"], 100)
+    changed = client.get(path, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+    categories = client.get("/categories")
+    assert (
+        client.get(
+            "/categories", headers={"If-None-Match": categories.headers["etag"]}
+        ).status_code
+        == 304
+    )
+
+
+def test_list_pages_match_their_documented_schemas(client):
+    # Sidorna skickas med FastJSONResponse utan response_model, se fast_json.py
+    seller = create_user(client, "saljare")
+    buyer = create_user(client, "kopare")
+    listing = create_listing(client, seller["id"])
+    bid(client, buyer["id"], listing["id"], 100)
+    client.post(
+        "/messages",
+        json={
+            "sender_id": buyer["id"],
+            "recipient_id": seller["id"],
+            "listing_id": listing["id"],
+            "message_text": "Hej",
+        },
+    )
+    pages = {
+        "/bids": schemas.BidPage,
+        "/users": schemas.UserPage,
+        "/listings": schemas.ListingPage,
+        "/listings/search?q=stol": schemas.SearchResult,
+        f"/users/{seller['id']}/messages": schemas.MessagePage,
+        f"/users/{seller['id']}/inbox": schemas.Inbox,
+        f"/conversations/{seller['id']}/{buyer['id']}": schemas.MessagePage,
+    }
+    for path, model in pages.items():
+        body = client.get(path).json()
+        documented = model.model_validate(body).model_dump(mode="json")
+        for key, value in body.items():
+            if isinstance(value, list):
+                assert value, path
+                assert set(value[0]) == set(documented[key][0]), path
@@ -0,0 +1,272 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from fastapi.routing import APIRoute
+from dotenv import load_dotenv
+
+load_dotenv()
+
+"""
+Spårning per request: hur väntetiden fördelas mellan att låna en koppling,
+frågor, serialisering och resten (FastAPI, validering och routens egen kod).
+
+TracingMiddleware skapar ett Trace för varje HTTP-request och lägger det i en
+contextvar, som följer med till trådpoolen där de synkrona routes körs. Delar
+av koden rapporterar tid till det med span() eller record():
+
+- db_connect: get_db och get_async_db när de lånar en koppling
+- db: db-funktionerna, via metrics.timed (bara den yttersta om de anropar varandra)
+- serialize: FastJSONResponse.render och FastAPI:s response_model-serialisering,
+  som mäts av TracedRoute som tiden från att routen returnerat tills svaret finns
+- app: resten av tiden fram till att svarshuvudena skickas
+
+Svaret får X-Request-ID (samma som i requesten om klienten skickade ett) och
+Server-Timing med faserna, som syns under Timing i webbläsarens devtools.
+När svaret är skickat loggas en JSON-rad per request med loggern "tracing".
+
+- TRACING: 0 för att stänga av middlewaren
+- TRACE_LOG: 1 för att skriva JSON-raderna till stderr
+- TRACE_FILE: fil som varje trace med alla spans läggs till i som NDJSON
+"""
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv("TRACING", "1") == "1"
+TRACE_LOG = os.getenv("TRACE_LOG", "0") == "1"
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+PHASES = ("db_connect", "db", "serialize")
+
+# Fler spans än så sparas inte i trace-filen, faserna summeras ändå
+MAX_SPANS = 200
+
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """Tider för en request, delas mellan eventloopen och trådpoolen"""
+
+    def __init__(self, request_id, method, path):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.route = None
+        self.status = None
+        self.started = time.perf_counter()
+        self.response_started = None
+        self.endpoint_finished = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.spans = []
+
+    def add(self, phase, started, seconds, detail=None):
+        self.phases[phase] += seconds
+        self.calls[phase] += 1
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append((phase, detail, started - self.started, seconds))
+
+    def breakdown(self):
+        """Millisekunder per fas fram till svarshuvudena, app är det som blir över"""
+        total = (self.response_started or time.perf_counter()) - self.started
+        phases = {phase: seconds * 1000 for phase, seconds in self.phases.items()}
+        phases["app"] = max(total * 1000 - sum(phases.values()), 0.0)
+        phases["total"] = total * 1000
+        return phases
+
+    def server_timing(self):
+        entries = []
+        for phase, milliseconds in self.breakdown().items():
+            entry = f"{phase.replace('_', '-')};dur={milliseconds:.2f}"
+            if self.calls.get(phase, 0) > 1:
+                entry += f';desc="{self.calls[phase]} anrop"'
+            entries.append(entry)
+        return ", ".join(entries)
+
+    def log_record(self):
+        record = {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+        }
+        for phase, milliseconds in self.breakdown().items():
+            record[f"{phase}_ms"] = round(milliseconds, 3)
+        record["db_calls"] = self.calls["db"]
+        record["duration_ms"] = round((time.perf_counter() - self.started) * 1000, 3)
+        return record
+
+
+def current():
+    """Trace för requesten som körs, None utanför en request"""
+    return _current.get()
+
+
+def record(phase, started, seconds, detail=None):
+    """Lägger till en redan uppmätt tid, started från time.perf_counter()"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(phase, started, seconds, detail)
+
+
+@contextmanager
+def span(phase, detail=None):
+    """Mäter tiden i with-blocket som phase"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(phase, started, time.perf_counter() - started, detail)
+
+
+class TracingMiddleware:
+    """ASGI-middleware som skapar ett Trace per HTTP-request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(_request_id(scope), scope["method"], scope["path"])
+        token = _current.set(trace)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                trace.response_started = time.perf_counter()
+                trace.status = message["status"]
+                route = scope.get("route")
+                trace.route = getattr(route, "path", None)
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", trace.request_id.encode()))
+                headers.append((b"server-timing", trace.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception:
+            trace.status = trace.status or 500
+            raise
+        finally:
+            _current.reset(token)
+            _export(trace)
+
+
+def _request_id(scope):
+    for name, value in scope.get("headers", []):
+        if name == b"x-request-id":
+            request_id = value.decode("latin-1")
+            if _REQUEST_ID.match(request_id):
+                return request_id
+    return uuid.uuid4().hex
+
+
+class TracedRoute(APIRoute):
+    """APIRoute som mäter FastAPI:s serialisering av svaret efter routen"""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _mark_endpoint_finished(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def traced_handler(request):
+            response = await handler(request)
+            trace = _current.get()
+            if trace is not None and trace.endpoint_finished is not None:
+                finished = trace.endpoint_finished
+                trace.add("serialize", finished, time.perf_counter() - finished)
+            return response
+
+        return traced_handler
+
+
+def _mark_endpoint_finished(endpoint):
+    """Sparar när routen returnerade, FastAPI läser signaturen via __wrapped__"""
+    if inspect.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _endpoint_finished()
+
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            _endpoint_finished()
+
+    return wrapper
+
+
+def _endpoint_finished():
+    trace = _current.get()
+    if trace is not None:
+        trace.endpoint_finished = time.perf_counter()
+
+
+# Export
+
+
+_file_lock = threading.Lock()
+_trace_file = None
+
+
+def _export(trace):
+    if not TRACE_FILE and not logger.isEnabledFor(logging.INFO):
+        return
+    record = trace.log_record()
+    logger.info(json.dumps(record, ensure_ascii=False))
+    if TRACE_FILE:
+        record["timestamp"] = datetime.now(timezone.utc).isoformat()
+        record["spans"] = [
+            {
+                "phase": phase,
+                "detail": detail,
+                "start_ms": round(offset * 1000, 3),
+                "duration_ms": round(seconds * 1000, 3),
+            }
+            for phase, detail, offset, seconds in trace.spans
+        ]
+        _write_trace(json.dumps(record, ensure_ascii=False))
+
+
+def _write_trace(line):
+    global _trace_file
+    with _file_lock:
+        if _trace_file is None:
+            _trace_file = open(TRACE_FILE, "a", encoding="utf-8", buffering=1)
+        _trace_file.write(line + "\n")
+
+
+if TRACE_LOG:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False